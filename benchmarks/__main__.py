@@ -0,0 +1,58 @@
+"""Run the pyrestreamer benchmarks and write a JSON report.
+
+Usage: python -m benchmarks [--scenarios parse,load,...] [--output report.json] [--baseline old.json]
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+
+from benchmarks.harness import SCENARIOS, run_benchmarks, compare, dump
+from pyrestreamer.config import configure_logging
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmark the pyrestreamer supervisor against fake streamlink/ffmpeg processes.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma separated scenarios to run (default: all of {', '.join(SCENARIOS)}).")
+    parser.add_argument('--streams', type=int, default=4, help="Concurrent streams for the load scenario.")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run the load scenario for.")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+    parser.add_argument('--baseline', help="Compare against this report; exit 1 if any metric regressed.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Fraction a metric may get worse by before it is a regression.")
+    parser.add_argument('--verbose', action='store_true', help="Log pyrestreamer warnings while benchmarking.")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    configure_logging(os.getenv('LOG_CONFIG') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.yml'))
+
+    if args.verbose:
+        logging.getLogger("pyrestreamer").setLevel(logging.WARNING)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    report = run_benchmarks(scenarios, {'load': {'streams': args.streams, 'seconds': args.duration}})
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fh:
+            regressions = compare(report, json.load(fh), args.tolerance)
+
+        report['regressions'] = regressions
+
+    dump(report, args.output)
+
+    if args.baseline and report['regressions']:
+        for regression in report['regressions']:
+            sys.stderr.write(f"Regression: {regression}\n")
+
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
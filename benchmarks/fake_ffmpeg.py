@@ -0,0 +1,84 @@
+"""Fake ffmpeg: consume stdin and report scripted -progress output on stdout."""
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--interval', type=float, default=0.5, help="Seconds between progress blocks (ffmpeg's default is 0.5).")
+    parser.add_argument('--speed', type=float, default=1.0, help="Encoder speed to report.")
+    parser.add_argument('--freeze-after', type=float, default=0, help="Stop advancing progress after this many seconds (0 never).")
+    parser.add_argument('--exit-after', type=float, default=0, help="Exit after this many seconds (0 never).")
+    parser.add_argument('--exit-code', type=int, default=1, help="Exit code when exiting after --exit-after.")
+    parser.add_argument('--banner', type=int, default=5, help="Log lines to print before the first progress block.")
+
+    return parser.parse_args()
+
+class InputCounter(threading.Thread):
+    """Consume stdin, counting bytes, like ffmpeg reading its input."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.total = 0
+        self.eof = False
+
+    def run(self):
+        stdin = sys.stdin.buffer
+
+        while True:
+            data = stdin.read1(65536)
+
+            if not data:
+                break
+
+            self.total += len(data)
+
+        self.eof = True
+
+def main():
+    args = parse_args()
+
+    out = sys.stdout
+    counter = InputCounter()
+    counter.start()
+
+    for line in range(args.banner):
+        out.write(f"Input #0, matroska,webm, from 'pipe:': stream {line}\n")
+
+    started = time.monotonic()
+    total_size = 0
+    out_time_us = 0
+
+    while True:
+        time.sleep(args.interval)
+
+        elapsed = time.monotonic() - started
+
+        if args.exit_after and elapsed >= args.exit_after:
+            out.write("Conversion failed!\n")
+            out.flush()
+
+            # Skip interpreter shutdown, which would wait on the thread blocked reading stdin
+            os._exit(args.exit_code)
+
+        if not args.freeze_after or elapsed < args.freeze_after:
+            total_size = counter.total
+            out_time_us = int(elapsed * args.speed * 1000000)
+
+        out.write(
+            f"bitrate={total_size * 8 / max(elapsed, 0.001) / 1000:.1f}kbits/s\n"
+            f"total_size={total_size}\n"
+            f"out_time_us={out_time_us}\n"
+            f"speed={args.speed}x\n"
+            f"progress={'end' if counter.eof else 'continue'}\n"
+        )
+        out.flush()
+
+        if counter.eof:
+            return
+
+if __name__ == '__main__':
+    main()
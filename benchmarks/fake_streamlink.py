@@ -0,0 +1,61 @@
+"""Fake streamlink: write a scripted stream to stdout and log lines to stderr."""
+
+import sys
+import time
+import argparse
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=250000, help="Bytes per second to write.")
+    parser.add_argument('--chunk', type=int, default=16384, help="Bytes per write.")
+    parser.add_argument('--stall-after', type=float, default=0, help="Stop writing after this many seconds (0 never).")
+    parser.add_argument('--stall-for', type=float, default=0, help="How long to stop writing for (0 forever).")
+    parser.add_argument('--error-every', type=float, default=0, help="Seconds between bursts of error lines (0 never).")
+    parser.add_argument('--error-burst', type=int, default=10, help="Error lines per burst.")
+    parser.add_argument('--exit-after', type=float, default=0, help="Exit after this many seconds (0 never).")
+    parser.add_argument('--exit-code', type=int, default=1, help="Exit code when exiting after --exit-after.")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    out = sys.stdout.buffer
+    chunk = b'\x00' * args.chunk
+    interval = args.chunk / args.rate
+
+    started = time.monotonic()
+    next_write = started
+    next_errors = started + args.error_every if args.error_every else None
+
+    sys.stderr.write("[cli][info] Opening stream: best (dash)\n")
+    sys.stderr.flush()
+
+    while True:
+        now = time.monotonic()
+        elapsed = now - started
+
+        if args.exit_after and elapsed >= args.exit_after:
+            sys.exit(args.exit_code)
+
+        if next_errors is not None and now >= next_errors:
+            for segment in range(args.error_burst):
+                sys.stderr.write(f"[stream.dash][error] Failed to open segment {segment}: Read timeout\n")
+
+            sys.stderr.flush()
+            next_errors += args.error_every
+
+        stalled = args.stall_after and elapsed >= args.stall_after and (not args.stall_for or elapsed < args.stall_after + args.stall_for)
+
+        if not stalled:
+            try:
+                out.write(chunk)
+                out.flush()
+            except BrokenPipeError:
+                return
+
+        next_write += interval
+        time.sleep(max(next_write - time.monotonic(), 0))
+
+if __name__ == '__main__':
+    main()
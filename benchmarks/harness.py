@@ -0,0 +1,395 @@
+"""Benchmark scenarios for the pyrestreamer supervisor, run against fake streamlink/ffmpeg processes."""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import datetime
+import platform
+import resource
+import statistics
+import subprocess
+
+from typing import Callable, Dict, List, Optional
+
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.helpers import ReStreamer
+from pyrestreamer.supervisor import AsyncReStreamer
+from pyrestreamer.progress import ProgressParser
+from pyrestreamer.recovery import RestartPolicy
+from pyrestreamer.watchdog import StallWatchdog
+from pyrestreamer.rules import OutputRules
+
+log = logging.getLogger("pyrestreamer")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_STREAMLINK = os.path.join(HERE, 'fake_streamlink.py')
+FAKE_FFMPEG = os.path.join(HERE, 'fake_ffmpeg.py')
+
+# Scheduled always (Sunday 00:00 for a week)
+ALWAYS = "1|00:00|10080"
+
+# A representative ffmpeg progress block, as parse_ffmpeg_output sees it
+PROGRESS_LINES = [
+    'frame=1450', 'fps=30.00', 'stream_0_0_q=-1.0', 'bitrate= 715.7kbits/s', 'total_size=4580200',
+    'out_time_us=48330000', 'out_time_ms=48330000', 'out_time=00:00:48.330000', 'dup_frames=0',
+    'drop_frames=0', 'speed=1.01x', 'progress=continue',
+]
+
+def metric(value: float, unit: str, better: str) -> dict:
+    """Build a report entry.
+
+    Args:
+        value (float): The measured value.
+        unit (str): Unit of the value.
+        better (str): "lower" or "higher", for regression checks.
+    """
+
+    return {'value': round(value, 6), 'unit': unit, 'better': better}
+
+class BenchReStreamer(ReStreamer):
+    """A restreamer whose ingest and outputs are the fake streamlink/ffmpeg scripts."""
+
+    def __init__(self, name: str, ingest_opts: List[str] = None, output_opts: List[str] = None, outputs: int = 1, restart_policy: RestartPolicy = None, watchdog: StallWatchdog = None):
+        super().__init__(PipelineConfig(name, ALWAYS, 0, 1, 'UTC', 'https://example.invalid/Manifest.mpd', '', ('',) * outputs, restart_policy, watchdog))
+
+        self.ingest_opts = ingest_opts or []
+        self.output_opts = output_opts or []
+
+    def ingest_args(self) -> List[str]:
+        return [sys.executable, FAKE_STREAMLINK] + self.ingest_opts
+
+    def output_args(self, ffmpeg_params: str) -> List[str]:
+        return [sys.executable, FAKE_FFMPEG] + self.output_opts
+
+class ScriptedSchedule():
+    """A schedule with one window, given in seconds from now (a stand-in for ServiceSchedule)."""
+
+    def __init__(self, start_in: float, stop_in: float):
+        now = time.monotonic()
+
+        self.tz = datetime.timezone.utc
+        self.start_at = now + start_in
+        self.stop_at = now + stop_in
+
+    def is_active(self, now=None) -> bool: #pylint: disable=unused-argument
+        return self.start_at <= time.monotonic() < self.stop_at
+
+    def seconds_until_transition(self, now=None) -> Optional[float]: #pylint: disable=unused-argument
+        current = time.monotonic()
+
+        for edge in (self.start_at, self.stop_at):
+            if edge > current:
+                return edge - current
+
+        return None
+
+    def next_transition(self, now=None) -> Optional[datetime.datetime]: #pylint: disable=unused-argument
+        until = self.seconds_until_transition()
+
+        return None if until is None else datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=until)
+
+class InstrumentedSupervisor(AsyncReStreamer):
+    """An AsyncReStreamer that records when it starts, stops, fails and makes progress."""
+
+    def __init__(self, restreamer: ReStreamer):
+        super().__init__(restreamer, handle_signals=False)
+
+        self.events: List[tuple] = []
+
+        for output in self.outputs:
+            output.fail = self._instrument_fail(output)
+
+    def _record(self, event: str, *details):
+        self.events.append((event, time.monotonic()) + details)
+
+    def _instrument_fail(self, output) -> Callable[[str], None]:
+        fail = output.fail
+
+        def instrumented(message: str):
+            if output.failure is None:
+                self._record('fail', output.index, output.health.watchdog.last_progress)
+
+            fail(message)
+
+        return instrumented
+
+    def events_named(self, event: str) -> List[tuple]:
+        return [entry for entry in self.events if entry[0] == event]
+
+    async def _start(self):
+        await super()._start()
+        self._record('started')
+
+    async def _stop(self):
+        self._record('stopping')
+        await super()._stop()
+        self._record('stopped')
+
+    def _on_output_progress(self, output):
+        self._record('progress', output.index)
+        super()._on_output_progress(output)
+
+async def run_supervisors(supervisors: List[AsyncReStreamer], seconds: float):
+    """Run supervisors for a while, then stop them gracefully."""
+
+    tasks = [asyncio.ensure_future(supervisor.run()) for supervisor in supervisors]
+
+    await asyncio.sleep(seconds)
+
+    for supervisor in supervisors:
+        supervisor.request_stop()
+
+    await asyncio.gather(*tasks)
+
+def rss_bytes(field: str = 'VmRSS') -> int:
+    """Get this process's resident set size (or another /proc/self/status size field) in bytes."""
+
+    with open('/proc/self/status', 'r') as fh:
+        for line in fh:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+def best_rate(func: Callable[[], int], repeat: int = 5) -> float:
+    """Run func repeatedly and get the best rate of (units it returns) per second."""
+
+    rates = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        units = func()
+        rates.append(units / (time.perf_counter() - started))
+
+    return max(rates)
+
+def bench_parse(blocks: int = 20000) -> Dict[str, dict]:
+    """Measure output parsing and classification throughput."""
+
+    lines = PROGRESS_LINES * blocks
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    chunk = 2 ** 16
+
+    def parse_lines():
+        ReStreamer.parse_ffmpeg_output(lines)
+        return len(lines)
+
+    def feed_parser():
+        parser = ProgressParser()
+
+        for idx in range(0, len(data), chunk):
+            parser.feed(data[idx:idx + chunk])
+
+        return len(data)
+
+    rules = OutputRules()
+    log_lines = [f"[stream.dash][error] Failed to open segment {idx}: Read timeout" if idx % 4 == 0 else f"[cli][info] Line {idx}" for idx in range(len(lines))]
+
+    def classify():
+        for line in log_lines:
+            rules.classify(line)
+
+        return len(log_lines)
+
+    return {
+        'parse_ffmpeg_output_lines_per_second': metric(best_rate(parse_lines), 'lines/s', 'higher'),
+        'progress_parser_bytes_per_second': metric(best_rate(feed_parser), 'B/s', 'higher'),
+        'output_rules_lines_per_second': metric(best_rate(classify), 'lines/s', 'higher'),
+    }
+
+def bench_load(streams: int = 4, seconds: float = 10.0) -> Dict[str, dict]:
+    """Measure supervisor CPU and RSS per stream, with periodic streamlink error bursts."""
+
+    supervisors = [
+        InstrumentedSupervisor(BenchReStreamer(f'load-{idx}', ingest_opts=['--error-every', '1', '--error-burst', '20']))
+        for idx in range(streams)
+    ]
+
+    rss_before = rss_bytes()
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+
+    asyncio.run(run_supervisors(supervisors, seconds))
+
+    elapsed = time.monotonic() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+
+    return {
+        'streams': metric(streams, 'streams', 'higher'),
+        'cpu_percent_per_stream': metric(100 * cpu / elapsed / streams, '%', 'lower'),
+        'rss_bytes_per_stream': metric(max(rss_bytes() - rss_before, 0) / streams, 'B', 'lower'),
+        'peak_rss_bytes': metric(rss_bytes('VmHWM'), 'B', 'lower'),
+    }
+
+def bench_stall(progress_timeout: float = 2.0, freeze_after: float = 3.0) -> Dict[str, dict]:
+    """Measure how long after its last progress a frozen ffmpeg is detected."""
+
+    watchdog = StallWatchdog(progress_timeout=progress_timeout, min_speed=0, max_drift=0)
+    rs = BenchReStreamer('stall', output_opts=['--freeze-after', str(freeze_after)], watchdog=watchdog, restart_policy=RestartPolicy(base_delay=60, jitter=0))
+    supervisor = InstrumentedSupervisor(rs)
+
+    async def scenario():
+        task = asyncio.ensure_future(supervisor.run())
+
+        while not supervisor.events_named('fail') and time.monotonic() - started < freeze_after + progress_timeout * 5:
+            await asyncio.sleep(0.05)
+
+        supervisor.request_stop()
+        await task
+
+    started = time.monotonic()
+    asyncio.run(scenario())
+
+    failures = supervisor.events_named('fail')
+
+    if not failures or failures[0][3] is None:
+        raise RuntimeError("Stall was not detected")
+
+    detect = failures[0][1] - failures[0][3]
+
+    return {
+        'time_to_detect_seconds': metric(detect, 's', 'lower'),
+        'detect_overshoot_seconds': metric(detect - progress_timeout, 's', 'lower'),
+    }
+
+def bench_transition(start_in: float = 1.0, hold: float = 3.0) -> Dict[str, dict]:
+    """Measure time to start and stop streaming around schedule transitions."""
+
+    rs = BenchReStreamer('transition')
+    schedule = ScriptedSchedule(start_in, start_in + hold)
+    rs.settings = rs.settings._replace(schedule=schedule)
+    supervisor = InstrumentedSupervisor(rs)
+
+    asyncio.run(run_supervisors([supervisor], start_in + hold + 3))
+
+    started = supervisor.events_named('started')
+    progress = supervisor.events_named('progress')
+    stopping = supervisor.events_named('stopping')
+    stopped = supervisor.events_named('stopped')
+
+    if not (started and progress and stopping and stopped):
+        raise RuntimeError(f"Pipeline did not start and stop as scheduled: {supervisor.events}")
+
+    return {
+        'time_to_spawn_seconds': metric(started[0][1] - schedule.start_at, 's', 'lower'),
+        'time_to_first_progress_seconds': metric(progress[0][1] - schedule.start_at, 's', 'lower'),
+        'time_to_stop_seconds': metric(stopped[0][1] - schedule.stop_at, 's', 'lower'),
+        'stop_transition_lag_seconds': metric(stopping[0][1] - schedule.stop_at, 's', 'lower'),
+    }
+
+def bench_restart(exit_after: float = 2.0, restarts: int = 3, base_delay: float = 0.1) -> Dict[str, dict]:
+    """Measure restart latency: from an output exiting to the restarted output making progress."""
+
+    policy = RestartPolicy(base_delay=base_delay, multiplier=1, jitter=0, max_failures=restarts * 10)
+    rs = BenchReStreamer('restart', output_opts=['--exit-after', str(exit_after)], restart_policy=policy)
+    supervisor = InstrumentedSupervisor(rs)
+
+    asyncio.run(run_supervisors([supervisor], (exit_after + 1.5) * restarts + 1))
+
+    latencies = []
+
+    for failure in supervisor.events_named('fail'):
+        recovered = [event for event in supervisor.events_named('progress') if event[1] > failure[1]]
+
+        if recovered:
+            latencies.append(recovered[0][1] - failure[1])
+
+    if not latencies:
+        raise RuntimeError(f"Output was not restarted: {supervisor.events}")
+
+    return {
+        'restarts': metric(len(latencies), 'restarts', 'higher'),
+        'restart_latency_mean_seconds': metric(statistics.mean(latencies), 's', 'lower'),
+        'restart_latency_max_seconds': metric(max(latencies), 's', 'lower'),
+        'restart_backoff_seconds': metric(base_delay, 's', 'lower'),
+    }
+
+SCENARIOS: Dict[str, Callable[..., Dict[str, dict]]] = {
+    'parse': bench_parse,
+    'load': bench_load,
+    'stall': bench_stall,
+    'transition': bench_transition,
+    'restart': bench_restart,
+}
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True, check=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scenarios: List[str], options: Dict[str, Dict[str, float]] = None) -> dict:
+    """Run benchmark scenarios and build a report.
+
+    Args:
+        scenarios (List[str]): Names of the scenarios to run (see SCENARIOS).
+        options (Dict[str, Dict[str, float]]): Keyword arguments for each scenario.
+
+    Returns:
+        dict: The report.
+    """
+
+    random.seed(0)
+    options = options or {}
+
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': {},
+    }
+
+    for name in scenarios:
+        log.warning(f"Running benchmark: {name}")
+        report['results'][name] = SCENARIOS[name](**options.get(name, {}))
+
+    return report
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.2) -> List[str]:
+    """Compare a report against a baseline report.
+
+    Args:
+        report (dict): The new report.
+        baseline (dict): The baseline report.
+        tolerance (float): Fraction a metric may get worse by before it counts as a regression.
+
+    Returns:
+        List[str]: A description of each regression.
+    """
+
+    regressions = []
+
+    for scenario, results in report['results'].items():
+        for name, result in results.items():
+            base = baseline.get('results', {}).get(scenario, {}).get(name)
+
+            if base is None:
+                continue
+
+            if result['better'] == 'lower':
+                regressed = result['value'] > base['value'] * (1 + tolerance)
+            else:
+                regressed = result['value'] < base['value'] * (1 - tolerance)
+
+            if regressed:
+                regressions.append(f"{scenario}.{name}: {base['value']} -> {result['value']} {result['unit']} ({result['better']} is better)")
+
+    return regressions
+
+def dump(report: dict, path: Optional[str]):
+    """Write a report as JSON to a file, or stdout if path is None."""
+
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+
+    if path is None:
+        sys.stdout.write(text)
+    else:
+        with open(path, 'w') as fh:
+            fh.write(text)
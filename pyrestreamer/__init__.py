@@ -1 +1,13 @@
-from pyrestreamer.__main__ import run
\ No newline at end of file
+import sys
+import time
+
+# Startup is profiled from the first import of the package (see --startup-profile)
+IMPORT_STARTED = time.perf_counter()
+IMPORT_MODULES = len(sys.modules)
+
+def run(argv=None):
+    """Run PyRestreamer (see pyrestreamer.__main__), importing it only when called."""
+
+    from pyrestreamer.__main__ import run as main #pylint: disable=import-outside-toplevel
+
+    main(argv)
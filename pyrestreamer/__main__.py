@@ -1,64 +1,433 @@
 import os
 import sys
 import logging
-import logging.config
 import datetime
 import hashlib
+import shlex
+import argparse
+import json
+import struct
+import signal
+import socket
 
-import yaml
-import freezegun
+from typing import Callable, Dict, List, Optional, Tuple
 
-from pyrestreamer.helpers import \
-    load_services, list_has_active_service, StreamingState, ReStreamer
+from pyrestreamer import IMPORT_STARTED, IMPORT_MODULES
+from pyrestreamer.config import AppConfig, configure_logging, parse_env_config, load_pipeline_configs, read_env_file, reloadable_settings
+from pyrestreamer.signals import add_signal_handler
+from pyrestreamer.startup import StartupProfile, format_profile
+
+# Everything else is imported where it is used, so a restart only loads what the configured features need
 
 log = logging.getLogger("pyrestreamer")
-with open(str(os.getenv('LOG_CONFIG')), 'r') as fh:
-    logging.config.dictConfig(yaml.load(fh, Loader=yaml.FullLoader))
 
-log.info('PyRestreamer app is initializing.')
+# Environment variables each command needs (run needs none of them if PIPELINES_CONFIG is set)
+REQUIRED_SETTINGS = {
+    'run': ('SERVICE_TIMES', 'PYTZ_TIMEZONE', 'INPUT_URL', 'FFMPEG_PARAMS'),
+    'simulate': ('SERVICE_TIMES', 'PYTZ_TIMEZONE'),
+    'tune': ('FFMPEG_PARAMS',),
+}
+
+def load_config(command: str) -> AppConfig:
+    """Read and validate the settings a command needs from the environment, exiting if they are invalid."""
+
+    required = () if command == 'run' and os.getenv("PIPELINES_CONFIG") else REQUIRED_SETTINGS[command]
+
+    try:
+        return parse_env_config(os.environ, required)
+    except (OSError, ValueError) as e:
+        log.critical(f'Invalid settings: {e}')
+        sys.exit(1)
+
+def log_settings(config: AppConfig):
+    """Log the settings in use (hashing the input URL and ffmpeg params, which may hold secrets)."""
+
+    if not log.isEnabledFor(logging.INFO):
+        return
+
+    pipeline = config.pipeline
+    restart = pipeline.restart_policy
+    watchdog = pipeline.watchdog
+    resources = pipeline.resources
+    selector = pipeline.adaptive
+    jitter = pipeline.jitter
+
+    log.info('PyRestreamer app is initializing.')
+    log.info(f'Debug mode: {config.debug}' + (f' from {config.debug_start.isoformat()}' if config.debug_start else ''))
+    log.info(f'Service times: {pipeline.service_times}')
+    log.info(f"Input URL SHA256: {hashlib.sha256(pipeline.input_url.encode('UTF-8')).hexdigest()}")
+    log.info(f"FFMPEG params SHA256:{hashlib.sha256(pipeline.ffmpeg_params.encode('UTF-8')).hexdigest()}")
+    log.info(f'Service buffer: {pipeline.service_buffer}')
+    log.info(f'Timezone: {pipeline.pytz_timezone}')
+    log.info(f'Sleep Time: {pipeline.sleep_time}')
+    log.info(f'Logging Path: {config.log_config}')
+    log.info(f'Engine: {config.engine}')
+    log.info(f'Pipelines config: {config.pipelines_config}')
+    log.info(f'Metrics address: {config.metrics_address}')
+    log.info(f'Output rules: {config.output_rules}')
+    log.info(f'Control address: {config.control_address}')
+    log.info(f'Reload env file: {config.reload_env_file}')
+    log.info(f'Restart policy: base delay {restart.base_delay}s, max delay {restart.max_delay}s, {restart.max_failures} failures per {restart.window}s')
+    log.info(f'Stop policy: SIGTERM, then SIGKILL after {pipeline.stop_policy.grace}s')
+    log.info(f'Pre-roll: warm up {pipeline.preroll:g}s before each service' if pipeline.preroll > 0 else 'Pre-roll: disabled')
+    log.info(f'Ingest: {pipeline.ingest.mode} mode, {pipeline.ingest.quality} quality, options {dict(pipeline.ingest.options)}')
+    log.info(f'Stall watchdog: progress timeout {watchdog.progress_timeout}s, startup timeout {watchdog.startup_timeout}s, min speed {watchdog.min_speed}x over {watchdog.slow_window}s, max drift {watchdog.max_drift}s')
+    log.info(f'Resource sampling: every {resources.interval}s, max CPU {resources.max_cpu_percent}%, max RSS {resources.max_rss_mb} MiB for {resources.sustain}s ({resources.action.value})')
+
+    if pipeline.ingest.quality == 'adaptive':
+        log.info(f'Adaptive variants: {", ".join(selector.variants) or "discovered"}; down after {selector.downgrade_after}s below {selector.min_speed}x or {selector.ingest_gap}s without ingest data, up after {selector.upgrade_after}s')
+
+    log.info(f'Jitter buffer: {jitter.seconds}s, up to {jitter.max_mb} MiB in {jitter.storage}, {jitter.on_drain} when drained' if jitter.enabled else 'Jitter buffer: disabled')
+    log.info(f'Progress history: {pipeline.progress_history:g}s, dumped to {pipeline.dump_dir or "the temp directory"} on fatal errors and SIGUSR1')
+    log.info(f'Hot standby: {config.lease.backend} lease as {config.lease.node or socket.gethostname()}, TTL {config.lease.ttl:g}s' if config.lease else 'Hot standby: disabled')
+
+def build_elector(config: AppConfig):
+    """Build the hot-standby elector, if a lease backend is configured.
+
+    Returns:
+        LeaderElector: The elector (not yet started), or None.
+    """
+
+    if config.lease is None:
+        return None
+
+    from pyrestreamer.lease import LeaderElector, parse_lease_backend #pylint: disable=import-outside-toplevel
+
+    lease = config.lease
+    stop_policy = config.pipeline.stop_policy
+
+    # A leader stops counting as leader this long before its lease could expire: time to stop the pipeline, plus clock skew
+    return LeaderElector(
+        parse_lease_backend(lease.backend, lease.path, lease.listen, lease.peer),
+        lease.node or socket.gethostname(),
+        ttl=lease.ttl,
+        fence_margin=stop_policy.grace + stop_policy.kill_timeout + lease.clock_skew
+    )
+
+def load_env_settings(path: str) -> Dict[str, dict]:
+    """Read the single pipeline's reloadable settings from an env file (falling back to the environment)."""
+
+    env = dict(os.environ)
+    env.update(read_env_file(path))
+
+    return {'default': reloadable_settings(parse_env_config(env, REQUIRED_SETTINGS['run']).pipeline)}
+
+def load_pipeline_settings(path: str) -> Dict[str, dict]:
+    """Read every pipeline's reloadable settings from a pipelines config file."""
+
+    return {config.name: reloadable_settings(config) for config in load_pipeline_configs(path)[0]}
+
+def start_control(restreamers: List['ReStreamer'], loader: Optional[Callable[[], Dict[str, dict]]], address: Optional[str], token: Optional[str] = None):
+    """Reload settings on SIGHUP, and serve the control interface if an address is given.
+
+    The control module (and its HTTP server) is only loaded if there is
+    something to reload from or an address to serve on.
+    """
+
+    if loader is None and not address:
+        add_signal_handler(signal.SIGHUP, log.error, "Could not reload settings: Reloading is not configured; set RELOAD_ENV_FILE or PIPELINES_CONFIG")
+        return None
+
+    from pyrestreamer.control import Controller, start_control_server #pylint: disable=import-outside-toplevel
+
+    controller = Controller(restreamers, loader)
 
-DEBUG_MODE = os.getenv("DEBUG")
-log.info(f'Debug mode: {DEBUG_MODE}')
+    # Reloading in the background leaves the dispatcher free for a SIGTERM during a slow reload
+    add_signal_handler(signal.SIGHUP, controller.reload_in_background)
 
-DEBUG_DATETIME = os.getenv("DEBUG_DATETIME")
-log.info(f'Debug datetime: {DEBUG_DATETIME}')
+    if address:
+        start_control_server(address, controller, token)
 
-DEBUG_TZ_OFFSET = os.getenv("DEBUG_TZ_OFFSET")
-log.info(f'Debug TZ offset: {DEBUG_TZ_OFFSET}')
+    return controller
 
-SERVICE_TIMES = os.getenv("SERVICE_TIMES")
-log.info(f'Service times: {SERVICE_TIMES}')
+def build_pipelines(config: AppConfig, elector) -> Tuple[List['ReStreamer'], int, Optional[Callable[[], Dict[str, dict]]]]:
+    """Build the restreamers to run: those in PIPELINES_CONFIG, or the single pipeline from the environment.
 
-INPUT_URL = os.getenv("INPUT_URL")
-log.info(f"Input URL SHA256: {hashlib.sha256(str(INPUT_URL).encode('UTF-8')).hexdigest()}")
+    Returns:
+        Tuple[List[ReStreamer], int, Callable]: The restreamers, the maximum number running at once
+            (0 for no limit), and what reloads their settings (None if nothing can).
+    """
 
-FFMPEG_PARAMS = os.getenv("FFMPEG_PARAMS")
-log.info(f"FFMPEG params SHA256:{hashlib.sha256(str(FFMPEG_PARAMS).encode('UTF-8')).hexdigest()}")
+    from pyrestreamer.helpers import ReStreamer #pylint: disable=import-outside-toplevel
+    from pyrestreamer.clock import OffsetClock #pylint: disable=import-outside-toplevel
 
-SERVICE_BUFFER = os.getenv("SERVICE_BUFFER")
-log.info(f'Service buffer: {SERVICE_BUFFER}')
+    if config.pipelines_config:
+        configs, max_concurrent = load_pipeline_configs(config.pipelines_config)
 
-PYTZ_TIMEZONE = os.getenv("PYTZ_TIMEZONE")
-log.info(f'Timezone: {PYTZ_TIMEZONE}')
+        return [ReStreamer(pipeline, elector=elector) for pipeline in configs], max_concurrent, lambda: load_pipeline_settings(config.pipelines_config)
 
-SLEEP_TIME = os.getenv("SLEEP_TIME")
-log.info(f'Sleep Time: {SLEEP_TIME}')
+    clock = OffsetClock(config.debug_start) if config.debug else None
+    loader = (lambda: load_env_settings(config.reload_env_file)) if config.reload_env_file else None
 
-LOG_CONFIG = os.getenv("LOG_CONFIG")
-log.info(f'Logging Path: {LOG_CONFIG}')
+    return [ReStreamer(config.pipeline, clock, elector)], 0, loader
 
-def run():
-    rs = ReStreamer(SERVICE_TIMES, SERVICE_BUFFER, SLEEP_TIME, PYTZ_TIMEZONE, INPUT_URL, FFMPEG_PARAMS)
+def run_engine(config: AppConfig, restreamers: List['ReStreamer'], max_concurrent: int = 0):
+    """Run the restreamers on the configured event loop engine until they are stopped."""
 
-    if str(os.getenv('DEBUG')).lower() == 'true':
-        with freezegun.freeze_time(DEBUG_DATETIME, tz_offset=int(DEBUG_TZ_OFFSET)):
-            rs.event_loop()
+    if not config.pipelines_config and config.engine == 'thread':
+        from pyrestreamer.engine import ThreadReStreamer #pylint: disable=import-outside-toplevel
+
+        ThreadReStreamer(restreamers[0]).run()
+        return
+
+    import asyncio #pylint: disable=import-outside-toplevel
+
+    from pyrestreamer.supervisor import AsyncReStreamer, MultiSupervisor #pylint: disable=import-outside-toplevel
+
+    if config.pipelines_config:
+        asyncio.run(MultiSupervisor(restreamers, max_concurrent).run())
+    else:
+        asyncio.run(AsyncReStreamer(restreamers[0]).run())
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Parse command line arguments (settings otherwise come from the environment)."""
+
+    parser = argparse.ArgumentParser(prog='pyrestreamer', description="Restream scheduled DASH/HLS streams to RTMP.")
+    parser.add_argument('--startup-profile', action='store_true', help="Start up as if to run, print the time and memory each phase of startup took, and exit before streaming.")
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('run', help="Run the restreamer (the default).")
+
+    simulate_parser = commands.add_parser('simulate', help="Fast-forward SERVICE_TIMES on a simulated clock and print every transition.")
+    simulate_parser.add_argument('--start', help="ISO 8601 time to start from (defaults to now; times without an offset are in PYTZ_TIMEZONE).")
+    simulate_parser.add_argument('--days', type=float, default=7, help="Number of days to simulate (default 7).")
+
+    tune_parser = commands.add_parser('tune', help="Benchmark variations of FFMPEG_PARAMS on this host and recommend the cheapest that keeps up.")
+    tune_parser.add_argument('--sample', help="Media file to encode (defaults to a generated test pattern and tone).")
+    tune_parser.add_argument('--size', default='1280x720', help="Size of the generated test pattern (default 1280x720).")
+    tune_parser.add_argument('--rate', type=int, default=30, help="Frame rate of the generated test pattern (default 30).")
+    tune_parser.add_argument('--duration', type=float, default=20, help="Seconds of media to encode per candidate (default 20).")
+    tune_parser.add_argument('--threads', default='1,2,4,0', help="Comma-separated thread counts to try; 0 lets ffmpeg choose (default 1,2,4,0).")
+    tune_parser.add_argument('--presets', default='ultrafast,superfast,veryfast,faster,fast,medium', help="Comma-separated encoder presets to try, if the encoder takes presets.")
+    tune_parser.add_argument('--margin', type=float, default=0.5, help="Required speed above realtime, e.g. 0.5 for 1.5x (default 0.5).")
+    tune_parser.add_argument('--output', help="Also write the results to this JSON file.")
+
+    dump_parser = commands.add_parser('show-dump', help="Print a progress history dump written on a fatal error or SIGUSR1.")
+    dump_parser.add_argument('path', help="The dump file.")
+
+    witness_parser = commands.add_parser('lease-witness', help="Vote in a peer-backend hot-standby lease without streaming (the pair's third member).")
+    witness_parser.add_argument('--listen', required=True, help="host:port to answer vote requests on.")
+
+    return parser.parse_args(argv)
+
+def run_simulation(config: AppConfig, start: str = None, days: float = 7) -> int:
+    """Print every streaming transition and DST change over the coming days.
+
+    Args:
+        config (AppConfig): The settings holding the schedule.
+        start (str): ISO 8601 time to start from (defaults to now).
+        days (float): Number of days to simulate.
+
+    Returns:
+        int: Exit code; 1 if the schedule would keep the event loop from sleeping.
+    """
+
+    from pyrestreamer.helpers import ReStreamer #pylint: disable=import-outside-toplevel
+    from pyrestreamer.clock import SimulatedClock #pylint: disable=import-outside-toplevel
+    from pyrestreamer.simulate import simulate, format_transition #pylint: disable=import-outside-toplevel
+
+    pipeline = config.pipeline
+    tz = pipeline.timezone
+
+    if start is None:
+        start_at = datetime.datetime.now(tz)
     else:
-        try:
-            rs.event_loop()
-        except Exception as e:
-            log.critical(f'Fatal error running app (will exit to prompt container restart): {e}')
-            sys.exit(1)
+        start_at = datetime.datetime.fromisoformat(start)
+        start_at = tz.localize(start_at) if start_at.tzinfo is None else start_at
+
+    rs = ReStreamer(pipeline, SimulatedClock(start_at))
+    result = simulate(rs, start_at + datetime.timedelta(days=days))
+
+    for transition in result.transitions:
+        print(format_transition(transition))
+
+    print(f"Simulated {days:g} days from {start_at.isoformat()}: {sum(1 for t in result.transitions if t.event == 'start')} streams, "
+          f"{datetime.timedelta(seconds=round(result.streaming_seconds))} streaming, {result.wakeups} event loop wakeups.")
+
+    return 1 if any(transition.event == 'stuck' for transition in result.transitions) else 0
+
+def run_tune(config: AppConfig, args: argparse.Namespace) -> int:
+    """Benchmark variations of FFMPEG_PARAMS and print a recommendation.
+
+    Returns:
+        int: Exit code; 1 if no candidate keeps up with the required margin.
+    """
+
+    from pyrestreamer.tune import build_candidates, input_args, run_candidate, recommend, format_result #pylint: disable=import-outside-toplevel
+
+    ffmpeg_params = config.pipeline.ffmpeg_params
+    candidates = build_candidates(
+        ffmpeg_params,
+        [int(threads) for threads in args.threads.split(',')],
+        [preset.strip() for preset in args.presets.split(',') if preset.strip()]
+    )
+    source = input_args(args.sample, args.size, args.rate)
+    results = []
+
+    print(f"Encoding {args.duration:g}s of {args.sample or f'{args.size}@{args.rate} test pattern'} with {len(candidates)} candidates on {os.cpu_count()} cores.")
+
+    for candidate in candidates:
+        result = run_candidate(candidate, source, args.duration)
+        results.append(result)
+
+        print(format_result(result))
+
+    best = recommend(results, args.margin)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'cores': os.cpu_count(),
+                'results': [result._asdict() for result in results],
+                'recommended': best.label if best else None,
+            }, fh, indent=2)
+
+    if best is None:
+        print(f"No candidate reached {1 + args.margin:g}x realtime.")
+        return 1
+
+    streams = int(os.cpu_count() / best.cores_per_stream) if best.cores_per_stream > 0 else '?'
+
+    print(f"Recommended: {best.label} ({best.speed:.2f}x, {best.cores_per_stream:.2f} cores/stream, about {streams} streams on this host)")
+    print(f"FFMPEG_PARAMS={best.params} {shlex.quote(shlex.split(ffmpeg_params)[-1])}")
+
+    return 0
+
+def show_dump(path: str) -> int:
+    """Print a progress history dump as a table.
+
+    Returns:
+        int: Exit code; 1 if the file is not a progress dump.
+    """
+
+    from pyrestreamer.recorder import read_dump, format_dump #pylint: disable=import-outside-toplevel
+
+    try:
+        dump = read_dump(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Could not read {path}: {e}", file=sys.stderr)
+        return 1
+
+    for line in format_dump(dump):
+        print(line)
+
+    return 0
+
+def run_witness(listen: str) -> int:
+    """Answer vote requests for a peer-backend lease until SIGTERM or SIGINT.
+
+    Returns:
+        int: Exit code.
+    """
+
+    import threading #pylint: disable=import-outside-toplevel
+
+    from pyrestreamer.lease import PeerLease #pylint: disable=import-outside-toplevel
+
+    try:
+        witness = PeerLease(listen, [])
+        witness.serve()
+    except (OSError, ValueError) as e:
+        log.critical(f"Could not start the lease witness: {e}")
+        return 1
+
+    stopped = threading.Event()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        add_signal_handler(sig, stopped.set)
+
+    log.warning(f"Lease witness is answering on {listen}.")
+
+    stopped.wait()
+    witness.close()
+
+    return 0
+
+def run(argv: List[str] = None):
+    profile = StartupProfile(IMPORT_STARTED, IMPORT_MODULES)
+    profile.mark('imports')
+
+    args = parse_args(argv)
+    command = args.command or 'run'
+
+    configure_logging(os.getenv('LOG_CONFIG'))
+    profile.mark('logging')
+
+    if command == 'show-dump':
+        sys.exit(show_dump(args.path))
+
+    if command == 'lease-witness':
+        sys.exit(run_witness(args.listen))
+
+    config = load_config(command)
+    log_settings(config)
+    profile.mark('settings')
+
+    if command == 'simulate':
+        sys.exit(run_simulation(config, args.start, args.days))
+
+    if command == 'tune':
+        sys.exit(run_tune(config, args))
+
+    run_service(config, profile, args.startup_profile)
+
+def run_service(config: AppConfig, profile: StartupProfile, profile_only: bool = False):
+    """Start the restreamer and run it until it is stopped.
+
+    Args:
+        config (AppConfig): The settings.
+        profile (StartupProfile): Startup so far, to be continued through the remaining phases.
+        profile_only (bool): Print the startup profile and return before starting any servers, taking
+            the hot-standby lease or streaming.
+    """
+
+    try:
+        elector = build_elector(config)
+        restreamers, max_concurrent, loader = build_pipelines(config, elector)
+    except Exception as e: #pylint: disable=broad-except
+        if config.debug:
+            raise
+
+        log.critical(f'Fatal error running app (will exit to prompt container restart): {e}')
+        sys.exit(1)
+
+    profile.mark('pipelines')
+
+    if profile_only:
+        for line in format_profile(profile):
+            print(line)
+
+        return
+
+    if config.metrics_address:
+        from pyrestreamer.server import start_metrics_server #pylint: disable=import-outside-toplevel
+
+        start_metrics_server(config.metrics_address)
+
+    start_control(restreamers, loader, config.control_address, config.control_token)
+
+    if elector is not None:
+        elector.start()
+
+    profile.mark('interfaces')
+
+    log.info(f'Started in {profile.seconds:.3f}s with {profile.rss_bytes / 1048576:.1f} MiB resident.')
+
+    try:
+        run_engine(config, restreamers, max_concurrent)
+    except BaseException as e:
+        if elector is not None:
+            # A pipeline may have failed to stop, so leave the lease to expire rather than handing it over
+            elector.stop(release=False)
+
+        if config.debug or not isinstance(e, Exception):
+            raise
+
+        log.critical(f'Fatal error running app (will exit to prompt container restart): {e}')
+        sys.exit(1)
+
+    if elector is not None:
+        elector.stop()
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    run()
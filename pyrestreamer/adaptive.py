@@ -0,0 +1,160 @@
+"""Adaptive variant selection from measured ingest throughput and encoder speed."""
+
+import re
+
+from typing import List, Optional, Sequence, Tuple
+
+# Stream name aliases that do not identify a variant
+ALIASES = ('best', 'worst', 'best-unfiltered', 'worst-unfiltered')
+
+# Quality value selecting the adaptive mode
+ADAPTIVE = 'adaptive'
+
+VARIANT_PATTERN = re.compile(r'^(?:(\d+)p(\d+)?|(\d+)k)')
+
+def variant_weight(name: str) -> Optional[Tuple[int, int, int]]:
+    """Get a sort weight for a stream name like 1080p60, 720p, 720p_alt or 1500k.
+
+    Returns:
+        Tuple[int, int, int]: A weight (higher is better quality), or None if the name does not identify a variant.
+    """
+
+    match = VARIANT_PATTERN.match(name)
+
+    if name in ALIASES or match is None:
+        return None
+
+    height, fps, kbps = match.groups()
+
+    if kbps is not None:
+        return (0, int(kbps), 0)
+
+    # Alternates of the same variant rank just below it
+    return (int(height), int(fps or 30), 0 if '_alt' in name else 1)
+
+def rank_variants(names: Sequence[str]) -> List[str]:
+    """Order stream names from the highest quality variant down, leaving out aliases and audio-only streams."""
+
+    weighted = [(variant_weight(name), name) for name in names]
+
+    return [name for weight, name in sorted((item for item in weighted if item[0] is not None), reverse=True)]
+
+class VariantSelector():
+    """Step down the variant ladder when a pipeline can't keep up, and back up when it can.
+
+    The pipeline is falling behind when ffmpeg's speed is below min_speed or
+    ingest data stops for ingest_gap seconds; after downgrade_after seconds of
+    that, the selector steps down one variant. After upgrade_after seconds
+    without falling behind it steps back up one variant. An upgrade that has
+    to be undone within upgrade_after seconds doubles the wait before the next
+    one, so a variant that can't be sustained isn't retried over and over.
+    """
+
+    def __init__(self, min_speed: float = 0.95, ingest_gap: float = 8.0, downgrade_after: float = 20.0, upgrade_after: float = 300.0, grace: float = 15.0, variants: Sequence[str] = ()):
+        """
+        Args:
+            min_speed (float): Encoder speed below which the pipeline is falling behind.
+            ingest_gap (float): Seconds without ingest data after which the pipeline is falling behind.
+            downgrade_after (float): Seconds of falling behind before stepping down.
+            upgrade_after (float): Seconds without falling behind before stepping up.
+            grace (float): Seconds after starting a variant before it is judged.
+            variants (Sequence[str]): The variant ladder, highest quality first (discovered if empty).
+        """
+
+        self.min_speed = min_speed
+        self.ingest_gap = ingest_gap
+        self.downgrade_after = downgrade_after
+        self.upgrade_after = upgrade_after
+        self.grace = grace
+
+        self.variants: List[str] = list(variants)
+        self.index = 0
+        self.failed_upgrades = 0
+        self.upgraded_at: Optional[float] = None
+
+        self.start(0.0)
+
+    def clone(self) -> 'VariantSelector':
+        """Get a fresh selector with the same thresholds and ladder."""
+
+        return VariantSelector(self.min_speed, self.ingest_gap, self.downgrade_after, self.upgrade_after, self.grace, self.variants)
+
+    @property
+    def current(self) -> Optional[str]:
+        """The selected variant (None until the ladder is known)."""
+
+        return self.variants[self.index] if self.variants else None
+
+    def set_variants(self, variants: Sequence[str]):
+        """Set the variant ladder (highest quality first) and select the top variant."""
+
+        self.variants = list(variants)
+        self.index = 0
+
+    def start(self, now: float):
+        """Reset the timers for a newly started variant.
+
+        Args:
+            now (float): Monotonic time the variant started.
+        """
+
+        self.started = now
+        self.behind_since: Optional[float] = None
+        self.healthy_since = now + self.grace
+
+    def observe(self, speed: Optional[float], ingest_idle: float, now: float) -> Optional[int]:
+        """Judge the current variant from the latest measurements.
+
+        Args:
+            speed (float): The slowest output's latest encoder speed (None if not known yet).
+            ingest_idle (float): Seconds since ingest data last arrived.
+            now (float): Monotonic time of the measurements.
+
+        Returns:
+            int: -1 to step down or 1 to step up a variant (see switch), or None to stay.
+        """
+
+        if len(self.variants) < 2 or now < self.started + self.grace:
+            return None
+
+        behind = ingest_idle >= self.ingest_gap or (speed is not None and speed < self.min_speed)
+
+        if behind:
+            self.healthy_since = now
+
+            if self.behind_since is None:
+                self.behind_since = now
+
+            if now - self.behind_since >= self.downgrade_after and self.index < len(self.variants) - 1:
+                return -1
+
+            return None
+
+        self.behind_since = None
+
+        # An upgrade that has held for upgrade_after seconds succeeded
+        if self.upgraded_at is not None and now - self.healthy_since >= self.upgrade_after:
+            self.failed_upgrades = 0
+            self.upgraded_at = None
+
+        if self.index > 0 and now - self.healthy_since >= self.upgrade_after * 2 ** self.failed_upgrades:
+            return 1
+
+        return None
+
+    def switch(self, step: int, now: float) -> str:
+        """Step down (-1) or up (1) the ladder and restart the timers.
+
+        Returns:
+            str: The newly selected variant.
+        """
+
+        if step < 0 and self.upgraded_at is not None:
+            self.failed_upgrades += 1
+
+        self.upgraded_at = now if step > 0 else None
+        self.index = min(max(self.index - step, 0), len(self.variants) - 1)
+
+        self.start(now)
+
+        return self.current
@@ -0,0 +1,93 @@
+"""Injectable clocks, so schedules can be run against real, shifted or simulated time."""
+
+import time
+import datetime
+import threading
+
+class Clock():
+    """The system clock."""
+
+    def now(self, tz: datetime.tzinfo = None) -> datetime.datetime:
+        """Get the current time.
+
+        Args:
+            tz (datetime.tzinfo): Timezone to get the time in (naive local time if not given).
+
+        Returns:
+            datetime.datetime: The current time.
+        """
+
+        return datetime.datetime.now(tz)
+
+    def monotonic(self) -> float:
+        """Get a monotonic time in seconds, for measuring intervals."""
+
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        """Wait for a number of seconds."""
+
+        time.sleep(seconds)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """Wait for a number of seconds, or until an event is set.
+
+        Returns:
+            bool: Whether the event is set.
+        """
+
+        return event.wait(seconds)
+
+# The clock used unless another is injected
+SYSTEM_CLOCK = Clock()
+
+class OffsetClock(Clock):
+    """A clock that starts at a given time and runs in real time from there (for debugging schedules)."""
+
+    def __init__(self, start: datetime.datetime):
+        """
+        Args:
+            start (datetime.datetime): The time to start at (naive times are UTC).
+        """
+
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=datetime.timezone.utc)
+
+        self.offset = start - datetime.datetime.now(datetime.timezone.utc)
+
+    def now(self, tz: datetime.tzinfo = None) -> datetime.datetime:
+        now = datetime.datetime.now(datetime.timezone.utc) + self.offset
+
+        return now.astimezone(tz) if tz is not None else now.astimezone().replace(tzinfo=None)
+
+class SimulatedClock(Clock):
+    """A clock that only moves when slept on, so a schedule can be fast-forwarded."""
+
+    def __init__(self, start: datetime.datetime):
+        """
+        Args:
+            start (datetime.datetime): The time to start at (naive times are UTC).
+        """
+
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=datetime.timezone.utc)
+
+        self.start = start
+        self.elapsed = 0.0
+
+    def now(self, tz: datetime.tzinfo = None) -> datetime.datetime:
+        now = self.start + datetime.timedelta(seconds=self.elapsed)
+
+        return now.astimezone(tz) if tz is not None else now.astimezone().replace(tzinfo=None)
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def sleep(self, seconds: float):
+        self.elapsed += max(seconds, 0.0)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        if not event.is_set():
+            self.sleep(seconds)
+
+        return event.is_set()
@@ -0,0 +1,397 @@
+"""Pipeline and process configuration, from the environment or a multi-pipeline config file."""
+
+import datetime
+import logging.config
+
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import yaml
+
+from pyrestreamer.recovery import RestartPolicy
+from pyrestreamer.watchdog import StallWatchdog
+from pyrestreamer.rules import Rule, parse_rules
+from pyrestreamer.ingest import IngestConfig, parse_ingest_config
+from pyrestreamer.resources import ResourceSampler
+from pyrestreamer.adaptive import VariantSelector
+from pyrestreamer.jitter import JitterConfig, parse_jitter_config
+from pyrestreamer.shutdown import StopPolicy
+from pyrestreamer.schedule import ServiceTime, parse_service_times, parse_timezone
+
+class PipelineConfig(NamedTuple):
+    """Configuration for a single restreaming pipeline.
+
+    services and timezone are service_times and pytz_timezone parsed, which
+    checks them when the config is read.
+    """
+
+    name: Optional[str]
+    service_times: str
+    service_buffer: int
+    sleep_time: int
+    pytz_timezone: str
+    input_url: str
+    ffmpeg_params: str
+    outputs: Tuple[str, ...] = ()
+    restart_policy: Optional[RestartPolicy] = None
+    watchdog: Optional[StallWatchdog] = None
+    rules: Tuple[Rule, ...] = ()
+    ingest: IngestConfig = IngestConfig()
+    resources: Optional[ResourceSampler] = None
+    adaptive: Optional[VariantSelector] = None
+    jitter: JitterConfig = JitterConfig()
+    progress_history: float = 600
+    dump_dir: Optional[str] = None
+    stop_policy: Optional[StopPolicy] = None
+    preroll: float = 0
+    services: Tuple[ServiceTime, ...] = ()
+    timezone: Optional[datetime.tzinfo] = None
+
+class LeaseConfig(NamedTuple):
+    """Hot-standby lease settings (see parse_lease_backend and LeaderElector)."""
+
+    backend: str
+    path: Optional[str] = None
+    listen: Optional[str] = None
+    peer: Optional[str] = None
+    node: Optional[str] = None
+    ttl: float = 15
+    clock_skew: float = 1
+
+class AppConfig(NamedTuple):
+    """Settings for the whole process, read and validated once at startup.
+
+    pipeline is the single pipeline configured by SERVICE_TIMES, INPUT_URL and
+    the rest; it is not run when pipelines_config declares the pipelines instead,
+    though its stop policy still sets the hot-standby fencing margin.
+    """
+
+    pipeline: PipelineConfig
+    log_config: Optional[str] = None
+    engine: str = 'thread'
+    pipelines_config: Optional[str] = None
+    metrics_address: Optional[str] = None
+    control_address: Optional[str] = None
+    control_token: Optional[str] = None
+    reload_env_file: Optional[str] = None
+    output_rules: Optional[str] = None
+    lease: Optional[LeaseConfig] = None
+    debug: bool = False
+    debug_start: Optional[datetime.datetime] = None
+
+# Event loop engines (see ENGINE)
+ENGINES = ('thread', 'asyncio')
+
+# Settings that can be changed without restarting PyRestreamer (see ReStreamer.reload)
+RELOADABLE = ('service_times', 'service_buffer', 'sleep_time', 'pytz_timezone', 'input_url', 'ffmpeg_params', 'outputs')
+
+def reloadable_settings(config: PipelineConfig) -> dict:
+    """Get a pipeline's reloadable settings, as keyword arguments for ReStreamer.reload."""
+
+    return {key: getattr(config, key) for key in RELOADABLE}
+
+def parse_pipeline_configs(config: dict) -> Tuple[List[PipelineConfig], int]:
+    """Parse pipeline configurations from a loaded config document.
+
+    Each entry under "pipelines" may override any key from "defaults". A pipeline
+    sends its input to one destination with "ffmpeg_params", or fans a single
+    ingest out to several destinations with a list of "outputs" ffmpeg params.
+    An optional "restart" mapping holds RestartPolicy settings, and an optional
+    "watchdog" mapping holds StallWatchdog thresholds. An optional "rules" list
+    classifies output lines (see parse_rules), ahead of the default rules. An
+    optional "ingest" mapping selects how the input is read (see parse_ingest_config),
+    an optional "resources" mapping holds ResourceSampler settings and limits, and
+    an optional "adaptive" mapping holds VariantSelector settings for the
+    "adaptive" ingest quality. An optional "jitter" mapping configures a jitter
+    buffer between the ingest and ffmpeg (see parse_jitter_config).
+    "progress_history" is how many seconds of progress to keep for post-mortem
+    dumps, which are written to "dump_dir". An optional "stop" mapping holds
+    StopPolicy timeouts. "preroll" is how many seconds before each service the
+    pipeline is warmed up (0 to cold start at the service start).
+
+    Args:
+        config (dict): The loaded config document.
+
+    Returns:
+        Tuple[List[PipelineConfig], int]: Pipeline configs, and the maximum number of concurrent pipelines (0 for no limit).
+    """
+
+    defaults = config.get('defaults') or {}
+    pipelines = config.get('pipelines') or []
+
+    if not pipelines:
+        raise ValueError("Pipeline config does not declare any pipelines.")
+
+    configs = []
+    names = set()
+
+    for idx, pipeline in enumerate(pipelines):
+        merged = dict(defaults)
+        merged.update(pipeline)
+
+        name = str(merged.get('name', f'pipeline-{idx + 1}'))
+
+        if name in names:
+            raise ValueError(f"Duplicate pipeline name: {name}")
+
+        names.add(name)
+
+        missing = [key for key in ('service_times', 'input_url', 'timezone') if key not in merged]
+
+        if 'ffmpeg_params' not in merged and not merged.get('outputs'):
+            missing.append('ffmpeg_params')
+
+        if missing:
+            raise ValueError(f"Pipeline {name} is missing required keys: {', '.join(missing)}")
+
+        outputs = tuple(str(output) for output in merged.get('outputs') or ())
+
+        try:
+            services = parse_service_times(merged['service_times'])
+            timezone = parse_timezone(str(merged['timezone']))
+        except ValueError as e:
+            raise ValueError(f"Pipeline {name}: {e}") from e
+
+        configs.append(
+            PipelineConfig(
+                name,
+                str(merged['service_times']),
+                int(merged.get('service_buffer', 0)),
+                int(merged.get('sleep_time', 15)),
+                str(merged['timezone']),
+                str(merged['input_url']),
+                str(merged.get('ffmpeg_params', outputs[0] if outputs else '')),
+                outputs,
+                RestartPolicy(**merged['restart']) if merged.get('restart') else None,
+                StallWatchdog(**merged['watchdog']) if merged.get('watchdog') else None,
+                tuple(parse_rules(merged.get('rules'))),
+                parse_ingest_config(merged.get('ingest')),
+                ResourceSampler(**merged['resources']) if merged.get('resources') else None,
+                VariantSelector(**merged['adaptive']) if merged.get('adaptive') else None,
+                parse_jitter_config(merged.get('jitter')),
+                float(merged.get('progress_history', 600)),
+                str(merged['dump_dir']) if merged.get('dump_dir') else None,
+                StopPolicy(**merged['stop']) if merged.get('stop') else None,
+                float(merged.get('preroll', 0)),
+                services,
+                timezone
+            )
+        )
+
+    return configs, int(config.get('max_concurrent', 0))
+
+def _env_number(env: Mapping[str, str], key: str, default: float, cast: type = float):
+    value = env.get(key) or default
+
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a number, not {value!r}") from None
+
+def parse_env_config(env: Mapping[str, str], required: Sequence[str] = ()) -> AppConfig:
+    """Parse and validate settings from environment variables (see sample.env).
+
+    Unset or empty numeric settings take their defaults. SERVICE_TIMES and
+    PYTZ_TIMEZONE are parsed, and OUTPUT_RULES is loaded, here, so a malformed
+    schedule, an unknown timezone or a broken rules file stops PyRestreamer
+    before anything starts.
+
+    Args:
+        env (Mapping[str, str]): The environment (e.g. os.environ).
+        required (Sequence[str]): Variables that must be set for what is being run.
+
+    Raises:
+        ValueError: If a required variable is missing or a value is invalid.
+        OSError: If OUTPUT_RULES cannot be read.
+
+    Returns:
+        AppConfig: The settings.
+    """
+
+    missing = [key for key in required if not env.get(key)]
+
+    if missing:
+        raise ValueError(f"Missing required settings: {', '.join(missing)}")
+
+    engine = (env.get("ENGINE") or 'thread').lower()
+
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown ENGINE {engine}; use {' or '.join(ENGINES)}")
+
+    try:
+        services = parse_service_times(env["SERVICE_TIMES"]) if env.get("SERVICE_TIMES") else ()
+    except ValueError as e:
+        raise ValueError(f"SERVICE_TIMES: {e}") from e
+
+    timezone = parse_timezone(env["PYTZ_TIMEZONE"]) if env.get("PYTZ_TIMEZONE") else None
+
+    try:
+        streamlink_options = yaml.safe_load(env.get("STREAMLINK_OPTIONS") or "{}")
+    except yaml.YAMLError as e:
+        raise ValueError(f"STREAMLINK_OPTIONS is not valid YAML: {e}") from e
+
+    pipeline = PipelineConfig(
+        None,
+        env.get("SERVICE_TIMES", ''),
+        _env_number(env, "SERVICE_BUFFER", 0, int),
+        _env_number(env, "SLEEP_TIME", 15, int),
+        env.get("PYTZ_TIMEZONE", ''),
+        env.get("INPUT_URL", ''),
+        env.get("FFMPEG_PARAMS", ''),
+        (),
+        RestartPolicy(
+            base_delay=_env_number(env, "RESTART_BASE_DELAY", 1),
+            max_delay=_env_number(env, "RESTART_MAX_DELAY", 60),
+            jitter=_env_number(env, "RESTART_JITTER", 0.2),
+            max_failures=_env_number(env, "RESTART_MAX_FAILURES", 5, int),
+            window=_env_number(env, "RESTART_WINDOW", 600)
+        ),
+        StallWatchdog(
+            progress_timeout=_env_number(env, "WATCHDOG_PROGRESS_TIMEOUT", 10),
+            startup_timeout=_env_number(env, "WATCHDOG_STARTUP_TIMEOUT", 30),
+            min_speed=_env_number(env, "WATCHDOG_MIN_SPEED", 0.9),
+            slow_window=_env_number(env, "WATCHDOG_SLOW_WINDOW", 30),
+            max_drift=_env_number(env, "WATCHDOG_MAX_DRIFT", 30)
+        ),
+        tuple(load_output_rules(env["OUTPUT_RULES"])) if env.get("OUTPUT_RULES") else (),
+        parse_ingest_config({
+            'mode': env.get("INGEST_MODE") or "process",
+            'quality': env.get("STREAMLINK_QUALITY") or "best",
+            'options': streamlink_options
+        }),
+        ResourceSampler(
+            interval=_env_number(env, "RESOURCE_SAMPLE_INTERVAL", 5),
+            max_cpu_percent=_env_number(env, "RESOURCE_MAX_CPU_PERCENT", 0),
+            max_rss_mb=_env_number(env, "RESOURCE_MAX_RSS_MB", 0),
+            sustain=_env_number(env, "RESOURCE_SUSTAIN", 30),
+            action=(env.get("RESOURCE_ACTION") or "warn").lower()
+        ),
+        VariantSelector(
+            min_speed=_env_number(env, "ADAPTIVE_MIN_SPEED", 0.95),
+            ingest_gap=_env_number(env, "ADAPTIVE_INGEST_GAP", 8),
+            downgrade_after=_env_number(env, "ADAPTIVE_DOWNGRADE_AFTER", 20),
+            upgrade_after=_env_number(env, "ADAPTIVE_UPGRADE_AFTER", 300),
+            variants=[variant.strip() for variant in env.get("ADAPTIVE_VARIANTS", "").split(',') if variant.strip()]
+        ),
+        parse_jitter_config({
+            'seconds': env.get("JITTER_SECONDS") or "0",
+            'max_mb': env.get("JITTER_MAX_MB") or "64",
+            'storage': env.get("JITTER_STORAGE") or "memory",
+            'directory': env.get("JITTER_DIRECTORY"),
+            'on_drain': env.get("JITTER_ON_DRAIN") or "refill"
+        }),
+        _env_number(env, "PROGRESS_HISTORY_SECONDS", 600),
+        env.get("PROGRESS_DUMP_DIR") or None,
+        StopPolicy(
+            grace=_env_number(env, "STOP_GRACE_SECONDS", 3),
+            kill_timeout=_env_number(env, "STOP_KILL_TIMEOUT", 2)
+        ),
+        _env_number(env, "PREROLL_SECONDS", 0),
+        services,
+        timezone
+    )
+
+    lease = LeaseConfig(
+        env["LEASE_BACKEND"].lower(),
+        env.get("LEASE_FILE") or None,
+        env.get("LEASE_LISTEN") or None,
+        env.get("LEASE_PEER") or None,
+        env.get("LEASE_NODE") or None,
+        _env_number(env, "LEASE_TTL", 15),
+        _env_number(env, "LEASE_CLOCK_SKEW", 1)
+    ) if env.get("LEASE_BACKEND") else None
+
+    control_address = env.get("CONTROL_ADDRESS") or None
+    control_token = env.get("CONTROL_TOKEN") or None
+
+    # The control interface can start and stop streams, so anything but a Unix socket needs a token
+    if control_address is not None and not control_address.startswith('unix:') and control_token is None:
+        raise ValueError("CONTROL_ADDRESS: serving the control interface over TCP needs CONTROL_TOKEN (or use unix:/path/to/socket)")
+
+    debug = str(env.get("DEBUG")).lower() == 'true'
+    debug_start = None
+
+    # In debug mode the clock starts at DEBUG_DATETIME (UTC) shifted by DEBUG_TZ_OFFSET hours
+    if debug:
+        try:
+            debug_start = datetime.datetime.fromisoformat(env.get("DEBUG_DATETIME") or '') + datetime.timedelta(hours=_env_number(env, "DEBUG_TZ_OFFSET", 0, int))
+        except ValueError as e:
+            raise ValueError(f"Debug mode needs an ISO 8601 DEBUG_DATETIME: {e}") from e
+
+    return AppConfig(
+        pipeline,
+        env.get("LOG_CONFIG"),
+        engine,
+        env.get("PIPELINES_CONFIG") or None,
+        env.get("METRICS_ADDRESS") or None,
+        control_address,
+        control_token,
+        env.get("RELOAD_ENV_FILE") or None,
+        env.get("OUTPUT_RULES") or None,
+        lease,
+        debug,
+        debug_start
+    )
+
+def load_pipeline_configs(path: str) -> Tuple[List[PipelineConfig], int]:
+    """Load pipeline configurations from a YAML file.
+
+    Args:
+        path (str): Path to the YAML pipeline config.
+
+    Returns:
+        Tuple[List[PipelineConfig], int]: Pipeline configs, and the maximum number of concurrent pipelines (0 for no limit).
+    """
+
+    with open(path, 'r') as fh:
+        return parse_pipeline_configs(yaml.load(fh, Loader=yaml.FullLoader) or {})
+
+def load_output_rules(path: str) -> List[Rule]:
+    """Load output rules from a YAML file holding a list of rules (see parse_rules).
+
+    Args:
+        path (str): Path to the YAML rules file.
+
+    Returns:
+        List[Rule]: The configured rules.
+    """
+
+    with open(path, 'r') as fh:
+        return parse_rules(yaml.load(fh, Loader=yaml.FullLoader))
+
+def configure_logging(path: str):
+    """Configure logging from a YAML dictConfig file (LOG_CONFIG)."""
+
+    with open(str(path), 'r') as fh:
+        logging.config.dictConfig(yaml.load(fh, Loader=yaml.FullLoader))
+
+def read_env_file(path: str) -> Dict[str, str]:
+    """Read an env file (KEY=VALUE lines, as used by docker --env-file and sample.env).
+
+    Blank lines and comments are skipped, and values may be wrapped in matching
+    quotes.
+
+    Args:
+        path (str): Path to the env file.
+
+    Returns:
+        Dict[str, str]: The variables it sets.
+    """
+
+    env = {}
+
+    with open(path, 'r') as fh:
+        for line in fh:
+            line = line.strip()
+
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+
+            key, _, value = line.partition('=')
+            value = value.strip()
+
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'"):
+                value = value[1:-1]
+
+            env[key.strip()] = value
+
+    return env
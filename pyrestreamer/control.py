@@ -0,0 +1,284 @@
+"""Local control interface: reload settings, override the schedule and add one-off events without a restart."""
+
+import hmac
+import os
+import json
+import datetime
+import logging
+import threading
+import socketserver
+import http.server
+import urllib.parse
+
+from typing import Callable, Dict, List, Optional
+
+from pyrestreamer.helpers import ReStreamer
+from pyrestreamer.server import serve
+
+log = logging.getLogger("pyrestreamer")
+
+def pipeline_status(rs: ReStreamer, transitions: int = 4) -> dict:
+    """Describe a pipeline's state, override, one-off events and next transitions.
+
+    Args:
+        rs (ReStreamer): The pipeline.
+        transitions (int): How many upcoming transitions to list.
+
+    Returns:
+        dict: The status, ready to be sent as JSON.
+    """
+
+    now = rs.clock.now(rs.settings.schedule.tz)
+    override = rs.override
+
+    if override is not None and override.applies(now):
+        override_status = {'state': 'streaming' if override.streaming else 'idle', 'until': override.until.isoformat() if override.until else None}
+    else:
+        override_status = None
+
+    return {
+        'name': rs.name or 'default',
+        'state': rs.state.name.lower(),
+        'expected_state': rs.expected_state(now).name.lower(),
+        'leader': rs.elector.is_leader if rs.elector is not None else None,
+        'override': override_status,
+        'events': [{'start': event.start.isoformat(), 'end': event.end.isoformat()} for event in rs.events if event.end > now],
+        'next_transitions': [
+            {'time': instant.isoformat(), 'state': 'streaming' if streaming else 'idle'}
+            for instant, streaming in rs.upcoming_transitions(transitions, now)
+        ],
+    }
+
+class Controller():
+    """Apply control requests to running restreamers.
+
+    Requests come from the control server's threads or a SIGHUP. Each one changes
+    a restreamer's settings, override or one-off events and wakes its event loop,
+    which acts on the change straight away.
+    """
+
+    def __init__(self, restreamers: List[ReStreamer], loader: Callable[[], Dict[str, dict]] = None):
+        """
+        Args:
+            restreamers (List[ReStreamer]): The running restreamers.
+            loader (Callable): Reads the current settings of every pipeline, as ReStreamer.reload keyword
+                arguments by pipeline name (None if there is nowhere to reload settings from).
+        """
+
+        self.restreamers = {rs.name or 'default': rs for rs in restreamers}
+        self.loader = loader
+
+        self._lock = threading.Lock()
+
+    def pipeline(self, name: str = None) -> ReStreamer:
+        """Get a pipeline by name (which may be left out if there is only one).
+
+        Raises:
+            LookupError: If there is no such pipeline.
+        """
+
+        if name is None and len(self.restreamers) == 1:
+            return next(iter(self.restreamers.values()))
+
+        if name not in self.restreamers:
+            raise LookupError(f"Unknown pipeline {name}; pipelines are: {', '.join(self.restreamers)}")
+
+        return self.restreamers[name]
+
+    def status(self) -> dict:
+        """Describe every pipeline (see pipeline_status)."""
+
+        return {'pipelines': [pipeline_status(rs) for rs in self.restreamers.values()]}
+
+    def reload(self) -> dict:
+        """Reload every pipeline's settings.
+
+        Every pipeline's settings are validated and compiled before any are applied,
+        so an invalid config changes nothing. Pipelines added to or removed from the
+        config are reported but not started or stopped.
+
+        Raises:
+            ValueError: If reloading is not configured or the settings are invalid.
+
+        Returns:
+            dict: The pipelines that were reloaded, those restarting to use new parameters, and those ignored.
+        """
+
+        if self.loader is None:
+            raise ValueError("Reloading is not configured; set RELOAD_ENV_FILE or PIPELINES_CONFIG")
+
+        with self._lock:
+            try:
+                settings = self.loader()
+            except OSError as e:
+                raise ValueError(f"Could not read settings: {e}") from e
+
+            compiled = {name: self.restreamers[name].compile_settings(**settings[name]) for name in settings if name in self.restreamers}
+            result: Dict[str, List[str]] = {'reloaded': [], 'restarting': [], 'ignored': []}
+
+            for name, rs in self.restreamers.items():
+                if name not in compiled:
+                    log.warning(f"Pipeline {name} is no longer configured; restart PyRestreamer to remove it.")
+                    result['ignored'].append(name)
+                elif rs.apply_settings(compiled[name]):
+                    result['restarting'].append(name)
+                else:
+                    result['reloaded'].append(name)
+
+            for name in settings:
+                if name not in self.restreamers:
+                    log.warning(f"Pipeline {name} is newly configured; restart PyRestreamer to add it.")
+                    result['ignored'].append(name)
+
+        log.warning(f"Reloaded settings for {len(compiled)} pipelines ({len(result['restarting'])} restarting to use new parameters).")
+
+        return result
+
+    def reload_in_background(self):
+        """Reload settings from a new thread, logging any error (SIGHUP handler)."""
+
+        def reload():
+            try:
+                self.reload()
+            except Exception as e: #pylint: disable=broad-except
+                log.error(f"Could not reload settings: {e}")
+
+        threading.Thread(target=reload, daemon=True).start()
+
+    def override(self, name: Optional[str], streaming: Optional[bool], minutes: float = None) -> dict:
+        """Start or stop a pipeline regardless of its schedule, or clear its override (see ReStreamer.set_override)."""
+
+        rs = self.pipeline(name)
+        rs.set_override(streaming, minutes)
+
+        return pipeline_status(rs)
+
+    def add_event(self, name: Optional[str], start: str, minutes: float) -> dict:
+        """Add a one-off event to a pipeline.
+
+        Args:
+            name (str): The pipeline (optional if there is only one).
+            start (str): ISO 8601 start time (in the pipeline's timezone if it has no offset).
+            minutes (float): How long the event lasts.
+        """
+
+        rs = self.pipeline(name)
+        rs.add_event(datetime.datetime.fromisoformat(start), float(minutes))
+
+        return pipeline_status(rs)
+
+    def clear_events(self, name: Optional[str]) -> dict:
+        """Remove a pipeline's one-off events."""
+
+        rs = self.pipeline(name)
+        rs.clear_events()
+
+        return pipeline_status(rs)
+
+class ControlHandler(http.server.BaseHTTPRequestHandler):
+    """Serve a Controller as JSON.
+
+    GET /status describes every pipeline. POST /reload reloads settings; POST
+    /start and /stop override the schedule (for "minutes" if given) and POST
+    /resume clears the override; POST /events adds a one-off event at "start"
+    lasting "minutes", and DELETE /events removes them. Parameters are taken from
+    the query string, and "pipeline" names the pipeline if there are several.
+
+    If token is set, every request must carry it as "Authorization: Bearer <token>".
+    """
+
+    controller: Controller = None
+    token: Optional[str] = None
+
+    def do_GET(self): #pylint: disable=invalid-name
+        self._dispatch({
+            '/': lambda params: self.controller.status(),
+            '/status': lambda params: self.controller.status(),
+        })
+
+    def do_POST(self): #pylint: disable=invalid-name
+        self._dispatch({
+            '/reload': lambda params: self.controller.reload(),
+            '/start': lambda params: self.controller.override(params.get('pipeline'), True, params.get('minutes')),
+            '/stop': lambda params: self.controller.override(params.get('pipeline'), False, params.get('minutes')),
+            '/resume': lambda params: self.controller.override(params.get('pipeline'), None),
+            '/events': lambda params: self.controller.add_event(params.get('pipeline'), params['start'], params['minutes']),
+        })
+
+    def do_DELETE(self): #pylint: disable=invalid-name
+        self._dispatch({
+            '/events': lambda params: self.controller.clear_events(params.get('pipeline')),
+        })
+
+    def _dispatch(self, routes: Dict[str, Callable[[Dict[str, str]], dict]]):
+        if self.token is not None and not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), f'Bearer {self.token}'.encode('utf-8')):
+            self._respond(401, {'error': "Missing or wrong control token"})
+            return
+
+        url = urllib.parse.urlsplit(self.path)
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        route = routes.get(url.path)
+
+        if route is None:
+            self._respond(404, {'error': f"No such endpoint: {self.command} {url.path}"})
+            return
+
+        try:
+            body = route(params)
+        except KeyError as e:
+            self._respond(400, {'error': f"Missing parameter {e}"})
+            return
+        except LookupError as e:
+            self._respond(404, {'error': str(e)})
+            return
+        except ValueError as e:
+            self._respond(400, {'error': str(e)})
+            return
+
+        self._respond(200, body)
+
+    def _respond(self, status: int, body: dict):
+        data = json.dumps(body, indent=2).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args): #pylint: disable=redefined-builtin
+        log.debug(f"Control request: {format % args}")
+
+def start_control_server(address: str, controller: Controller, token: str = None) -> socketserver.BaseServer:
+    """Serve the control interface from a background thread.
+
+    The interface can change what is streamed, so it is served on a Unix socket
+    (guarded by its file permissions) unless a token is given.
+
+    Args:
+        address (str): "unix:/path/to/socket", or "host:port" (e.g. "127.0.0.1:9465") with a token.
+        controller (Controller): The controller to serve.
+        token (str): Token every request must present (required on TCP).
+
+    Raises:
+        ValueError: If address is a TCP address and there is no token.
+
+    Returns:
+        socketserver.BaseServer: The running server (call shutdown() to stop it).
+    """
+
+    if not address.startswith('unix:') and not token:
+        raise ValueError("Serving the control interface over TCP needs a token; use a unix: address otherwise")
+
+    server = serve(address, type('BoundControlHandler', (ControlHandler,), {'controller': controller, 'token': token or None}))
+
+    # Only the user we run as may connect to the socket
+    if address.startswith('unix:'):
+        os.chmod(address[len('unix:'):], 0o600)
+
+    log.info(f"Serving the control interface on {address}")
+
+    return server
@@ -0,0 +1,376 @@
+"""Thread-based pipeline engine (the default ENGINE)."""
+
+import os
+import time
+import queue
+import signal
+import logging
+import threading
+
+from pyrestreamer.helpers import ReStreamer, StreamingState
+from pyrestreamer.pipeline import ManagedPipeline, OutputHealth, StreamGate, PipelineFailure, FatalPipelineError
+from pyrestreamer.progress import ProgressParser
+from pyrestreamer.rules import Action
+from pyrestreamer.signals import add_signal_handler
+
+log = logging.getLogger("pyrestreamer")
+
+class ThreadReStreamer():
+    """Run a ReStreamer pipeline from a blocking event loop on the calling thread.
+
+    The loop polls the pipeline every sleep_time seconds while streaming (sooner
+    when a health check is due) and otherwise sleeps until the next schedule
+    transition or a change made from another thread. Output is read by a
+    thread of its own. A failed pipeline is restarted according to the
+    restreamer's RestartPolicy; see supervisor.AsyncReStreamer for the asyncio
+    engine, which restarts single outputs as well.
+    """
+
+    # Size of each read from the pipeline's output
+    READ_CHUNK = 2 ** 16
+
+    def __init__(self, restreamer: ReStreamer):
+        """
+        Args:
+            restreamer (ReStreamer): The configured restreamer to run.
+        """
+
+        self.restreamer = restreamer
+
+        self._shutdown = threading.Event()
+
+    @classmethod
+    def output_reader(cls, proc: ManagedPipeline, queue: queue.Queue):
+        """Queue (monotonic arrival time, unix arrival time, bytes ingested by then, chunk) for everything ffmpeg outputs."""
+
+        fd = proc.stdout.fileno()
+
+        for chunk in iter(lambda: os.read(fd, ThreadReStreamer.READ_CHUNK), b''):
+            queue.put((time.monotonic(), time.time(), proc.meter.total_bytes, chunk))
+
+    def request_stop(self):
+        """Ask the event loop to stop streaming and return (signal handler)."""
+
+        log.warning("PyRestreamer received a shutdown request.")
+
+        self._shutdown.set()
+        self.restreamer.notify()
+
+    def run(self):
+        """The main PyReStreamer event loop."""
+
+        rs = self.restreamer
+        current_state = StreamingState.IDLE
+
+        comm_queue: queue.Queue = None
+        reader_thread: threading.Thread = None
+        parser: ProgressParser = None
+        proc: ManagedPipeline = None
+        health: OutputHealth = None
+        started_at: float = None
+
+        rs.report_state(current_state)
+        rs.metrics.transitions(rs.next_transition)
+
+        # Stop gracefully on docker stop or ^C, and dump the progress history on demand
+        # (signal handlers can only be set from the main thread, and run on the dispatcher thread so they may log)
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                add_signal_handler(sig, self.request_stop)
+
+            add_signal_handler(signal.SIGUSR1, rs.dump_progress, "requested with SIGUSR1")
+
+        log.warning("PyRestreamer has begun monitoring for active events.")
+
+        try:
+            while True:
+                log.debug('Main loop start.')
+
+                # Cleared before anything is checked, so a change made from here on wakes the next sleep
+                rs.wake.clear()
+
+                if self._shutdown.is_set():
+                    if current_state is not StreamingState.IDLE:
+                        if not self.stop_pipeline(proc, reader_thread):
+                            raise PipelineFailure("Did not exit streaming state on shutdown (ffmpeg still running?)")
+
+                        current_state = StreamingState.IDLE
+
+                    rs.report_state(current_state)
+
+                    log.warning("PyRestreamer has shut down.")
+                    return
+
+                expected_state = rs.expected_state()
+                should_stop = False
+                switching = False
+                failure: str = None
+
+                if expected_state is not current_state:
+                    log.info(f"We need to transition from {current_state} to {expected_state}")
+
+                    if current_state is StreamingState.WARMING and expected_state is StreamingState.STREAMING:
+                        # Everything is running already; just let the stream through to ffmpeg
+                        proc.gate.open()
+
+                        started_at = time.monotonic()
+                        health = OutputHealth(rs.output_watchdog())
+                        rs.resources.reset()
+
+                        current_state = StreamingState.STREAMING
+
+                        rs.report_state(current_state)
+
+                        log.warning(f"PyRestreamer has started streaming (warm start, {proc.meter.total_bytes} bytes ingested in advance).")
+
+                    elif current_state is StreamingState.IDLE:
+                        warm = expected_state is StreamingState.WARMING
+                        source_error = rs.check_source() if warm else None
+
+                        if source_error is not None:
+                            log.warning(f"Source is not ready for a warm start ({source_error}); trying again shortly.")
+                        else:
+                            log.debug("Warming up." if warm else "Starting streaming.")
+
+                            rs.prepare_variant()
+                            rs.take_restart_request()
+
+                            try:
+                                proc = ManagedPipeline(
+                                    rs.ingest_args(),
+                                    rs.output_args(rs.settings.ffmpeg_params),
+                                    rs.make_ingest if rs.in_process_ingest else None,
+                                    rs.jitter,
+                                    StreamGate() if warm else None
+                                ).start()
+                            except PipelineFailure as e:
+                                # A failed warm start isn't a pipeline failure; it is simply tried again
+                                if warm:
+                                    log.warning(f"Warm start failed ({e}); trying again shortly.")
+                                else:
+                                    log.critical(f"{e}; restarting pipeline.")
+                                    failure = str(e)
+                            else:
+                                started_at = None if warm else time.monotonic()
+                                comm_queue = queue.Queue()
+                                parser = ProgressParser()
+                                health = None if warm else OutputHealth(rs.output_watchdog())
+                                rs.resources.reset()
+                                reader_thread = threading.Thread(target=ThreadReStreamer.output_reader, args=(proc, comm_queue))
+                                reader_thread.start()
+
+                                current_state = expected_state
+
+                                rs.report_state(current_state)
+                                rs.metrics.ingest(proc.meter)
+                                rs.metrics.jitter(proc.buffer)
+
+                                log.warning("PyRestreamer is warming up for the next service." if warm else "PyRestreamer has started streaming.")
+
+                    else:
+                        log.debug("Service ended. We should stop streaming.")
+
+                        should_stop = True
+
+                elif current_state is StreamingState.STREAMING:
+                    log.debug("We are currently streaming. Checking for new output to verify state.")
+
+                    try:
+                        if proc.poll() is not None:
+                            raise PipelineFailure("ffmpeg has exited unexpectedly")
+
+                        had_status_out = health.had_status_out
+                        standard_out = []
+                        records = []
+
+                        while True:
+                            try:
+                                received, received_at, ingested, chunk = comm_queue.get(block=False)
+                            except queue.Empty:
+                                break
+
+                            chunk_out, chunk_records = parser.feed(chunk)
+                            standard_out.extend(chunk_out)
+
+                            for record in chunk_records:
+                                rs.metrics.progress(record)
+                                rs.recorder.record(record, ingested, now=received_at)
+
+                                if started_at is not None and record.total_size:
+                                    log.info(f"ffmpeg wrote its first output {received - started_at:.2f} seconds after the service started.")
+
+                                    rs.metrics.start_time(received - started_at)
+                                    started_at = None
+
+                                if health.handle_record(record, received):
+                                    self._record_recovery('pipeline')
+
+                            records.extend(chunk_records)
+
+                        for line in standard_out:
+                            rule = rs.handle_output_line(line, 'ffmpeg', expected=not had_status_out)
+
+                            if rule is not None and rule.action is Action.FATAL:
+                                raise FatalPipelineError(rule.description or rule.name)
+
+                            if rule is not None:
+                                raise PipelineFailure(f"{rule.description or rule.name}: {line}")
+
+                        if records:
+                            log.debug(f"Total output size: {health.total_size}, speed: {records[-1].speed}x, bitrate: {records[-1].bitrate}kbits/s")
+
+                        ingest_idle = proc.meter.idle_for()
+
+                        log.debug(f"Ingest rate: {proc.meter.rate():.0f} B/s, idle for {ingest_idle:.1f}s, stalls: {proc.meter.stalls}")
+
+                        if ingest_idle >= rs.ingest_stall_timeout():
+                            raise PipelineFailure(f"Source seems to be stalled; no ingest data for {ingest_idle:.0f} seconds")
+
+                        # The output's input is held back on purpose while the jitter buffer refills
+                        if proc.buffer is not None:
+                            health.watchdog.hold(proc.buffer.refilling, proc.buffer.held_seconds())
+
+                        reason = health.check()
+
+                        if reason is not None:
+                            raise PipelineFailure(f"Ffmpeg seems to be stuck; {reason}")
+
+                        if proc.buffer is not None:
+                            log.debug(f"Jitter buffer: {proc.buffer.used} bytes ({proc.buffer.fill_seconds():.1f}s), {proc.buffer.state}, drained {proc.buffer.drains} times")
+
+                            if proc.buffer.failed:
+                                raise PipelineFailure("Jitter buffer drained")
+
+                        if rs.resources.due(time.monotonic()):
+                            breach = rs.sample_resources({proc.pid: ''})
+
+                            if breach is not None:
+                                raise PipelineFailure(f"Resource limit exceeded; {breach[1]}")
+
+                        if rs.take_restart_request():
+                            log.warning("Pipeline settings changed; restarting pipeline.")
+
+                            should_stop = True
+                            switching = True
+                        elif rs.adapt(health.last_record.speed if health.last_record else None, ingest_idle):
+                            should_stop = True
+                            switching = True
+
+                    except PipelineFailure as e:
+                        log.critical(f"{e}; restarting pipeline.")
+
+                        should_stop = True
+                        failure = str(e)
+
+                elif current_state is StreamingState.WARMING:
+                    ingest_idle = proc.meter.idle_for()
+
+                    # A failed warm start isn't a pipeline failure; it is simply tried again
+                    if proc.poll() is not None:
+                        log.warning("Warm start failed (ffmpeg has exited); trying again shortly.")
+                        should_stop = True
+                    elif ingest_idle >= rs.ingest_stall_timeout():
+                        log.warning(f"Warm start failed (no ingest data for {ingest_idle:.0f} seconds); trying again shortly.")
+                        should_stop = True
+                    elif rs.take_restart_request():
+                        log.warning("Pipeline settings changed; warming up again.")
+                        should_stop = True
+
+                if should_stop:
+                    if not self.stop_pipeline(proc, reader_thread):
+                        raise PipelineFailure("Did not exit streaming state as expected (ffmpeg still running?)")
+
+                    # Reset event loop loop variables
+                    comm_queue = None
+                    reader_thread = None
+                    parser = None
+                    proc = None
+                    health = None
+                    started_at = None
+
+                    current_state = StreamingState.IDLE
+
+                    rs.report_state(current_state)
+                    rs.metrics.stopped()
+                    rs.metrics.resources({})
+                    rs.metrics.jitter(None)
+
+                    log.warning("PyRestreamer has stopped streaming.")
+
+                # Start again straight away on the new variant
+                if switching:
+                    continue
+
+                if failure is not None:
+                    delay = rs.restart_policy.record_failure(time.monotonic())
+
+                    if delay is None:
+                        raise PipelineFailure(f"Pipeline failed {rs.restart_policy.max_failures} times within {rs.restart_policy.window:.0f} seconds; last failure: {failure}")
+
+                    rs.metrics.restart('pipeline')
+
+                    log.warning(f"Restarting pipeline in {delay:.1f} seconds.")
+
+                    rs.clock.wait(rs.wake, delay)
+                    continue
+
+                sleep_for = rs.sleep_duration(current_state)
+
+                if health is not None:
+                    sleep_for = min(sleep_for, max(health.deadline() - time.monotonic(), 0.0))
+
+                    if rs.resources.enabled:
+                        sleep_for = min(sleep_for, max(rs.resources.next_sample - time.monotonic(), 0.0))
+
+                log.debug(f"Main loop end. Sleep for {sleep_for:.3f} seconds.")
+
+                rs.clock.wait(rs.wake, sleep_for)
+        except (PipelineFailure, FatalPipelineError) as e:
+            rs.dump_progress(str(e))
+            raise
+        finally:
+            # Stop whatever is still running on the way out, as the asyncio engine does
+            if current_state is not StreamingState.IDLE and self.stop_pipeline(proc, reader_thread):
+                rs.report_state(StreamingState.IDLE)
+
+    def stop_pipeline(self, proc: ManagedPipeline, reader_thread: threading.Thread) -> bool:
+        """Stop a running pipeline.
+
+        Args:
+            proc (ManagedPipeline): The running pipeline.
+            reader_thread (threading.Thread): The thread reading its output.
+
+        Returns:
+            bool: True if the pipeline stopped, false if ffmpeg is still running.
+        """
+
+        rs = self.restreamer
+
+        # end process group running streamlink and ffmpeg (and any in-process ingest)
+        result = proc.stop(rs.stop_policy)
+
+        rs.metrics.stop_time(result)
+
+        if result.killed:
+            log.warning(f"Pipeline did not exit within {rs.stop_policy.grace:g} seconds of SIGTERM; killed it.")
+
+        if not result.exited:
+            return False
+
+        log.info(f"Pipeline stopped in {result.seconds:.2f} seconds.")
+
+        # the log pipe closes once every process has exited, ending the output reader thread
+        reader_thread.join()
+
+        return True
+
+    def _record_recovery(self, component: str):
+        """Log and record the time taken to recover, if we were recovering from a failure."""
+
+        rs = self.restreamer
+        time_to_recover = rs.restart_policy.record_recovery(time.monotonic())
+
+        if time_to_recover is not None:
+            log.warning(f"PyRestreamer has recovered ({component}) after {time_to_recover:.1f} seconds.")
+
+            rs.metrics.recovered(time_to_recover, component)
@@ -1,28 +1,42 @@
 """Helper classes."""
 
-import os
 import datetime
 import logging
 import time
 import threading
-import subprocess
 import sys
 import queue
-import signal
+import collections
 
-from typing import List, Tuple, Dict
+from typing import TYPE_CHECKING, Callable, Hashable, List, NamedTuple, Tuple, Dict, Optional
 from enum import Enum
 
 import pytz
 import pytz.tzinfo
-import pushover
+
+from pyrestreamer.schedule import ServiceSchedule, OneOffEvent, Override, parse_service_times, parse_timezone
+from pyrestreamer.clock import Clock, SYSTEM_CLOCK
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.ingest import StreamlinkIngest, option_args, stream_names
+from pyrestreamer.pipeline import streamlink_args, ffmpeg_args
+from pyrestreamer.metrics import PipelineMetrics
+from pyrestreamer.recovery import RestartPolicy
+from pyrestreamer.watchdog import StallWatchdog
+from pyrestreamer.rules import Action, OutputRules, Rule, DEFAULT_RULES
+from pyrestreamer.resources import ResourceSampler, format_usage
+from pyrestreamer.adaptive import ADAPTIVE, VariantSelector, rank_variants
+from pyrestreamer.recorder import ProgressRecorder
+from pyrestreamer.shutdown import StopPolicy
+
+if TYPE_CHECKING:
+    from pyrestreamer.lease import LeaderElector
 
 log = logging.getLogger("pyrestreamer")
 
 class Service():
     """Represents a church service or other event."""
 
-    def __init__(self, dow: int, hr: int, min: int, buf: int, dur:int , tz: pytz.tzinfo):
+    def __init__(self, dow: int, hr: int, min: int, buf: int, dur:int , tz: pytz.tzinfo, clock: Clock = None):
         """
         Args:
             dow (int): Day of the week on which the service occurs. Monday is day 1.
@@ -31,6 +45,7 @@ class Service():
             buf (int): The number of minutes before and after the service content should be active.
             dur (int): The duration of the service (minutes).
             tz (tzinfo): The PYTZ timezone object for the local timezone.
+            clock (Clock): Clock giving the current time (defaults to the system clock).
         """
 
         self.dow = dow
@@ -39,20 +54,25 @@ class Service():
         self.buf = buf
         self.dur = dur
         self.tz = tz
+        self.clock = clock or SYSTEM_CLOCK
 
-    def is_active(self):
-        """Is this service active now?
+    def is_active(self, now: datetime.datetime = None):
+        """Is this service active now (or at the given time)?
         
         Note:
             This currently does not support services which cross date
             boundaries, such as a service that starts at 11:00 pm on
-            one day and finishes at 12:30 pm the next.
+            one day and finishes at 12:30 pm the next. ServiceSchedule
+            handles these, and is what the event loop uses.
+
+        Args:
+            now (datetime.datetime): Time to check (defaults to the current time).
 
         Returns:
             (bool): True if service is active now, false if it is not.
         """
 
-        now = datetime.datetime.now(self.tz)
+        now = self.clock.now(self.tz) if now is None else now.astimezone(self.tz)
         start_date = self._date_for_dow(now, self.dow)
         start_datetime = datetime.datetime(
             start_date.year,
@@ -100,168 +120,827 @@ class Service():
         return f'<Service: DOW={self.dow}, HR={self.hr}, MIN={self.min}, BUF={self.buf}, DUR={self.dur}, TZ={self.tz}>'
 
 class PushoverHandler(logging.Handler):
-    """Emit logs directly to pushover."""
+    """Emit logs to pushover from a background worker.
+
+    emit() only formats and queues the record, so logging never waits on the
+    network. The worker collects records for batch_interval seconds after the
+    first one arrives, merges repeats (records from the same logger, at the same
+    level and with the same message template) into the first one's text with a
+    count, and sends each batch as one
+    message, at most rate_limit messages per rate_period seconds. On close,
+    whatever is queued is flushed for up to flush_timeout seconds.
+    """
+
+    # Pushover's maximum message length
+    MAX_MESSAGE = 1024
+
+    _STOP = object()
+
+    def __init__(self, user_key, api_token, *args, batch_interval: float = 5.0, rate_limit: int = 10, rate_period: float = 60.0, queue_size: int = 1000, flush_timeout: float = 5.0, **kwargs):
+        """
+        Args:
+            user_key (str): Pushover user key.
+            api_token (str): Pushover application token.
+            batch_interval (float): How long to collect records into one message (seconds).
+            rate_limit (int): Maximum number of messages per rate_period.
+            rate_period (float): Rate limit period (seconds).
+            queue_size (int): Maximum number of queued records; further records are dropped.
+            flush_timeout (float): How long close() may spend sending queued records (seconds).
+        """
 
-    def __init__(self, user_key, api_token, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.client = pushover.Client(user_key, api_token=api_token)
+        self.batch_interval = batch_interval
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.flush_timeout = flush_timeout
+
+        self.client = self.make_client(user_key, api_token)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        # Records dropped because the queue was full (counted by emit, reported by the worker; guarded by self.lock)
+        self.dropped = 0
+
+        self._sent: collections.deque = collections.deque()
+        self._worker = threading.Thread(target=self._run, name='pushover', daemon=True)
+        self._worker.start()
+
+    def make_client(self, user_key, api_token):
+        """Create the pushover client."""
+
+        import pushover #pylint: disable=import-outside-toplevel
+
+        return pushover.Client(user_key, api_token=api_token)
 
     def emit(self, record):
-        log_entry = self.format(record)
+        try:
+            self.queue.put_nowait((PushoverHandler.repeat_key(record), self.format(record)))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+        except Exception: #pylint: disable=broad-except
+            self.handleError(record)
+
+    def close(self):
+        """Flush queued records (up to flush_timeout) and stop the worker."""
+
+        if self._worker.is_alive():
+            try:
+                self.queue.put(PushoverHandler._STOP, timeout=self.flush_timeout)
+            except queue.Full:
+                pass
+
+            self._worker.join(self.flush_timeout)
+
+        super().close()
+
+    @staticmethod
+    def repeat_key(record: logging.LogRecord) -> Tuple[str, int, str]:
+        """Get the key records must share to be merged as repeats: logger, level and message template."""
+
+        return (record.name, record.levelno, str(record.msg))
+
+    @classmethod
+    def coalesce(cls, entries: List[Tuple[Hashable, str]]) -> str:
+        """Merge a batch of log entries into one message, collapsing repeats.
+
+        Args:
+            entries (List[Tuple[Hashable, str]]): (repeat key, formatted text) for each log entry, oldest first.
+
+        Returns:
+            str: The message to send; repeats keep the first entry's text.
+        """
+
+        groups: Dict[Hashable, List] = collections.OrderedDict()
+
+        for key, entry in entries:
+            if key in groups:
+                groups[key][1] += 1
+            else:
+                groups[key] = [entry, 1]
+
+        parts = [entry if count == 1 else f"{entry}\n(repeated {count} times)" for entry, count in groups.values()]
+        message = '\n\n'.join(parts)
+
+        if len(message) > PushoverHandler.MAX_MESSAGE:
+            message = message[:PushoverHandler.MAX_MESSAGE - 3] + '...'
 
-        return self.client.send_message(log_entry, 'PyReStreamer')
+        return message
+
+    def _run(self):
+        stopping = False
+
+        while not stopping:
+            item = self.queue.get()
+
+            if item is PushoverHandler._STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.batch_interval
+
+            # Collect the batch, then keep collecting while we are rate limited
+            while True:
+                wait = max(deadline, self._next_send_time()) - time.monotonic()
+
+                if wait <= 0:
+                    break
+
+                try:
+                    item = self.queue.get(timeout=wait)
+                except queue.Empty:
+                    continue
+
+                if item is PushoverHandler._STOP:
+                    stopping = True
+                    break
+
+                batch.append(item)
+
+            if stopping:
+                batch += self._drain()
+
+            with self.lock:
+                dropped, self.dropped = self.dropped, 0
+
+            if dropped:
+                batch.append((None, f"PyReStreamer dropped {dropped} log records (alert queue full)."))
+
+            self._send(PushoverHandler.coalesce(batch))
+
+    def _drain(self) -> List[Tuple[Hashable, str]]:
+        entries = []
+
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return entries
+
+            if item is not PushoverHandler._STOP:
+                entries.append(item)
+
+    def _next_send_time(self) -> float:
+        """Get the earliest time the rate limit allows another message."""
+
+        now = time.monotonic()
+
+        while self._sent and self._sent[0] <= now - self.rate_period:
+            self._sent.popleft()
+
+        if len(self._sent) < self.rate_limit:
+            return now
+
+        return self._sent[0] + self.rate_period
+
+    def _send(self, message: str):
+        self._sent.append(time.monotonic())
+
+        try:
+            self.client.send_message(message, 'PyReStreamer')
+        except Exception as e: #pylint: disable=broad-except
+            sys.stderr.write(f"PyReStreamer could not send pushover alert: {e}\n")
 
 class StreamingState(Enum):
     """Enum for possible streaming states."""
 
     IDLE = 0 #pylint: disable=unused-variable
     STREAMING = 1 #pylint: disable=unused-variable
+    WARMING = 2 #pylint: disable=unused-variable
+
+class Settings(NamedTuple):
+    """A pipeline's reloadable settings, validated and with the schedule compiled (see ReStreamer.compile_settings)."""
+
+    service_times: str
+    service_buffer: int
+    sleep_time: int
+    pytz_timezone: str
+    input_url: str
+    ffmpeg_params: str
+    outputs: List[str]
+    services: List[Service]
+    schedule: ServiceSchedule
 
 class ReStreamer():
-    def __init__(self, service_times: str, service_buffer: int, sleep_time: int, pytz_timezone: str, input_url: str, ffmpeg_params: str):
-        self.service_times = service_times
-        self.service_buffer = service_buffer
-        self.sleep_time = sleep_time
-        self.pytz_timezone = pytz_timezone
-        self.input_url = input_url
-        self.ffmpeg_params = ffmpeg_params
 
-        self.services = load_services(self.service_times, int(self.service_buffer), self.pytz_timezone)
+    # Upper bound on how long we sleep while idle, so wall-clock changes are picked up
+    MAX_IDLE_SLEEP = 3600
 
-    @classmethod
-    def output_reader(cls, proc: subprocess.Popen, queue: queue.Queue):
-        for line in iter(proc.stdout.readline, b''):
-            queue.put(line.decode('utf-8'))
+    # How long the source may send nothing before we consider it stalled (seconds), on top of any jitter buffer
+    INGEST_STALL_TIMEOUT = 20
+
+    def __init__(self, config: PipelineConfig, clock: Clock = None, elector: 'LeaderElector' = None):
+        """
+        Args:
+            config (PipelineConfig): The pipeline's settings. Its restart policy, watchdog, resource sampler and
+                variant selector keep state, so the restreamer uses copies and one config can build several.
+            clock (Clock): Clock giving the current time (defaults to the system clock).
+            elector (LeaderElector): Hot-standby elector to follow (optional).
+        """
 
-    def event_loop(self):
-        """The main PyReStreamer event loop."""
+        self.name = config.name
+        self.ingest_config = config.ingest
+        self.clock = clock or SYSTEM_CLOCK
+        self.restart_policy = config.restart_policy.clone() if config.restart_policy else RestartPolicy()
+        self.watchdog = config.watchdog.clone() if config.watchdog else StallWatchdog()
+        self.rules = OutputRules(config.rules + DEFAULT_RULES)
+        self.resources = config.resources.clone() if config.resources else ResourceSampler()
+        self.selector = config.adaptive.clone() if config.adaptive else VariantSelector()
+        self.jitter = config.jitter
+        outputs = list(config.outputs) if config.outputs else [config.ffmpeg_params]
+        self.recorder = ProgressRecorder(config.progress_history, len(outputs), directory=config.dump_dir)
+        self.stop_policy = config.stop_policy or StopPolicy()
+        self.preroll = config.preroll
+        self.elector = elector
+
+        # The config parsed and checked these when it was read, unless it was built by hand
+        tz = config.timezone or parse_timezone(config.pytz_timezone)
+        service_times = config.services or parse_service_times(config.service_times)
+        services = [Service(service.dow, service.hour, service.minute, int(config.service_buffer), service.duration, tz, self.clock) for service in service_times]
+
+        # Reloadable settings, replaced as a whole by apply_settings (take it once to read several fields)
+        self.settings = Settings(
+            config.service_times, config.service_buffer, config.sleep_time, config.pytz_timezone, config.input_url,
+            config.ffmpeg_params, outputs, services, ServiceSchedule(services, tz, self.clock)
+        )
 
-        current_state = StreamingState.IDLE
+        self.metrics = PipelineMetrics(self.name or 'default')
 
-        comm_queue: queue.Queue = None
-        reader_thread: threading.Thread = None
-        proc: subprocess.Popen = None
-        had_status_out: bool = None
-        last_ts: int = 0
-        ts_unchanged_count: int = 0
-        no_status_out_intervals: int = 0
+        # Manual control (see the control module): an override of the schedule and one-off events
+        self.override: Optional[Override] = None
+        self.events: List[OneOffEvent] = []
+        self.state = StreamingState.IDLE
 
-        log.warning("PyRestreamer has begun monitoring for active events.")
+        # Set (and, for the asyncio engine, on_change called) after a change, to wake the event loop
+        self.wake = threading.Event()
+        self.on_change: Optional[Callable[[], None]] = None
 
-        while True:
-            log.debug('Main loop start.')
+        self._restart_requested = False
+
+        if self.elector is not None:
+            self.elector.subscribe(self.notify)
+
+    def ingest_args(self) -> List[str]:
+        """Get the arguments for the streamlink ingest process."""
+
+        return streamlink_args(self.settings.input_url, self.quality, option_args(self.ingest_config.options))
+
+    @property
+    def in_process_ingest(self) -> bool:
+        """Whether streamlink runs in this process (api ingest mode) rather than as a subprocess."""
+
+        return self.ingest_config.mode == 'api'
+
+    def make_ingest(self, fd: int, log_fd: int, meter=None) -> StreamlinkIngest:
+        """Create an in-process ingest thread writing the stream to fd and log lines to log_fd."""
+
+        return StreamlinkIngest(self.settings.input_url, self.ingest_config._replace(quality=self.quality), fd, log_fd, meter, self.metrics)
+
+    def dump_progress(self, reason: str, logger: logging.LoggerAdapter = None) -> Optional[str]:
+        """Write the recent progress history to a file for a post-mortem (see ProgressRecorder).
+
+        Args:
+            reason (str): Why the history is being dumped.
+            logger (logging.LoggerAdapter): Logger to use (defaults to the app logger).
+
+        Returns:
+            str: Path of the dump, or None if it could not be written.
+        """
+
+        logger = logger or log
+
+        try:
+            path = self.recorder.dump(reason, self.name or 'default')
+        except OSError as e:
+            logger.error(f"Could not write progress history: {e}")
+            return None
+
+        logger.warning(f"Wrote {self.recorder.count} progress samples to {path} ({reason}).")
+
+        return path
+
+    def output_watchdog(self) -> StallWatchdog:
+        """Get a fresh watchdog for an output, allowing for the jitter buffer to fill before its first progress.
+
+        Later refills after the buffer drains are exempted as they happen (see StallWatchdog.hold).
+        """
+
+        watchdog = self.watchdog.clone()
+        watchdog.startup_timeout += self.jitter.seconds
+
+        return watchdog
+
+    def ingest_stall_timeout(self) -> float:
+        """Get how long the source may send nothing before it is stalled, allowing for a gap the jitter buffer covers."""
+
+        return ReStreamer.INGEST_STALL_TIMEOUT + self.jitter.seconds
+
+    @property
+    def adaptive(self) -> bool:
+        """Whether the variant is chosen by the VariantSelector (quality "adaptive")."""
+
+        return self.ingest_config.quality == ADAPTIVE
+
+    @property
+    def quality(self) -> str:
+        """The stream quality to ingest."""
+
+        if not self.adaptive:
+            return self.ingest_config.quality
+
+        return self.selector.current or 'best'
+
+    def _now(self, now: datetime.datetime = None) -> datetime.datetime:
+        return self.clock.now(self.settings.schedule.tz) if now is None else now
+
+    def is_scheduled(self, now: datetime.datetime = None) -> bool:
+        """Whether a service window or one-off event is active now (or at the given time), ignoring any override."""
+
+        now = self._now(now)
+
+        return self.settings.schedule.is_active(now) or any(event.is_active(now) for event in self.events)
+
+    def is_streaming_at(self, now: datetime.datetime = None) -> bool:
+        """Whether we should be streaming now (or at the given time): per the override if there is one, otherwise per the schedule."""
+
+        now = self._now(now)
+        override = self.override
+
+        if override is not None and override.applies(now):
+            return override.streaming
+
+        return self.is_scheduled(now)
+
+    def expected_state(self, now: datetime.datetime = None) -> StreamingState:
+        """Get the state called for now (or at the given time): streaming in a service window or one-off event, warming up in the pre-roll before one.
+
+        A manual override takes precedence, and skips the pre-roll. In a hot-standby
+        pair, only the instance holding the lease streams; the other stays warmed up
+        so it can take over by opening the gate.
+        """
+
+        state = self._scheduled_state(self._now(now))
+
+        if state is StreamingState.STREAMING and self.elector is not None and not self.elector.is_leader:
+            return StreamingState.WARMING
+
+        return state
+
+    def _scheduled_state(self, now: datetime.datetime) -> StreamingState:
+        override = self.override
+
+        if override is not None and override.applies(now):
+            return StreamingState.STREAMING if override.streaming else StreamingState.IDLE
+
+        if self.is_scheduled(now):
+            return StreamingState.STREAMING
+
+        if self.preroll > 0:
+            until_start = self.seconds_until_transition(now)
+
+            if until_start is not None and until_start <= self.preroll:
+                return StreamingState.WARMING
+
+        return StreamingState.IDLE
+
+    def seconds_until_transition(self, now: datetime.datetime = None) -> Optional[float]:
+        """Get the number of seconds until the schedule, a one-off event or the override next changes.
+
+        Args:
+            now (datetime.datetime): Time to check from (defaults to the current time).
+
+        Returns:
+            float: Seconds until the next change, or None if there is none.
+        """
+
+        now = self._now(now)
+        override = self.override
+        candidates = [self.settings.schedule.seconds_until_transition(now)]
+
+        for event in self.events:
+            candidates.extend((instant - now).total_seconds() for instant in event if instant > now)
+
+        if override is not None and override.until is not None and override.until > now:
+            candidates.append((override.until - now).total_seconds())
+
+        # Wake to stop pushing once the lease lapses, if it isn't renewed by then
+        if self.elector is not None:
+            candidates.append(self.elector.seconds_left())
+
+        candidates = [seconds for seconds in candidates if seconds is not None]
+
+        return min(candidates) if candidates else None
+
+    def next_transition(self, now: datetime.datetime = None) -> Optional[datetime.datetime]:
+        """Get when the state called for (see expected_state) next changes, including the start of a pre-roll.
+
+        Args:
+            now (datetime.datetime): Time to look from (defaults to the current time).
+
+        Returns:
+            datetime.datetime: When the state next changes, or None if it never does.
+        """
 
-            expected_state = StreamingState.STREAMING if list_has_active_service(self.services) else StreamingState.IDLE
+        instant = self._now(now)
+        state = self.expected_state(instant)
+        tz = self.settings.schedule.tz
 
-            if expected_state is not current_state:
-                log.info(f"We need to transition from {current_state} to {expected_state}")
+        # Not every change (e.g. an event inside a service window) is a transition, so bound the search
+        for _ in range(16):
+            seconds = self.seconds_until_transition(instant)
 
-                if current_state is StreamingState.IDLE:
-                    log.debug("Starting streaming.")
+            if seconds is None:
+                return None
 
-                    proc = subprocess.Popen(
-                        f"streamlink {self.input_url} best -O| ffmpeg -progress - -nostats -hide_banner -re -i - {self.ffmpeg_params}",
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        shell=True,
-                        preexec_fn=os.setsid
-                    )
+            change = tz.normalize(instant + datetime.timedelta(seconds=max(seconds, 0.001)))
 
-                    comm_queue = queue.Queue()
-                    reader_thread = threading.Thread(target=ReStreamer.output_reader, args=(proc, comm_queue))
-                    reader_thread.start()
+            # Warming up begins the pre-roll before the change itself
+            if state is StreamingState.IDLE and self.preroll > 0:
+                warm_at = tz.normalize(change - datetime.timedelta(seconds=self.preroll))
 
-                    current_state = StreamingState.STREAMING
+                if warm_at > instant and self.expected_state(warm_at) is not state:
+                    return warm_at
 
-                    log.warning("PyRestreamer has started streaming.")
+            if self.expected_state(change) is not state:
+                return change
 
-                elif current_state is StreamingState.STREAMING:
-                    log.debug("Service ended. We should stop streaming.")
+            instant = change
 
-                    # end process group for shell running ffmpeg
-                    os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
+        return None
 
-                    # make sure we gave ffmpeg enough time to quit
-                    time.sleep(2)
+    def upcoming_transitions(self, count: int = 4, now: datetime.datetime = None) -> List[Tuple[datetime.datetime, bool]]:
+        """Get the next times streaming starts or stops.
 
-                    # kill output reader thread
-                    reader_thread.join()
+        Args:
+            count (int): Maximum number of transitions to get.
+            now (datetime.datetime): Time to look from (defaults to the current time).
+
+        Returns:
+            List[Tuple[datetime.datetime, bool]]: When, and whether we should be streaming from then on.
+        """
+
+        instant = self._now(now)
+        streaming = self.is_streaming_at(instant)
+        transitions: List[Tuple[datetime.datetime, bool]] = []
+
+        # Not every change (e.g. an event inside a service window) is a transition, so bound the search
+        for _ in range(count * 4):
+            if len(transitions) >= count:
+                break
+
+            seconds = self.seconds_until_transition(instant)
+
+            if seconds is None:
+                break
+
+            instant = self.settings.schedule.tz.normalize(instant + datetime.timedelta(seconds=max(seconds, 0.001)))
+
+            if self.is_streaming_at(instant) != streaming:
+                streaming = not streaming
+                transitions.append((instant, streaming))
+
+        return transitions
+
+    def report_state(self, state: StreamingState):
+        """Record the event loop's current state."""
+
+        self.state = state
+
+        self.metrics.state(state)
+
+    def set_override(self, streaming: Optional[bool], minutes: float = None) -> Optional[Override]:
+        """Start or stop streaming regardless of the schedule.
+
+        Args:
+            streaming (bool): Whether to stream, or None to clear the override and follow the schedule again.
+            minutes (float): How long the override lasts (until cleared if not given).
+
+        Returns:
+            Override: The new override, if any.
+        """
+
+        if streaming is None:
+            self.override = None
+
+            log.warning("Manual override cleared; following the schedule.")
+        else:
+            until = None if minutes is None else self._now() + datetime.timedelta(minutes=float(minutes))
+            self.override = Override(streaming, until)
+
+            log.warning(f"Manual override: {'streaming' if streaming else 'idle'} {f'until {until.isoformat()}' if until else 'until cleared'}.")
+
+        self.notify()
+
+        return self.override
+
+    def add_event(self, start: datetime.datetime, minutes: float) -> OneOffEvent:
+        """Stream for a one-off event outside the weekly schedule.
+
+        Args:
+            start (datetime.datetime): When the event starts (in the pipeline's timezone if naive).
+            minutes (float): How long the event lasts.
+
+        Returns:
+            OneOffEvent: The event.
+        """
+
+        if float(minutes) <= 0:
+            raise ValueError("One-off events must last more than 0 minutes")
+
+        tz = self.settings.schedule.tz
+        start = tz.localize(start) if start.tzinfo is None else start.astimezone(tz)
+        event = OneOffEvent(start, tz.normalize(start + datetime.timedelta(minutes=float(minutes))))
+        now = self._now()
+
+        self.events = sorted([current for current in self.events if current.end > now] + [event])
+
+        log.warning(f"Added one-off event from {event.start.isoformat()} to {event.end.isoformat()}.")
+
+        self.notify()
+
+        return event
+
+    def clear_events(self):
+        """Remove all one-off events."""
+
+        self.events = []
+
+        log.warning("Cleared one-off events.")
+
+        self.notify()
+
+    def compile_settings(self, service_times: str, service_buffer: int, sleep_time: int, pytz_timezone: str, input_url: str, ffmpeg_params: str, outputs: List[str] = None) -> Settings:
+        """Validate new settings and compile their schedule, without applying them.
+
+        Raises:
+            ValueError: If the service times, buffer, sleep time or timezone are invalid.
+
+        Returns:
+            Settings: The settings, ready for apply_settings.
+        """
+
+        try:
+            int(sleep_time)
+            tz = pytz.timezone(pytz_timezone)
+            services = load_services(service_times, int(service_buffer), pytz_timezone, self.clock)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid settings: {e}") from e
+
+        return Settings(
+            service_times, service_buffer, sleep_time, pytz_timezone, input_url, ffmpeg_params,
+            list(outputs) if outputs else [ffmpeg_params], services, ServiceSchedule(services, tz, self.clock)
+        )
+
+    def apply_settings(self, settings: Settings) -> bool:
+        """Switch to compiled settings and wake the event loop.
+
+        The settings are swapped in one assignment, so the event loop (on its own
+        thread) sees either the old or the new ones, never a mix. A running pipeline keeps streaming unless its own parameters
+        (input URL or outputs) changed, in which case the event loop restarts it.
+
+        Returns:
+            bool: True if the pipeline must restart to use the new settings.
+        """
+
+        current = self.settings
+        restart = settings.input_url != current.input_url or settings.outputs != current.outputs
+
+        self.settings = settings
+
+        if restart:
+            self._restart_requested = True
+
+        self.notify()
+
+        return restart
+
+    def reload(self, **settings) -> bool:
+        """Validate and apply new settings (see compile_settings and apply_settings).
+
+        Returns:
+            bool: True if the pipeline must restart to use the new settings.
+        """
+
+        return self.apply_settings(self.compile_settings(**settings))
+
+    def take_restart_request(self) -> bool:
+        """Check, and clear, whether reloaded settings call for a pipeline restart."""
+
+        requested = self._restart_requested
+        self._restart_requested = False
+
+        return requested
 
-                    if proc.poll() is None:
-                        log.critical("Did not exit streaming state as expected (ffmpeg still running?); exiting to force container restart.")
-                        sys.exit(1)
+    def notify(self):
+        """Wake the event loop to act on a change made from another thread or a signal handler."""
 
-                    # Reset event loop loop variables
-                    comm_queue = None
-                    reader_thread = None
-                    proc = None
-                    had_status_out = False
-                    last_ts = 0
-                    ts_unchanged_count = 0
-                    no_status_out_intervals = 0
+        self.wake.set()
 
-                    current_state = StreamingState.IDLE
+        if self.on_change is not None:
+            self.on_change()
 
-                    log.warning("PyRestreamer has stopped streaming.")
+    def check_source(self, logger: logging.LoggerAdapter = None) -> Optional[str]:
+        """Resolve the input's streams ahead of a warm start, caching the variant ladder for adaptive quality.
 
-            elif current_state is StreamingState.STREAMING:
-                log.debug("We are currently streaming. Checking for new output to verify state.")
+        Args:
+            logger (logging.LoggerAdapter): Logger to use (defaults to the app logger).
+
+        Returns:
+            str: Why the source isn't ready, or None if it is live.
+        """
+
+        logger = logger or log
+
+        try:
+            names = stream_names(self.settings.input_url, self.ingest_config)
+        except Exception as e: #pylint: disable=broad-except
+            return str(e) or type(e).__name__
+
+        if not names:
+            return "no streams found"
+
+        logger.info(f"Source is live with streams: {', '.join(names)}")
+
+        if self.adaptive and not self.selector.variants:
+            variants = rank_variants(names)
+
+            if variants:
+                logger.info(f"Adaptive variant ladder: {', '.join(variants)}")
+
+            self.selector.set_variants(variants)
+
+        return None
+
+    def prepare_variant(self, logger: logging.LoggerAdapter = None):
+        """Discover the variant ladder if it isn't known yet, and restart the selector's timers (adaptive quality only).
+
+        Args:
+            logger (logging.LoggerAdapter): Logger to use (defaults to the app logger).
+        """
+
+        if not self.adaptive:
+            return
 
-                if proc.poll():
-                    log.critical("ffmpeg has exited unexpectedly; exiting to force container restart.")
-                    sys.exit(1)
+        logger = logger or log
 
-                lines = []
+        if not self.selector.variants:
+            try:
+                names = stream_names(self.settings.input_url, self.ingest_config)
+            except Exception as e: #pylint: disable=broad-except
+                logger.warning(f"Could not list the input's variants ({e}); using best.")
+                names = []
 
-                while True:
-                    try:
-                        lines.append(str(comm_queue.get(block=False)).strip())
-                    except queue.Empty:
-                        break
+            variants = rank_variants(names)
 
-                standard_out, status_out = ReStreamer.parse_ffmpeg_output(lines)
+            if variants:
+                logger.info(f"Adaptive variant ladder: {', '.join(variants)}")
 
-                if had_status_out and standard_out:
-                    segment_timeouts = [line for line in standard_out if line.startswith('[stream.dash][error] Failed to open segment')]
+            self.selector.set_variants(variants)
 
-                    if segment_timeouts:
-                        log.info(f"Segment timeouts: {'##'.join(segment_timeouts)}")
+        self.selector.start(time.monotonic())
+        self.metrics.variant(self.selector.index)
 
-                    if [line for line in standard_out if line.startswith('[stream.ffmpegmux][error] Pipe copy aborted:')]:
-                        log.critical(f"Pipe died. Forcing container restart: {'##'.join(standard_out)}")
-                        sys.exit(1)
+    def adapt(self, speed: Optional[float], ingest_idle: float, logger: logging.LoggerAdapter = None) -> bool:
+        """Let the selector judge the current variant, switching variants if it should (adaptive quality only).
 
-                    standard_out = [line for line in standard_out if not line.startswith('[stream.dash][error] Failed to open segment')]
+        Args:
+            speed (float): The slowest output's latest encoder speed (None if not known yet).
+            ingest_idle (float): Seconds since ingest data last arrived.
+            logger (logging.LoggerAdapter): Logger to use (defaults to the app logger).
+
+        Returns:
+            bool: True if the variant changed and the pipeline must restart to use it.
+        """
+
+        if not self.adaptive:
+            return False
+
+        now = time.monotonic()
+        step = self.selector.observe(speed, ingest_idle, now)
+
+        if step is None:
+            return False
+
+        previous = self.quality
+        variant = self.selector.switch(step, now)
+
+        if step < 0:
+            (logger or log).warning(f"Pipeline can't keep up (speed {speed}x, no ingest data for {ingest_idle:.1f}s); stepping down from {previous} to {variant}.")
+        else:
+            (logger or log).warning(f"Pipeline has kept up for {self.selector.upgrade_after * 2 ** self.selector.failed_upgrades:.0f}s; stepping up from {previous} to {variant}.")
 
-                    if standard_out:
-                        log.warning(f"Unexpected output from ffmpeg proc: {'##'.join(standard_out)}")
+        self.metrics.variant_switch('down' if step < 0 else 'up', variant, self.selector.index)
 
-                elif standard_out:
-                    log.info(f"FFMPEG proc output: {'##'.join(standard_out)}")
+        return True
 
-                if 'total_size' in status_out:
-                    had_status_out = True
-                    total_size = int(status_out['total_size'])
-                    
-                    log.debug(f"Total output size: {total_size}")
+    def output_args(self, ffmpeg_params: str) -> List[str]:
+        """Get the arguments for an ffmpeg output process."""
 
-                    if total_size > last_ts:
-                        last_ts = total_size
-                        ts_unchanged_count = 0
-                    else:
-                        ts_unchanged_count += 1
+        return ffmpeg_args(ffmpeg_params)
 
-                if last_ts == 0 and not had_status_out:
-                    no_status_out_intervals += 1
+    def handle_output_line(self, line: str, source: str, expected: bool = True, logger: logging.LoggerAdapter = None) -> Optional[Rule]:
+        """Classify a line of streamlink/ffmpeg output and log or count it.
+
+        Args:
+            line (str): The output line.
+            source (str): Name of the process that output the line, for log messages.
+            expected (bool): Whether output not matching a rule is expected (logged as info rather than a warning).
+            logger (logging.LoggerAdapter): Logger to use (defaults to the app logger).
+
+        Returns:
+            Rule: The matching rule if its action is to restart the pipeline or exit, otherwise None.
+        """
+
+        logger = logger or log
+        rule = self.rules.classify(line)
+
+        if rule is None:
+            if expected:
+                logger.info(f"{source} proc output: {line}")
+            else:
+                logger.warning(f"Unexpected output from {source} proc: {line}")
 
-                if ts_unchanged_count == 3 or no_status_out_intervals == 3:
-                    log.critical("Ffmpeg seems to be stuck; output size not increasing or no status output. Forcing container restart.")
-                    sys.exit(1)
+            return None
 
-            log.debug(f"Main loop end. Sleep for {self.sleep_time} seconds.")
+        self.metrics.rule_matched(rule.name)
 
-            time.sleep(int(self.sleep_time))
+        if rule.action is Action.COUNT:
+            logger.info(f"{rule.description or rule.name}: {line}")
+        elif rule.action is Action.WARN:
+            logger.warning(f"{rule.description or rule.name}: {line}")
+        elif rule.action in (Action.RESTART, Action.FATAL):
+            logger.critical(f"{rule.description or rule.name}: {line}")
+            return rule
+
+        return None
+
+    def sample_resources(self, groups: Dict[int, str], logger: logging.LoggerAdapter = None) -> Optional[Tuple[str, str]]:
+        """Sample the CPU, memory and I/O of the pipeline's process groups, log and record it, and check the limits.
+
+        Args:
+            groups (Dict[int, str]): Label for each process group ID ('' for no prefix).
+            logger (logging.LoggerAdapter): Logger to use (defaults to the app logger).
+
+        Returns:
+            Tuple[str, str]: The component breaching its limits and why, if the breach should restart it, otherwise None.
+        """
+
+        logger = logger or log
+        now = time.monotonic()
+        usage = self.resources.sample(groups, now)
+
+        for current in usage.values():
+            logger.debug(f"Resource usage of {format_usage(current)}")
+
+        self.metrics.resources(usage)
+
+        breach = self.resources.check(usage, now)
+
+        if breach is None:
+            return None
+
+        if self.resources.action is Action.RESTART:
+            return breach
+
+        logger.warning(f"Resource limit exceeded; {breach[1]}")
+
+        return None
+
+    def sleep_duration(self, current_state: StreamingState) -> float:
+        """Get how long to sleep until the next schedule transition or health check.
+
+        While streaming or warming up we wake at least every sleep_time seconds to
+        check on ffmpeg; while idle there is nothing to check, so we sleep until the
+        next transition (or the pre-roll before it).
+
+        Args:
+            current_state (StreamingState): The current streaming state.
+
+        Returns:
+            float: Number of seconds to sleep.
+        """
+
+        until_transition = self.seconds_until_transition()
+        sleep_time = float(self.settings.sleep_time)
+
+        # Wake for the pre-roll rather than the start
+        if current_state is StreamingState.IDLE and self.preroll > 0 and until_transition is not None and not self.is_streaming_at():
+            if until_transition > self.preroll:
+                until_transition -= self.preroll
+
+        # Retry a transition that didn't happen (e.g. a warm start while the source was down) every sleep_time seconds
+        if self.expected_state() is not current_state:
+            until_transition = sleep_time if until_transition is None else min(until_transition, sleep_time)
+
+        if current_state is not StreamingState.IDLE:
+            limit = sleep_time
+        else:
+            limit = float(ReStreamer.MAX_IDLE_SLEEP)
+
+        if until_transition is None:
+            return limit
+
+        return min(until_transition, limit)
 
     @classmethod
     def parse_ffmpeg_output(cls, ffmpeg_output: List[str]) -> Tuple[List[str], Dict[str, str]]:
@@ -269,7 +948,8 @@ class ReStreamer():
 
         Splits output into a list of standard outputs and status outputs. For status outputs,
         there can be multiples of the same key depending on polling intervals. This function
-        will return only the most recent status output for a given key.
+        will return only the most recent status output for a given key. The event loops
+        use the incremental ProgressParser instead, which keeps each progress block.
 
         Args:
             ffmpeg_output (List[int]): List of lines from ffmpeg output.
@@ -294,46 +974,38 @@ class ReStreamer():
 
         return standard_output, status_output
 
-def list_has_active_service(services: List[Service]) -> bool:
+def list_has_active_service(services: List[Service], now: datetime.datetime = None) -> bool:
     """Check whether or not we have a currently active service.
 
     Args:
         list[Service]: A list of service objects.
+        now (datetime.datetime): Time to check (defaults to the current time).
 
     Returns:
         bool: True if we have an active service, false if we do not.
     """
 
-    return any(service.is_active() for service in services)
+    return any(service.is_active(now) for service in services)
 
-def load_services(services_string, service_buffer, timezone):
+def load_services(services_string, service_buffer, timezone, clock: Clock = None):
     """Return array of service objects from environment variable.
     
     Args:
-        services_string (str): String representing service times.
+        services_string (str): String representing service times (see parse_service_times).
         service_buffer (int): Buffer time to start streaming before service.
         timezone (str): The PYTZ-compatible timezone string.
+        clock (Clock): Clock the services tell the time by (defaults to the system clock).
+
+    Raises:
+        ValueError: If the service times or timezone are invalid.
 
     Returns:
         [Service]: Array of service objects.
     """
 
-    services_string = services_string.split(',')
-
-    service_objs = []
-
-    for service in services_string:
-        split = service.split('|')
-        
-        service_objs.append(
-            Service(
-                int(split[0]),
-                int(split[1].split(':')[0]),
-                int(split[1].split(':')[1]),
-                int(service_buffer),
-                int(split[2]),
-                pytz.timezone(timezone)
-            )
-        )
+    tz = parse_timezone(timezone)
 
-    return service_objs
+    return [
+        Service(service.dow, service.hour, service.minute, int(service_buffer), service.duration, tz, clock)
+        for service in parse_service_times(services_string)
+    ]
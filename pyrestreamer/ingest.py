@@ -0,0 +1,387 @@
+"""In-process streamlink ingest using streamlink's Python API."""
+
+import os
+import json
+import fcntl
+import logging
+import threading
+import subprocess
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pyrestreamer.pipeline import F_SETPIPE_SZ
+
+log = logging.getLogger("pyrestreamer")
+
+class IngestConfig(NamedTuple):
+    """How to read the input stream.
+
+    In "process" mode the streamlink CLI runs as a subprocess; in "api" mode
+    streamlink's Python API runs inside our process. Options are streamlink
+    session options (e.g. stream-segment-attempts), passed as --option flags to
+    the CLI or set on the session.
+    """
+
+    mode: str = 'process'
+    quality: str = 'best'
+    options: Tuple[Tuple[str, Any], ...] = ()
+
+INGEST_MODES = ('process', 'api')
+
+def parse_ingest_config(config: Optional[Dict[str, Any]]) -> IngestConfig:
+    """Parse an ingest config mapping (mode, quality and an options mapping).
+
+    Args:
+        config (Dict[str, Any]): The mapping (may be None for the defaults).
+
+    Returns:
+        IngestConfig: The parsed config.
+    """
+
+    config = config or {}
+    mode = str(config.get('mode', 'process')).lower()
+
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest mode {mode} (expected one of {', '.join(INGEST_MODES)})")
+
+    options = tuple(sorted((str(key), value) for key, value in (config.get('options') or {}).items()))
+
+    return IngestConfig(mode, str(config.get('quality', 'best')), options)
+
+def option_args(options: Tuple[Tuple[str, Any], ...]) -> List[str]:
+    """Convert session options to streamlink CLI flags.
+
+    Args:
+        options (Tuple[Tuple[str, Any], ...]): (name, value) session options.
+
+    Returns:
+        List[str]: CLI arguments; true options become bare flags and false ones are left out.
+    """
+
+    args: List[str] = []
+
+    for name, value in options:
+        if value is True:
+            args.append(f'--{name}')
+        elif value is not False and value is not None:
+            args.extend([f'--{name}', str(value)])
+
+    return args
+
+def make_session(options: Tuple[Tuple[str, Any], ...]):
+    """Create a streamlink session with the given options (streamlink is only needed in api mode)."""
+
+    from streamlink import Streamlink #pylint: disable=import-outside-toplevel
+
+    session = Streamlink()
+
+    for name, value in options:
+        session.set_option(name, value)
+
+    return session
+
+def stream_names(input_url: str, config: IngestConfig, timeout: float = 30) -> List[str]:
+    """List the streams (variants and aliases) available from an input.
+
+    Uses the streamlink CLI's --json output in process mode, and a session in api mode.
+
+    Args:
+        input_url (str): The DASH or HLS input URL.
+        config (IngestConfig): Ingest mode and session options.
+        timeout (float): How long to wait for the CLI (seconds).
+
+    Returns:
+        List[str]: The stream names.
+    """
+
+    if config.mode == 'api':
+        return list(make_session(config.options).streams(input_url))
+
+    result = subprocess.run(
+        ['streamlink'] + option_args(config.options) + ['--json', input_url],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        timeout=timeout,
+        check=False
+    )
+    document = json.loads(result.stdout.decode('utf-8', errors='replace') or '{}')
+
+    if 'error' in document:
+        raise ValueError(document['error'])
+
+    return list(document.get('streams') or {})
+
+class StreamlinkLogRouter(logging.Handler):
+    """Route streamlink's log records to the ingest that produced them.
+
+    streamlink logs through module-level loggers shared by every session in the
+    process, so records are routed by thread. Each ingest binds its own thread
+    (a thread-local set while StreamlinkIngest.run runs), and a thread streamlink
+    starts on its behalf (stream workers and segment fetch pools) is adopted by
+    the ingest when it is the only one running. With several ingests in one
+    process such threads can't be told apart, so their records, like any others
+    no ingest owns, are logged by our own logger.
+    """
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+
+        self.local = threading.local()
+        self.active: List['StreamlinkIngest'] = []
+        self.threads: Dict[int, 'StreamlinkIngest'] = {}
+
+    def bind(self, ingest: 'StreamlinkIngest'):
+        """Attribute records logged from the calling thread to ingest until unbind is called."""
+
+        self.local.owner = ingest
+
+        with self.lock:
+            self.active.append(ingest)
+
+    def unbind(self, ingest: 'StreamlinkIngest'):
+        """Stop attributing records to ingest, from its own thread or those it adopted."""
+
+        self.local.owner = None
+
+        with self.lock:
+            self.active.remove(ingest)
+            self.threads = {ident: owner for ident, owner in self.threads.items() if owner is not ingest}
+
+    def owner(self, record: logging.LogRecord) -> Optional['StreamlinkIngest']:
+        """Find the ingest a record belongs to (called from the thread that logged it)."""
+
+        owner = getattr(self.local, 'owner', None)
+
+        if owner is not None:
+            return owner
+
+        with self.lock:
+            owner = self.threads.get(record.thread)
+
+            if owner is None and len(self.active) == 1:
+                owner = self.threads[record.thread] = self.active[0]
+
+        return owner
+
+    def emit(self, record):
+        owner = self.owner(record)
+        line = f"[{record.name[len('streamlink.'):] or 'cli'}][{record.levelname.lower()}] {record.getMessage()}"
+
+        if owner is None:
+            log.info(f"Unattributed streamlink output: {line}")
+        else:
+            owner.record_event(record)
+            owner.write_line(line)
+
+ROUTER = StreamlinkLogRouter()
+
+def count_retries(http, on_retry: Callable[[], None], retries: int):
+    """Retry failed requests a requests session makes, reporting each retry.
+
+    Sets a urllib3 Retry on each of the session's mounted adapters (keeping the
+    adapters streamlink mounted), which retries connection errors, read errors
+    and server error statuses with a backoff and calls on_retry for each retry.
+    This is on top of streamlink's own attempts at each segment, which it makes
+    without logging them.
+
+    Args:
+        http (requests.Session): The session (a streamlink session's http).
+        on_retry (Callable[[], None]): Called for each retry.
+        retries (int): The most retries for a request.
+    """
+
+    from urllib3.util.retry import Retry #pylint: disable=import-outside-toplevel
+
+    class CountingRetry(Retry):
+        """A Retry that reports each retry it allows."""
+
+        def increment(self, *args, **kwargs): #pylint: disable=signature-differs
+            # Raises once the retries are used up, which isn't a retry
+            retry = super().increment(*args, **kwargs)
+            on_retry()
+
+            return retry
+
+    for adapter in http.adapters.values():
+        adapter.max_retries = CountingRetry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False
+        )
+
+def install_router():
+    """Attach the log router to the streamlink logger (idempotent)."""
+
+    logger = logging.getLogger('streamlink')
+
+    if ROUTER not in logger.handlers:
+        logger.addHandler(ROUTER)
+        logger.propagate = False
+
+        if logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+
+# Events counted by StreamlinkIngest: errors logged by streamlink's stream workers and retried requests
+INGEST_EVENTS = ('segment_error', 'retry')
+
+class StreamlinkIngest(threading.Thread):
+    """Read a stream with streamlink's Python API and write it straight to a file descriptor.
+
+    This replaces the streamlink subprocess: the stream is written to fd in large
+    writes (as much as each read returns, up to READ_SIZE) and streamlink's log
+    records are written to log_fd as lines in the CLI's format, so the rest of the
+    pipeline cannot tell the difference. Owns and closes both descriptors when done.
+
+    Segment errors and request retries are also counted as events (see
+    INGEST_EVENTS) in events and, when given, in metrics.
+    """
+
+    # Maximum bytes read from streamlink (and written out) at a time
+    READ_SIZE = 2 ** 20
+
+    # Requested kernel buffer size for the output pipe (best effort)
+    PIPE_SIZE = 2 ** 20
+
+    # Most retries for a failed HTTP request (see count_retries)
+    HTTP_RETRIES = 2
+
+    def __init__(self, input_url: str, config: IngestConfig, fd: int, log_fd: int, meter=None, metrics=None):
+        """
+        Args:
+            input_url (str): The DASH or HLS input URL.
+            config (IngestConfig): Quality and session options.
+            fd (int): Descriptor to write the stream to (e.g. ffmpeg's stdin).
+            log_fd (int): Descriptor to write log lines to.
+            meter (ThroughputMeter): Meter to record ingested bytes on (optional).
+            metrics (PipelineMetrics): Metrics to count events in (optional).
+        """
+
+        super().__init__(daemon=True)
+
+        self.input_url = input_url
+        self.config = config
+        self.fd = fd
+        self.log_fd = log_fd
+        self.meter = meter
+        self.metrics = metrics
+
+        self.returncode: Optional[int] = None
+        self.log_records: Dict[str, int] = {}
+        self.events: Dict[str, int] = dict.fromkeys(INGEST_EVENTS, 0)
+
+        self._stream = None
+        self._stopping = threading.Event()
+        self._log_lock = threading.Lock()
+
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, StreamlinkIngest.PIPE_SIZE)
+        except OSError:
+            pass
+
+    def make_session(self):
+        """Create a configured streamlink session (streamlink is only needed in api mode)."""
+
+        return make_session(self.config.options)
+
+    def write_line(self, line: str):
+        """Write a log line for the supervisor, counting it by level."""
+
+        level = line.split('][', 1)[-1].split(']', 1)[0] if line.startswith('[') else 'other'
+
+        with self._log_lock:
+            self.log_records[level] = self.log_records.get(level, 0) + 1
+
+            try:
+                os.write(self.log_fd, (line + '\n').encode('utf-8', errors='replace'))
+            except OSError:
+                pass
+
+    def count_event(self, kind: str):
+        """Count an event (one of INGEST_EVENTS)."""
+
+        with self._log_lock:
+            self.events[kind] += 1
+
+        if self.metrics is not None:
+            self.metrics.ingest_event(kind)
+
+    def record_event(self, record: logging.LogRecord):
+        """Count the event a streamlink log record reports, if any."""
+
+        if record.levelno >= logging.ERROR and record.name.startswith('streamlink.stream'):
+            self.count_event('segment_error')
+
+    def stop(self):
+        """Stop reading the stream; the thread exits once its current read returns."""
+
+        self._stopping.set()
+
+        stream = self._stream
+
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception: #pylint: disable=broad-except
+                pass
+
+    def run(self):
+        install_router()
+
+        ROUTER.bind(self)
+
+        try:
+            session = self.make_session()
+
+            if hasattr(session, 'http'):
+                count_retries(session.http, lambda: self.count_event('retry'), StreamlinkIngest.HTTP_RETRIES)
+
+            streams = session.streams(self.input_url)
+
+            if self.config.quality not in streams:
+                raise ValueError(f"No {self.config.quality} stream found (available: {', '.join(streams) or 'none'})")
+
+            self._stream = streams[self.config.quality].open()
+
+            self.write_line(f"[cli][info] Opened {self.config.quality} stream in process")
+            self._copy()
+            self.returncode = 0
+        except BrokenPipeError:
+            self.returncode = 0
+        except Exception as e: #pylint: disable=broad-except
+            if self._stopping.is_set():
+                self.returncode = 0
+            else:
+                self.write_line(f"error: {e}")
+                self.returncode = 1
+        finally:
+            if self._stream is not None:
+                try:
+                    self._stream.close()
+                except Exception: #pylint: disable=broad-except
+                    pass
+
+            # Records from workers still winding down are no longer attributed once the descriptors close
+            ROUTER.unbind(self)
+
+            os.close(self.fd)
+
+            with self._log_lock:
+                os.close(self.log_fd)
+                self.log_fd = -1
+
+    def _copy(self):
+        while not self._stopping.is_set():
+            data = self._stream.read(StreamlinkIngest.READ_SIZE)
+
+            if not data:
+                return
+
+            if self.meter is not None:
+                self.meter.record(len(data))
+
+            view = memoryview(data)
+            written = 0
+
+            while written < len(data):
+                written += os.write(self.fd, view[written:])
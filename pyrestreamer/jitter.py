@@ -0,0 +1,387 @@
+"""A jitter buffer between the ingest and the encoder, to ride out source hiccups."""
+
+import os
+import mmap
+import time
+import logging
+import threading
+
+from typing import Any, Dict, NamedTuple, Optional
+
+log = logging.getLogger("pyrestreamer")
+
+class JitterConfig(NamedTuple):
+    """Jitter buffer settings.
+
+    The buffer holds the stream back for seconds of media before feeding the
+    encoder, so a source outage shorter than that doesn't reach the output.
+    Data is stored in a ring of up to max_mb MiB, in memory or in a
+    memory-mapped file in directory. on_drain says what happens when an outage
+    empties the buffer: "refill" holds the output until it has refilled,
+    "passthrough" forwards data as it arrives, and "restart" restarts the pipeline.
+    """
+
+    seconds: float = 0.0
+    max_mb: float = 64.0
+    storage: str = 'memory'
+    directory: Optional[str] = None
+    on_drain: str = 'refill'
+
+    @property
+    def enabled(self) -> bool:
+        return self.seconds > 0
+
+JITTER_STORAGE = ('memory', 'file')
+DRAIN_POLICIES = ('refill', 'passthrough', 'restart')
+
+def parse_jitter_config(config: Optional[Dict[str, Any]]) -> JitterConfig:
+    """Parse a jitter buffer config mapping (see JitterConfig).
+
+    Args:
+        config (Dict[str, Any]): The mapping (may be None to disable the buffer).
+
+    Returns:
+        JitterConfig: The parsed config.
+    """
+
+    config = config or {}
+    storage = str(config.get('storage', 'memory')).lower()
+    on_drain = str(config.get('on_drain', 'refill')).lower()
+
+    if storage not in JITTER_STORAGE:
+        raise ValueError(f"Unknown jitter buffer storage {storage} (expected one of {', '.join(JITTER_STORAGE)})")
+
+    if on_drain not in DRAIN_POLICIES:
+        raise ValueError(f"Unknown jitter buffer drain policy {on_drain} (expected one of {', '.join(DRAIN_POLICIES)})")
+
+    return JitterConfig(
+        float(config.get('seconds', 0)),
+        float(config.get('max_mb', 64)),
+        storage,
+        str(config['directory']) if config.get('directory') else None,
+        on_drain
+    )
+
+class RingBuffer():
+    """A fixed-size byte ring backed by an anonymous or file-backed memory map.
+
+    Pages of an anonymous map are only allocated once written, so a large ring
+    costs nothing until it fills.
+    """
+
+    def __init__(self, capacity: int, directory: str = None, file: bool = False):
+        """
+        Args:
+            capacity (int): Size of the ring in bytes.
+            directory (str): Directory for the backing file (the system default if not given).
+            file (bool): Back the ring with a temporary file rather than memory.
+        """
+
+        self.capacity = capacity
+        self.used = 0
+
+        self._start = 0
+        self._file = None
+
+        if file:
+            import tempfile #pylint: disable=import-outside-toplevel
+
+            self._file = tempfile.TemporaryFile(dir=directory)
+            self._file.truncate(capacity)
+            self._map = mmap.mmap(self._file.fileno(), capacity)
+        else:
+            self._map = mmap.mmap(-1, capacity)
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.used
+
+    def write(self, data: bytes) -> int:
+        """Append as much data as fits.
+
+        Returns:
+            int: Number of bytes written.
+        """
+
+        count = min(len(data), self.free)
+        end = (self._start + self.used) % self.capacity
+        first = min(count, self.capacity - end)
+
+        self._map[end:end + first] = data[:first]
+        self._map[0:count - first] = data[first:count]
+        self.used += count
+
+        return count
+
+    def read(self, size: int) -> bytes:
+        """Remove and return up to size bytes from the front of the ring."""
+
+        count = min(size, self.used)
+        first = min(count, self.capacity - self._start)
+        data = self._map[self._start:self._start + first] + self._map[0:count - first]
+
+        self._start = (self._start + count) % self.capacity
+        self.used -= count
+
+        return data
+
+    def close(self):
+        self._map.close()
+
+        if self._file is not None:
+            self._file.close()
+
+class JitterBuffer():
+    """Hold stream data back for a number of seconds and release it to the encoder.
+
+    Not thread-safe on its own; JitterCopier guards it with a condition, and the
+    asyncio engine only touches it from the event loop.
+    """
+
+    PREFILL = 'prefill'
+    PLAYING = 'playing'
+
+    def __init__(self, config: JitterConfig, meter=None):
+        """
+        Args:
+            config (JitterConfig): Buffer settings.
+            meter (ThroughputMeter): Meter of the data coming in, used to convert the fill level to seconds (optional).
+        """
+
+        self.config = config
+        self.meter = meter
+        self.ring = RingBuffer(int(config.max_mb * 2 ** 20), config.directory, config.storage == 'file')
+
+        self.state = JitterBuffer.PREFILL
+        self.prefill_since: Optional[float] = None
+        self.finished = False
+        self.failed = False
+        self.drains = 0
+
+        # When the current refill started, and how long earlier refills held the output back
+        self.refilling_since: Optional[float] = None
+        self._refilled_seconds = 0.0
+
+        self._drained = False
+
+    @property
+    def used(self) -> int:
+        return self.ring.used
+
+    @property
+    def full(self) -> bool:
+        return self.ring.free == 0
+
+    @property
+    def refilling(self) -> bool:
+        """Whether the output is held back while the buffer refills after draining."""
+
+        return self.refilling_since is not None
+
+    def held_seconds(self, now: float = None) -> float:
+        """Get how long refills have held the output back in total (not counting the first prefill)."""
+
+        since = self.refilling_since
+
+        if since is None:
+            return self._refilled_seconds
+
+        return self._refilled_seconds + (time.monotonic() if now is None else now) - since
+
+    def fill_seconds(self) -> float:
+        """Estimate the buffered media duration from the incoming data rate."""
+
+        rate = self.meter.rate() if self.meter is not None else 0
+
+        return self.ring.used / rate if rate > 0 else 0.0
+
+    def put(self, data: bytes, now: float = None) -> int:
+        """Buffer incoming data.
+
+        Args:
+            data (bytes): The data.
+            now (float): Monotonic time the data arrived (defaults to now).
+
+        Returns:
+            int: Number of bytes accepted (less than all of them if the buffer is full).
+        """
+
+        if self.state is JitterBuffer.PREFILL and self.prefill_since is None and data:
+            self.prefill_since = time.monotonic() if now is None else now
+
+        return self.ring.write(data)
+
+    def finish(self):
+        """Mark the end of the incoming data; whatever is buffered is released."""
+
+        self.finished = True
+
+    def ready_at(self) -> Optional[float]:
+        """Monotonic time the buffer will start releasing data (None if it is waiting for data)."""
+
+        if self.state is JitterBuffer.PLAYING or self.finished:
+            return 0.0
+
+        return None if self.prefill_since is None else self.prefill_since + self.config.seconds
+
+    def take(self, size: int, now: float = None) -> bytes:
+        """Release up to size bytes of buffered data to the encoder.
+
+        Args:
+            size (int): Maximum number of bytes.
+            now (float): Monotonic time (defaults to now).
+
+        Returns:
+            bytes: The data; empty while prefilling or if the buffer has drained.
+        """
+
+        now = time.monotonic() if now is None else now
+
+        if self.state is JitterBuffer.PREFILL:
+            ready_at = self.ready_at()
+
+            if not (self.finished or self.full or (ready_at is not None and now >= ready_at)):
+                return b''
+
+            self.state = JitterBuffer.PLAYING
+
+            if self.refilling_since is not None:
+                self._refilled_seconds += now - self.refilling_since
+                self.refilling_since = None
+
+        data = self.ring.read(size)
+
+        if data:
+            self._drained = False
+        elif not self.finished and not self._drained:
+            self._drain(now)
+
+        return data
+
+    def _drain(self, now: float):
+        self._drained = True
+        self.drains += 1
+
+        if self.config.on_drain == 'refill':
+            log.warning(f"Jitter buffer drained; holding output until {self.config.seconds:g} seconds are buffered again.")
+
+            self.state = JitterBuffer.PREFILL
+            self.prefill_since = None
+            self.refilling_since = now
+        elif self.config.on_drain == 'restart':
+            log.warning("Jitter buffer drained.")
+
+            self.failed = True
+        else:
+            log.warning("Jitter buffer drained; passing data through as it arrives.")
+
+    def close(self):
+        self.ring.close()
+
+class JitterCopier(threading.Thread):
+    """Copy a stream from one pipe to another through a JitterBuffer.
+
+    A reader thread fills the buffer from the source while this thread feeds the
+    destination from it. Closes both descriptors when done; the destination is
+    closed once the source reaches EOF and the buffer is empty, like a shell pipe.
+    """
+
+    # Maximum bytes moved per read/write call
+    CHUNK = 2 ** 16
+
+    def __init__(self, src_fd: int, dst_fd: int, buffer: JitterBuffer, meter, gate=None):
+        """
+        Args:
+            src_fd (int): Read end of the source pipe (owned by the copier).
+            dst_fd (int): Write end of the destination pipe (owned by the copier).
+            buffer (JitterBuffer): The buffer to copy through (owned by the copier).
+            meter (ThroughputMeter): Meter to record incoming bytes on.
+            gate (StreamGate): Gate holding the stream back from the buffer until it is opened (optional).
+        """
+
+        super().__init__(daemon=True)
+
+        self.src_fd = src_fd
+        self.dst_fd = dst_fd
+        self.buffer = buffer
+        self.meter = meter
+        self.gate = gate
+        self.error: Optional[OSError] = None
+
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._reader = threading.Thread(target=self._read, daemon=True)
+
+    def start(self):
+        self._reader.start()
+        super().start()
+
+    def _read(self):
+        try:
+            while True:
+                data = os.read(self.src_fd, JitterCopier.CHUNK)
+
+                if not data:
+                    break
+
+                self.meter.record(len(data))
+
+                if self.gate is not None:
+                    data = self.gate.filter(data)
+
+                view = memoryview(data)
+
+                with self._cond:
+                    while view and not self._stopping:
+                        accepted = self.buffer.put(view)
+                        view = view[accepted:]
+                        self._cond.notify_all()
+
+                        if view:
+                            self._cond.wait()
+
+                    if self._stopping:
+                        break
+        except OSError as e:
+            self.error = e
+        finally:
+            os.close(self.src_fd)
+
+            with self._cond:
+                self.buffer.finish()
+                self._cond.notify_all()
+
+    def run(self):
+        try:
+            while True:
+                with self._cond:
+                    data = self.buffer.take(JitterCopier.CHUNK)
+
+                    if not data:
+                        if self.buffer.finished and self.buffer.used == 0:
+                            return
+
+                        ready_at = self.buffer.ready_at()
+                        self._cond.wait(max(ready_at - time.monotonic(), 0.01) if ready_at else None)
+                        continue
+
+                    self._cond.notify_all()
+
+                view = memoryview(data)
+                written = 0
+
+                while written < len(data):
+                    written += os.write(self.dst_fd, view[written:])
+        except BrokenPipeError:
+            pass
+        except OSError as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self._stopping = True
+                self._cond.notify_all()
+
+            os.close(self.dst_fd)
+
+            self._reader.join()
+            self.buffer.close()
@@ -0,0 +1,484 @@
+"""Hot-standby leases: which of a pair of instances may push to the destinations."""
+
+import os
+import json
+import time
+import fcntl
+import socket
+import logging
+import threading
+import socketserver
+
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from pyrestreamer.metrics import REGISTRY, Metrics
+
+log = logging.getLogger("pyrestreamer")
+
+class LeaseState(NamedTuple):
+    """The contents of a lease file."""
+
+    holder: Optional[str]
+    token: int
+    expires: float
+
+class FileLease():
+    """A lease kept in a small JSON file, read and written under flock.
+
+    Both instances must see the same file: on one host (for testing) or on
+    storage both hosts mount. The file acts as the arbiter, so a leader that
+    can't reach it stops before its lease runs out, and the pair is safe even if
+    the hosts can't reach each other. Expiry is in wall-clock time, so the hosts'
+    clocks must agree to within the elector's skew allowance.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Path of the lease file (created if missing).
+        """
+
+        self.path = path
+
+    def _update(self, change: Callable[[LeaseState], Optional[LeaseState]]) -> LeaseState:
+        """Apply a change to the lease under an exclusive lock, writing it back if change returns a new state."""
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            raw = os.read(fd, 4096)
+
+            try:
+                state = LeaseState(**json.loads(raw)) if raw else LeaseState(None, 0, 0.0)
+            except (TypeError, ValueError):
+                log.warning(f"Lease file {self.path} is corrupt; treating it as expired.")
+                state = LeaseState(None, 0, 0.0)
+
+            updated = change(state)
+
+            if updated is not None:
+                data = json.dumps(updated._asdict()).encode('utf-8')
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, data)
+                os.fsync(fd)
+
+                state = updated
+
+            return state
+        finally:
+            os.close(fd)
+
+    def acquire(self, node: str, ttl: float) -> Optional[int]:
+        """Take or renew the lease for ttl seconds.
+
+        Returns:
+            int: The fencing token (one higher for every new holder), or None if another node holds the lease.
+        """
+
+        acquired: List[int] = []
+
+        def change(state: LeaseState) -> Optional[LeaseState]:
+            now = time.time()
+
+            if state.holder == node and state.expires > now:
+                acquired.append(state.token)
+                return state._replace(expires=now + ttl)
+
+            if state.holder is None or state.expires <= now:
+                acquired.append(state.token + 1)
+                return LeaseState(node, state.token + 1, now + ttl)
+
+            return None
+
+        self._update(change)
+
+        return acquired[0] if acquired else None
+
+    def release(self, node: str):
+        """Give up the lease, if we hold it, so the standby can take over straight away."""
+
+        self._update(lambda state: LeaseState(None, state.token, 0.0) if state.holder == node else None)
+
+    def peek(self) -> LeaseState:
+        """Read the lease without changing it."""
+
+        return self._update(lambda state: None)
+
+class PeerLease():
+    """A lease granted by a majority of voting members over TCP: this instance, its peer and a witness.
+
+    Every member serves a vote. A vote is a promise to one node, for ttl seconds
+    on the voter's own clock from when the request arrived, tagged with the
+    fencing token that node proposed. While its promise stands a voter refuses
+    every other node, and it never grants a token lower than the highest it has
+    granted (or equal to it, to another node). A node leads only while a majority
+    of the members, itself included, have promised it their vote, and renews by
+    asking again with the same token.
+
+    Any two majorities share a member, so there are never two leaders: a node
+    cut off from the rest can't gather a majority, and the others can't until
+    its promises have expired. A pair alone can't tell a dead peer from a
+    partition, so at least three members are needed; a witness is a member
+    that votes but never leads (see serve).
+    """
+
+    def __init__(self, listen: str, peers: List[str], timeout: float = 1.0):
+        """
+        Args:
+            listen (str): "host:port" to serve our vote on.
+            peers (List[str]): "host:port" of every other member (the other instance and the witness).
+            timeout (float): How long to wait for each member to answer (seconds).
+        """
+
+        self.listen = listen
+        self.peers = list(peers)
+        self.timeout = timeout
+
+        self.node: Optional[str] = None
+        self.leader = False
+        self.token = 0
+
+        # Our vote: who it is promised to, with which token, and until when
+        self._promise: Optional[Tuple[str, int, float]] = None
+        self._highest: Tuple[int, Optional[str]] = (0, None)
+        self._lock = threading.Lock()
+        self._server: Optional[socketserver.BaseServer] = None
+
+    @classmethod
+    def _address(cls, address: str) -> Tuple[str, int]:
+        host, _, port = address.rpartition(':')
+
+        return host or '127.0.0.1', int(port)
+
+    @property
+    def quorum(self) -> int:
+        return (len(self.peers) + 1) // 2 + 1
+
+    def vote(self, node: str, token: int, ttl: float, release: bool = False) -> Tuple[bool, int]:
+        """Handle a request for our vote (or to give it back).
+
+        Returns:
+            Tuple[bool, int]: Whether the vote is promised to node, and the highest token we have granted.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            promise = self._promise if self._promise is not None and self._promise[2] > now else None
+
+            if release:
+                if promise is not None and promise[0] == node:
+                    self._promise = None
+
+                return False, self._highest[0]
+
+            if promise is not None and promise[0] != node:
+                return False, self._highest[0]
+
+            if token < self._highest[0] or (token == self._highest[0] and self._highest[1] not in (None, node)):
+                return False, self._highest[0]
+
+            self._promise = (node, token, now + ttl)
+            self._highest = (token, node)
+
+            return True, token
+
+    def serve(self) -> socketserver.BaseServer:
+        """Start answering vote requests from a background thread (all a witness does)."""
+
+        lease = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline(4096))
+                    granted, highest = lease.vote(str(request['node']), int(request['token']), float(request['ttl']), bool(request.get('release')))
+                except (KeyError, TypeError, ValueError):
+                    return
+
+                self.wfile.write(json.dumps({'granted': granted, 'highest': highest}).encode('utf-8') + b'\n')
+
+        server = socketserver.ThreadingTCPServer(PeerLease._address(self.listen), Handler, bind_and_activate=False)
+        server.daemon_threads = True
+        server.allow_reuse_address = True
+        server.server_bind()
+        server.server_activate()
+
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        self._server = server
+
+        return server
+
+    def close(self):
+        """Stop answering vote requests."""
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _ask(self, peer: str, request: dict) -> Optional[dict]:
+        """Send a request to another member (None if it didn't answer)."""
+
+        try:
+            with socket.create_connection(PeerLease._address(peer), timeout=self.timeout) as sock:
+                sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+                with sock.makefile('rb') as fh:
+                    return json.loads(fh.readline(4096))
+        except (OSError, ValueError):
+            return None
+
+    def _poll(self, request: dict) -> List[Optional[dict]]:
+        """Send a request to every other member at once."""
+
+        replies: List[Optional[dict]] = [None] * len(self.peers)
+
+        def ask(idx: int):
+            replies[idx] = self._ask(self.peers[idx], request)
+
+        threads = [threading.Thread(target=ask, args=(idx,), daemon=True) for idx in range(len(self.peers))]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return replies
+
+    def acquire(self, node: str, ttl: float) -> Optional[int]:
+        """Take or renew the lease (see FileLease.acquire)."""
+
+        self.node = node
+        token = self.token if self.leader else max(self.token, self._highest[0]) + 1
+        request = {'node': node, 'token': token, 'ttl': ttl}
+
+        granted, highest = self.vote(node, token, ttl)
+        votes = [granted]
+
+        for reply in self._poll(request):
+            if reply is not None:
+                votes.append(bool(reply.get('granted')))
+                highest = max(highest, int(reply.get('highest', 0)))
+
+        if votes.count(True) >= self.quorum:
+            self.leader = True
+            self.token = token
+
+            return token
+
+        # Give back the votes we did get, so they are free for a node that can gather a majority
+        self.leader = False
+        self.token = max(self.token, highest)
+        self._release(node)
+
+        return None
+
+    def _release(self, node: str):
+        self.vote(node, 0, 0, release=True)
+        self._poll({'node': node, 'token': 0, 'ttl': 0, 'release': True})
+
+    def release(self, node: str):
+        """Stand down, giving our votes back so another node can take over straight away."""
+
+        self.leader = False
+        self._release(node)
+
+class LeaderElector():
+    """Hold the lease while we can, and stand by while we can't.
+
+    The lease is renewed every ttl / 3 seconds from a background thread. We only
+    count as leader until fence_margin seconds before the lease could expire
+    (measured from when each renewal was sent), so a leader that can't renew
+    stops pushing, within the stop policy's time, before a standby can take over.
+    Nothing a renewal says about the backend's clock is trusted, so the margin
+    also has to cover clock skew between the hosts.
+    """
+
+    def __init__(self, backend, node: str, ttl: float = 15.0, fence_margin: float = 6.0, registry: Metrics = REGISTRY):
+        """
+        Args:
+            backend (FileLease or PeerLease): Where the lease is kept.
+            node (str): This instance's name (unique within the pair).
+            ttl (float): How long each renewal holds the lease for (seconds).
+            fence_margin (float): How long before the lease could expire we stop counting as leader (seconds).
+            registry (Metrics): The registry to record leadership in.
+        """
+
+        if fence_margin >= ttl * 2 / 3:
+            raise ValueError(f"Lease TTL ({ttl:g}s) must be more than 1.5 times the fence margin ({fence_margin:g}s)")
+
+        self.backend = backend
+        self.node = node
+        self.ttl = ttl
+        self.fence_margin = fence_margin
+        self.registry = registry
+        self.token: Optional[int] = None
+
+        self._valid_until = 0.0
+        self._was_leader = False
+        self._stood_by = False
+        self._listeners: List[Callable[[], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        registry.set('pyrestreamer_leader', lambda: 1.0 if self.is_leader else 0.0, node=node)
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    def seconds_left(self) -> Optional[float]:
+        """Seconds until we must stop pushing unless the lease is renewed (None if we aren't leader)."""
+
+        left = self._valid_until - time.monotonic()
+
+        return left if left > 0 else None
+
+    def subscribe(self, callback: Callable[[], None]):
+        """Call a function (from the elector's thread) whenever we gain or lose the lease."""
+
+        self._listeners.append(callback)
+
+    def renew(self) -> bool:
+        """Take or renew the lease once.
+
+        Returns:
+            bool: Whether we are leader.
+        """
+
+        sent = time.monotonic()
+
+        try:
+            token = self.backend.acquire(self.node, self.ttl)
+        except OSError as e:
+            # Keep what we have; if the backend stays unreachable, leadership lapses at the fence deadline
+            log.error(f"Could not renew the lease: {e}")
+        else:
+            if token is None:
+                self._valid_until = 0.0
+                self._stood_by = True
+            else:
+                if token != self.token and self._stood_by:
+                    self.registry.inc('pyrestreamer_failovers_total', node=self.node)
+
+                self.token = token
+                self._valid_until = sent + self.ttl - self.fence_margin
+
+                self.registry.set('pyrestreamer_lease_token', token, node=self.node)
+
+        self.check()
+
+        return self.is_leader
+
+    def check(self):
+        """Tell subscribers if we have gained or lost the lease since last checked."""
+
+        leader = self.is_leader
+
+        if leader == self._was_leader:
+            return
+
+        self._was_leader = leader
+
+        if leader:
+            log.warning(f"{self.node} holds the lease (fencing token {self.token}); streaming from this instance.")
+        else:
+            log.warning(f"{self.node} does not hold the lease; standing by.")
+
+        for callback in self._listeners:
+            callback()
+
+    def run(self):
+        """Renew the lease until stopped (thread target)."""
+
+        while not self._stop.is_set():
+            self.renew()
+
+            wait = self.ttl / 3
+            left = self.seconds_left()
+
+            # Wake at the fence deadline too, so subscribers hear about a lapse on time
+            if left is not None:
+                wait = min(wait, left)
+
+            if self._stop.wait(wait):
+                break
+
+            self.check()
+
+    def start(self) -> 'LeaderElector':
+        """Renew the lease from a background thread."""
+
+        if isinstance(self.backend, PeerLease):
+            self.backend.serve()
+
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self, release: bool = True):
+        """Stop renewing the lease.
+
+        Args:
+            release (bool): Give the lease up, so the standby can take over without waiting for it to expire.
+                Only release it once the pipelines have stopped.
+        """
+
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        self._valid_until = 0.0
+
+        try:
+            if release:
+                self.backend.release(self.node)
+        except OSError as e:
+            log.error(f"Could not release the lease: {e}")
+
+        if isinstance(self.backend, PeerLease):
+            self.backend.close()
+
+        self.check()
+
+def parse_lease_backend(backend: str, path: str = None, listen: str = None, peer: str = None):
+    """Build a lease backend from settings.
+
+    Args:
+        backend (str): "file" or "peer".
+        path (str): Lease file (file backend).
+        listen (str): "host:port" to answer vote requests on (peer backend).
+        peer (str): Comma-separated "host:port" of the other members, the peer and at least one witness (peer backend).
+
+    Returns:
+        FileLease or PeerLease: The backend.
+    """
+
+    backend = backend.lower()
+
+    if backend == 'file':
+        if not path:
+            raise ValueError("The file lease backend needs a lease file path")
+
+        return FileLease(path)
+
+    if backend == 'peer':
+        peers = [address.strip() for address in (peer or '').split(',') if address.strip()]
+
+        if not listen or not peers:
+            raise ValueError("The peer lease backend needs a listen address and the other members' addresses")
+
+        if len(peers) < 2:
+            raise ValueError("The peer lease backend needs a witness as well as the peer (a pair alone can't tell a dead peer from a partition)")
+
+        return PeerLease(listen, peers)
+
+    raise ValueError(f"Unknown lease backend {backend}; use file or peer")
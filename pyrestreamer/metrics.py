@@ -0,0 +1,307 @@
+"""Streaming health metrics in Prometheus text format."""
+
+import time
+import threading
+
+from typing import Callable, Dict, Set, Tuple, Union
+
+from pyrestreamer.shutdown import StopResult
+
+# A metric value, or a function evaluated when the metrics are rendered
+Value = Union[float, Callable[[], float]]
+
+# Name, type and help text for every metric we expose
+DEFINITIONS = [
+    ('pyrestreamer_state', 'gauge', 'Current streaming state (0 idle, 1 streaming, 2 warming up for the next service).'),
+    ('pyrestreamer_output_bitrate_kbps', 'gauge', 'Output bitrate reported by ffmpeg (kbit/s).'),
+    ('pyrestreamer_encoder_speed', 'gauge', 'Encoder speed reported by ffmpeg (1.0 is realtime).'),
+    ('pyrestreamer_ingest_bytes_per_second', 'gauge', 'Bytes per second received from streamlink.'),
+    ('pyrestreamer_ingest_bytes_total', 'counter', 'Bytes received from streamlink.'),
+    ('pyrestreamer_output_bytes_per_second', 'gauge', 'Bytes per second written by ffmpeg.'),
+    ('pyrestreamer_segment_timeouts_total', 'counter', 'Segments streamlink failed to open.'),
+    ('pyrestreamer_ingest_events_total', 'counter', 'Segment errors and request retries reported by in-process streamlink, by kind.'),
+    ('pyrestreamer_output_rule_matches_total', 'counter', 'Output lines matched by each output rule.'),
+    ('pyrestreamer_pipeline_restarts_total', 'counter', 'Pipeline or output restarts.'),
+    ('pyrestreamer_recovery_seconds', 'gauge', 'Time from the most recent failure to recovery.'),
+    ('pyrestreamer_start_seconds', 'gauge', 'Time from the most recent start (or opening the gate after a warm start) until ffmpeg wrote its first output.'),
+    ('pyrestreamer_stop_seconds', 'gauge', 'Time the most recent stop took, from SIGTERM until every process was reaped.'),
+    ('pyrestreamer_forced_kills_total', 'counter', 'Stops that needed SIGKILL after the grace period.'),
+    ('pyrestreamer_seconds_since_progress', 'gauge', 'Seconds since ffmpeg last reported progress.'),
+    ('pyrestreamer_process_cpu_percent', 'gauge', 'CPU used by a pipeline component (100 is one core).'),
+    ('pyrestreamer_process_rss_bytes', 'gauge', 'Resident memory of a pipeline component.'),
+    ('pyrestreamer_process_read_bytes_total', 'counter', 'Bytes read by a pipeline component (including pipes and sockets).'),
+    ('pyrestreamer_process_write_bytes_total', 'counter', 'Bytes written by a pipeline component (including pipes and sockets).'),
+    ('pyrestreamer_variant_rank', 'gauge', 'Position of the ingested variant in the adaptive ladder (0 is the highest quality).'),
+    ('pyrestreamer_variant_switches_total', 'counter', 'Adaptive variant switches, by direction and the variant switched to.'),
+    ('pyrestreamer_jitter_buffer_bytes', 'gauge', 'Bytes held in the jitter buffer.'),
+    ('pyrestreamer_jitter_buffer_seconds', 'gauge', 'Estimated seconds of media held in the jitter buffer.'),
+    ('pyrestreamer_jitter_buffer_drains_total', 'counter', 'Times the jitter buffer ran dry.'),
+    ('pyrestreamer_next_transition_timestamp_seconds', 'gauge', 'Unix time the pipeline next warms up, starts or stops (overrides, one-off events and pre-roll included).'),
+    ('pyrestreamer_leader', 'gauge', 'Whether this instance holds the hot-standby lease (1) or is standing by (0).'),
+    ('pyrestreamer_lease_token', 'gauge', 'Fencing token of the lease this instance most recently held.'),
+    ('pyrestreamer_failovers_total', 'counter', 'Times this instance took over the lease from another holder.'),
+]
+
+# Metrics recorded by PipelineMetrics.resources
+RESOURCE_METRICS = ('pyrestreamer_process_cpu_percent', 'pyrestreamer_process_rss_bytes', 'pyrestreamer_process_read_bytes_total', 'pyrestreamer_process_write_bytes_total')
+
+def escape_label(value) -> str:
+    """Escape a label value for the Prometheus text format (backslash, double quote and newline)."""
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics():
+    """Thread-safe registry of labelled metrics, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._definitions: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[Tuple[Tuple[str, str], ...], Value]] = {}
+
+        for name, kind, description in DEFINITIONS:
+            self.declare(name, kind, description)
+
+    def declare(self, name: str, kind: str, description: str):
+        """Declare a metric.
+
+        Args:
+            name (str): Metric name.
+            kind (str): Prometheus metric type (gauge or counter).
+            description (str): Help text.
+        """
+
+        with self._lock:
+            self._definitions[name] = (kind, description)
+            self._values.setdefault(name, {})
+
+    def set(self, name: str, value: Value, **labels: str):
+        """Set a metric's value for the given labels.
+
+        Args:
+            name (str): Metric name.
+            value (float or Callable): The value, or a function returning it when rendered.
+            labels (str): Metric labels.
+        """
+
+        with self._lock:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def inc(self, name: str, amount: float = 1, **labels: str):
+        """Increment a metric's value for the given labels.
+
+        Args:
+            name (str): Metric name.
+            amount (float): Amount to add.
+            labels (str): Metric labels.
+        """
+
+        key = tuple(sorted(labels.items()))
+
+        with self._lock:
+            self._values[name][key] = self._values[name].get(key, 0) + amount
+
+    def get(self, name: str, **labels: str) -> float:
+        """Get a metric's current value (None if it has not been set)."""
+
+        with self._lock:
+            value = self._values[name].get(tuple(sorted(labels.items())))
+
+        return value() if callable(value) else value
+
+    def clear(self, name: str, **labels: str):
+        """Remove a metric's value for the given labels."""
+
+        with self._lock:
+            self._values[name].pop(tuple(sorted(labels.items())), None)
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format.
+
+        Returns:
+            str: The rendered metrics.
+        """
+
+        with self._lock:
+            snapshot = {name: dict(values) for name, values in self._values.items()}
+            definitions = dict(self._definitions)
+
+        lines = []
+
+        for name, (kind, description) in definitions.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for labels, value in snapshot[name].items():
+                if callable(value):
+                    try:
+                        value = value()
+                    except Exception: #pylint: disable=broad-except
+                        value = None
+
+                if value is None:
+                    continue
+
+                label_str = ','.join(f'{key}="{escape_label(val)}"' for key, val in labels)
+                lines.append(f"{name}{{{label_str}}} {float(value)}" if label_str else f"{name} {float(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+# The process-wide registry
+REGISTRY = Metrics()
+
+class PipelineMetrics():
+    """Record one pipeline's metrics in a registry."""
+
+    def __init__(self, pipeline: str, registry: Metrics = REGISTRY):
+        """
+        Args:
+            pipeline (str): Pipeline name, used as the pipeline label.
+            registry (Metrics): The registry to record in.
+        """
+
+        self.pipeline = pipeline
+        self.registry = registry
+
+        self._last_progress: Dict[str, float] = {}
+        self._last_total_size: Dict[str, Tuple[float, int]] = {}
+        self._components: Set[str] = set()
+
+    def state(self, state):
+        """Record the current StreamingState."""
+
+        self.registry.set('pyrestreamer_state', state.value, pipeline=self.pipeline)
+
+    def transitions(self, next_transition):
+        """Expose the time of the next state change, from a function returning it (see ReStreamer.next_transition)."""
+
+        def timestamp():
+            transition = next_transition()
+
+            return None if transition is None else transition.timestamp()
+
+        self.registry.set('pyrestreamer_next_transition_timestamp_seconds', timestamp, pipeline=self.pipeline)
+
+    def ingest(self, meter):
+        """Expose a ThroughputMeter as the ingest throughput."""
+
+        self.registry.set('pyrestreamer_ingest_bytes_per_second', meter.rate, pipeline=self.pipeline)
+        self.registry.set('pyrestreamer_ingest_bytes_total', lambda: meter.total_bytes, pipeline=self.pipeline)
+
+    def progress(self, record, output: str = '0'):
+        """Record a ProgressRecord from one of the pipeline's outputs."""
+
+        labels = {'pipeline': self.pipeline, 'output': output}
+        now = time.monotonic()
+
+        if output not in self._last_progress:
+            self.registry.set('pyrestreamer_seconds_since_progress', lambda: time.monotonic() - self._last_progress[output], **labels)
+
+        self._last_progress[output] = now
+
+        if record.bitrate is not None:
+            self.registry.set('pyrestreamer_output_bitrate_kbps', record.bitrate, **labels)
+
+        if record.speed is not None:
+            self.registry.set('pyrestreamer_encoder_speed', record.speed, **labels)
+
+        if record.total_size is not None:
+            previous = self._last_total_size.get(output)
+
+            if previous is not None and now > previous[0] and record.total_size >= previous[1]:
+                self.registry.set('pyrestreamer_output_bytes_per_second', (record.total_size - previous[1]) / (now - previous[0]), **labels)
+
+            self._last_total_size[output] = (now, record.total_size)
+
+    def stopped(self, output: str = '0'):
+        """Forget progress for an output that stopped, so stale rates are not reported."""
+
+        labels = {'pipeline': self.pipeline, 'output': output}
+
+        for name in ('pyrestreamer_output_bitrate_kbps', 'pyrestreamer_encoder_speed', 'pyrestreamer_output_bytes_per_second', 'pyrestreamer_seconds_since_progress'):
+            self.registry.clear(name, **labels)
+
+        self._last_progress.pop(output, None)
+        self._last_total_size.pop(output, None)
+
+    def resources(self, usage: dict):
+        """Record the resource usage of each component (from a ResourceSampler), forgetting components that are gone."""
+
+        for component in self._components - set(usage):
+            for name in RESOURCE_METRICS:
+                self.registry.clear(name, pipeline=self.pipeline, component=component)
+
+        for component, current in usage.items():
+            labels = {'pipeline': self.pipeline, 'component': component}
+
+            self.registry.set('pyrestreamer_process_cpu_percent', current.cpu_percent, **labels)
+            self.registry.set('pyrestreamer_process_rss_bytes', current.rss_bytes, **labels)
+            self.registry.set('pyrestreamer_process_read_bytes_total', current.read_bytes, **labels)
+            self.registry.set('pyrestreamer_process_write_bytes_total', current.write_bytes, **labels)
+
+        self._components = set(usage)
+
+    def variant(self, rank: int):
+        """Record the position of the ingested variant in the adaptive ladder."""
+
+        self.registry.set('pyrestreamer_variant_rank', rank, pipeline=self.pipeline)
+
+    def variant_switch(self, direction: str, variant: str, rank: int):
+        """Count an adaptive variant switch (direction "up" or "down")."""
+
+        self.registry.inc('pyrestreamer_variant_switches_total', pipeline=self.pipeline, direction=direction, variant=variant)
+        self.variant(rank)
+
+    def jitter(self, buffer):
+        """Expose a JitterBuffer's fill level and drains (None when there is no buffer)."""
+
+        if buffer is None:
+            for name in ('pyrestreamer_jitter_buffer_bytes', 'pyrestreamer_jitter_buffer_seconds', 'pyrestreamer_jitter_buffer_drains_total'):
+                self.registry.clear(name, pipeline=self.pipeline)
+
+            return
+
+        self.registry.set('pyrestreamer_jitter_buffer_bytes', lambda: buffer.used, pipeline=self.pipeline)
+        self.registry.set('pyrestreamer_jitter_buffer_seconds', buffer.fill_seconds, pipeline=self.pipeline)
+        self.registry.set('pyrestreamer_jitter_buffer_drains_total', lambda: buffer.drains, pipeline=self.pipeline)
+
+    def segment_timeout(self):
+        """Count a segment streamlink failed to open."""
+
+        self.registry.inc('pyrestreamer_segment_timeouts_total', pipeline=self.pipeline)
+
+    def ingest_event(self, kind: str):
+        """Count an in-process ingest event (segment_error or retry)."""
+
+        self.registry.inc('pyrestreamer_ingest_events_total', pipeline=self.pipeline, kind=kind)
+
+    def rule_matched(self, rule: str):
+        """Count an output line matched by an output rule."""
+
+        self.registry.inc('pyrestreamer_output_rule_matches_total', pipeline=self.pipeline, rule=rule)
+
+        # Segment timeouts also keep their own counter
+        if rule == 'segment_timeout':
+            self.segment_timeout()
+
+    def restart(self, component: str):
+        """Count a restart of the pipeline or one of its components."""
+
+        self.registry.inc('pyrestreamer_pipeline_restarts_total', pipeline=self.pipeline, component=component)
+
+    def recovered(self, seconds: float, component: str):
+        """Record the time the pipeline or one of its components took to recover."""
+
+        self.registry.set('pyrestreamer_recovery_seconds', seconds, pipeline=self.pipeline, component=component)
+
+    def start_time(self, seconds: float, output: str = '0'):
+        """Record how long an output took from starting to its first output."""
+
+        self.registry.set('pyrestreamer_start_seconds', seconds, pipeline=self.pipeline, output=output)
+
+    def stop_time(self, result: StopResult, component: str = 'pipeline'):
+        """Record how long the pipeline or one of its components took to stop, and whether it had to be killed."""
+
+        self.registry.set('pyrestreamer_stop_seconds', result.seconds, pipeline=self.pipeline, component=component)
+
+        if result.killed:
+            self.registry.inc('pyrestreamer_forced_kills_total', pipeline=self.pipeline, component=component)
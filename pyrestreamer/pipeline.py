@@ -0,0 +1,530 @@
+"""Building blocks for streamlink/ffmpeg pipelines."""
+
+import os
+import time
+import shlex
+import fcntl
+import threading
+import subprocess
+import collections
+
+from typing import Callable, Deque, List, Optional, Tuple
+
+from pyrestreamer.progress import ProgressRecord
+from pyrestreamer.watchdog import StallWatchdog
+from pyrestreamer.jitter import JitterBuffer, JitterConfig, JitterCopier
+from pyrestreamer.shutdown import StopPolicy, StopResult, stop_group
+
+# EBML magic at the start of a matroska stream, and the matroska Cluster element ID
+MATROSKA_MAGIC = b'\x1a\x45\xdf\xa3'
+MATROSKA_CLUSTER = b'\x1f\x43\xb6\x75'
+
+# fcntl.F_SETPIPE_SZ is only exposed from Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+class PipelineFailure(Exception):
+    """Raised when a streaming pipeline fails and cannot continue."""
+
+class FatalPipelineError(Exception):
+    """Raised when a pipeline hits an error that restarting it will not fix."""
+
+def streamlink_args(input_url: str, quality: str = 'best', extra_args: List[str] = None) -> List[str]:
+    """Get the argument list for the streamlink ingest process.
+
+    Args:
+        input_url (str): The DASH or HLS input URL.
+        quality (str): The stream quality to select.
+        extra_args (List[str]): Additional streamlink options.
+
+    Returns:
+        List[str]: Arguments for the streamlink process (stream written to stdout).
+    """
+
+    return ['streamlink'] + (extra_args or []) + [input_url, quality, '-O']
+
+def ffmpeg_args(ffmpeg_params: str) -> List[str]:
+    """Get the argument list for an ffmpeg output process reading from stdin.
+
+    Args:
+        ffmpeg_params (str): The user-supplied ffmpeg output parameters.
+
+    Returns:
+        List[str]: Arguments for the ffmpeg process.
+    """
+
+    return ['ffmpeg', '-progress', '-', '-nostats', '-hide_banner', '-re', '-i', '-'] + shlex.split(ffmpeg_params)
+
+class OutputHealth():
+    """Track the health of one ffmpeg output from its progress records."""
+
+    def __init__(self, watchdog: StallWatchdog = None, now: float = None):
+        """
+        Args:
+            watchdog (StallWatchdog): Watchdog to detect stalls with (a default one if not given).
+            now (float): Monotonic time the output started (defaults to now).
+        """
+
+        self.watchdog = watchdog or StallWatchdog()
+        self.watchdog.start(time.monotonic() if now is None else now)
+
+        self.had_status_out = False
+        self.total_size: Optional[int] = None
+        self.last_record: Optional[ProgressRecord] = None
+
+    def handle_record(self, record: ProgressRecord, now: float = None) -> bool:
+        """Record a progress block parsed from ffmpeg.
+
+        Args:
+            record (ProgressRecord): The progress record.
+            now (float): Monotonic time the record arrived (defaults to now).
+
+        Returns:
+            bool: True if the record shows progress.
+        """
+
+        self.had_status_out = True
+        self.last_record = record
+
+        if record.total_size is not None:
+            self.total_size = record.total_size
+
+        return self.watchdog.observe(record, time.monotonic() if now is None else now)
+
+    def deadline(self) -> float:
+        """Get the monotonic time by which the output must make progress."""
+
+        return self.watchdog.deadline()
+
+    def check(self, now: float = None) -> Optional[str]:
+        """Check the output is making progress.
+
+        Args:
+            now (float): Current monotonic time (defaults to now).
+
+        Returns:
+            str: Reason the output is considered stalled, or None if it is healthy.
+        """
+
+        return self.watchdog.check(time.monotonic() if now is None else now)
+
+class StreamHeaderCache():
+    """Capture the container header of an ingest stream for late-joining outputs.
+
+    A restarted output joins the ingest stream mid-way. MPEG-TS can be picked up
+    at any packet, but a matroska stream is only decodable with its header, so we
+    keep everything before the first Cluster and replay it to new outputs.
+    """
+
+    # Give up looking for the end of the header after this many bytes
+    MAX_HEADER = 2 ** 20
+
+    def __init__(self):
+        self.header = b''
+        self.complete = False
+
+    def feed(self, data: bytes):
+        """Feed ingest bytes (in order) until the header is complete.
+
+        Args:
+            data (bytes): The next chunk of ingest output.
+        """
+
+        if self.complete:
+            return
+
+        buffered = self.header + data
+
+        if not buffered.startswith(MATROSKA_MAGIC[:len(buffered)]):
+            self.header = b''
+            self.complete = True
+            return
+
+        cluster = buffered.find(MATROSKA_CLUSTER)
+
+        if cluster >= 0:
+            self.header = buffered[:cluster]
+            self.complete = True
+        elif len(buffered) > StreamHeaderCache.MAX_HEADER:
+            self.header = b''
+            self.complete = True
+        else:
+            self.header = buffered
+
+class StreamGate():
+    """Hold an ingest stream back from ffmpeg until the service starts (pre-roll warm start).
+
+    While closed, data is discarded once its container header has been
+    captured, so the ingest stays at the live edge while ffmpeg waits on its
+    input without connecting to the output. When opened, the header is replayed
+    and everything after it passes through, like a restarted output joining
+    the stream. Filtered from the copier thread and opened from another.
+    """
+
+    def __init__(self):
+        self.header = StreamHeaderCache()
+        self.discarded = 0
+        self.opened_at: Optional[float] = None
+
+        self._open = threading.Event()
+        self._replayed = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._open.is_set()
+
+    def open(self):
+        """Let the stream through."""
+
+        self.opened_at = time.monotonic()
+        self._open.set()
+
+    def filter(self, data: bytes) -> bytes:
+        """Get what of a chunk of ingest data should be passed on to ffmpeg.
+
+        Args:
+            data (bytes): The next chunk of ingest data.
+
+        Returns:
+            bytes: The data to pass on (empty while the gate is closed).
+        """
+
+        if not self._open.is_set():
+            self.header.feed(data)
+            self.discarded += len(data)
+            return b''
+
+        if not self._replayed:
+            self._replayed = True
+
+            if self.discarded:
+                return self.header.header + bytes(data)
+
+        return data
+
+class ThroughputMeter():
+    """Count bytes moving through a pipe, their rate, and gaps between them.
+
+    Safe to update from a copier thread while another thread reads it.
+    """
+
+    # Length of the window used for rate calculations (seconds)
+    WINDOW = 10
+
+    # A gap between data of at least this long counts as a stall (seconds)
+    STALL_GAP = 2.0
+
+    def __init__(self):
+        self.total_bytes = 0
+        self.stalls = 0
+        self.max_gap = 0.0
+        self.started = time.monotonic()
+        self.last_data: Optional[float] = None
+
+        self._buckets: Deque[Tuple[int, int]] = collections.deque(maxlen=ThroughputMeter.WINDOW + 1)
+        self._lock = threading.Lock()
+
+    def record(self, nbytes: int, now: float = None):
+        """Record bytes moved through the pipe.
+
+        Args:
+            nbytes (int): Number of bytes moved.
+            now (float): Monotonic time of the transfer (defaults to now).
+        """
+
+        now = time.monotonic() if now is None else now
+        second = int(now)
+
+        with self._lock:
+            gap = now - (self.started if self.last_data is None else self.last_data)
+
+            if gap > self.max_gap:
+                self.max_gap = gap
+
+            if gap >= ThroughputMeter.STALL_GAP and self.last_data is not None:
+                self.stalls += 1
+
+            self.total_bytes += nbytes
+            self.last_data = now
+
+            if self._buckets and self._buckets[-1][0] == second:
+                self._buckets[-1] = (second, self._buckets[-1][1] + nbytes)
+            else:
+                self._buckets.append((second, nbytes))
+
+    def rate(self, now: float = None) -> float:
+        """Get the average rate over the last WINDOW seconds.
+
+        Returns:
+            float: Bytes per second.
+        """
+
+        now = time.monotonic() if now is None else now
+        window_start = int(now) - ThroughputMeter.WINDOW
+
+        with self._lock:
+            total = sum(nbytes for second, nbytes in self._buckets if second > window_start)
+
+        return total / ThroughputMeter.WINDOW
+
+    def idle_for(self, now: float = None) -> float:
+        """Get how long it has been since data last moved (or since the meter started).
+
+        Returns:
+            float: Seconds since the last data.
+        """
+
+        now = time.monotonic() if now is None else now
+
+        return now - (self.started if self.last_data is None else self.last_data)
+
+class PipeCopier(threading.Thread):
+    """Copy bytes from one pipe to another outside of the Python data path.
+
+    Uses os.splice where available so the data never enters userspace, and
+    otherwise falls back to large reads and writes. Closes the destination
+    when the source reaches EOF, so the reader sees EOF like a shell pipe.
+    """
+
+    # Maximum bytes moved per splice/read call
+    CHUNK = 2 ** 20
+
+    # Requested kernel buffer size for the pipes (best effort)
+    PIPE_SIZE = 2 ** 20
+
+    def __init__(self, src_fd: int, dst_fd: int, meter: ThroughputMeter, gate: StreamGate = None):
+        """
+        Args:
+            src_fd (int): Read end of the source pipe (owned by the copier).
+            dst_fd (int): Write end of the destination pipe (owned by the copier).
+            meter (ThroughputMeter): Meter to record copied bytes on.
+            gate (StreamGate): Gate holding the stream back until it is opened (optional).
+        """
+
+        super().__init__(daemon=True)
+
+        self.src_fd = src_fd
+        self.dst_fd = dst_fd
+        self.meter = meter
+        self.gate = gate
+        self.error: Optional[OSError] = None
+
+        for fd in (src_fd, dst_fd):
+            try:
+                fcntl.fcntl(fd, F_SETPIPE_SZ, PipeCopier.PIPE_SIZE)
+            except OSError:
+                pass
+
+    def run(self):
+        try:
+            if self.gate is not None and not self._copy_gated():
+                return
+
+            if hasattr(os, 'splice'):
+                self._copy_splice()
+            else:
+                self._copy_buffered()
+        except BrokenPipeError:
+            pass
+        except OSError as e:
+            self.error = e
+        finally:
+            os.close(self.src_fd)
+            os.close(self.dst_fd)
+
+    def _copy_gated(self) -> bool:
+        """Copy through the gate until it has opened and let the first data through.
+
+        Returns:
+            bool: False if the source reached EOF first.
+        """
+
+        while True:
+            data = os.read(self.src_fd, PipeCopier.CHUNK)
+
+            if not data:
+                return False
+
+            self.meter.record(len(data))
+            data = self.gate.filter(data)
+
+            if data:
+                view = memoryview(data)
+                written = 0
+
+                while written < len(data):
+                    written += os.write(self.dst_fd, view[written:])
+
+                return True
+
+    def _copy_splice(self):
+        while True:
+            moved = os.splice(self.src_fd, self.dst_fd, PipeCopier.CHUNK) #pylint: disable=no-member
+
+            if moved == 0:
+                return
+
+            self.meter.record(moved)
+
+    def _copy_buffered(self):
+        buf = bytearray(PipeCopier.CHUNK)
+        view = memoryview(buf)
+
+        while True:
+            count = os.readv(self.src_fd, [buf])
+
+            if count == 0:
+                return
+
+            self.meter.record(count)
+
+            written = 0
+
+            while written < count:
+                written += os.write(self.dst_fd, view[written:count])
+
+class ManagedPipeline():
+    """A streamlink | ffmpeg pipeline without a shell, with Python owning the pipe.
+
+    ffmpeg leads a new process group that streamlink joins, so the whole pipeline
+    can be signalled at once. Log output from both processes is merged into a
+    single pipe exposed as stdout, and the stream itself is moved between them
+    by a PipeCopier that meters ingest throughput. Quacks enough like
+    subprocess.Popen (pid, stdout, poll) to drop into the event loop.
+
+    With an in-process ingest there is no streamlink process: the ingest thread
+    writes the stream straight into ffmpeg's stdin and its log lines into the
+    merged log pipe. With a jitter buffer, the stream is copied through it by a
+    JitterCopier instead (from the ingest process or thread alike). With a
+    gate, the stream is always copied, and held back until the gate opens.
+    """
+
+    def __init__(self, ingest_args: List[str], output_args: List[str], in_process: Callable[[int, int, 'ThroughputMeter'], threading.Thread] = None, jitter: JitterConfig = None, gate: StreamGate = None):
+        """
+        Args:
+            ingest_args (List[str]): Arguments for the streamlink process.
+            output_args (List[str]): Arguments for the ffmpeg process.
+            in_process (Callable): Creates an in-process ingest thread writing to (stream fd, log fd), recording on a meter,
+                used instead of the streamlink process (optional).
+            jitter (JitterConfig): Jitter buffer between the ingest and ffmpeg (optional).
+            gate (StreamGate): Gate holding the stream back from ffmpeg until it is opened (optional).
+        """
+
+        self.ingest_args = ingest_args
+        self.output_args = output_args
+        self.in_process = in_process
+        self.jitter = jitter if jitter is not None and jitter.enabled else None
+        self.meter = ThroughputMeter()
+        self.gate = gate
+        self.buffer: Optional[JitterBuffer] = None
+
+        self.ingest: Optional[subprocess.Popen] = None
+        self.ingest_thread: Optional[threading.Thread] = None
+        self.output: Optional[subprocess.Popen] = None
+        self.copier: Optional[threading.Thread] = None
+        self.stdout = None
+
+    @property
+    def pid(self) -> int:
+        return self.output.pid
+
+    def start(self) -> 'ManagedPipeline':
+        """Start both processes and the copier.
+
+        Returns:
+            ManagedPipeline: This pipeline.
+
+        Raises:
+            PipelineFailure: If a process or the ingest thread could not be started (whatever was started is stopped).
+        """
+
+        log_r, log_w = os.pipe()
+        stream_r, stream_w = os.pipe()
+        feed_r, feed_w = os.pipe()
+
+        try:
+            self.output = subprocess.Popen(
+                self.output_args,
+                stdin=feed_r,
+                stdout=log_w,
+                stderr=log_w,
+                preexec_fn=os.setpgrp
+            )
+
+            pgid = self.output.pid
+
+            if self.in_process is not None and self.jitter is None and self.gate is None:
+                self.ingest_thread = self.in_process(feed_w, os.dup(log_w), self.meter)
+                self.ingest_thread.start()
+
+                os.close(stream_r)
+                self.stdout = os.fdopen(log_r, 'rb')
+
+                return self
+
+            if self.in_process is not None:
+                # The copier meters the stream on its way through the buffer or gate
+                self.ingest_thread = self.in_process(os.dup(stream_w), os.dup(log_w), None)
+                self.ingest_thread.start()
+            else:
+                self.ingest = subprocess.Popen(
+                    self.ingest_args,
+                    stdout=stream_w,
+                    stderr=log_w,
+                    preexec_fn=lambda: os.setpgid(0, pgid)
+                )
+        except BaseException as e:
+            for fd in (log_r, stream_r, feed_w):
+                os.close(fd)
+
+            # ffmpeg leads its own group, so nothing else would stop it
+            if self.output is not None:
+                self.output.kill()
+                self.output.wait()
+
+            if isinstance(e, Exception):
+                raise PipelineFailure(f"Could not start the pipeline: {e}") from e
+
+            raise
+        finally:
+            for fd in (log_w, stream_w, feed_r):
+                os.close(fd)
+
+        if self.jitter is not None:
+            self.buffer = JitterBuffer(self.jitter, self.meter)
+            self.copier = JitterCopier(stream_r, feed_w, self.buffer, self.meter, self.gate)
+        else:
+            self.copier = PipeCopier(stream_r, feed_w, self.meter, self.gate)
+
+        self.copier.start()
+
+        self.stdout = os.fdopen(log_r, 'rb')
+
+        return self
+
+    def poll(self) -> Optional[int]:
+        """Reap any exited processes.
+
+        Returns:
+            int: ffmpeg's exit code, or None if it is still running.
+        """
+
+        if self.ingest is not None:
+            self.ingest.poll()
+
+        return self.output.poll()
+
+    def stop(self, policy: StopPolicy = None) -> StopResult:
+        """Stop the whole pipeline, escalating to SIGKILL if it outlives the grace period (see stop_group).
+
+        Args:
+            policy (StopPolicy): Grace and kill timeouts (defaults if not given).
+
+        Returns:
+            StopResult: Whether everything exited, whether SIGKILL was needed, and how long it took.
+        """
+
+        if self.ingest_thread is not None:
+            self.ingest_thread.stop()
+
+        # ffmpeg leads the group, so its pid is the group id even once it has been reaped
+        return stop_group(self.pid, [proc for proc in (self.output, self.ingest) if proc is not None], policy)
@@ -0,0 +1,138 @@
+"""Incremental parser for ffmpeg -progress output."""
+
+from typing import List, NamedTuple, Optional, Tuple
+
+class ProgressRecord(NamedTuple):
+    """One ffmpeg progress block, emitted when its progress= line arrives."""
+
+    out_time_us: Optional[int]
+    total_size: Optional[int]
+    bitrate: Optional[float]
+    speed: Optional[float]
+    fps: Optional[float]
+    dup_frames: Optional[int]
+    drop_frames: Optional[int]
+    end: bool
+
+def _parse_int(value: bytes) -> Optional[int]:
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def _parse_float(value: bytes, suffix: bytes = b'') -> Optional[float]:
+    """Parse a float such as b'715.7kbits/s' or b'1.01x' ("N/A" gives None)."""
+
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+# Progress keys we keep, and how to parse each value
+FIELDS = {
+    b'out_time_us': _parse_int,
+    b'total_size': _parse_int,
+    b'bitrate': lambda value: _parse_float(value, b'kbits/s'),
+    b'speed': lambda value: _parse_float(value, b'x'),
+    b'fps': _parse_float,
+    b'dup_frames': _parse_int,
+    b'drop_frames': _parse_int,
+}
+
+# Index of each kept key within a ProgressRecord
+FIELD_INDEX = {key.encode('ascii'): idx for idx, key in enumerate(ProgressRecord._fields) if key != 'end'}
+
+class ProgressParser():
+    """Parse ffmpeg -progress output incrementally as raw bytes arrive.
+
+    Lines of the form key=value are progress fields; the fields we care about
+    are collected until the progress=continue/end line closing the block, which
+    emits a ProgressRecord. Any other line is standard (log) output. Memory is
+    bounded: only the current partial line (capped at MAX_LINE) and the current
+    block's fields are held between calls.
+    """
+
+    # Longest line we buffer; longer lines are emitted truncated
+    MAX_LINE = 2 ** 16
+
+    def __init__(self):
+        self._partial = b''
+        self._block: List[Optional[float]] = [None] * len(FIELDS)
+
+    def feed(self, data: bytes) -> Tuple[List[str], List[ProgressRecord]]:
+        """Feed the next chunk of ffmpeg output.
+
+        Args:
+            data (bytes): Raw bytes, in order, with no regard for line boundaries.
+
+        Returns:
+            Tuple[List[str], List[ProgressRecord]]: Completed standard output lines, completed progress records.
+        """
+
+        standard_output: List[str] = []
+        records: List[ProgressRecord] = []
+
+        if self._partial:
+            data = self._partial + data
+            self._partial = b''
+
+        start = 0
+
+        while True:
+            end = data.find(b'\n', start)
+
+            if end < 0:
+                break
+
+            self._handle_line(data[start:end], standard_output, records)
+            start = end + 1
+
+        if start < len(data):
+            remainder = data[start:]
+
+            if len(remainder) > ProgressParser.MAX_LINE:
+                self._handle_line(remainder[:ProgressParser.MAX_LINE], standard_output, records)
+            else:
+                self._partial = remainder
+
+        return standard_output, records
+
+    def flush(self) -> List[str]:
+        """Get any buffered partial line as standard output (call at EOF).
+
+        Returns:
+            List[str]: The partial line, if there was one.
+        """
+
+        standard_output: List[str] = []
+
+        if self._partial:
+            self._handle_line(self._partial, standard_output, [])
+            self._partial = b''
+
+        return standard_output
+
+    def _handle_line(self, line: bytes, standard_output: List[str], records: List[ProgressRecord]):
+        line = line.strip()
+
+        if not line:
+            return
+
+        key, sep, value = line.partition(b'=')
+
+        if not sep or not key or not value or b' ' in key or b'=' in value:
+            standard_output.append(line.decode('utf-8', errors='replace'))
+            return
+
+        if key == b'progress':
+            records.append(ProgressRecord(*self._block, end=(value == b'end')))
+            self._block = [None] * len(FIELDS)
+            return
+
+        parse = FIELDS.get(key)
+
+        if parse is not None:
+            self._block[FIELD_INDEX[key]] = parse(value.strip())
@@ -0,0 +1,221 @@
+"""A compact ring of recent progress samples, dumped to a file for post-mortems."""
+
+import os
+import sys
+import time
+import array
+import math
+import struct
+import datetime
+import threading
+
+from typing import Dict, List, NamedTuple, Optional
+
+from pyrestreamer.progress import ProgressRecord
+
+# Columns stored for every sample, all as doubles (NaN when not reported)
+COLUMNS = ('time', 'output', 'out_time_us', 'total_size', 'speed', 'bitrate', 'ingest_bytes')
+
+# File magic, format version, then column count, sample count, creation time and reason length
+MAGIC = b'PRPD'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIdH')
+
+NAN = float('nan')
+
+class ProgressDump(NamedTuple):
+    """The contents of a progress dump file."""
+
+    created: float
+    reason: str
+    columns: Dict[str, array.array]
+
+    @property
+    def samples(self) -> int:
+        return len(self.columns['time'])
+
+class ProgressRecorder():
+    """Keep the last few minutes of progress samples in fixed-width numeric arrays.
+
+    Each column is a preallocated array of doubles used as a ring, so recording
+    a sample allocates nothing. ffmpeg reports progress about twice a second, so
+    the ring holds seconds * rate samples per output.
+    """
+
+    def __init__(self, seconds: float = 600, outputs: int = 1, rate: float = 2.0, directory: str = None):
+        """
+        Args:
+            seconds (float): How much history to keep (seconds).
+            outputs (int): Number of outputs recording into the ring.
+            rate (float): Expected progress samples per second per output.
+            directory (str): Where dumps are written (the system temp directory if not given).
+        """
+
+        self.seconds = seconds
+        self.capacity = max(int(seconds * rate * outputs), 1)
+        self.directory = directory
+
+        self.columns = {name: array.array('d', [NAN]) * self.capacity for name in COLUMNS}
+        self.count = 0
+        self.next = 0
+
+        # Reentrant, as dumps can be requested from a signal handler
+        self._lock = threading.RLock()
+
+    def record(self, record: ProgressRecord, ingest_bytes: int, output: int = 0, now: float = None):
+        """Record a progress sample.
+
+        Args:
+            record (ProgressRecord): The progress record.
+            ingest_bytes (int): Total bytes ingested so far.
+            output (int): Index of the output that reported the record.
+            now (float): Unix time of the sample (defaults to now).
+        """
+
+        values = (
+            time.time() if now is None else now,
+            output,
+            record.out_time_us,
+            record.total_size,
+            record.speed,
+            record.bitrate,
+            ingest_bytes,
+        )
+
+        with self._lock:
+            idx = self.next
+
+            for name, value in zip(COLUMNS, values):
+                self.columns[name][idx] = NAN if value is None else value
+
+            self.next = (idx + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def snapshot(self, now: float = None) -> Dict[str, array.array]:
+        """Get the samples from the last seconds, oldest first."""
+
+        with self._lock:
+            start = (self.next - self.count) % self.capacity
+            order = [(start + offset) % self.capacity for offset in range(self.count)]
+            columns = {name: array.array('d', (column[idx] for idx in order)) for name, column in self.columns.items()}
+
+        cutoff = (time.time() if now is None else now) - self.seconds
+        first = next((idx for idx, value in enumerate(columns['time']) if value >= cutoff), len(columns['time']))
+
+        return {name: column[first:] for name, column in columns.items()}
+
+    def dump(self, reason: str, name: str = 'pipeline', now: float = None) -> str:
+        """Write the recent samples to a file in the dump directory.
+
+        Args:
+            reason (str): Why the dump was written.
+            name (str): Pipeline name, used in the file name.
+            now (float): Unix time of the dump (defaults to now).
+
+        Returns:
+            str: Path of the dump file.
+        """
+
+        now = time.time() if now is None else now
+        stamp = datetime.datetime.fromtimestamp(now).strftime('%Y%m%d-%H%M%S')
+        directory = self.directory
+
+        if directory is None:
+            import tempfile #pylint: disable=import-outside-toplevel
+
+            directory = tempfile.gettempdir()
+
+        path = os.path.join(directory, f"pyrestreamer-{name}-{stamp}.progress")
+
+        write_dump(path, ProgressDump(now, reason, self.snapshot(now)))
+
+        return path
+
+def write_dump(path: str, dump: ProgressDump):
+    """Write a progress dump: a small header, the reason, then each column as little-endian doubles."""
+
+    reason = dump.reason.encode('utf-8')[:65535]
+    count = len(dump.columns['time'])
+
+    with open(path, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, len(COLUMNS), count, dump.created, len(reason)))
+        fh.write(reason)
+
+        for name in COLUMNS:
+            column = array.array('d', dump.columns[name])
+
+            if sys.byteorder != 'little':
+                column.byteswap()
+
+            fh.write(column.tobytes())
+
+def read_dump(path: str) -> ProgressDump:
+    """Read a progress dump written by write_dump."""
+
+    with open(path, 'rb') as fh:
+        magic, version, column_count, count, created, reason_length = HEADER.unpack(fh.read(HEADER.size))
+
+        if magic != MAGIC or version != VERSION or column_count != len(COLUMNS):
+            raise ValueError(f"{path} is not a version {VERSION} progress dump")
+
+        reason = fh.read(reason_length).decode('utf-8', errors='replace')
+        columns = {}
+
+        for name in COLUMNS:
+            column = array.array('d')
+            column.frombytes(fh.read(count * column.itemsize))
+
+            if sys.byteorder != 'little':
+                column.byteswap()
+
+            columns[name] = column
+
+    return ProgressDump(created, reason, columns)
+
+def _rate(values: array.array, times: array.array, idx: int, previous: Optional[int]) -> float:
+    if previous is None or math.isnan(values[idx]) or math.isnan(values[previous]) or times[idx] <= times[previous]:
+        return NAN
+
+    return (values[idx] - values[previous]) / (times[idx] - times[previous])
+
+def format_dump(dump: ProgressDump) -> List[str]:
+    """Render a progress dump as a table, one line per sample.
+
+    Alongside ffmpeg's speed and bitrate, each line shows the ingest rate, the
+    output rate and how far output time is behind wall time, so it's clear
+    whether the source, the network or the encoder degraded first.
+    """
+
+    columns = dump.columns
+    times = columns['time']
+    lines = [
+        f"Dumped {datetime.datetime.fromtimestamp(dump.created).isoformat(sep=' ', timespec='seconds')}: {dump.reason}",
+        f"{'time':<12} {'out':>3} {'out_time':>10} {'speed':>6} {'kbit/s':>8} {'ingest B/s':>11} {'output B/s':>11} {'lag s':>6}",
+    ]
+
+    previous_by_output: Dict[int, int] = {}
+    previous_ingest: Optional[int] = None
+    anchors: Dict[int, float] = {}
+
+    for idx in range(dump.samples):
+        output = int(columns['output'][idx])
+        previous = previous_by_output.get(output)
+        out_time = columns['out_time_us'][idx] / 1000000
+
+        lag = NAN
+
+        if not math.isnan(out_time):
+            anchor = anchors.setdefault(output, times[idx] - out_time)
+            lag = times[idx] - out_time - anchor
+
+        lines.append(
+            f"{datetime.datetime.fromtimestamp(times[idx]).strftime('%H:%M:%S.%f')[:12]:<12} {output:>3} {out_time:>10.1f} "
+            f"{columns['speed'][idx]:>6.2f} {columns['bitrate'][idx]:>8.1f} "
+            f"{_rate(columns['ingest_bytes'], times, idx, previous_ingest):>11.0f} "
+            f"{_rate(columns['total_size'], times, idx, previous):>11.0f} {lag:>6.1f}"
+        )
+
+        previous_by_output[output] = idx
+        previous_ingest = idx
+
+    return lines
@@ -0,0 +1,96 @@
+"""Restart policy for failed pipelines."""
+
+import random
+import collections
+
+from typing import Deque, Optional
+
+class RestartPolicy():
+    """Exponential backoff with jitter and a circuit breaker for pipeline restarts.
+
+    Each failure returns how long to wait before restarting. Consecutive failures
+    back off exponentially up to max_delay; a recovery (the pipeline making progress
+    again) resets the backoff and reports the time taken to recover. If more than
+    max_failures failures happen within window seconds the breaker opens, and the
+    caller should stop trying (in single-pipeline mode, exit for a container restart).
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 60.0, multiplier: float = 2.0, jitter: float = 0.2, max_failures: int = 5, window: float = 600.0):
+        """
+        Args:
+            base_delay (float): Delay before the first restart (seconds).
+            max_delay (float): Maximum delay between restarts (seconds).
+            multiplier (float): Backoff multiplier for each consecutive failure.
+            jitter (float): Random +/- fraction applied to each delay.
+            max_failures (int): Failures allowed within window before the breaker opens.
+            window (float): Circuit breaker window (seconds).
+        """
+
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_failures = max_failures
+        self.window = window
+
+        self.consecutive = 0
+        self.failed_at: Optional[float] = None
+        self._failures: Deque[float] = collections.deque()
+
+    def clone(self) -> 'RestartPolicy':
+        """Get a fresh policy with the same settings."""
+
+        return RestartPolicy(self.base_delay, self.max_delay, self.multiplier, self.jitter, self.max_failures, self.window)
+
+    def record_failure(self, now: float) -> Optional[float]:
+        """Record a failure.
+
+        Args:
+            now (float): Monotonic time of the failure.
+
+        Returns:
+            float: Seconds to wait before restarting, or None if the circuit breaker is open.
+        """
+
+        self._failures.append(now)
+
+        while self._failures and self._failures[0] < now - self.window:
+            self._failures.popleft()
+
+        if self.failed_at is None:
+            self.failed_at = now
+
+        if len(self._failures) > self.max_failures:
+            return None
+
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** self.consecutive)
+        self.consecutive += 1
+
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def record_recovery(self, now: float) -> Optional[float]:
+        """Record that the pipeline is making progress again.
+
+        Args:
+            now (float): Monotonic time the pipeline recovered.
+
+        Returns:
+            float: Seconds from the first failure to recovery, or None if we were not recovering.
+        """
+
+        if self.failed_at is None:
+            return None
+
+        time_to_recover = now - self.failed_at
+
+        self.failed_at = None
+        self.consecutive = 0
+
+        return time_to_recover
+
+    def reset(self):
+        """Close the circuit breaker and forget all failures."""
+
+        self.consecutive = 0
+        self.failed_at = None
+        self._failures.clear()
@@ -0,0 +1,276 @@
+"""CPU, memory and I/O accounting for pipeline process groups from /proc."""
+
+import os
+
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from pyrestreamer.rules import Action
+
+# Clock ticks per second used by /proc/<pid>/stat CPU times
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# Command names reported as the "shell" component
+SHELLS = ('sh', 'bash', 'dash')
+
+class ProcessSample(NamedTuple):
+    """One reading of a process's counters."""
+
+    pid: int
+    pgid: int
+    comm: str
+    cpu_ticks: int
+    rss_bytes: int
+    read_bytes: int
+    write_bytes: int
+
+class ComponentUsage(NamedTuple):
+    """Resource usage of one pipeline component (all of its processes)."""
+
+    component: str
+    processes: int
+    cpu_percent: float
+    rss_bytes: int
+    read_bytes: int
+    write_bytes: int
+
+def component_name(comm: str) -> str:
+    """Get the component a process belongs to from its command name."""
+
+    if comm in SHELLS:
+        return 'shell'
+
+    if comm.startswith('ffmpeg'):
+        return 'ffmpeg'
+
+    if comm.startswith('streamlink'):
+        return 'streamlink'
+
+    return comm
+
+def read_process(pid: int, proc_root: str = '/proc') -> Optional[ProcessSample]:
+    """Read a process's CPU time, RSS and I/O counters.
+
+    I/O counts every byte read and written (rchar/wchar), including pipes and
+    sockets, since almost none of a pipeline's I/O touches the disk. They are 0
+    if /proc/<pid>/io is not readable.
+
+    Args:
+        pid (int): The process ID.
+        proc_root (str): Where procfs is mounted.
+
+    Returns:
+        ProcessSample: The sample, or None if the process has gone.
+    """
+
+    base = os.path.join(proc_root, str(pid))
+
+    try:
+        with open(os.path.join(base, 'stat'), 'r') as fh:
+            stat = fh.read()
+
+        with open(os.path.join(base, 'status'), 'r') as fh:
+            status = fh.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    # comm may contain spaces and parentheses, so split around the last ")"
+    comm = stat[stat.index('(') + 1:stat.rindex(')')]
+    fields = stat[stat.rindex(')') + 2:].split()
+
+    rss_bytes = 0
+
+    for line in status.splitlines():
+        if line.startswith('VmRSS:'):
+            rss_bytes = int(line.split()[1]) * 1024
+            break
+
+    io: Dict[str, int] = {}
+
+    try:
+        with open(os.path.join(base, 'io'), 'r') as fh:
+            for line in fh:
+                key, _, value = line.partition(':')
+                io[key] = int(value)
+    except (OSError, ValueError):
+        pass
+
+    return ProcessSample(pid, int(fields[2]), comm, int(fields[11]) + int(fields[12]), rss_bytes, io.get('rchar', 0), io.get('wchar', 0))
+
+def group_processes(pgids: List[int], proc_root: str = '/proc') -> List[ProcessSample]:
+    """Sample every process in the given process groups.
+
+    Args:
+        pgids (List[int]): Process group IDs.
+        proc_root (str): Where procfs is mounted.
+
+    Returns:
+        List[ProcessSample]: A sample for each process found.
+    """
+
+    wanted = set(pgids)
+    samples = []
+
+    for entry in os.listdir(proc_root):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(os.path.join(proc_root, entry, 'stat'), 'r') as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+
+        if int(stat[stat.rindex(')') + 2:].split()[2]) not in wanted:
+            continue
+
+        sample = read_process(int(entry), proc_root)
+
+        if sample is not None:
+            samples.append(sample)
+
+    return samples
+
+class ResourceSampler():
+    """Sample the processes of a pipeline every interval seconds and check them against limits.
+
+    Usage is reported per component: the processes in a group are grouped by
+    command name (shell, streamlink, ffmpeg), prefixed with the group's label if
+    it has one (e.g. "output-0/ffmpeg"). A component breaches its limits when its
+    CPU% or RSS stays above them for sustain seconds.
+    """
+
+    def __init__(self, interval: float = 5.0, max_cpu_percent: float = 0.0, max_rss_mb: float = 0.0, sustain: float = 30.0, action: Union[Action, str] = Action.WARN, proc_root: str = '/proc'):
+        """
+        Args:
+            interval (float): Seconds between samples (0 to disable sampling).
+            max_cpu_percent (float): CPU% (100 is one core) a component may use (0 for no limit).
+            max_rss_mb (float): Resident memory a component may use, in MiB (0 for no limit).
+            sustain (float): Seconds a component must stay over a limit to breach it.
+            action (Action): What a breach does: warn (an alert) or restart (the pipeline or output).
+            proc_root (str): Where procfs is mounted.
+        """
+
+        self.interval = interval
+        self.max_cpu_percent = max_cpu_percent
+        self.max_rss_mb = max_rss_mb
+        self.sustain = sustain
+        self.action = Action(action) if isinstance(action, str) else action
+        self.proc_root = proc_root
+
+        if self.action not in (Action.WARN, Action.RESTART):
+            raise ValueError(f"Resource limit action must be warn or restart, not {self.action.value}")
+
+        self.reset()
+
+    def clone(self) -> 'ResourceSampler':
+        """Get a fresh sampler with the same settings."""
+
+        return ResourceSampler(self.interval, self.max_cpu_percent, self.max_rss_mb, self.sustain, self.action, self.proc_root)
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0 and os.path.isdir(self.proc_root)
+
+    def reset(self):
+        """Forget previous samples (for a newly started pipeline)."""
+
+        self.next_sample = 0.0
+
+        self._cpu_ticks: Dict[int, Tuple[int, float]] = {}
+        self._over_since: Dict[str, float] = {}
+
+    def due(self, now: float) -> bool:
+        """Whether a sample is due at a monotonic time."""
+
+        return self.enabled and now >= self.next_sample
+
+    def sample(self, groups: Dict[int, str], now: float) -> Dict[str, ComponentUsage]:
+        """Sample the processes in some process groups.
+
+        CPU% is measured since the previous sample of each process, so a
+        process's first sample reports 0.
+
+        Args:
+            groups (Dict[int, str]): Label for each process group ID ('' for no prefix).
+            now (float): Monotonic time of the sample.
+
+        Returns:
+            Dict[str, ComponentUsage]: Usage by component.
+        """
+
+        self.next_sample = now + self.interval
+
+        totals: Dict[str, List[float]] = {}
+        cpu_ticks: Dict[int, Tuple[int, float]] = {}
+
+        for process in group_processes(list(groups), self.proc_root):
+            label = groups.get(process.pgid, '')
+            name = component_name(process.comm)
+            component = f"{label}/{name}" if label else name
+
+            previous = self._cpu_ticks.get(process.pid)
+            cpu_ticks[process.pid] = (process.cpu_ticks, now)
+            cpu_percent = 0.0
+
+            if previous is not None and now > previous[1]:
+                cpu_percent = 100.0 * (process.cpu_ticks - previous[0]) / CLOCK_TICKS / (now - previous[1])
+
+            total = totals.setdefault(component, [0, 0.0, 0, 0, 0])
+            total[0] += 1
+            total[1] += cpu_percent
+            total[2] += process.rss_bytes
+            total[3] += process.read_bytes
+            total[4] += process.write_bytes
+
+        self._cpu_ticks = cpu_ticks
+
+        return {
+            component: ComponentUsage(component, int(total[0]), total[1], int(total[2]), int(total[3]), int(total[4]))
+            for component, total in sorted(totals.items())
+        }
+
+    def check(self, usage: Dict[str, ComponentUsage], now: float) -> Optional[Tuple[str, str]]:
+        """Check a sample against the limits.
+
+        A component that breaches its limits must stay over them for another
+        sustain seconds before it is reported again.
+
+        Args:
+            usage (Dict[str, ComponentUsage]): Usage by component, from sample().
+            now (float): Monotonic time of the sample.
+
+        Returns:
+            Tuple[str, str]: The component breaching its limits and why, or None.
+        """
+
+        for component in list(self._over_since):
+            if component not in usage:
+                del self._over_since[component]
+
+        breach = None
+
+        for component, current in usage.items():
+            reasons = []
+
+            if self.max_cpu_percent and current.cpu_percent > self.max_cpu_percent:
+                reasons.append(f"CPU {current.cpu_percent:.0f}% over {self.max_cpu_percent:.0f}%")
+
+            if self.max_rss_mb and current.rss_bytes > self.max_rss_mb * 2 ** 20:
+                reasons.append(f"RSS {current.rss_bytes / 2 ** 20:.0f} MiB over {self.max_rss_mb:.0f} MiB")
+
+            if not reasons:
+                self._over_since.pop(component, None)
+                continue
+
+            since = self._over_since.setdefault(component, now)
+
+            if breach is None and now - since >= self.sustain:
+                self._over_since[component] = now
+                breach = (component, f"{component} {' and '.join(reasons)} for {now - since:.0f} seconds")
+
+        return breach
+
+def format_usage(usage: ComponentUsage) -> str:
+    """Format a component's usage for the log."""
+
+    return f"{usage.component}: {usage.processes} proc, CPU {usage.cpu_percent:.1f}%, RSS {usage.rss_bytes / 2 ** 20:.1f} MiB, read {usage.read_bytes} B, written {usage.write_bytes} B"
@@ -0,0 +1,122 @@
+"""Classify streamlink/ffmpeg output lines with a configurable rule table."""
+
+import re
+
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+class Action(Enum):
+    """What to do with a line matching a rule."""
+
+    IGNORE = 'ignore' #pylint: disable=unused-variable
+    COUNT = 'count' #pylint: disable=unused-variable
+    WARN = 'warn' #pylint: disable=unused-variable
+    RESTART = 'restart' #pylint: disable=unused-variable
+    FATAL = 'fatal' #pylint: disable=unused-variable
+
+class Rule(NamedTuple):
+    """A line classification rule.
+
+    A rule matches lines starting with pattern, or, if regex is set, lines in
+    which the regular expression pattern is found.
+    """
+
+    name: str
+    pattern: str
+    action: Action
+    regex: bool = False
+    description: str = ''
+
+# Rules for failure signatures we know about; configured rules are tried first
+DEFAULT_RULES = (
+    Rule('segment_timeout', '[stream.dash][error] Failed to open segment', Action.COUNT, description="Segment timeout"),
+    Rule('pipe_copy_aborted', '[stream.ffmpegmux][error] Pipe copy aborted:', Action.RESTART, description="Pipe died"),
+)
+
+def parse_rules(entries: Optional[List[dict]]) -> List[Rule]:
+    """Parse rules from config entries.
+
+    Each entry has a name, an action (ignore, count, warn, restart or fatal),
+    and either "prefix" or "regex"; "description" is optional.
+
+    Args:
+        entries (List[dict]): The configured rules (may be None).
+
+    Returns:
+        List[Rule]: The parsed rules.
+    """
+
+    rules = []
+
+    for entry in entries or []:
+        if ('prefix' in entry) == ('regex' in entry):
+            raise ValueError(f"Output rule {entry.get('name')} needs exactly one of prefix or regex")
+
+        pattern = str(entry['regex'] if 'regex' in entry else entry['prefix'])
+
+        if 'regex' in entry:
+            re.compile(pattern)
+
+        rules.append(Rule(str(entry['name']), pattern, Action(str(entry['action']).lower()), 'regex' in entry, str(entry.get('description', ''))))
+
+    return rules
+
+class OutputRules():
+    """Match output lines against a rule table in a single pass.
+
+    All rules are compiled into one alternation, so classifying a line is one
+    regular expression match however many rules there are; the first matching
+    rule wins. Each rule keeps a count of the lines it matched.
+    """
+
+    def __init__(self, rules: Sequence[Rule] = DEFAULT_RULES):
+        """
+        Args:
+            rules (Sequence[Rule]): The rules, in priority order.
+        """
+
+        self.rules = list(rules)
+        self._matches = [0] * len(self.rules)
+
+        alternatives = []
+        self._group_rule: Dict[int, int] = {}
+        group = 1
+
+        for idx, rule in enumerate(self.rules):
+            pattern = f'.*?(?:{rule.pattern})' if rule.regex else re.escape(rule.pattern)
+
+            # The rule's own group closes after any groups nested in it, so it is
+            # always the match's lastindex
+            self._group_rule[group] = idx
+            alternatives.append(f'({pattern})')
+            group += 1 + re.compile(pattern).groups
+
+        self._matcher = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def classify(self, line: str) -> Optional[Rule]:
+        """Find the rule matching a line and count the match.
+
+        Args:
+            line (str): The output line.
+
+        Returns:
+            Rule: The first matching rule, or None if no rule matches.
+        """
+
+        if self._matcher is None:
+            return None
+
+        match = self._matcher.match(line)
+
+        if match is None:
+            return None
+
+        idx = self._group_rule[match.lastindex]
+        self._matches[idx] += 1
+
+        return self.rules[idx]
+
+    def counts(self) -> Dict[str, int]:
+        """Get the number of lines each rule has matched."""
+
+        return {rule.name: count for rule, count in zip(self.rules, self._matches)}
@@ -0,0 +1,293 @@
+"""Compiled weekly schedule index."""
+
+import bisect
+import datetime
+
+from typing import List, NamedTuple, Optional, Tuple
+
+import pytz
+
+from pyrestreamer.clock import Clock, SYSTEM_CLOCK
+
+WEEK_SECONDS = 7 * 24 * 60 * 60
+
+class OneOffEvent(NamedTuple):
+    """A window outside the weekly schedule during which we should stream (e.g. a funeral or a special service).
+
+    Like schedule windows, events are half-open.
+    """
+
+    start: datetime.datetime
+    end: datetime.datetime
+
+    def is_active(self, now: datetime.datetime) -> bool:
+        return self.start <= now < self.end
+
+class Override(NamedTuple):
+    """A manual start or stop that takes precedence over the schedule until it expires (or is cleared if until is None)."""
+
+    streaming: bool
+    until: Optional[datetime.datetime] = None
+
+    def applies(self, now: datetime.datetime) -> bool:
+        return self.until is None or now < self.until
+
+class ServiceTime(NamedTuple):
+    """A weekly service from SERVICE_TIMES: its day of the week (Monday is 1), start time and duration (minutes)."""
+
+    dow: int
+    hour: int
+    minute: int
+    duration: int
+
+def parse_service_times(value: str) -> Tuple[ServiceTime, ...]:
+    """Parse service times: comma-separated DOW|HH:MM|DURATION entries (see sample.env).
+
+    Raises:
+        ValueError: If an entry is malformed or out of range.
+
+    Returns:
+        Tuple[ServiceTime, ...]: The services.
+    """
+
+    services = []
+
+    for entry in str(value).split(','):
+        fields = entry.strip().split('|')
+
+        try:
+            dow, start, duration = fields
+            hour, minute = start.split(':')
+            service = ServiceTime(int(dow), int(hour), int(minute), int(duration))
+        except ValueError:
+            raise ValueError(f"Service {entry.strip()!r} is not in DOW|HH:MM|DURATION format") from None
+
+        if not 1 <= service.dow <= 7 or not 0 <= service.hour <= 23 or not 0 <= service.minute <= 59 or service.duration <= 0:
+            raise ValueError(f"Service {entry.strip()!r} is out of range (day 1-7, a time of day and a positive duration)")
+
+        services.append(service)
+
+    return tuple(services)
+
+def parse_timezone(name: str) -> datetime.tzinfo:
+    """Look up a timezone by its TZ database name (e.g. America/New_York).
+
+    Raises:
+        ValueError: If there is no such timezone.
+    """
+
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown timezone {name!r}") from None
+
+class ServiceSchedule():
+    """Sorted index of the weekly windows during which we should be streaming.
+
+    Every service is converted to a window in local wall-clock seconds since
+    Monday 00:00 (including its buffer). Windows that cross midnight or the end
+    of the week are wrapped around, and overlapping or touching windows are
+    merged, so answering "are we active?" and "when is the next transition?"
+    is a binary search over the window start times.
+
+    Windows are half-open: a window is active from its buffered start up to,
+    but not including, its buffered end.
+    """
+
+    def __init__(self, services: List, tz: pytz.tzinfo, clock: Clock = None):
+        """
+        Args:
+            services (List[Service]): The services to compile.
+            tz (tzinfo): The PYTZ timezone object for the local timezone.
+            clock (Clock): Clock giving the current time (defaults to the system clock).
+        """
+
+        self.tz = tz
+        self.clock = clock or SYSTEM_CLOCK
+        self.windows = ServiceSchedule._compile(services)
+
+        self._starts = [start for start, _ in self.windows]
+        self._ends = [end for _, end in self.windows]
+
+    @classmethod
+    def _compile(cls, services: List) -> List[Tuple[float, float]]:
+        """Compile services into sorted, merged, non-overlapping windows.
+
+        Args:
+            services (List[Service]): The services to compile.
+
+        Returns:
+            List[Tuple[float, float]]: (start, end) seconds of the week.
+        """
+
+        raw = []
+
+        for service in services:
+            start = (service.dow - 1) * 86400 + service.hr * 3600 + service.min * 60 - service.buf * 60
+            length = (service.dur + 2 * service.buf) * 60
+
+            if length <= 0:
+                continue
+
+            if length >= WEEK_SECONDS:
+                return [(0, WEEK_SECONDS)]
+
+            start %= WEEK_SECONDS
+            end = start + length
+
+            if end > WEEK_SECONDS:
+                raw.append((start, WEEK_SECONDS))
+                raw.append((0, end - WEEK_SECONDS))
+            else:
+                raw.append((start, end))
+
+        raw.sort()
+
+        merged: List[Tuple[float, float]] = []
+
+        for start, end in raw:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        return merged
+
+    def _local(self, now: Optional[datetime.datetime]) -> datetime.datetime:
+        """Get the current (or given) time in the local timezone."""
+
+        if now is None:
+            return self.clock.now(self.tz)
+
+        return now.astimezone(self.tz)
+
+    @classmethod
+    def second_of_week(cls, local: datetime.datetime) -> float:
+        """Get the wall-clock second of the week for a local datetime.
+
+        Args:
+            local (datetime.datetime): A datetime in the local timezone.
+
+        Returns:
+            float: Seconds since Monday 00:00 local wall-clock time.
+        """
+
+        return (
+            (local.isoweekday() - 1) * 86400
+            + local.hour * 3600
+            + local.minute * 60
+            + local.second
+            + local.microsecond / 1000000
+        )
+
+    def _window_index(self, sow: float) -> int:
+        """Get the index of the window containing sow, or -1 if there is none."""
+
+        idx = bisect.bisect_right(self._starts, sow) - 1
+
+        if idx >= 0 and sow < self._ends[idx]:
+            return idx
+
+        return -1
+
+    def is_active(self, now: Optional[datetime.datetime] = None) -> bool:
+        """Is any service active now?
+
+        Args:
+            now (datetime.datetime): Time to check (defaults to the current time).
+
+        Returns:
+            bool: True if a service is active, false if not.
+        """
+
+        return self._window_index(ServiceSchedule.second_of_week(self._local(now))) >= 0
+
+    def next_transition(self, now: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+        """Get the time of the next start or stop transition.
+
+        Args:
+            now (datetime.datetime): Time to check from (defaults to the current time).
+
+        Returns:
+            datetime.datetime: Time of the next transition, or None if the schedule never changes state.
+        """
+
+        if not self.windows or self.windows == [(0, WEEK_SECONDS)]:
+            return None
+
+        local = self._local(now)
+        sow = ServiceSchedule.second_of_week(local)
+        idx = self._window_index(sow)
+
+        if idx >= 0:
+            target = self._ends[idx]
+
+            # A window ending at the week boundary continues into the window starting at 0
+            if target == WEEK_SECONDS and self._starts[0] == 0:
+                target = WEEK_SECONDS + self._ends[0]
+        else:
+            nxt = bisect.bisect_right(self._starts, sow)
+            target = self._starts[nxt] if nxt < len(self._starts) else WEEK_SECONDS + self._starts[0]
+
+        naive = local.replace(tzinfo=None) + datetime.timedelta(seconds=target - sow)
+
+        return self._first_instant(naive, local)
+
+    def _first_instant(self, naive: datetime.datetime, after: datetime.datetime) -> datetime.datetime:
+        """Get the first instant after a given time at which the local wall clock reaches a naive time.
+
+        A wall-clock time skipped by a DST change is reached when the clock jumps
+        past it; one repeated by a DST change is first reached on its earlier pass.
+
+        Args:
+            naive (datetime.datetime): The local wall-clock time.
+            after (datetime.datetime): Only instants after this (aware) time count.
+
+        Returns:
+            datetime.datetime: The instant, in the local timezone.
+        """
+
+        try:
+            self.tz.localize(naive, is_dst=None)
+        except pytz.NonExistentTimeError:
+            # Search between the instants the two possible offsets give for the clock jump
+            low = self.tz.normalize(self.tz.localize(naive, is_dst=True))
+            high = self.tz.normalize(self.tz.localize(naive, is_dst=False))
+
+            while high - low > datetime.timedelta(milliseconds=1):
+                middle = self.tz.normalize(low + (high - low) / 2)
+
+                if middle.replace(tzinfo=None) >= naive:
+                    high = middle
+                else:
+                    low = middle
+
+            return high
+        except pytz.AmbiguousTimeError:
+            pass
+
+        for is_dst in (True, False):
+            candidate = self.tz.normalize(self.tz.localize(naive, is_dst=is_dst))
+
+            if candidate > after:
+                return candidate
+
+        return candidate
+
+    def seconds_until_transition(self, now: Optional[datetime.datetime] = None) -> Optional[float]:
+        """Get the number of seconds until the next transition.
+
+        Args:
+            now (datetime.datetime): Time to check from (defaults to the current time).
+
+        Returns:
+            float: Seconds until the next transition, or None if there is none.
+        """
+
+        local = self._local(now)
+        transition = self.next_transition(local)
+
+        if transition is None:
+            return None
+
+        return max((transition - local).total_seconds(), 0.0)
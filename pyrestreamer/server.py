@@ -0,0 +1,103 @@
+"""HTTP servers for the metrics and control interfaces, on TCP or Unix sockets."""
+
+import os
+import socket
+import logging
+import threading
+import socketserver
+import http.server
+
+from pyrestreamer.metrics import REGISTRY, Metrics
+
+log = logging.getLogger("pyrestreamer")
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the registry on GET /metrics."""
+
+    registry: Metrics = REGISTRY
+
+    def do_GET(self): #pylint: disable=invalid-name
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.registry.render().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args): #pylint: disable=redefined-builtin
+        log.debug(f"Metrics request: {format % args}")
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix socket."""
+
+    daemon_threads = True
+
+def serve(address: str, handler: type) -> socketserver.BaseServer:
+    """Serve HTTP requests from a background thread.
+
+    Args:
+        address (str): "host:port" (e.g. "127.0.0.1:9464") or "unix:/path/to/socket".
+        handler (type): The request handler class.
+
+    Returns:
+        socketserver.BaseServer: The running server (call shutdown() to stop it).
+    """
+
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+        server: socketserver.BaseServer = UnixHTTPServer(path, handler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = http.server.ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def start_metrics_server(address: str, registry: Metrics = REGISTRY) -> socketserver.BaseServer:
+    """Serve metrics from a background thread.
+
+    Args:
+        address (str): "host:port" (e.g. "127.0.0.1:9464") or "unix:/path/to/socket".
+        registry (Metrics): The registry to serve.
+
+    Returns:
+        socketserver.BaseServer: The running server (call shutdown() to stop it).
+    """
+
+    server = serve(address, type('BoundMetricsHandler', (MetricsHandler,), {'registry': registry}))
+
+    log.info(f"Serving metrics on {address}")
+
+    return server
+
+def unix_get(path: str, url: str = '/metrics') -> str:
+    """Fetch a URL from an HTTP server on a Unix socket (for scripts and tests)."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(f"GET {url} HTTP/1.0\r\n\r\n".encode('ascii'))
+
+        chunks = []
+
+        while True:
+            chunk = sock.recv(65536)
+
+            if not chunk:
+                break
+
+            chunks.append(chunk)
+
+    return b''.join(chunks).decode('utf-8').split('\r\n\r\n', 1)[1]
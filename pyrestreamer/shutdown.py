@@ -0,0 +1,192 @@
+"""Stop process groups quickly: SIGTERM, wait against a deadline, then SIGKILL."""
+
+import os
+import time
+import signal
+import subprocess
+
+from typing import NamedTuple, Sequence
+
+class StopPolicy(NamedTuple):
+    """How a pipeline's process group is stopped.
+
+    The group is sent SIGTERM and given grace seconds to exit, so ffmpeg can
+    finish writing to its destination; anything still running is then sent
+    SIGKILL and given kill_timeout seconds more to be reaped.
+    """
+
+    grace: float = 3.0
+    kill_timeout: float = 2.0
+
+class StopResult(NamedTuple):
+    """How a stop went."""
+
+    exited: bool
+    killed: bool
+    seconds: float
+
+# How often to check whether the rest of a process group has exited (seconds)
+GROUP_POLL_INTERVAL = 0.02
+
+def signal_group(pgid: int, sig: int) -> bool:
+    """Send a signal to a process group.
+
+    Returns:
+        bool: False if the group has no processes left.
+    """
+
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+def reap_group(pgid: int) -> int:
+    """Reap any of our exited children in a process group.
+
+    The members we started are reaped by whoever waits on them; this collects
+    the rest, like a muxer streamlink started, which become our children when
+    we run as PID 1 in a container. Only call it once the members we started
+    have been waited on, or their exit codes are lost.
+
+    Returns:
+        int: Number of processes reaped.
+    """
+
+    reaped = 0
+
+    while True:
+        try:
+            pid, _ = os.waitpid(-pgid, os.WNOHANG)
+        except ChildProcessError:
+            return reaped
+
+        if pid == 0:
+            return reaped
+
+        reaped += 1
+
+def group_alive(pgid: int, proc_root: str = '/proc') -> bool:
+    """Check whether a process group has any running processes left, reaping our exited children first.
+
+    Exited processes count as members until their parent reaps them, which can
+    take a while for orphans adopted by a lazy init, so procfs is checked (if
+    mounted) for members that are not zombies.
+    """
+
+    reap_group(pgid)
+
+    if not signal_group(pgid, 0):
+        return False
+
+    try:
+        entries = os.listdir(proc_root)
+    except OSError:
+        return True
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(os.path.join(proc_root, entry, 'stat'), 'r') as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+
+        # state and process group follow comm, which may contain spaces and parentheses
+        fields = stat[stat.rindex(')') + 2:].split()
+
+        if int(fields[2]) == pgid and fields[0] != 'Z':
+            return True
+
+    return False
+
+def wait_group(pgid: int, procs: Sequence[subprocess.Popen], deadline: float) -> bool:
+    """Wait until the processes have exited and the rest of their group is gone.
+
+    Args:
+        pgid (int): The process group.
+        procs (Sequence[subprocess.Popen]): Processes we started in the group.
+        deadline (float): Monotonic time to give up at.
+
+    Returns:
+        bool: True if everything exited in time.
+    """
+
+    for proc in procs:
+        try:
+            proc.wait(max(deadline - time.monotonic(), 0.0))
+        except subprocess.TimeoutExpired:
+            return False
+
+    while group_alive(pgid):
+        if time.monotonic() >= deadline:
+            return False
+
+        time.sleep(GROUP_POLL_INTERVAL)
+
+    return True
+
+def stop_group(pgid: int, procs: Sequence[subprocess.Popen], policy: StopPolicy = None) -> StopResult:
+    """Stop a process group, escalating to SIGKILL if it outlives the grace period.
+
+    Args:
+        pgid (int): The process group.
+        procs (Sequence[subprocess.Popen]): Processes we started in the group, which are waited on.
+        policy (StopPolicy): Grace and kill timeouts (defaults if not given).
+
+    Returns:
+        StopResult: Whether everything exited, whether SIGKILL was needed, and how long it took.
+    """
+
+    policy = policy or StopPolicy()
+    started = time.monotonic()
+    killed = False
+
+    signal_group(pgid, signal.SIGTERM)
+    exited = wait_group(pgid, procs, started + policy.grace)
+
+    if not exited:
+        killed = signal_group(pgid, signal.SIGKILL)
+        exited = wait_group(pgid, procs, time.monotonic() + policy.kill_timeout)
+
+    return StopResult(exited, killed, time.monotonic() - started)
+
+async def wait_group_async(pgid: int, proc: 'asyncio.subprocess.Process', deadline: float) -> bool:
+    """Wait until an asyncio process has exited and the rest of its group is gone (see wait_group)."""
+
+    # Only the asyncio engine stops processes this way; the thread engine never loads asyncio
+    import asyncio #pylint: disable=import-outside-toplevel
+
+    try:
+        await asyncio.wait_for(proc.wait(), max(deadline - time.monotonic(), 0.0))
+    except asyncio.TimeoutError:
+        return False
+
+    while group_alive(pgid):
+        if time.monotonic() >= deadline:
+            return False
+
+        await asyncio.sleep(GROUP_POLL_INTERVAL)
+
+    return True
+
+async def stop_group_async(pgid: int, proc: 'asyncio.subprocess.Process', policy: StopPolicy = None) -> StopResult:
+    """Stop an asyncio process's group, escalating to SIGKILL if it outlives the grace period (see stop_group)."""
+
+    policy = policy or StopPolicy()
+    started = time.monotonic()
+    killed = False
+
+    signal_group(pgid, signal.SIGTERM)
+    exited = await wait_group_async(pgid, proc, started + policy.grace)
+
+    if not exited:
+        killed = signal_group(pgid, signal.SIGKILL)
+        exited = await wait_group_async(pgid, proc, time.monotonic() + policy.kill_timeout)
+
+    return StopResult(exited, killed, time.monotonic() - started)
@@ -0,0 +1,72 @@
+"""Signal handling for the thread engine, with handlers run outside the signal handler itself."""
+
+import os
+import signal
+import logging
+import threading
+
+from typing import Callable, Dict, Optional, Tuple
+
+log = logging.getLogger("pyrestreamer")
+
+class SignalDispatcher():
+    """Run signal handlers on a thread of their own.
+
+    A Python signal handler runs in the main thread between any two bytecodes,
+    including while that thread holds a non-reentrant lock (such as a queue's in
+    a logging handler), so logging or taking a lock from one can deadlock. Like
+    asyncio's loop.add_signal_handler, the handler we install only writes the
+    signal number to a pipe; a dispatcher thread reads it and calls the real
+    handler, where it is free to log, take locks and wake other threads.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[int, Tuple[Callable, tuple]] = {}
+        self._read_fd, self._write_fd = os.pipe()
+
+        # Never block the signal handler; a full pipe already has a wake-up pending
+        os.set_blocking(self._write_fd, False)
+
+        self._thread = threading.Thread(target=self._run, name='signals', daemon=True)
+        self._thread.start()
+
+    def add(self, sig: int, handler: Callable, *args):
+        """Call handler(*args) on the dispatcher thread whenever sig arrives (must be called from the main thread)."""
+
+        self._handlers[sig] = (handler, args)
+
+        signal.signal(sig, self._deliver)
+
+    def _deliver(self, signum, frame): #pylint: disable=unused-argument
+        try:
+            os.write(self._write_fd, bytes([signum]))
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            for signum in os.read(self._read_fd, 64):
+                handler, args = self._handlers.get(signum, (None, ()))
+
+                if handler is None:
+                    continue
+
+                try:
+                    handler(*args)
+                except Exception: #pylint: disable=broad-except
+                    log.exception(f"Signal {signal.Signals(signum).name} handler failed")
+
+_DISPATCHER: Optional[SignalDispatcher] = None
+
+def add_signal_handler(sig: int, handler: Callable, *args):
+    """Call handler(*args) from a dispatcher thread whenever sig arrives (see SignalDispatcher).
+
+    Must be called from the main thread, like signal.signal.
+    """
+
+    global _DISPATCHER #pylint: disable=global-statement
+
+    if _DISPATCHER is None:
+        _DISPATCHER = SignalDispatcher()
+
+    _DISPATCHER.add(sig, handler, *args)
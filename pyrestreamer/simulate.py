@@ -0,0 +1,134 @@
+"""Fast-forward a restreamer's schedule on a simulated clock."""
+
+import bisect
+import datetime
+
+from typing import List, NamedTuple
+
+import pytz
+
+from pyrestreamer.clock import SimulatedClock
+from pyrestreamer.helpers import ReStreamer, StreamingState
+
+class Transition(NamedTuple):
+    """Something that happened during a simulation."""
+
+    at: datetime.datetime
+    event: str
+    detail: str = ''
+
+class SimulationResult(NamedTuple):
+    """The outcome of a simulation."""
+
+    transitions: List[Transition]
+    streaming_seconds: float
+    wakeups: int
+
+def dst_changes(tz: pytz.tzinfo, start: datetime.datetime, end: datetime.datetime) -> List[datetime.datetime]:
+    """Get the times a timezone changes its UTC offset between two times.
+
+    Args:
+        tz (tzinfo): The PYTZ timezone.
+        start (datetime.datetime): Start of the range (aware).
+        end (datetime.datetime): End of the range (aware).
+
+    Returns:
+        List[datetime.datetime]: UTC times of each change, in order.
+    """
+
+    # Fixed-offset zones have no transitions
+    transitions = getattr(tz, '_utc_transition_times', [])
+
+    start = start.astimezone(pytz.utc).replace(tzinfo=None)
+    end = end.astimezone(pytz.utc).replace(tzinfo=None)
+
+    first = bisect.bisect_right(transitions, start)
+    last = bisect.bisect_right(transitions, end)
+
+    return [pytz.utc.localize(transition) for transition in transitions[first:last]]
+
+def format_offset(offset: datetime.timedelta) -> str:
+    minutes = int(offset.total_seconds() // 60)
+    sign = '-' if minutes < 0 else '+'
+
+    return f"UTC{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+
+def simulate(restreamer: ReStreamer, until: datetime.datetime) -> SimulationResult:
+    """Run a restreamer's scheduling decisions on its simulated clock until a given time.
+
+    The simulation decides what to do as the event loop does (see ReStreamer.expected_state,
+    which accounts for overrides, one-off events and the pre-roll) and wakes exactly when the
+    event loop would (see ReStreamer.sleep_duration), so it also catches a schedule that would
+    keep the loop from sleeping.
+
+    Args:
+        restreamer (ReStreamer): A restreamer built with a SimulatedClock.
+        until (datetime.datetime): When to stop the simulation (aware).
+
+    Returns:
+        SimulationResult: Every start, stop and DST change, with totals.
+    """
+
+    clock = restreamer.clock
+
+    if not isinstance(clock, SimulatedClock):
+        raise ValueError("Simulations need a restreamer with a SimulatedClock.")
+
+    tz = restreamer.settings.schedule.tz
+    changes = dst_changes(tz, clock.now(pytz.utc), until)
+    transitions: List[Transition] = []
+
+    state = StreamingState.IDLE
+    started_at = None
+    streaming_seconds = 0.0
+    wakeups = 0
+
+    while True:
+        now = clock.now(tz)
+
+        while changes and changes[0] <= now:
+            change = changes.pop(0)
+            before = (change - datetime.timedelta(seconds=1)).astimezone(tz)
+            after = change.astimezone(tz)
+            transitions.append(Transition(after, 'dst', f"{format_offset(before.utcoffset())} -> {format_offset(after.utcoffset())} ({before.tzname()} -> {after.tzname()})"))
+
+        if now >= until:
+            break
+
+        wakeups += 1
+        expected = restreamer.expected_state(now)
+
+        if expected is not state:
+            if state is StreamingState.STREAMING:
+                streaming_seconds += (now - started_at).total_seconds()
+                transitions.append(Transition(now, 'stop', f"streamed for {now - started_at}"))
+            elif expected is StreamingState.IDLE:
+                transitions.append(Transition(now, 'stop', "warmed up without streaming"))
+
+            if expected is StreamingState.STREAMING:
+                started_at = now
+                transitions.append(Transition(now, 'start'))
+            elif expected is StreamingState.WARMING:
+                transitions.append(Transition(now, 'warm'))
+
+            state = expected
+
+        sleep_for = restreamer.sleep_duration(state)
+
+        if sleep_for <= 0:
+            transitions.append(Transition(now, 'stuck', "schedule reports a transition now but the state does not change"))
+            sleep_for = 1.0
+
+        clock.sleep(min(sleep_for, (until - now).total_seconds()))
+
+    if state is StreamingState.STREAMING:
+        streaming_seconds += (until - started_at).total_seconds()
+
+    return SimulationResult(transitions, streaming_seconds, wakeups)
+
+def format_transition(transition: Transition) -> str:
+    """Format a transition as a line of simulator output."""
+
+    line = f"{transition.at:%a %Y-%m-%d %H:%M:%S %Z}  {transition.event:<5}"
+
+    return f"{line}  {transition.detail}" if transition.detail else line.rstrip()
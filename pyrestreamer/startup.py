@@ -0,0 +1,91 @@
+"""Time and memory taken by each phase of startup (see --startup-profile)."""
+
+import os
+import sys
+import time
+import resource
+
+from typing import List, NamedTuple, Optional
+
+from pyrestreamer.resources import read_process
+
+class Phase(NamedTuple):
+    """One phase of startup."""
+
+    name: str
+    seconds: float
+    rss_bytes: int
+    modules: int
+
+def current_rss() -> int:
+    """Get this process's resident memory, falling back to its peak where procfs is not mounted."""
+
+    sample = read_process(os.getpid())
+
+    if sample is not None and sample.rss_bytes:
+        return sample.rss_bytes
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class StartupProfile():
+    """Record how long each phase of startup took, and the memory and modules it added.
+
+    Each call to mark ends a phase that started at the previous mark (or when
+    the profile was created), so phases cover startup without gaps.
+    """
+
+    def __init__(self, started: float = None, modules: int = None):
+        """
+        Args:
+            started (float): perf_counter time the first phase started (defaults to now).
+            modules (int): Modules loaded when the first phase started (defaults to those loaded now).
+        """
+
+        self.started = time.perf_counter() if started is None else started
+        self.phases: List[Phase] = []
+
+        self._mark = self.started
+        self._modules = len(sys.modules) if modules is None else modules
+
+    def mark(self, name: str) -> Phase:
+        """End the current phase and start the next."""
+
+        now = time.perf_counter()
+        modules = len(sys.modules)
+        phase = Phase(name, now - self._mark, current_rss(), modules - self._modules)
+
+        self.phases.append(phase)
+        self._mark = now
+        self._modules = modules
+
+        return phase
+
+    @property
+    def seconds(self) -> float:
+        """Time from the start of the first phase to the end of the last."""
+
+        return self._mark - self.started
+
+    @property
+    def rss_bytes(self) -> Optional[int]:
+        """Resident memory at the end of the last phase."""
+
+        return self.phases[-1].rss_bytes if self.phases else None
+
+def format_profile(profile: StartupProfile) -> List[str]:
+    """Format a startup profile as a table, one line per phase and a total."""
+
+    lines = [f"{'phase':<12} {'seconds':>8} {'total':>8} {'rss MiB':>8} {'+MiB':>7} {'modules':>8}"]
+    total = 0.0
+    previous: Optional[int] = None
+
+    for phase in profile.phases:
+        total += phase.seconds
+        growth = f"{(phase.rss_bytes - previous) / 1048576:+7.1f}" if previous is not None else f"{'':>7}"
+        previous = phase.rss_bytes
+
+        lines.append(f"{phase.name:<12} {phase.seconds:8.3f} {total:8.3f} {phase.rss_bytes / 1048576:8.1f} {growth} {phase.modules:+8d}")
+
+    lines.append(f"Started in {profile.seconds:.3f}s with {(profile.rss_bytes or 0) / 1048576:.1f} MiB resident and {len(sys.modules)} modules loaded.")
+
+    return lines
@@ -0,0 +1,1127 @@
+"""asyncio-based pipeline supervisor."""
+
+import asyncio
+import collections
+import logging
+import os
+import time
+import signal
+
+from typing import Callable, Deque, Dict, List, Optional
+
+from pyrestreamer.helpers import ReStreamer, StreamingState
+from pyrestreamer.pipeline import OutputHealth, StreamHeaderCache, ThroughputMeter, PipelineFailure, FatalPipelineError
+from pyrestreamer.progress import ProgressParser, ProgressRecord
+from pyrestreamer.metrics import PipelineMetrics
+from pyrestreamer.recovery import RestartPolicy
+from pyrestreamer.watchdog import StallWatchdog
+from pyrestreamer.rules import Action, Rule
+from pyrestreamer.ingest import StreamlinkIngest
+from pyrestreamer.jitter import JitterBuffer
+from pyrestreamer.shutdown import StopPolicy, StopResult, stop_group_async
+
+log = logging.getLogger("pyrestreamer")
+
+class PipelineLogAdapter(logging.LoggerAdapter):
+    """Prefix log messages with the pipeline name, if there is one."""
+
+    def process(self, msg, kwargs):
+        if self.extra.get('pipeline'):
+            return f"[{self.extra['pipeline']}] {msg}", kwargs
+
+        return msg, kwargs
+
+class InProcessIngest():
+    """Present an in-process streamlink ingest thread like an asyncio subprocess.
+
+    The thread writes the stream and its log lines to pipes read by asyncio
+    StreamReaders, exposed as stdout and stderr.
+    """
+
+    def __init__(self, thread: StreamlinkIngest, stdout: asyncio.StreamReader, stderr: asyncio.StreamReader):
+        self.thread = thread
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @classmethod
+    async def start(cls, restreamer: ReStreamer, limit: int) -> 'InProcessIngest':
+        """Start an in-process ingest for a restreamer.
+
+        Args:
+            restreamer (ReStreamer): The restreamer to ingest for.
+            limit (int): Maximum line length for the log reader.
+
+        Returns:
+            InProcessIngest: The running ingest.
+        """
+
+        loop = asyncio.get_running_loop()
+        readers = []
+        write_fds = []
+
+        for _ in range(2):
+            read_fd, write_fd = os.pipe()
+            reader = asyncio.StreamReader(limit=limit)
+
+            await loop.connect_read_pipe(lambda reader=reader: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, 'rb', 0))
+
+            readers.append(reader)
+            write_fds.append(write_fd)
+
+        thread = restreamer.make_ingest(write_fds[0], write_fds[1])
+        thread.start()
+
+        return cls(thread, readers[0], readers[1])
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.thread.returncode if not self.thread.is_alive() else None
+
+    async def wait(self) -> int:
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+
+        return self.thread.returncode
+
+    def terminate(self):
+        self.thread.stop()
+
+async def terminate_process(proc, policy: StopPolicy) -> StopResult:
+    """Stop a process's group (or an in-process ingest), escalating to SIGKILL after the grace period.
+
+    Args:
+        proc (asyncio.subprocess.Process): The process (leader of its own process group), or an InProcessIngest.
+        policy (StopPolicy): Grace and kill timeouts.
+
+    Returns:
+        StopResult: Whether it exited, whether SIGKILL was needed, and how long it took.
+    """
+
+    if not isinstance(proc, InProcessIngest):
+        return await stop_group_async(proc.pid, proc, policy)
+
+    # Threads can't be killed; give the ingest the whole time to notice it was stopped
+    started = time.monotonic()
+    proc.terminate()
+
+    try:
+        await asyncio.wait_for(proc.wait(), policy.grace + policy.kill_timeout)
+    except asyncio.TimeoutError:
+        return StopResult(False, False, time.monotonic() - started)
+
+    return StopResult(True, False, time.monotonic() - started)
+
+class AsyncOutput():
+    """One ffmpeg output fed from a shared ingest stream.
+
+    Each output has its own input queue and writer task, so the pump only hands
+    it data and never waits on its ffmpeg. An output that stops consuming its
+    input (a write stuck for DRAIN_TIMEOUT seconds, or a queue over QUEUE_LIMIT
+    bytes) fails and is restarted by the supervisor without holding up the rest.
+    """
+
+    # Size of each read from ffmpeg's output
+    READ_CHUNK = 2 ** 16
+
+    # How long a single write to ffmpeg may take before the output is considered stuck (seconds)
+    DRAIN_TIMEOUT = 5
+
+    # Most input bytes queued for an output before it is considered too slow (several segments' worth)
+    QUEUE_LIMIT = 2 ** 24
+
+    def __init__(self, index: int, args: List[str], log: logging.LoggerAdapter, metrics: PipelineMetrics, policy: RestartPolicy, on_failure: Callable[[], None], on_progress: Callable[['AsyncOutput'], None], watchdog: StallWatchdog = None, on_line: Callable[[str, str, bool], Optional[Rule]] = None, on_record: Callable[['AsyncOutput', ProgressRecord], None] = None):
+        """
+        Args:
+            index (int): Index of this output within its pipeline.
+            args (List[str]): Arguments for the ffmpeg process.
+            log (logging.LoggerAdapter): Logger for the owning pipeline.
+            metrics (PipelineMetrics): Metrics for the owning pipeline.
+            policy (RestartPolicy): Restart policy for this output.
+            on_failure (Callable): Called when the output fails.
+            on_progress (Callable): Called with this output when it makes progress.
+            watchdog (StallWatchdog): Stall thresholds for this output (cloned on every start).
+            on_line (Callable): Classifies each standard output line (given the line, the output's name and whether
+                output is expected), returning the matching rule if the output must restart.
+            on_record (Callable): Called with this output and each progress record (optional).
+        """
+
+        self.index = index
+        self.args = args
+        self.log = log
+        self.metrics = metrics
+        self.policy = policy
+        self.on_failure = on_failure
+        self.on_progress = on_progress
+        self.watchdog = watchdog or StallWatchdog()
+        self.on_line = on_line or (lambda line, source, expected: log.info(f"{source} proc output: {line}"))
+        self.on_record = on_record
+
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.health = OutputHealth(self.watchdog.clone())
+        self.failure: Optional[str] = None
+        self.restart_at: Optional[float] = None
+        self.restarts = 0
+        self.started_at: Optional[float] = None
+
+        self._reader: Optional[asyncio.Task] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._queue: Deque[bytes] = collections.deque()
+        self._queued = 0
+        self._data: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.failure is None
+
+    def fail(self, message: str):
+        """Mark this output as failed so the supervisor restarts it."""
+
+        if self.failure is None:
+            self.failure = message
+            self.log.critical(f"Output {self.index} failed: {message}")
+            self._clear_queue()
+            self.on_failure()
+
+    async def start(self, header: bytes = b''):
+        """Start the ffmpeg process for this output.
+
+        Args:
+            header (bytes): Container header to replay before joining the live stream.
+        """
+
+        self.health = OutputHealth(self.watchdog.clone())
+        self.failure = None
+        self.restart_at = None
+        self.started_at = time.monotonic()
+
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True
+        )
+
+        self._reader = asyncio.ensure_future(self._read_output(self.proc))
+        self._data = asyncio.Event()
+        self._space = asyncio.Event()
+        self._clear_queue()
+        self._writer = asyncio.ensure_future(self._write_input(self.proc))
+
+        if header:
+            self.write(header)
+
+    def begin(self, header: bytes = b''):
+        """Start feeding an output started ahead of its service: restart its watchdog and replay the container header.
+
+        Args:
+            header (bytes): Container header to replay before joining the live stream.
+        """
+
+        self.health = OutputHealth(self.watchdog.clone())
+        self.started_at = time.monotonic()
+
+        if header:
+            self.write(header)
+
+    async def stop(self, policy: StopPolicy) -> bool:
+        """Stop the ffmpeg process for this output.
+
+        Args:
+            policy (StopPolicy): Grace and kill timeouts.
+
+        Returns:
+            bool: True if the process exited, false if it is still running.
+        """
+
+        proc = self.proc
+        self.proc = None
+
+        if proc is None:
+            return True
+
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+        self._clear_queue()
+
+        if proc.stdin is not None:
+            proc.stdin.close()
+
+        result = await terminate_process(proc, policy)
+        exited = result.exited
+
+        self.metrics.stop_time(result, f'output-{self.index}')
+
+        if result.killed:
+            self.log.warning(f"Output {self.index} did not exit within {policy.grace:g} seconds of SIGTERM; killed it.")
+
+        if exited and self._reader is not None:
+            await self._reader
+
+        self._reader = None
+        self.metrics.stopped(str(self.index))
+
+        return exited
+
+    def write(self, data: bytes):
+        """Queue ingest bytes for this output without waiting (dropped if it is not running).
+
+        Fails the output if its queue would grow past QUEUE_LIMIT bytes.
+        """
+
+        if not self.running:
+            return
+
+        if self._queued + len(data) > AsyncOutput.QUEUE_LIMIT:
+            self.fail(f"ffmpeg fell more than {AsyncOutput.QUEUE_LIMIT} bytes behind the stream")
+            return
+
+        self._queue.append(data)
+        self._queued += len(data)
+        self._data.set()
+
+        if self._queued > AsyncOutput.QUEUE_LIMIT // 2:
+            self._space.clear()
+
+    async def wait_for_space(self):
+        """Wait until this output's queue is at most half full, or it has stopped running.
+
+        Never waits much longer than DRAIN_TIMEOUT, since the writer fails an output whose ffmpeg stops consuming.
+        """
+
+        if self.running:
+            await self._space.wait()
+
+    def _clear_queue(self):
+        self._queue.clear()
+        self._queued = 0
+
+        # Wake anything waiting for space; a stopped output doesn't take data
+        if self._space is not None:
+            self._space.set()
+
+    async def _write_input(self, proc: asyncio.subprocess.Process):
+        """Write queued input to ffmpeg, failing the output if it stops accepting it."""
+
+        while True:
+            while not self._queue:
+                self._data.clear()
+                await self._data.wait()
+
+            data = self._queue.popleft()
+            self._queued -= len(data)
+
+            if self._queued <= AsyncOutput.QUEUE_LIMIT // 2:
+                self._space.set()
+
+            try:
+                proc.stdin.write(data)
+                await asyncio.wait_for(proc.stdin.drain(), AsyncOutput.DRAIN_TIMEOUT)
+            except (BrokenPipeError, ConnectionResetError):
+                self.fail("ffmpeg stopped accepting input")
+                return
+            except asyncio.TimeoutError:
+                self.fail("ffmpeg is not consuming input")
+                return
+
+    async def _read_output(self, proc: asyncio.subprocess.Process):
+        """Parse ffmpeg output as it arrives."""
+
+        parser = ProgressParser()
+
+        while True:
+            data = await proc.stdout.read(AsyncOutput.READ_CHUNK)
+
+            if not data:
+                break
+
+            standard_out, records = parser.feed(data)
+
+            for line in standard_out:
+                self.handle_line(line)
+
+            for record in records:
+                self.handle_record(record)
+
+        for line in parser.flush():
+            self.handle_line(line)
+
+        await proc.wait()
+
+        if proc is self.proc:
+            self.fail("ffmpeg has exited unexpectedly")
+
+    def handle_line(self, line: str):
+        """Handle a single line of standard ffmpeg output."""
+
+        rule = self.on_line(line, f"output {self.index} ffmpeg", not self.health.had_status_out)
+
+        if rule is not None:
+            self.fail(rule.description or rule.name)
+
+    def handle_record(self, record: ProgressRecord):
+        """Handle a progress record from ffmpeg."""
+
+        progressed = self.health.handle_record(record)
+        self.metrics.progress(record, str(self.index))
+
+        if self.started_at is not None and record.total_size:
+            seconds = time.monotonic() - self.started_at
+            self.started_at = None
+
+            self.log.info(f"Output {self.index} wrote its first output {seconds:.2f} seconds after starting.")
+            self.metrics.start_time(seconds, str(self.index))
+
+        if self.on_record is not None:
+            self.on_record(self, record)
+
+        if progressed:
+            self.on_progress(self)
+
+    def log_health(self):
+        """Log this output's latest progress (runs every sleep_time seconds)."""
+
+        record = self.health.last_record
+
+        if self.running and record is not None:
+            self.log.debug(f"Output {self.index} total output size: {record.total_size}, speed: {record.speed}x, bitrate: {record.bitrate}kbits/s")
+
+    def check_health(self):
+        """Check this output is making progress (runs on every pass and at the watchdog deadline)."""
+
+        if not self.running:
+            return
+
+        reason = self.health.check()
+
+        if reason is not None:
+            self.fail(reason)
+
+class AsyncReStreamer():
+    """Supervise a ReStreamer pipeline with asyncio instead of threads and polling.
+
+    A pipeline is one streamlink ingest process fanned out to one ffmpeg process
+    per output; the ingest stream is read once and copied to every output. Output
+    is read and handled as it arrives, schedule transitions and health checks run
+    as timers, and SIGTERM/SIGINT stop streaming gracefully. A failed output is
+    restarted without disturbing the ingest or the other outputs, and a failed
+    pipeline is restarted in-process; both back off according to a RestartPolicy.
+    """
+
+    # Maximum length of a single line of streamlink output
+    LINE_LIMIT = 2 ** 20
+
+    # Size of each read from the ingest stream
+    PUMP_CHUNK = 2 ** 16
+
+    def __init__(self, restreamer: ReStreamer, slots: asyncio.Semaphore = None, handle_signals: bool = True):
+        """
+        Args:
+            restreamer (ReStreamer): The configured restreamer to supervise.
+            slots (asyncio.Semaphore): Shared limit on concurrently running pipelines (optional).
+            handle_signals (bool): Whether to stop gracefully on SIGTERM/SIGINT.
+        """
+
+        self.restreamer = restreamer
+        self.slots = slots
+        self.handle_signals = handle_signals
+        self.log = PipelineLogAdapter(log, {'pipeline': restreamer.name})
+        self.metrics = restreamer.metrics
+        self.restart_policy = restreamer.restart_policy
+
+        self.state = StreamingState.IDLE
+        self.ingest = None
+        self.outputs = self._make_outputs()
+        self.header = StreamHeaderCache()
+        self.ingest_meter = ThroughputMeter()
+        self.jitter: Optional[JitterBuffer] = None
+
+        self._tasks: List[asyncio.Task] = []
+        self._jitter_data: Optional[asyncio.Event] = None
+        self._jitter_space: Optional[asyncio.Event] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._gated = False
+        self._failure: Optional[str] = None
+        self._fatal: Optional[str] = None
+        self._next_health_check = 0.0
+
+    def _make_outputs(self, outputs: List[str] = None) -> List[AsyncOutput]:
+        return [
+            AsyncOutput(idx, self.restreamer.output_args(params), self.log, self.metrics, self.restart_policy.clone(), self._wakeup, self._on_output_progress, self.restreamer.output_watchdog(), self.handle_output_line, self._on_output_record)
+            for idx, params in enumerate(self.restreamer.settings.outputs if outputs is None else outputs)
+        ]
+
+    def request_stop(self):
+        """Ask the supervisor to stop streaming and return (signal handler)."""
+
+        self.log.warning("PyRestreamer received a shutdown request.")
+
+        self._stopping = True
+        self._wakeup()
+
+    def _wakeup(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def _fail(self, message: str):
+        """Record a pipeline failure; the main loop restarts the pipeline on its next pass."""
+
+        if self._failure is None:
+            self._failure = message
+
+        self._wakeup()
+
+    async def run(self):
+        """The asyncio PyReStreamer event loop."""
+
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._failure = None
+        self._fatal = None
+
+        if self.handle_signals:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, self.request_stop)
+
+            loop.add_signal_handler(signal.SIGUSR1, self.dump_progress, "requested with SIGUSR1")
+
+        # Control requests arrive on other threads
+        self.restreamer.on_change = lambda: loop.call_soon_threadsafe(self._wakeup)
+        self.restreamer.report_state(self.state)
+        self.metrics.transitions(self.restreamer.next_transition)
+
+        self.log.warning("PyRestreamer has begun monitoring for active events.")
+
+        try:
+            while not self._stopping:
+                if self._fatal is not None:
+                    raise FatalPipelineError(self._fatal)
+
+                if self._failure is not None and self.state is not StreamingState.WARMING:
+                    await self._recover()
+                    continue
+
+                expected_state = self.restreamer.expected_state()
+
+                if expected_state is not self.state:
+                    self.log.info(f"We need to transition from {self.state} to {expected_state}")
+
+                    if self.state is StreamingState.WARMING and expected_state is StreamingState.STREAMING:
+                        self._open_gate()
+                    elif self.state is StreamingState.IDLE and expected_state is StreamingState.WARMING:
+                        source_error = await loop.run_in_executor(None, self.restreamer.check_source, self.log)
+
+                        if source_error is not None:
+                            self.log.warning(f"Source is not ready for a warm start ({source_error}); trying again shortly.")
+                        else:
+                            await self._start(warm=True)
+                    elif self.state is StreamingState.IDLE:
+                        await self._start()
+                    else:
+                        await self._stop()
+
+                elif self.state is StreamingState.WARMING and self._failure is not None:
+                    # A failed warm start isn't a pipeline failure; it is simply tried again
+                    self.log.warning(f"Warm start failed ({self._failure}); trying again shortly.")
+
+                    self._failure = None
+                    await self._stop()
+                    self._wake.clear()
+
+                elif self.state is StreamingState.WARMING and self.restreamer.take_restart_request():
+                    self.log.warning("Pipeline settings changed; warming up again.")
+
+                    await self._stop()
+
+                elif self.state is StreamingState.STREAMING:
+                    await self._restart_failed_outputs()
+
+                    if loop.time() >= self._next_health_check:
+                        self._check_health()
+
+                        self._next_health_check = loop.time() + float(self.restreamer.settings.sleep_time)
+
+                    self._hold_outputs()
+
+                    for output in self.outputs:
+                        output.check_health()
+
+                    if self.restreamer.resources.due(time.monotonic()):
+                        self._check_resources()
+
+                    if self.restreamer.take_restart_request():
+                        self.log.warning("Pipeline settings changed; restarting pipeline.")
+
+                        await self._stop()
+                        await self._start()
+                        continue
+
+                    if self.restreamer.adapt(self._slowest_speed(), self.ingest_meter.idle_for(), self.log):
+                        await self._stop()
+                        await self._start()
+                        continue
+
+                timeout = self.restreamer.sleep_duration(self.state)
+
+                if self.state is StreamingState.STREAMING:
+                    timeout = min(timeout, max(self._next_health_check - loop.time(), 0.0))
+
+                    if self.restreamer.resources.enabled:
+                        timeout = min(timeout, max(self.restreamer.resources.next_sample - time.monotonic(), 0.0))
+
+                    for output in self.outputs:
+                        if output.restart_at is not None:
+                            timeout = min(timeout, max(output.restart_at - time.monotonic(), 0.0))
+                        elif output.running:
+                            timeout = min(timeout, max(output.health.deadline() - time.monotonic(), 0.0))
+
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+                self._wake.clear()
+
+        except (PipelineFailure, FatalPipelineError) as e:
+            self.dump_progress(str(e))
+            raise
+        finally:
+            if self.handle_signals:
+                for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+                    loop.remove_signal_handler(sig)
+
+            self.restreamer.on_change = None
+
+            if self.state is not StreamingState.IDLE:
+                await self._stop()
+
+    async def _recover(self):
+        """Stop a failed pipeline and wait out the restart backoff.
+
+        Raises:
+            PipelineFailure: If the pipeline could not be stopped or the circuit breaker is open.
+        """
+
+        self.log.critical(f"{self._failure}; restarting pipeline.")
+
+        if self.state is StreamingState.STREAMING:
+            await self._stop()
+
+        self._failure = None
+
+        delay = self.restart_policy.record_failure(time.monotonic())
+
+        if delay is None:
+            raise PipelineFailure(f"Pipeline failed {self.restart_policy.max_failures} times within {self.restart_policy.window:.0f} seconds")
+
+        self.metrics.restart('pipeline')
+
+        self.log.warning(f"Restarting pipeline in {delay:.1f} seconds.")
+
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+        self._wake.clear()
+
+    def dump_progress(self, reason: str):
+        """Write the pipeline's recent progress history to a file for a post-mortem."""
+
+        self.restreamer.dump_progress(reason, self.log)
+
+    def _on_output_record(self, output: AsyncOutput, record: ProgressRecord):
+        self.restreamer.recorder.record(record, self.ingest_meter.total_bytes, output.index)
+
+    def _on_output_progress(self, output: AsyncOutput):
+        """Record recovery of an output, and of the pipeline, once output grows again."""
+
+        for component, policy in ((f'output-{output.index}', output.policy), ('pipeline', self.restart_policy)):
+            time_to_recover = policy.record_recovery(time.monotonic())
+
+            if time_to_recover is not None:
+                self.log.warning(f"PyRestreamer has recovered ({component}) after {time_to_recover:.1f} seconds.")
+                self.metrics.recovered(time_to_recover, component)
+
+    async def _acquire_slot(self) -> bool:
+        """Wait for a free pipeline slot, giving up early if we are woken.
+
+        Returns:
+            bool: True if a slot was acquired (or there is no limit), false if not.
+        """
+
+        if self.slots is None:
+            return True
+
+        if self.slots.locked():
+            self.log.warning("Maximum number of concurrent pipelines reached; waiting for a free slot.")
+
+        acquire = asyncio.ensure_future(self.slots.acquire())
+        woken = asyncio.ensure_future(self._wake.wait())
+
+        await asyncio.wait([acquire, woken], timeout=self.restreamer.sleep_duration(self.state), return_when=asyncio.FIRST_COMPLETED)
+
+        woken.cancel()
+
+        if acquire.done():
+            return True
+
+        acquire.cancel()
+
+        return False
+
+    def _release_slot(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    async def _start(self, warm: bool = False):
+        """Start the ingest and all outputs.
+
+        Args:
+            warm (bool): Warm up for the next service: the ingest stream is held back from the outputs until _open_gate.
+        """
+
+        if not await self._acquire_slot():
+            return
+
+        self.log.debug("Warming up." if warm else "Starting streaming.")
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.restreamer.prepare_variant, self.log)
+
+            # Pick up output params changed by a reload
+            self.restreamer.take_restart_request()
+
+            outputs = self.restreamer.settings.outputs
+
+            if [self.restreamer.output_args(params) for params in outputs] != [output.args for output in self.outputs]:
+                self.outputs = self._make_outputs(outputs)
+
+            self._failure = None
+            self._gated = warm
+            self.header = StreamHeaderCache()
+            self.ingest_meter = ThroughputMeter()
+
+            for output in self.outputs:
+                await output.start()
+
+            if self.restreamer.in_process_ingest:
+                self.ingest = await InProcessIngest.start(self.restreamer, AsyncReStreamer.LINE_LIMIT)
+            else:
+                self.ingest = await asyncio.create_subprocess_exec(
+                    *self.restreamer.ingest_args(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                    limit=AsyncReStreamer.LINE_LIMIT
+                )
+
+            self._tasks = [
+                asyncio.ensure_future(self._pump(self.ingest)),
+                asyncio.ensure_future(self._read_ingest_log(self.ingest)),
+            ]
+
+            if self.restreamer.jitter.enabled:
+                self.jitter = JitterBuffer(self.restreamer.jitter, self.ingest_meter)
+                self._jitter_data = asyncio.Event()
+                self._jitter_space = asyncio.Event()
+                self._tasks.append(asyncio.ensure_future(self._feed(self.jitter)))
+            else:
+                self.jitter = None
+        except BaseException:
+            await self._abort_start()
+            raise
+
+        self._next_health_check = asyncio.get_running_loop().time() + float(self.restreamer.settings.sleep_time)
+        self.restreamer.resources.reset()
+
+        self.state = StreamingState.WARMING if warm else StreamingState.STREAMING
+
+        self.restreamer.report_state(self.state)
+        self.metrics.ingest(self.ingest_meter)
+        self.metrics.jitter(self.jitter)
+
+        self.log.warning("PyRestreamer is warming up for the next service." if warm else "PyRestreamer has started streaming.")
+
+    async def _abort_start(self):
+        """Undo a start that failed part way: stop whatever was started and give the slot back."""
+
+        for task in self._tasks:
+            task.cancel()
+
+        self._tasks = []
+
+        ingest = self.ingest
+        self.ingest = None
+        policy = self.restreamer.stop_policy
+
+        await asyncio.gather(
+            *([terminate_process(ingest, policy)] if ingest is not None else []),
+            *[output.stop(policy) for output in self.outputs],
+            return_exceptions=True
+        )
+
+        self._release_slot()
+
+    def _open_gate(self):
+        """Start streaming after a warm start: let the ingest stream through to the outputs."""
+
+        for output in self.outputs:
+            output.begin(self.header.header)
+
+        self._gated = False
+        self._next_health_check = asyncio.get_running_loop().time() + float(self.restreamer.settings.sleep_time)
+        self.restreamer.resources.reset()
+
+        self.state = StreamingState.STREAMING
+
+        self.restreamer.report_state(self.state)
+
+        self.log.warning(f"PyRestreamer has started streaming (warm start, {self.ingest_meter.total_bytes} bytes ingested in advance).")
+
+    async def _stop(self):
+        """Stop the ingest and all outputs."""
+
+        self.log.debug("Service ended. We should stop streaming.")
+
+        ingest = self.ingest
+        self.state = StreamingState.IDLE
+        self.ingest = None
+
+        self.restreamer.report_state(self.state)
+        self.metrics.resources({})
+        self.metrics.jitter(None)
+
+        # Stop the ingest and outputs together, so a handover waits for the slowest rather than all of them
+        policy = self.restreamer.stop_policy
+        started = time.monotonic()
+
+        ingest_result, *outputs_exited = await asyncio.gather(
+            terminate_process(ingest, policy),
+            *[output.stop(policy) for output in self.outputs]
+        )
+        exited = ingest_result.exited and all(outputs_exited)
+
+        self.metrics.stop_time(ingest_result, 'ingest')
+
+        if ingest_result.killed:
+            self.log.warning(f"Ingest did not exit within {policy.grace:g} seconds of SIGTERM; killed it.")
+
+        self._release_slot()
+
+        if not exited:
+            raise PipelineFailure("Did not exit streaming state as expected (ffmpeg still running?)")
+
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+
+        self.log.info(f"Pipeline stopped in {time.monotonic() - started:.2f} seconds.")
+        self.log.warning("PyRestreamer has stopped streaming.")
+
+    def _check_health(self):
+        """Check the ingest and every output are making progress."""
+
+        self.log.debug("We are currently streaming. Checking output to verify state.")
+
+        ingest_idle = self.ingest_meter.idle_for()
+
+        self.log.debug(f"Ingest rate: {self.ingest_meter.rate():.0f} B/s, idle for {ingest_idle:.1f}s, stalls: {self.ingest_meter.stalls}")
+
+        if ingest_idle >= self.restreamer.ingest_stall_timeout():
+            self.log.critical(f"Source seems to be stalled; no ingest data for {ingest_idle:.0f} seconds.")
+            self._fail("Source seems to be stalled")
+            return
+
+        if self.jitter is not None:
+            self.log.debug(f"Jitter buffer: {self.jitter.used} bytes ({self.jitter.fill_seconds():.1f}s), {self.jitter.state}, drained {self.jitter.drains} times")
+
+        for output in self.outputs:
+            output.log_health()
+
+    def _hold_outputs(self):
+        """Pause the outputs' watchdogs while the jitter buffer refills, since their input is held back on purpose."""
+
+        if self.jitter is None:
+            return
+
+        held_seconds = self.jitter.held_seconds()
+
+        for output in self.outputs:
+            output.health.watchdog.hold(self.jitter.refilling, held_seconds)
+
+    def _slowest_speed(self) -> Optional[float]:
+        """Get the lowest latest encoder speed of the running outputs (None if none has reported one)."""
+
+        speeds = [
+            output.health.last_record.speed for output in self.outputs
+            if output.running and output.health.last_record is not None and output.health.last_record.speed is not None
+        ]
+
+        return min(speeds) if speeds else None
+
+    def _check_resources(self):
+        """Sample the ingest's and every output's process group, restarting whichever breaches its resource limits."""
+
+        groups = {} if isinstance(self.ingest, InProcessIngest) else {self.ingest.pid: 'ingest'}
+
+        for output in self.outputs:
+            if output.running:
+                groups[output.proc.pid] = f'output-{output.index}'
+
+        breach = self.restreamer.sample_resources(groups, self.log)
+
+        if breach is None:
+            return
+
+        component, reason = breach
+        label = component.split('/', 1)[0]
+
+        if label.startswith('output-'):
+            self.outputs[int(label[len('output-'):])].fail(f"Resource limit exceeded; {reason}")
+        else:
+            self._fail(f"Resource limit exceeded; {reason}")
+
+    async def _restart_failed_outputs(self):
+        """Restart failed outputs after their backoff, without touching the ingest or other outputs."""
+
+        for output in self.outputs:
+            if output.failure is None:
+                continue
+
+            now = time.monotonic()
+
+            if output.restart_at is None:
+                if not await output.stop(self.restreamer.stop_policy):
+                    raise PipelineFailure(f"Output {output.index} did not exit as expected (ffmpeg still running?)")
+
+                delay = output.policy.record_failure(now)
+
+                if delay is None:
+                    output.policy.reset()
+                    self._fail(f"Output {output.index} keeps failing")
+                    return
+
+                output.restart_at = now + delay
+
+                self.log.warning(f"Restarting output {output.index} in {delay:.1f} seconds ({output.failure}).")
+
+            if now >= output.restart_at:
+                output.restarts += 1
+                self.metrics.restart(f'output-{output.index}')
+
+                await output.start(self.header.header)
+
+    async def _pump(self, ingest: asyncio.subprocess.Process):
+        """Copy the ingest stream to every running output."""
+
+        while True:
+            data = await ingest.stdout.read(AsyncReStreamer.PUMP_CHUNK)
+
+            if not data:
+                break
+
+            self.ingest_meter.record(len(data))
+            self.header.feed(data)
+
+            # Warming up: keep the ingest at the live edge without feeding the outputs
+            if self._gated:
+                continue
+
+            if self.jitter is not None:
+                await self._buffer(self.jitter, data)
+                continue
+
+            # Never wait on the outputs here: each has its own queue, and one that falls too far behind is restarted
+            for output in self.outputs:
+                output.write(data)
+
+        if self.jitter is not None:
+            self.jitter.finish()
+            self._jitter_data.set()
+
+        await ingest.wait()
+
+        if ingest is self.ingest:
+            self._fail("streamlink has exited unexpectedly")
+
+    async def _buffer(self, jitter: JitterBuffer, data: bytes):
+        """Put ingest data into the jitter buffer, waiting for space if it is full."""
+
+        view = memoryview(data)
+
+        while view:
+            accepted = jitter.put(view)
+            view = view[accepted:]
+            self._jitter_data.set()
+
+            if view:
+                self._jitter_space.clear()
+                await self._jitter_space.wait()
+
+    async def _feed(self, jitter: JitterBuffer):
+        """Copy the jitter buffer to every running output as it releases data."""
+
+        while True:
+            # The buffer holds the stream while the outputs catch up; a stuck output fails within DRAIN_TIMEOUT
+            await asyncio.gather(*[output.wait_for_space() for output in self.outputs])
+
+            refilling = jitter.refilling
+            data = jitter.take(AsyncReStreamer.PUMP_CHUNK)
+
+            if jitter.refilling != refilling:
+                self._hold_outputs()
+                self._wake.set()
+
+            if jitter.failed:
+                self._fail("Jitter buffer drained")
+
+            if data:
+                self._jitter_space.set()
+
+                for output in self.outputs:
+                    output.write(data)
+
+                continue
+
+            if jitter.finished and jitter.used == 0:
+                break
+
+            ready_at = jitter.ready_at()
+            self._jitter_data.clear()
+
+            try:
+                await asyncio.wait_for(self._jitter_data.wait(), max(ready_at - time.monotonic(), 0.01) if ready_at else None)
+            except asyncio.TimeoutError:
+                pass
+
+        jitter.close()
+
+    async def _read_ingest_log(self, ingest: asyncio.subprocess.Process):
+        """Handle streamlink log output line by line as it arrives."""
+
+        while True:
+            try:
+                line = await ingest.stderr.readline()
+            except ValueError:
+                self.log.warning("Discarding overlong line of streamlink proc output.")
+                continue
+
+            if not line:
+                break
+
+            self.handle_ingest_line(line.decode('utf-8', errors='replace').strip())
+
+    def handle_ingest_line(self, line: str):
+        """Handle a single line of streamlink output."""
+
+        rule = self.handle_output_line(line, 'streamlink')
+
+        if rule is not None:
+            self._fail(rule.description or rule.name)
+
+    def handle_output_line(self, line: str, source: str, expected: bool = True) -> Optional[Rule]:
+        """Classify a line of streamlink/ffmpeg output.
+
+        A line matching a fatal rule stops the supervisor without restarting.
+
+        Returns:
+            Rule: The matching rule if the process that output the line must restart, otherwise None.
+        """
+
+        rule = self.restreamer.handle_output_line(line, source, expected, self.log)
+
+        if rule is not None and rule.action is Action.FATAL:
+            self._fatal = rule.description or rule.name
+            self._wakeup()
+
+            return None
+
+        return rule
+
+class MultiSupervisor():
+    """Supervise many restreaming pipelines from a single process.
+
+    Each pipeline has its own schedule and state; a shared semaphore caps the
+    number of ffmpeg pipelines that may run at the same time. Pipelines restart
+    themselves in-process; one whose circuit breaker opens is paused for the
+    breaker window and then resumed, without disturbing the others.
+    """
+
+    def __init__(self, restreamers: List[ReStreamer], max_concurrent: int = 0):
+        """
+        Args:
+            restreamers (List[ReStreamer]): The configured restreamers to supervise.
+            max_concurrent (int): Maximum number of concurrently running pipelines (0 for no limit).
+        """
+
+        self.restreamers = restreamers
+        self.max_concurrent = max_concurrent
+        self.supervisors: Dict[str, AsyncReStreamer] = {}
+
+        self._stopping: Optional[asyncio.Event] = None
+
+    def request_stop(self):
+        """Stop all pipelines and return (signal handler)."""
+
+        log.warning("PyRestreamer received a shutdown request.")
+
+        self._stopping.set()
+
+        for supervisor in self.supervisors.values():
+            supervisor.request_stop()
+
+    async def run(self):
+        """Run all pipelines until asked to stop."""
+
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+
+        slots = asyncio.Semaphore(self.max_concurrent) if self.max_concurrent > 0 else None
+
+        for rs in self.restreamers:
+            self.supervisors[rs.name] = AsyncReStreamer(rs, slots, handle_signals=False)
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.request_stop)
+
+        loop.add_signal_handler(signal.SIGUSR1, self.dump_progress)
+
+        log.warning(f"PyRestreamer is supervising {len(self.supervisors)} pipelines.")
+
+        try:
+            await asyncio.gather(*[self._supervise(supervisor) for supervisor in self.supervisors.values()])
+        finally:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+                loop.remove_signal_handler(sig)
+
+    def dump_progress(self):
+        """Write every pipeline's recent progress history to a file (signal handler)."""
+
+        for supervisor in self.supervisors.values():
+            supervisor.dump_progress("requested with SIGUSR1")
+
+    async def _supervise(self, supervisor: AsyncReStreamer):
+        """Run one pipeline, restarting it if it fails."""
+
+        while not self._stopping.is_set():
+            try:
+                await supervisor.run()
+            except FatalPipelineError as e:
+                supervisor.log.critical(f"Pipeline hit a fatal error; stopping it: {e}")
+                return
+            except PipelineFailure as e:
+                supervisor.log.critical(f"Pipeline failed; pausing it for {supervisor.restart_policy.window:.0f} seconds: {e}")
+            except Exception as e:
+                supervisor.log.critical(f"Unexpected error running pipeline; pausing it for {supervisor.restart_policy.window:.0f} seconds: {e}")
+            else:
+                return
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), supervisor.restart_policy.window)
+            except asyncio.TimeoutError:
+                pass
+
+            supervisor.restart_policy.reset()
@@ -0,0 +1,164 @@
+"""Benchmark FFMPEG_PARAMS variations on this host and recommend the cheapest that keeps up."""
+
+import os
+import time
+import shlex
+import resource
+import itertools
+import subprocess
+
+from typing import List, NamedTuple, Optional, Sequence
+
+from pyrestreamer.progress import ProgressParser
+
+# Video encoders that understand -preset
+PRESET_ENCODERS = ('libx264', 'libx265', 'h264_nvenc', 'hevc_nvenc')
+
+class TuneCandidate(NamedTuple):
+    """A variation of the output parameters to benchmark."""
+
+    label: str
+    params: List[str]
+
+class TuneResult(NamedTuple):
+    """How a candidate performed."""
+
+    label: str
+    params: str
+    speed: Optional[float]
+    cpu_percent: float
+    cores_per_stream: Optional[float]
+    bitrate_kbps: Optional[float]
+    returncode: int
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and self.speed is not None
+
+def option_value(params: List[str], *names: str) -> Optional[str]:
+    """Get the value of the last of the given options in an argument list."""
+
+    value = None
+
+    for idx, arg in enumerate(params[:-1]):
+        if arg in names:
+            value = params[idx + 1]
+
+    return value
+
+def set_option(params: List[str], name: str, value: str) -> List[str]:
+    """Set an output option, replacing it if present and otherwise adding it before the destination."""
+
+    params = list(params)
+
+    for idx, arg in enumerate(params[:-1]):
+        if arg == name:
+            params[idx + 1] = value
+            return params
+
+    return params[:-1] + [name, value] + params[-1:]
+
+def build_candidates(ffmpeg_params: str, threads: Sequence[int], presets: Sequence[str]) -> List[TuneCandidate]:
+    """Build the parameter sweep.
+
+    Every thread count is tried with every preset, if the video encoder takes
+    presets; the destination is replaced so nothing is published.
+
+    Args:
+        ffmpeg_params (str): The configured output parameters (ending with the destination).
+        threads (Sequence[int]): Thread counts to try (0 lets ffmpeg choose).
+        presets (Sequence[str]): Encoder presets to try.
+
+    Returns:
+        List[TuneCandidate]: The candidates.
+    """
+
+    params = shlex.split(ffmpeg_params)[:-1] + [os.devnull]
+    encoder = option_value(params, '-c:v', '-vcodec', '-codec:v')
+    presets = list(presets) if encoder in PRESET_ENCODERS and '-vn' not in params else [None]
+
+    candidates = []
+
+    for thread_count, preset in itertools.product(threads, presets):
+        candidate = set_option(params, '-threads', str(thread_count))
+        label = f"threads={thread_count}"
+
+        if preset is not None:
+            candidate = set_option(candidate, '-preset', preset)
+            label += f" preset={preset}"
+
+        candidates.append(TuneCandidate(label, candidate))
+
+    return candidates
+
+def input_args(sample: str = None, size: str = '1280x720', rate: int = 30) -> List[str]:
+    """Get ffmpeg input arguments for a sample file, or a generated test pattern and tone."""
+
+    if sample is not None:
+        return ['-stream_loop', '-1', '-i', sample]
+
+    return [
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}',
+        '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=48000',
+    ]
+
+def run_candidate(candidate: TuneCandidate, source_args: List[str], duration: float, ffmpeg: str = 'ffmpeg') -> TuneResult:
+    """Encode duration seconds of the source as fast as possible with a candidate's parameters.
+
+    Args:
+        candidate (TuneCandidate): The candidate.
+        source_args (List[str]): ffmpeg input arguments.
+        duration (float): Seconds of media to encode.
+        ffmpeg (str): The ffmpeg executable.
+
+    Returns:
+        TuneResult: Speed, CPU and bitrate of the encode.
+    """
+
+    args = [ffmpeg, '-hide_banner', '-nostats', '-progress', '-', '-y'] + source_args + ['-t', str(duration)] + candidate.params
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.monotonic()
+
+    proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+
+    wall = time.monotonic() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+
+    _, records = ProgressParser().feed(proc.stdout)
+    last = records[-1] if records else None
+    media_seconds = last.out_time_us / 1000000 if last is not None and last.out_time_us else None
+
+    bitrate = None
+
+    if last is not None and last.total_size and media_seconds:
+        bitrate = last.total_size * 8 / media_seconds / 1000
+
+    return TuneResult(
+        candidate.label,
+        ' '.join(shlex.quote(arg) for arg in candidate.params[:-1]),
+        media_seconds / wall if media_seconds and wall > 0 else None,
+        100.0 * cpu / wall if wall > 0 else 0.0,
+        cpu / media_seconds if media_seconds else None,
+        bitrate,
+        proc.returncode
+    )
+
+def recommend(results: Sequence[TuneResult], margin: float) -> Optional[TuneResult]:
+    """Pick the candidate using the least CPU per stream that still runs at least 1 + margin times realtime."""
+
+    passing = [result for result in results if result.ok and result.speed >= 1.0 + margin and result.cores_per_stream is not None]
+
+    return min(passing, key=lambda result: result.cores_per_stream) if passing else None
+
+def format_result(result: TuneResult) -> str:
+    """Format a result as a report line."""
+
+    if not result.ok:
+        return f"{result.label:<32} failed (exit code {result.returncode})"
+
+    cores = f"{result.cores_per_stream:.2f}" if result.cores_per_stream is not None else '?'
+    bitrate = f"{result.bitrate_kbps:.0f}" if result.bitrate_kbps is not None else '?'
+
+    return f"{result.label:<32} speed {result.speed:6.2f}x  CPU {result.cpu_percent:6.1f}%  {cores} cores/stream  {bitrate} kbit/s"
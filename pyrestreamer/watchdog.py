@@ -0,0 +1,169 @@
+"""Wall-clock stall detection for ffmpeg outputs."""
+
+from typing import Optional
+
+from pyrestreamer.progress import ProgressRecord
+
+class StallWatchdog():
+    """Detect a frozen or degraded output from its progress records.
+
+    Unlike counting health check intervals, every check is against wall-clock
+    deadlines, so a stall is caught within progress_timeout seconds however
+    often the supervisor polls. An output is considered stalled when:
+
+    - it reports no progress (growing total_size or out_time_us) for progress_timeout
+      seconds, or startup_timeout seconds after starting;
+    - encoder speed stays below min_speed for slow_window seconds; or
+    - out_time_us falls more than max_drift seconds behind wall time.
+
+    Time the output is held back on purpose (while a jitter buffer refills) is
+    not counted against any of these; see hold.
+    """
+
+    def __init__(self, progress_timeout: float = 10.0, startup_timeout: float = 30.0, min_speed: float = 0.9, slow_window: float = 30.0, max_drift: float = 30.0):
+        """
+        Args:
+            progress_timeout (float): Seconds without progress before the output is stalled.
+            startup_timeout (float): Seconds after starting allowed for the first progress.
+            min_speed (float): Encoder speed below which the output is too slow (0 to disable).
+            slow_window (float): Seconds the speed must stay below min_speed.
+            max_drift (float): Seconds out_time_us may lag wall time (0 to disable).
+        """
+
+        self.progress_timeout = progress_timeout
+        self.startup_timeout = startup_timeout
+        self.min_speed = min_speed
+        self.slow_window = slow_window
+        self.max_drift = max_drift
+
+        self.start(0.0)
+
+    def clone(self) -> 'StallWatchdog':
+        """Get a fresh watchdog with the same thresholds."""
+
+        return StallWatchdog(self.progress_timeout, self.startup_timeout, self.min_speed, self.slow_window, self.max_drift)
+
+    def start(self, now: float):
+        """Reset for a newly started output.
+
+        Args:
+            now (float): Monotonic time the output started.
+        """
+
+        self.started = now
+        self.last_progress: Optional[float] = None
+        self.slow_since: Optional[float] = None
+        self.drift = 0.0
+
+        self.held = False
+
+        self._total_size = -1
+        self._out_time_us = -1
+        self._anchor: Optional[tuple] = None
+        self._held_seconds: Optional[float] = None
+
+    def hold(self, held: bool, held_seconds: float):
+        """Exempt time the output is held back from the deadlines.
+
+        Args:
+            held (bool): Whether the output is being held back now.
+            held_seconds (float): Total time it has been held back so far; deadlines move out by any increase since the last call.
+        """
+
+        if self._held_seconds is not None and held_seconds > self._held_seconds:
+            shift = held_seconds - self._held_seconds
+
+            self.started += shift
+
+            if self.last_progress is not None:
+                self.last_progress += shift
+
+            if self.slow_since is not None:
+                self.slow_since += shift
+
+            if self._anchor is not None:
+                self._anchor = (self._anchor[0] + shift, self._anchor[1])
+
+        self.held = held
+        self._held_seconds = held_seconds
+
+    def observe(self, record: ProgressRecord, now: float) -> bool:
+        """Observe a progress record.
+
+        Args:
+            record (ProgressRecord): The progress record.
+            now (float): Monotonic time the record arrived.
+
+        Returns:
+            bool: True if the record shows progress.
+        """
+
+        progressed = False
+
+        if record.total_size is not None and record.total_size > self._total_size:
+            self._total_size = record.total_size
+            progressed = True
+
+        if record.out_time_us is not None and record.out_time_us > self._out_time_us:
+            self._out_time_us = record.out_time_us
+            progressed = True
+
+            if self._anchor is None:
+                self._anchor = (now, record.out_time_us)
+
+            self.drift = (now - self._anchor[0]) - (record.out_time_us - self._anchor[1]) / 1000000
+
+        if progressed:
+            self.last_progress = now
+
+        if record.speed is not None and self.min_speed > 0 and not self.held:
+            if record.speed < self.min_speed:
+                if self.slow_since is None:
+                    self.slow_since = now
+            else:
+                self.slow_since = None
+
+        return progressed
+
+    def deadline(self) -> float:
+        """Get the monotonic time at which the output stalls if nothing else happens (never while it is held back)."""
+
+        if self.held:
+            return float('inf')
+
+        if self.last_progress is None:
+            deadline = self.started + self.startup_timeout
+        else:
+            deadline = self.last_progress + self.progress_timeout
+
+        if self.slow_since is not None:
+            deadline = min(deadline, self.slow_since + self.slow_window)
+
+        return deadline
+
+    def check(self, now: float) -> Optional[str]:
+        """Check whether the output has stalled.
+
+        Args:
+            now (float): Current monotonic time.
+
+        Returns:
+            str: Why the output is considered stalled, or None if it is healthy.
+        """
+
+        if self.held:
+            return None
+
+        if self.last_progress is None:
+            if now - self.started >= self.startup_timeout:
+                return f"No progress from ffmpeg within {self.startup_timeout:.0f} seconds of starting"
+        elif now - self.last_progress >= self.progress_timeout:
+            return f"No progress from ffmpeg for {now - self.last_progress:.1f} seconds"
+
+        if self.slow_since is not None and now - self.slow_since >= self.slow_window:
+            return f"Encoder speed below {self.min_speed}x for {now - self.slow_since:.0f} seconds"
+
+        if self.max_drift > 0 and self.drift > self.max_drift:
+            return f"Output is {self.drift:.1f} seconds behind realtime"
+
+        return None
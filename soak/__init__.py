@@ -0,0 +1 @@
+"""End-to-end soak tests for pyrestreamer against a local origin and RTMP sink."""
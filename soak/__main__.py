@@ -0,0 +1,65 @@
+"""Soak pyrestreamer end to end and write a JSON report.
+
+Usage: python -m soak [--format hls|dash] [--duration 3h] [--faults delay@10m+30s=4,...] [--output report.json] [--baseline old.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+
+from benchmarks.harness import compare, dump
+from soak.harness import DEFAULT_FFMPEG_PARAMS, run_soak
+from soak.origin import MANIFESTS, parse_faults, parse_seconds
+from pyrestreamer.config import configure_logging
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m soak', description="Soak pyrestreamer against a local DASH/HLS origin with injected faults and a local RTMP sink (needs ffmpeg and streamlink).")
+    parser.add_argument('--format', choices=list(MANIFESTS), default='hls', help="Format the origin serves.")
+    parser.add_argument('--duration', type=parse_seconds, default=parse_seconds('1h'), help="How long to soak for, in seconds or with an m or h suffix.")
+    parser.add_argument('--faults', default='', help="Comma separated faults as kind@start+duration[=value] (kind: delay, 404 or outage), e.g. delay@10m+30s=4,404@20m+20s=0.5,outage@30m+1m.")
+    parser.add_argument('--repeat', type=parse_seconds, help="Repeat the faults this often.")
+    parser.add_argument('--engine', default='thread', help="pyrestreamer's ENGINE.")
+    parser.add_argument('--ffmpeg-params', default=DEFAULT_FFMPEG_PARAMS, help="pyrestreamer's FFMPEG_PARAMS; {sink} stands for the sink's RTMP URL.")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="Another pyrestreamer setting (may be repeated).")
+    parser.add_argument('--gap', type=float, default=1.0, help="Seconds without output that count as a gap.")
+    parser.add_argument('--sample-interval', type=parse_seconds, default=30.0, help="How often to sample pyrestreamer's CPU and memory and log progress.")
+    parser.add_argument('--workdir', help="Where to put the origin's segments and pyrestreamer's log (default: a new temporary directory).")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+    parser.add_argument('--baseline', help="Compare against this report; exit 1 if any metric regressed.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Fraction a metric may get worse by before it is a regression.")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    configure_logging(os.getenv('LOG_CONFIG') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.yml'))
+
+    try:
+        faults = parse_faults(args.faults)
+        env = dict(setting.split('=', 1) for setting in args.env)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    report = run_soak(
+        args.format, args.duration, faults, args.repeat, engine=args.engine, ffmpeg_params=args.ffmpeg_params, env=env,
+        gap_threshold=args.gap, sample_interval=args.sample_interval, workdir=args.workdir,
+    )
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fh:
+            regressions = compare(report, json.load(fh), args.tolerance)
+
+        report['regressions'] = regressions
+
+    dump(report, args.output)
+
+    if args.baseline and report['regressions']:
+        for regression in report['regressions']:
+            sys.stderr.write(f"Regression: {regression}\n")
+
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
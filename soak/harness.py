@@ -0,0 +1,237 @@
+"""Soak the real pyrestreamer against a local origin with injected faults and a local RTMP sink."""
+
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import datetime
+import platform
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.harness import ALWAYS, metric, git_revision
+from pyrestreamer.resources import CLOCK_TICKS, read_process
+from pyrestreamer.shutdown import stop_group
+from soak.origin import MANIFESTS, Fault, FaultPlan, OriginServer, start_encoder
+from soak.sink import ContinuityTracker, RtmpSink, fault_recovery
+
+log = logging.getLogger("pyrestreamer")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+RUN = os.path.join(ROOT, 'run.py')
+
+# Copy the origin's stream to the sink as is, so any discontinuity comes from the pipeline
+DEFAULT_FFMPEG_PARAMS = "-c copy -f flv {sink}"
+
+def free_port() -> int:
+    """Find a free TCP port on localhost."""
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def cpu_usage(samples: List[Tuple[float, int, int]]) -> dict:
+    """Summarize samples of a process's CPU time and memory.
+
+    Args:
+        samples (List[Tuple[float, int, int]]): Monotonic time, CPU ticks and RSS bytes, oldest first.
+
+    Returns:
+        dict: Mean and peak CPU (100 is one core), and RSS at the end, at its peak and its growth per hour.
+    """
+
+    if len(samples) < 2:
+        raise ValueError("At least two samples are needed")
+
+    intervals = [
+        (ticks - previous_ticks) / CLOCK_TICKS / (now - previous_now) * 100
+        for (previous_now, previous_ticks, _), (now, ticks, _) in zip(samples, samples[1:])
+        if now > previous_now
+    ]
+
+    hours = (samples[-1][0] - samples[0][0]) / 3600
+
+    return {
+        'cpu_percent': (samples[-1][1] - samples[0][1]) / CLOCK_TICKS / (hours * 3600) * 100,
+        'cpu_max_percent': max(intervals),
+        'rss_mb': samples[-1][2] / 1048576,
+        'rss_max_mb': max(sample[2] for sample in samples) / 1048576,
+        'rss_growth_mb_per_hour': (samples[-1][2] - samples[0][2]) / 1048576 / hours,
+    }
+
+def scrape(url: str) -> Dict[str, float]:
+    """Read a Prometheus text endpoint, totalling each metric over its labels."""
+
+    totals: Dict[str, float] = {}
+
+    with urllib.request.urlopen(url, timeout=5) as response:
+        for line in response.read().decode('utf-8').splitlines():
+            if not line or line.startswith('#'):
+                continue
+
+            name = line.split('{', 1)[0].split(' ', 1)[0]
+            totals[name] = totals.get(name, 0.0) + float(line.rsplit(' ', 1)[-1])
+
+    return totals
+
+def stop_supervisor(proc: subprocess.Popen, timeout: float = 30.0):
+    """Stop pyrestreamer with SIGTERM, as a container runtime would, killing it if it takes too long."""
+
+    proc.send_signal(signal.SIGTERM)
+
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        log.error(f"pyrestreamer did not stop within {timeout}s of SIGTERM; killing it")
+        proc.kill()
+        proc.wait()
+
+def run_soak(fmt: str = 'hls', seconds: float = 3600, faults: List[Fault] = None, period: float = None, engine: str = 'thread',
+             ffmpeg_params: str = DEFAULT_FFMPEG_PARAMS, env: Dict[str, str] = None, gap_threshold: float = 1.0, settle: float = 60.0,
+             sample_interval: float = 30.0, workdir: Optional[str] = None, ffmpeg: str = 'ffmpeg') -> dict:
+    """Run pyrestreamer (as run.py, with an always-on schedule) against a local origin and sink, and build a report.
+
+    Args:
+        fmt (str): "hls" or "dash".
+        seconds (float): How long to run for.
+        faults (List[Fault]): Faults for the origin to inject, timed from when pyrestreamer starts.
+        period (float): Repeat the faults this often (seconds); None runs them once.
+        engine (str): pyrestreamer's ENGINE.
+        ffmpeg_params (str): pyrestreamer's FFMPEG_PARAMS, with {sink} standing for the sink's RTMP URL.
+        env (Dict[str, str]): More settings for pyrestreamer, overriding the soak's.
+        gap_threshold (float): Seconds without output that count as a gap.
+        settle (float): Seconds after a fault ends that gaps are still blamed on it.
+        sample_interval (float): How often to sample pyrestreamer's CPU and memory and log progress (seconds).
+        workdir (str): Where to put the origin's segments and pyrestreamer's log (a new temporary directory if None).
+        ffmpeg (str): The ffmpeg used for the origin and sink.
+
+    Raises:
+        RuntimeError: If pyrestreamer exits or the sink receives nothing.
+
+    Returns:
+        dict: The report.
+    """
+
+    workdir = workdir or tempfile.mkdtemp(prefix='pyrestreamer-soak-')
+    media = os.path.join(workdir, 'origin')
+    log_path = os.path.join(workdir, 'pyrestreamer.log')
+    os.makedirs(media, exist_ok=True)
+
+    plan = FaultPlan(faults or [], period)
+    tracker = ContinuityTracker(gap_threshold)
+    sink = RtmpSink(tracker, free_port(), ffmpeg)
+    metrics_url = f"127.0.0.1:{free_port()}"
+
+    encoder = start_encoder(fmt, media, ffmpeg)
+    origin = OriginServer(media, plan)
+    origin.start()
+    sink.start()
+
+    settings = dict(
+        os.environ,
+        LOG_CONFIG=os.path.join(HERE, 'logging.yml'),
+        SERVICE_TIMES=ALWAYS,
+        SERVICE_BUFFER='0',
+        SLEEP_TIME='5',
+        PYTZ_TIMEZONE='UTC',
+        INPUT_URL=origin.url(MANIFESTS[fmt]),
+        FFMPEG_PARAMS=ffmpeg_params.format(sink=sink.url),
+        ENGINE=engine,
+        METRICS_ADDRESS=metrics_url,
+    )
+    settings.update(env or {})
+
+    samples: List[Tuple[float, int, int]] = []
+    started = time.monotonic()
+    origin.started = started
+
+    with open(log_path, 'w') as fh:
+        supervisor = subprocess.Popen([sys.executable, RUN], cwd=ROOT, env=settings, stdin=subprocess.DEVNULL, stdout=fh, stderr=subprocess.STDOUT)
+
+    log.warning(f"Soaking pyrestreamer (pid {supervisor.pid}) for {seconds}s; its log is {log_path}")
+
+    try:
+        while True:
+            now = time.monotonic()
+
+            if supervisor.poll() is not None:
+                raise RuntimeError(f"pyrestreamer exited with code {supervisor.returncode}; see {log_path}")
+
+            sample = read_process(supervisor.pid)
+
+            if sample is not None:
+                samples.append((now, sample.cpu_ticks, sample.rss_bytes))
+
+            with sink.lock:
+                progress = tracker.summary()
+
+            log.warning(
+                f"Soak {now - started:.0f}/{seconds:.0f}s: {progress['packets']} packets, {progress['gaps']} gaps "
+                f"({progress['gap_seconds']:.1f}s), {progress['reconnects']} reconnects, {progress['timestamp_jumps']} timestamp jumps"
+            )
+
+            if now - started >= seconds:
+                break
+
+            time.sleep(min(sample_interval, started + seconds - now))
+
+        counters = scrape(f"http://{metrics_url}/metrics")
+    finally:
+        stop_supervisor(supervisor)
+        sink.stop()
+        origin.shutdown()
+        origin.server_close()
+        stop_group(encoder.pid, [encoder])
+
+    with sink.lock:
+        tracker.finish(started + seconds)
+        continuity = tracker.summary()
+        gaps = list(tracker.gaps)
+
+    if tracker.first is None:
+        raise RuntimeError(f"The sink received no output; see {log_path}")
+
+    impact = fault_recovery(plan.windows(seconds), gaps, started, settle)
+    recoveries = [fault['recovery_seconds'] for fault in impact if fault['interrupted']]
+    usage = cpu_usage(samples)
+
+    results = {
+        'startup_latency_seconds': metric(tracker.first - started, 's', 'lower'),
+        'gaps': metric(continuity['gaps'], 'gaps', 'lower'),
+        'gap_seconds': metric(continuity['gap_seconds'], 's', 'lower'),
+        'longest_gap_seconds': metric(continuity['longest_gap_seconds'], 's', 'lower'),
+        'reconnects': metric(continuity['reconnects'], 'reconnects', 'lower'),
+        'timestamp_jumps': metric(continuity['timestamp_jumps'], 'jumps', 'lower'),
+        'delivered_ratio': metric(continuity['delivered_ratio'], 'ratio', 'higher'),
+        'faults_interrupting_output': metric(len(recoveries), 'faults', 'lower'),
+        'recovery_mean_seconds': metric(statistics.mean(recoveries) if recoveries else 0.0, 's', 'lower'),
+        'recovery_max_seconds': metric(max(recoveries, default=0.0), 's', 'lower'),
+        'pipeline_restarts': metric(counters.get('pyrestreamer_pipeline_restarts_total', 0.0), 'restarts', 'lower'),
+        'supervisor_cpu_percent': metric(usage['cpu_percent'], '%', 'lower'),
+        'supervisor_cpu_max_percent': metric(usage['cpu_max_percent'], '%', 'lower'),
+        'supervisor_rss_mb': metric(usage['rss_mb'], 'MB', 'lower'),
+        'supervisor_rss_growth_mb_per_hour': metric(usage['rss_growth_mb_per_hour'], 'MB/h', 'lower'),
+    }
+
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'format': fmt,
+        'engine': engine,
+        'seconds': seconds,
+        'workdir': workdir,
+        'origin_requests': dict(origin.counts),
+        'faults': impact,
+        'output_gaps': [{'start': gap.start - started, 'seconds': gap.seconds} for gap in gaps],
+        'results': {'soak': results},
+    }
@@ -0,0 +1,248 @@
+"""A local DASH/HLS origin: ffmpeg generates a live stream and an HTTP server serves it with injected faults."""
+
+import os
+import time
+import random
+import logging
+import threading
+import subprocess
+import http.server
+
+from typing import Dict, List, NamedTuple, Optional
+
+log = logging.getLogger("pyrestreamer")
+
+# Kinds of fault the origin can inject
+FAULT_KINDS = ('delay', '404', 'outage')
+
+# Manifest names by format
+MANIFESTS = {'hls': 'stream.m3u8', 'dash': 'stream.mpd'}
+
+class Fault(NamedTuple):
+    """A window in which the origin misbehaves.
+
+    Delays hold each segment request for value seconds; 404s fail each segment
+    request with probability value (1 if not given); outages drop every request,
+    manifests included, without a response.
+    """
+
+    kind: str
+    start: float
+    duration: float
+    value: float = 0.0
+
+    def is_active(self, elapsed: float) -> bool:
+        return self.start <= elapsed < self.start + self.duration
+
+def parse_seconds(text: str) -> float:
+    """Parse a duration in seconds, with an optional s, m or h suffix (e.g. "90", "20m", "3h")."""
+
+    text = text.strip()
+    scale = {'s': 1, 'm': 60, 'h': 3600}.get(text[-1:].lower())
+
+    if scale is not None:
+        text = text[:-1]
+
+    return float(text) * (scale or 1)
+
+def parse_faults(spec: Optional[str]) -> List[Fault]:
+    """Parse a fault plan.
+
+    Args:
+        spec (str): Comma separated faults as kind@start+duration[=value], with times as in parse_seconds,
+            e.g. "delay@10m+30s=4,404@20m+20s=0.5,outage@30m+1m".
+
+    Raises:
+        ValueError: If a fault is malformed.
+
+    Returns:
+        List[Fault]: The faults, ordered by start.
+    """
+
+    faults = []
+
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+
+        if not entry:
+            continue
+
+        kind, at, rest = entry.partition('@')
+        window, _, value = rest.partition('=')
+        start, plus, duration = window.partition('+')
+
+        if not at or not plus or kind not in FAULT_KINDS:
+            raise ValueError(f"Invalid fault {entry!r}: expected kind@start+duration[=value] with kind one of {', '.join(FAULT_KINDS)}")
+
+        fault = Fault(kind, parse_seconds(start), parse_seconds(duration), float(value) if value else 0.0)
+
+        if fault.duration <= 0:
+            raise ValueError(f"Invalid fault {entry!r}: the duration must be positive")
+
+        faults.append(fault)
+
+    return sorted(faults, key=lambda fault: fault.start)
+
+class FaultPlan():
+    """Which faults are active when, optionally repeating every period seconds."""
+
+    def __init__(self, faults: List[Fault], period: float = None):
+        """
+        Args:
+            faults (List[Fault]): The faults, timed from the start of the run.
+            period (float): Repeat the plan this often (seconds); None runs it once.
+        """
+
+        if period is not None and faults and period < max(fault.start + fault.duration for fault in faults):
+            raise ValueError(f"The fault plan repeats every {period}s but its faults run for longer")
+
+        self.faults = faults
+        self.period = period
+
+    def active(self, elapsed: float) -> List[Fault]:
+        """Faults active at elapsed seconds into the run."""
+
+        if self.period:
+            elapsed %= self.period
+
+        return [fault for fault in self.faults if fault.is_active(elapsed)]
+
+    def windows(self, seconds: float) -> List[Fault]:
+        """Every fault occurrence in the first seconds of the run, with absolute start times."""
+
+        if not self.period:
+            return [fault for fault in self.faults if fault.start < seconds]
+
+        windows = []
+        offset = 0.0
+
+        while offset < seconds:
+            windows.extend(fault._replace(start=fault.start + offset) for fault in self.faults if fault.start + offset < seconds)
+            offset += self.period
+
+        return windows
+
+class OriginHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve the origin's directory, injecting the faults the plan says are active."""
+
+    server: 'OriginServer'
+
+    def do_GET(self): #pylint: disable=invalid-name
+        path = self.path.split('?', 1)[0]
+        segment = not path.endswith(('.m3u8', '.mpd'))
+
+        for fault in self.server.plan.active(self.server.elapsed()):
+            if fault.kind == 'outage':
+                self.server.count('outage')
+                self.close_connection = True
+                return
+
+            if fault.kind == '404' and segment and random.random() < (fault.value or 1.0):
+                self.server.count('404')
+                self.send_error(404)
+                return
+
+            if fault.kind == 'delay' and segment:
+                self.server.count('delay')
+                time.sleep(fault.value)
+
+        self.server.count('requests')
+        super().do_GET()
+
+    def end_headers(self):
+        # Live manifests change every segment
+        self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+    def log_message(self, format, *args): #pylint: disable=redefined-builtin
+        log.debug(f"Origin request: {format % args}")
+
+class OriginServer(http.server.ThreadingHTTPServer):
+    """An HTTP origin serving a directory with a fault plan."""
+
+    daemon_threads = True
+
+    def __init__(self, directory: str, plan: FaultPlan, address: str = '127.0.0.1', port: int = 0):
+        """
+        Args:
+            directory (str): Directory to serve.
+            plan (FaultPlan): Faults to inject, timed from when the server is created.
+            address (str): Address to listen on.
+            port (int): Port to listen on (0 picks a free one).
+        """
+
+        super().__init__((address, port), lambda *args: OriginHandler(*args, directory=directory))
+
+        self.plan = plan
+        self.started = time.monotonic()
+        self.counts: Dict[str, int] = {'requests': 0, 'delay': 0, '404': 0, 'outage': 0}
+
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def url(self, name: str) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/{name}"
+
+    def start(self):
+        """Serve from a background thread (call shutdown() to stop)."""
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+def encoder_args(fmt: str, directory: str, ffmpeg: str = 'ffmpeg', segment_seconds: int = 2) -> List[str]:
+    """Build the ffmpeg command generating a live test stream into directory.
+
+    The stream is a 720p30 test pattern with a tone, encoded in realtime with a
+    keyframe every segment and a sliding window of segments, like a live origin.
+    """
+
+    args = [
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-re',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-tune', 'zerolatency', '-pix_fmt', 'yuv420p',
+        '-g', str(segment_seconds * 30), '-keyint_min', str(segment_seconds * 30), '-sc_threshold', '0', '-b:v', '2M',
+        '-c:a', 'aac', '-b:a', '128k',
+    ]
+
+    if fmt == 'hls':
+        args += [
+            '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_list_size', '10',
+            '-hls_flags', 'delete_segments+independent_segments',
+            '-hls_segment_filename', os.path.join(directory, 'segment%06d.ts'),
+        ]
+    elif fmt == 'dash':
+        args += ['-f', 'dash', '-seg_duration', str(segment_seconds), '-window_size', '10', '-extra_window_size', '5', '-use_template', '1', '-use_timeline', '1']
+    else:
+        raise ValueError(f"Unknown format {fmt}; expected one of {', '.join(MANIFESTS)}")
+
+    return args + [os.path.join(directory, MANIFESTS[fmt])]
+
+def start_encoder(fmt: str, directory: str, ffmpeg: str = 'ffmpeg', timeout: float = 30.0) -> subprocess.Popen:
+    """Start generating a live stream into directory and wait for its first manifest.
+
+    Raises:
+        RuntimeError: If ffmpeg exits or no manifest appears within timeout seconds.
+    """
+
+    proc = subprocess.Popen(encoder_args(fmt, directory, ffmpeg), stdin=subprocess.DEVNULL, start_new_session=True)
+    manifest = os.path.join(directory, MANIFESTS[fmt])
+    deadline = time.monotonic() + timeout
+
+    while not os.path.exists(manifest):
+        if proc.poll() is not None:
+            raise RuntimeError(f"The origin encoder exited with code {proc.returncode}")
+
+        if time.monotonic() >= deadline:
+            proc.kill()
+            raise RuntimeError(f"The origin encoder wrote no manifest within {timeout}s")
+
+        time.sleep(0.2)
+
+    return proc
@@ -0,0 +1,244 @@
+"""A local RTMP sink: an ffmpeg listener whose packets are checked for gaps and timestamp discontinuities."""
+
+import time
+import logging
+import threading
+import subprocess
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from soak.origin import Fault
+
+log = logging.getLogger("pyrestreamer")
+
+class Packet(NamedTuple):
+    """A packet the sink received, with its timestamps in seconds."""
+
+    stream: int
+    dts: float
+    duration: float
+
+class Gap(NamedTuple):
+    """A stretch of wall time (monotonic seconds) in which the sink received nothing."""
+
+    start: float
+    end: float
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+def parse_time_base(line: str) -> Optional[Tuple[int, float]]:
+    """Parse a framecrc "#tb <stream>: <num>/<den>" header line.
+
+    Returns:
+        Tuple[int, float]: The stream index and seconds per tick, or None if it is some other line.
+    """
+
+    if not line.startswith('#tb '):
+        return None
+
+    stream, _, fraction = line[len('#tb '):].partition(':')
+    num, _, den = fraction.strip().partition('/')
+
+    return int(stream), int(num) / int(den)
+
+def parse_packet(line: str, time_bases: Dict[int, float]) -> Optional[Packet]:
+    """Parse a framecrc packet line ("stream, dts, pts, duration, size, hash[, flags]").
+
+    Returns:
+        Packet: The packet, or None if it is a header or malformed line.
+    """
+
+    if line.startswith('#'):
+        return None
+
+    fields = line.split(',')
+
+    if len(fields) < 5:
+        return None
+
+    try:
+        stream, dts, duration = int(fields[0]), int(fields[1]), int(fields[3])
+    except ValueError:
+        return None
+
+    tick = time_bases.get(stream, 0.001)
+
+    return Packet(stream, dts * tick, duration * tick)
+
+class ContinuityTracker():
+    """Check the output the sink receives for gaps and timestamp discontinuities.
+
+    A gap is any stretch longer than gap_threshold seconds without a packet. A
+    timestamp jump is a packet whose dts goes backwards or lands more than
+    jump_threshold seconds after the previous packet of its stream ended;
+    reconnects (the publisher starting over) are counted separately, since
+    their timestamps start again from scratch.
+    """
+
+    def __init__(self, gap_threshold: float = 1.0, jump_threshold: float = 0.5):
+        self.gap_threshold = gap_threshold
+        self.jump_threshold = jump_threshold
+
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self.packets = 0
+        self.connections = 0
+        self.jumps = 0
+        self.media_seconds = 0.0
+        self.gaps: List[Gap] = []
+
+        self._streams: Dict[int, Packet] = {}
+
+    def connect(self):
+        """Note that a publisher (re)connected."""
+
+        self.connections += 1
+        self._streams = {}
+
+    def feed(self, arrival: float, packet: Packet):
+        """Record a packet received at arrival (monotonic seconds)."""
+
+        if self.last is not None and arrival - self.last > self.gap_threshold:
+            self.gaps.append(Gap(self.last, arrival))
+
+        if self.first is None:
+            self.first = arrival
+
+        previous = self._streams.get(packet.stream)
+
+        if previous is not None:
+            if packet.dts < previous.dts or packet.dts - (previous.dts + previous.duration) > self.jump_threshold:
+                self.jumps += 1
+            elif packet.stream == 0:
+                self.media_seconds += packet.dts - previous.dts
+
+        self._streams[packet.stream] = packet
+        self.packets += 1
+        self.last = arrival
+
+    def finish(self, now: float):
+        """Close the run at now, counting any trailing stretch without packets as a gap."""
+
+        if self.last is not None and now - self.last > self.gap_threshold:
+            self.gaps.append(Gap(self.last, now))
+            self.last = now
+
+    def summary(self) -> dict:
+        """Summarize continuity so far."""
+
+        received = (self.last - self.first) if self.first is not None else 0.0
+
+        return {
+            'packets': self.packets,
+            'connections': self.connections,
+            'reconnects': max(self.connections - 1, 0),
+            'timestamp_jumps': self.jumps,
+            'gaps': len(self.gaps),
+            'gap_seconds': sum(gap.seconds for gap in self.gaps),
+            'longest_gap_seconds': max((gap.seconds for gap in self.gaps), default=0.0),
+            'media_seconds': self.media_seconds,
+            'delivered_ratio': self.media_seconds / received if received else 0.0,
+        }
+
+def fault_recovery(windows: List[Fault], gaps: List[Gap], origin_started: float, settle: float = 60.0) -> List[dict]:
+    """Work out how each fault affected the output and how long it took to recover.
+
+    A fault interrupted the output if a gap overlaps its window or the settle
+    seconds after it. Recovery is measured from the end of the fault to the end
+    of the last such gap, and is 0 if the output resumed while the fault was
+    still going on.
+
+    Args:
+        windows (List[Fault]): Fault occurrences, timed from origin_started (see FaultPlan.windows).
+        gaps (List[Gap]): Gaps in the output, in monotonic seconds.
+        origin_started (float): Monotonic time the fault plan started.
+        settle (float): Seconds after a fault ends that gaps are still blamed on it.
+
+    Returns:
+        List[dict]: The impact of each fault.
+    """
+
+    impact = []
+
+    for fault in windows:
+        end = fault.start + fault.duration
+        overlapping = [
+            gap for gap in gaps
+            if gap.start - origin_started < end + settle and gap.end - origin_started > fault.start
+        ]
+
+        impact.append({
+            'kind': fault.kind,
+            'start': fault.start,
+            'duration': fault.duration,
+            'interrupted': bool(overlapping),
+            'gap_seconds': sum(gap.seconds for gap in overlapping),
+            'recovery_seconds': max([0.0] + [gap.end - origin_started - end for gap in overlapping]),
+        })
+
+    return impact
+
+def listener_args(url: str, ffmpeg: str = 'ffmpeg') -> List[str]:
+    """Build the ffmpeg command that accepts one RTMP publisher and prints a line per packet it receives."""
+
+    return [ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 'flv', '-listen', '1', '-i', url, '-map', '0', '-c', 'copy', '-f', 'framecrc', '-']
+
+class RtmpSink():
+    """Accept the restreamer's RTMP output and feed every packet to a ContinuityTracker.
+
+    ffmpeg's listener takes a single publisher, so it is started again every
+    time the publisher disconnects. Use lock while reading the tracker.
+    """
+
+    def __init__(self, tracker: ContinuityTracker, port: int, ffmpeg: str = 'ffmpeg'):
+        self.tracker = tracker
+        self.url = f"rtmp://127.0.0.1:{port}/live/soak"
+        self.ffmpeg = ffmpeg
+        self.lock = threading.Lock()
+
+        self._proc: Optional[subprocess.Popen] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._proc = subprocess.Popen(listener_args(self.url, self.ffmpeg), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True, start_new_session=True)
+            time_bases: Dict[int, float] = {}
+            connected = False
+
+            for line in self._proc.stdout:
+                time_base = parse_time_base(line)
+
+                if time_base is not None:
+                    time_bases[time_base[0]] = time_base[1]
+                    continue
+
+                packet = parse_packet(line, time_bases)
+
+                if packet is None:
+                    continue
+
+                with self.lock:
+                    if not connected:
+                        self.tracker.connect()
+                        connected = True
+
+                    self.tracker.feed(time.monotonic(), packet)
+
+            self._proc.wait()
+
+            if connected:
+                log.warning(f"The soak sink's publisher disconnected (ffmpeg exited with code {self._proc.returncode})")
+            elif not self._stopped.is_set():
+                # The listener failed before anyone published; don't spin
+                time.sleep(1)
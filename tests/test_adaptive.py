@@ -0,0 +1,74 @@
+from pyrestreamer.adaptive import VariantSelector, rank_variants
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.helpers import ReStreamer
+from pyrestreamer.ingest import IngestConfig
+
+class TestVariantSelector():
+    """Verify adaptive variant selection."""
+
+    def test_rank_variants(self):
+        """Verify variants are ordered by resolution and frame rate, without aliases or audio-only streams."""
+
+        names = ['audio_mp4a', '480p', 'best', '720p', '1080p60', '720p_alt', 'worst', '1080p']
+
+        assert rank_variants(names) == ['1080p60', '1080p', '720p', '720p_alt', '480p']
+        assert rank_variants(['1500k', '3000k', 'best']) == ['3000k', '1500k']
+
+    def test_step_down_and_up(self):
+        """Verify sustained slowness steps down and sustained headroom steps back up."""
+
+        selector = VariantSelector(min_speed=0.95, ingest_gap=8, downgrade_after=20, upgrade_after=300, grace=15, variants=['1080p', '720p', '480p'])
+        selector.start(0)
+
+        # Slowness during the grace period and brief dips are ignored
+        assert selector.observe(0.5, 0, 10) is None
+        assert selector.observe(0.8, 0, 20) is None
+        assert selector.observe(1.0, 0, 30) is None
+        assert selector.observe(1.0, 9, 40) is None
+        assert selector.observe(1.0, 0, 50) is None
+
+        assert selector.observe(0.8, 0, 60) is None
+        assert selector.observe(0.8, 0, 80) == -1
+        assert selector.switch(-1, 80) == '720p'
+
+        assert selector.observe(1.0, 0, 100) is None
+        assert selector.observe(1.0, 0, 394) is None
+        assert selector.observe(1.0, 0, 395) == 1
+        assert selector.switch(1, 395) == '1080p'
+
+    def test_failed_upgrade_backoff(self):
+        """Verify an upgrade that can't be sustained doubles the wait before the next one."""
+
+        selector = VariantSelector(downgrade_after=20, upgrade_after=100, grace=0, variants=['720p', '480p'])
+        selector.start(0)
+
+        assert selector.observe(0.5, 0, 0) is None
+        assert selector.observe(0.5, 0, 20) == -1
+        selector.switch(-1, 20)
+
+        assert selector.observe(1.0, 0, 120) == 1
+        selector.switch(1, 120)
+
+        assert selector.observe(0.5, 0, 130) is None
+        assert selector.observe(0.5, 0, 150) == -1
+        assert selector.switch(-1, 150) == '480p'
+
+        assert selector.observe(1.0, 0, 250) is None
+        assert selector.observe(1.0, 0, 350) == 1
+
+    def test_restreamer_quality(self):
+        """Verify an adaptive restreamer ingests the selected variant, falling back to best."""
+
+        rs = ReStreamer(PipelineConfig(None, '1|12:00|60', 0, 15, 'America/New_York', 'https://example.com/Manifest.mpd', '-f null -', ingest=IngestConfig(quality='adaptive'), adaptive=VariantSelector(grace=0, downgrade_after=0, variants=['720p', '480p'])))
+
+        assert rs.ingest_args()[-3:] == ['https://example.com/Manifest.mpd', '720p', '-O']
+
+        rs.prepare_variant()
+
+        assert rs.adapt(0.5, 0)
+        assert rs.quality == '480p'
+        assert rs.metrics.registry.get('pyrestreamer_variant_switches_total', pipeline='default', direction='down', variant='480p') == 1
+
+        rs.selector.set_variants([])
+
+        assert rs.quality == 'best'
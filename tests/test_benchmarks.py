@@ -0,0 +1,26 @@
+from benchmarks.harness import ScriptedSchedule, compare, metric
+
+class TestBenchmarks():
+    """Verify benchmark reporting helpers."""
+
+    def test_compare(self):
+        """Verify regressions respect each metric's direction and the tolerance."""
+
+        baseline = {'results': {'stall': {'time_to_detect_seconds': metric(2.0, 's', 'lower')}, 'parse': {'rate': metric(100, 'lines/s', 'higher')}}}
+        report = {'results': {'stall': {'time_to_detect_seconds': metric(2.3, 's', 'lower')}, 'parse': {'rate': metric(70, 'lines/s', 'higher'), 'new': metric(1, 's', 'lower')}}}
+
+        assert compare(report, baseline, tolerance=0.2) == ["parse.rate: 100 -> 70 lines/s (higher is better)"]
+        assert compare(report, baseline, tolerance=0.1) == [
+            "stall.time_to_detect_seconds: 2.0 -> 2.3 s (lower is better)",
+            "parse.rate: 100 -> 70 lines/s (higher is better)",
+        ]
+
+    def test_scripted_schedule(self):
+        """Verify the scripted schedule reports its window and transitions."""
+
+        schedule = ScriptedSchedule(-1, 60)
+
+        assert schedule.is_active()
+        assert 59 < schedule.seconds_until_transition() <= 60
+        assert schedule.next_transition() is not None
+        assert ScriptedSchedule(-2, -1).seconds_until_transition() is None
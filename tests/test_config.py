@@ -0,0 +1,103 @@
+import datetime
+
+import pytest
+import pytz
+
+from pyrestreamer.config import LeaseConfig, parse_env_config, parse_pipeline_configs, PipelineConfig
+from pyrestreamer.schedule import ServiceTime
+
+class TestPipelineConfig():
+    """Verify multi-pipeline config parsing."""
+
+    def test_parse_pipeline_configs(self):
+        """Verify defaults are applied and overridden per pipeline."""
+
+        config = {
+            'max_concurrent': 2,
+            'defaults': {'service_buffer': 2, 'timezone': 'US/Eastern', 'ffmpeg_params': '-f null -'},
+            'pipelines': [
+                {'name': 'a', 'service_times': '7|09:00|88', 'input_url': 'https://a'},
+                {'service_times': '7|10:45|88', 'input_url': 'https://b', 'service_buffer': 5, 'sleep_time': 3},
+            ]
+        }
+
+        configs, max_concurrent = parse_pipeline_configs(config)
+
+        assert max_concurrent == 2
+        assert configs == [
+            PipelineConfig('a', '7|09:00|88', 2, 15, 'US/Eastern', 'https://a', '-f null -', services=(ServiceTime(7, 9, 0, 88),), timezone=pytz.timezone('US/Eastern')),
+            PipelineConfig('pipeline-2', '7|10:45|88', 5, 3, 'US/Eastern', 'https://b', '-f null -', services=(ServiceTime(7, 10, 45, 88),), timezone=pytz.timezone('US/Eastern')),
+        ]
+
+    def test_parse_pipeline_configs_invalid(self):
+        """Verify invalid configs are rejected."""
+
+        with pytest.raises(ValueError):
+            parse_pipeline_configs({})
+
+        with pytest.raises(ValueError):
+            parse_pipeline_configs({
+                'defaults': {'timezone': 'US/Eastern', 'ffmpeg_params': '', 'input_url': 'https://a', 'service_times': '7|09:00|88'},
+                'pipelines': [{'name': 'a', 'rules': [{'name': 'r', 'prefix': 'x', 'action': 'sometimes'}]}]
+            })
+
+        with pytest.raises(ValueError):
+            parse_pipeline_configs({'pipelines': [{'name': 'a', 'service_times': '7|09:00|88'}]})
+
+        with pytest.raises(ValueError):
+            parse_pipeline_configs({
+                'defaults': {'timezone': 'US/Eastern', 'ffmpeg_params': '', 'input_url': 'https://a', 'service_times': '7|09:00|88'},
+                'pipelines': [{'name': 'a'}, {'name': 'a'}]
+            })
+
+        with pytest.raises(ValueError, match='Pipeline a: Unknown timezone'):
+            parse_pipeline_configs({
+                'defaults': {'timezone': 'US/Eastern', 'ffmpeg_params': '', 'input_url': 'https://a', 'service_times': '7|09:00|88'},
+                'pipelines': [{'name': 'a', 'timezone': 'Mars/Olympus_Mons'}]
+            })
+
+class TestEnvConfig():
+    """Verify settings are read and validated from the environment."""
+
+    def test_parse_env_config(self):
+        """Verify values are parsed, defaults fill in unset and empty settings, and the result is immutable."""
+
+        config = parse_env_config({
+            'SERVICE_TIMES': '7|09:00|88', 'SERVICE_BUFFER': '2', 'SLEEP_TIME': '', 'PYTZ_TIMEZONE': 'US/Eastern',
+            'INPUT_URL': 'https://a', 'FFMPEG_PARAMS': '-f null -', 'ENGINE': 'AsyncIO', 'STOP_GRACE_SECONDS': '8',
+            'STREAMLINK_OPTIONS': '{hls-live-edge: 6}', 'LEASE_BACKEND': 'File', 'LEASE_FILE': '/tmp/lease',
+            'DEBUG': 'true', 'DEBUG_DATETIME': '2020-03-01T09:00:00', 'DEBUG_TZ_OFFSET': '-5',
+        }, required=('SERVICE_TIMES', 'INPUT_URL'))
+
+        assert config.pipeline[:8] == (None, '7|09:00|88', 2, 15, 'US/Eastern', 'https://a', '-f null -', ())
+        assert config.pipeline.stop_policy.grace == 8
+        assert config.pipeline.services == (ServiceTime(7, 9, 0, 88),)
+        assert config.pipeline.timezone is pytz.timezone('US/Eastern')
+        assert dict(config.pipeline.ingest.options) == {'hls-live-edge': 6}
+        assert config.engine == 'asyncio'
+        assert config.lease == LeaseConfig('file', '/tmp/lease')
+        assert config.debug_start == datetime.datetime(2020, 3, 1, 4)
+
+        with pytest.raises(AttributeError):
+            config.engine = 'thread'
+
+    def test_parse_env_config_invalid(self):
+        """Verify missing and invalid settings are rejected."""
+
+        with pytest.raises(ValueError, match='INPUT_URL, FFMPEG_PARAMS'):
+            parse_env_config({'SERVICE_TIMES': '7|09:00|88'}, required=('SERVICE_TIMES', 'INPUT_URL', 'FFMPEG_PARAMS'))
+
+        for env in ({'SLEEP_TIME': 'often'}, {'ENGINE': 'fibers'}, {'STREAMLINK_OPTIONS': '{'}, {'DEBUG': 'true'}, {'PYTZ_TIMEZONE': 'Eastern Time'}):
+            with pytest.raises(ValueError):
+                parse_env_config(env)
+
+        for value in ('7|09:00', '7|9am|88', '8|09:00|88', '7|24:00|88', '7|09:00|0', '7|09:00|88,'):
+            with pytest.raises(ValueError, match='SERVICE_TIMES'):
+                parse_env_config({'SERVICE_TIMES': value})
+
+        # The control interface is only served over TCP with a token
+        with pytest.raises(ValueError, match='CONTROL_TOKEN'):
+            parse_env_config({'CONTROL_ADDRESS': '127.0.0.1:9465'})
+
+        assert parse_env_config({'CONTROL_ADDRESS': '127.0.0.1:9465', 'CONTROL_TOKEN': 'secret'}).control_token == 'secret'
+        assert parse_env_config({'CONTROL_ADDRESS': 'unix:/tmp/control.sock'}).control_token is None
@@ -0,0 +1,222 @@
+import os
+import datetime
+import json
+import urllib.request
+import urllib.error
+
+import pytest
+import pytz
+
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.helpers import ReStreamer, StreamingState
+from pyrestreamer.clock import SimulatedClock
+from pyrestreamer.control import Controller, start_control_server
+from pyrestreamer.server import unix_get
+
+def restreamer(name=None, start=datetime.datetime(2020, 1, 4, 12, 0)):
+    """Build a restreamer with a Saturday 18:00 service, on a simulated clock starting at noon that day."""
+
+    clock = SimulatedClock(pytz.timezone('US/Eastern').localize(start))
+
+    return ReStreamer(PipelineConfig(name, "6|18:00|60", 0, 15, 'US/Eastern', 'https://example.com', '-f null -'), clock)
+
+def settings(**overrides):
+    current = {
+        'service_times': "6|18:00|60", 'service_buffer': 0, 'sleep_time': 15, 'pytz_timezone': 'US/Eastern',
+        'input_url': 'https://example.com', 'ffmpeg_params': '-f null -', 'outputs': None,
+    }
+    current.update(overrides)
+
+    return current
+
+class TestControl():
+    """Verify reloads, overrides and one-off events."""
+
+    def test_override(self):
+        """Verify an override wins over the schedule until it expires."""
+
+        rs = restreamer()
+
+        rs.set_override(True, minutes=30)
+
+        assert rs.expected_state() is StreamingState.STREAMING
+        assert rs.seconds_until_transition() == 30 * 60
+
+        rs.clock.sleep(30 * 60)
+
+        assert rs.expected_state() is StreamingState.IDLE
+
+        # Stopping takes precedence over the service window too
+        rs.set_override(False)
+        rs.clock.sleep(6 * 60 * 60)
+
+        assert rs.expected_state() is StreamingState.IDLE
+
+        rs.set_override(None)
+
+        assert rs.expected_state() is StreamingState.STREAMING
+
+    def test_events(self):
+        """Verify one-off events are streamed and listed among the next transitions."""
+
+        rs = restreamer()
+        rs.add_event(datetime.datetime(2020, 1, 4, 12, 30), 60)
+
+        assert rs.expected_state() is StreamingState.IDLE
+        assert rs.sleep_duration(StreamingState.IDLE) == 30 * 60
+
+        transitions = [(instant.strftime('%H:%M'), streaming) for instant, streaming in rs.upcoming_transitions(4)]
+
+        assert transitions == [('12:30', True), ('13:30', False), ('18:00', True), ('19:00', False)]
+
+        rs.clock.sleep(30 * 60)
+
+        assert rs.expected_state() is StreamingState.STREAMING
+
+        with pytest.raises(ValueError):
+            rs.add_event(datetime.datetime(2020, 1, 5, 14, 0), 0)
+
+    def test_next_transition(self):
+        """Verify the next transition (and its gauge) accounts for the pre-roll, one-off events and overrides."""
+
+        rs = restreamer('transitions')
+        rs.preroll = 600
+        rs.metrics.transitions(rs.next_transition)
+
+        def local(hour, minute):
+            return pytz.timezone('US/Eastern').localize(datetime.datetime(2020, 1, 4, hour, minute))
+
+        assert rs.next_transition() == local(17, 50)
+
+        rs.add_event(datetime.datetime(2020, 1, 4, 13, 0), 30)
+
+        assert rs.next_transition() == local(12, 50)
+
+        rs.set_override(True, minutes=15)
+
+        assert rs.next_transition() == local(12, 15)
+        assert rs.metrics.registry.get('pyrestreamer_next_transition_timestamp_seconds', pipeline='transitions') == local(12, 15).timestamp()
+
+    def test_reload(self):
+        """Verify reloads recompile the schedule, and only ask for a restart when the pipeline's params change."""
+
+        rs = restreamer()
+        loaded = {'default': settings(service_times="6|12:00|60")}
+        controller = Controller([rs], lambda: loaded)
+
+        assert controller.reload() == {'reloaded': ['default'], 'restarting': [], 'ignored': []}
+        assert rs.expected_state() is StreamingState.STREAMING
+        assert not rs.take_restart_request()
+
+        loaded['default'] = settings(service_times="6|12:00|60", ffmpeg_params='-f flv rtmp://example.com/live')
+
+        assert controller.reload()['restarting'] == ['default']
+        assert rs.take_restart_request()
+        assert rs.settings.outputs == ['-f flv rtmp://example.com/live']
+
+        # Invalid settings change nothing
+        loaded['default'] = settings(service_times="6|25", ffmpeg_params='-f null -')
+        schedule = rs.settings.schedule
+
+        with pytest.raises(ValueError):
+            controller.reload()
+
+        assert rs.settings.schedule is schedule
+        assert rs.settings.ffmpeg_params == '-f flv rtmp://example.com/live'
+
+    def test_reload_swaps_settings(self):
+        """Verify a reload replaces every setting in one step, so a copy taken before it stays consistent."""
+
+        rs = restreamer()
+        before = rs.settings
+
+        rs.reload(**settings(service_times="6|12:00|60", sleep_time=5, input_url='https://example.com/new'))
+
+        assert before.input_url == 'https://example.com' and before.sleep_time == 15
+        assert before.schedule.seconds_until_transition(rs.clock.now(before.schedule.tz)) == 6 * 60 * 60
+        assert rs.settings.input_url == 'https://example.com/new' and rs.settings.sleep_time == 5
+        assert rs.settings.schedule.is_active()
+
+    def test_reload_atomic(self):
+        """Verify no pipeline is reloaded if any pipeline's settings are invalid."""
+
+        north, south = restreamer('north'), restreamer('south')
+        controller = Controller([north, south], lambda: {
+            'north': settings(service_times="6|12:00|60"),
+            'south': settings(pytz_timezone='Nowhere/Special'),
+            'east': settings(),
+        })
+
+        with pytest.raises(ValueError):
+            controller.reload()
+
+        assert north.expected_state() is StreamingState.IDLE
+
+        with pytest.raises(LookupError):
+            controller.pipeline()
+
+    def test_server(self):
+        """Verify the HTTP interface."""
+
+        rs = restreamer()
+
+        with pytest.raises(ValueError):
+            start_control_server('127.0.0.1:0', Controller([rs]))
+
+        server = start_control_server('127.0.0.1:0', Controller([rs]), token='secret')
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+
+        def request(path, method='GET', token='secret'):
+            headers = {'Authorization': f'Bearer {token}'} if token else {}
+
+            with urllib.request.urlopen(urllib.request.Request(base + path, method=method, headers=headers), timeout=5) as response:
+                return json.loads(response.read())
+
+        try:
+            for token in (None, 'wrong'):
+                with pytest.raises(urllib.error.HTTPError) as e:
+                    request('/stop', 'POST', token=token)
+
+                assert e.value.code == 401
+
+            assert rs.override is None
+
+            status = request('/status')['pipelines'][0]
+
+            assert status['state'] == 'idle'
+            assert status['next_transitions'][0] == {'time': '2020-01-04T18:00:00-05:00', 'state': 'streaming'}
+
+            status = request('/start?minutes=15', 'POST')
+
+            assert status['expected_state'] == 'streaming'
+            assert status['override']['until'] == '2020-01-04T12:15:00-05:00'
+
+            status = request('/events?start=2020-01-05T09:00&minutes=90', 'POST')
+
+            assert status['events'] == [{'start': '2020-01-05T09:00:00-05:00', 'end': '2020-01-05T10:30:00-05:00'}]
+
+            with pytest.raises(urllib.error.HTTPError) as e:
+                request('/reload', 'POST')
+
+            assert e.value.code == 400
+
+            with pytest.raises(urllib.error.HTTPError) as e:
+                request('/events', 'POST')
+
+            assert e.value.code == 400
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_unix_server(self, tmp_path):
+        """Verify the Unix socket interface needs no token and only its owner may connect."""
+
+        path = str(tmp_path / 'control.sock')
+        server = start_control_server(f'unix:{path}', Controller([restreamer()]))
+
+        try:
+            assert os.stat(path).st_mode & 0o777 == 0o600
+            assert json.loads(unix_get(path, '/status'))['pipelines'][0]['state'] == 'idle'
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,53 @@
+import os
+import time
+import threading
+
+import pytest
+
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.engine import ThreadReStreamer
+from pyrestreamer.helpers import ReStreamer, StreamingState
+from pyrestreamer.metrics import REGISTRY
+from pyrestreamer.pipeline import FatalPipelineError
+from pyrestreamer.recovery import RestartPolicy
+from pyrestreamer.rules import Action, Rule
+
+class TestThreadReStreamer():
+    """Verify the thread engine's event loop."""
+
+    def test_clean_ffmpeg_exit(self):
+        """Verify ffmpeg exiting cleanly (as it does at the end of its input) restarts the pipeline straight away."""
+
+        rs = ReStreamer(PipelineConfig('clean-exit', "1|00:00|10080", 0, 1, 'US/Eastern', 'https://example.com', '-f null -', restart_policy=RestartPolicy(base_delay=0.05, jitter=0)))
+        rs.ingest_args = lambda: ['true']
+        rs.output_args = lambda params: ['sh', '-c', 'printf "total_size=1\\nprogress=end\\n"; exit 0']
+
+        engine = ThreadReStreamer(rs)
+        thread = threading.Thread(target=engine.run, daemon=True)
+        thread.start()
+
+        # Well within the watchdog's progress timeout, which would otherwise catch it eventually
+        deadline = time.monotonic() + rs.watchdog.progress_timeout / 2
+
+        while not REGISTRY.get('pyrestreamer_pipeline_restarts_total', pipeline='clean-exit', component='pipeline'):
+            assert time.monotonic() < deadline, "A cleanly exited ffmpeg was not noticed"
+            time.sleep(0.05)
+
+        engine.request_stop()
+        thread.join(10)
+
+        assert not thread.is_alive()
+
+    def test_fatal_rule(self, tmp_path):
+        """Verify a fatal output line stops the pipeline, dumps its progress and raises rather than exiting."""
+
+        rule = Rule('forbidden', 'Server returned 403', Action.FATAL, description="Stream key rejected")
+        rs = ReStreamer(PipelineConfig('fatal', "1|00:00|10080", 0, 1, 'US/Eastern', 'https://example.com', '-f null -', rules=(rule,), dump_dir=str(tmp_path)))
+        rs.ingest_args = lambda: ['sh', '-c', 'while true; do echo data; sleep 0.1; done']
+        rs.output_args = lambda params: ['sh', '-c', 'echo "Server returned 403 Forbidden"; exec cat > /dev/null']
+
+        with pytest.raises(FatalPipelineError, match="Stream key rejected"):
+            ThreadReStreamer(rs).run()
+
+        assert rs.state is StreamingState.IDLE
+        assert [name for name in os.listdir(tmp_path) if name.startswith('pyrestreamer-fatal-')]
@@ -1,12 +1,17 @@
 import unittest
 import datetime
+import logging
+import time
 import os
 
 import pytest
 import pytz
 from freezegun import freeze_time
 
-from pyrestreamer.helpers import Service, load_services, list_has_active_service, ReStreamer
+from pyrestreamer.helpers import Service, load_services, list_has_active_service, ReStreamer, PushoverHandler, StreamingState
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.clock import SimulatedClock
+from pyrestreamer.jitter import JitterConfig
 
 class TestService():
     """Verify Service class function as expected."""
@@ -52,6 +57,20 @@ class TestService():
             assert True == service.is_active()
         #endregion
 
+    def test_is_active_clock(self):
+        """Verify a service tells the time by the clock it is given."""
+
+        tz = pytz.timezone('US/Eastern')
+        clock = SimulatedClock(tz.localize(datetime.datetime(2020, 1, 4, 17, 57)))
+        service = Service(6, 18, 00, 2, 90, tz, clock)
+
+        assert not service.is_active()
+
+        clock.sleep(60)
+
+        assert service.is_active()
+        assert load_services("6|18:00|90", 2, 'US/Eastern', clock)[0].is_active()
+
     @freeze_time("2020-01-04 19:32:00", tz_offset=5)
     def test_date_for_dow(self):
         """Test getting the next date for a given day of the week."""
@@ -240,4 +259,114 @@ class TestRestreamer():
             }
         )
 
-        assert exp_output == ReStreamer.parse_ffmpeg_output(fn_input)
\ No newline at end of file
+        assert exp_output == ReStreamer.parse_ffmpeg_output(fn_input)
+
+    def test_preroll(self):
+        """Verify the restreamer warms up ahead of a service and wakes for the pre-roll."""
+
+        clock = SimulatedClock(pytz.timezone('US/Eastern').localize(datetime.datetime(2020, 1, 4, 17, 50)))
+        rs = ReStreamer(PipelineConfig(None, "6|18:00|60", 2, 15, 'US/Eastern', 'https://example.com', '-f null -', preroll=120), clock)
+
+        # The window opens at 17:58, so the pre-roll starts at 17:56
+        assert rs.expected_state() is StreamingState.IDLE
+        assert rs.sleep_duration(StreamingState.IDLE) == 6 * 60
+
+        clock.sleep(6 * 60)
+
+        assert rs.expected_state() is StreamingState.WARMING
+        assert rs.sleep_duration(StreamingState.WARMING) == 15
+
+        # A warm start that didn't happen is tried again every sleep_time seconds
+        assert rs.sleep_duration(StreamingState.IDLE) == 15
+
+        clock.sleep(120)
+
+        assert rs.expected_state() is StreamingState.STREAMING
+
+    def test_ingest_stall_timeout(self):
+        """Verify a source gap the jitter buffer covers is not a stall."""
+
+        config = PipelineConfig(None, "6|18:00|60", 2, 15, 'US/Eastern', 'https://example.com', '-f null -')
+        rs = ReStreamer(config)
+        buffered = ReStreamer(config._replace(jitter=JitterConfig(seconds=30)))
+
+        assert rs.ingest_stall_timeout() == ReStreamer.INGEST_STALL_TIMEOUT
+        assert buffered.ingest_stall_timeout() == ReStreamer.INGEST_STALL_TIMEOUT + 30
+
+class FakeClient():
+    """Records messages instead of sending them to pushover."""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, message, title):
+        self.messages.append(message)
+
+class FakePushoverHandler(PushoverHandler):
+    """Pushover handler with a fake client."""
+
+    def make_client(self, user_key, api_token):
+        return FakeClient()
+
+class TestPushoverHandler():
+    """Verify the background pushover handler."""
+
+    def test_coalesce(self):
+        """Verify repeated messages are merged into the first one's text with a count."""
+
+        message = PushoverHandler.coalesce([
+            ('segment', "[stream.dash][error] Failed to open segment 1"),
+            ('pipe', "Pipe died"),
+            ('segment', "[stream.dash][error] Failed to open segment 2"),
+        ])
+
+        assert message == "[stream.dash][error] Failed to open segment 1\n(repeated 2 times)\n\nPipe died"
+
+    def test_repeat_key(self):
+        """Verify only records with the same logger, level and template are repeats, not ones that differ in numbers."""
+
+        def key(msg, *args, name='pyrestreamer', level=logging.ERROR):
+            return PushoverHandler.repeat_key(logging.makeLogRecord({'name': name, 'levelno': level, 'msg': msg, 'args': args}))
+
+        assert key("Segment timeout %d", 1) == key("Segment timeout %d", 2)
+        assert key("Output 0 failed: ffmpeg has exited unexpectedly") != key("Output 1 failed: ffmpeg has exited unexpectedly")
+        assert key("Pipe died") != key("Pipe died", level=logging.WARNING)
+        assert key("Pipe died") != key("Pipe died", name='streamlink')
+
+    def test_emit_batches(self):
+        """Verify emit does not send inline, and a burst is sent as one message on close."""
+
+        handler = FakePushoverHandler('key', 'token', batch_interval=30)
+        logger = logging.getLogger('test_pushover')
+        logger.addHandler(handler)
+
+        try:
+            for idx in range(5):
+                logger.warning("Segment timeout %d", idx)
+
+            logger.warning("Output 0 failed")
+            logger.warning("Output 1 failed")
+
+            assert handler.client.messages == []
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+        assert handler.client.messages == ["Segment timeout 0\n(repeated 5 times)\n\nOutput 0 failed\n\nOutput 1 failed"]
+
+    def test_rate_limit(self):
+        """Verify sends are limited to rate_limit per period."""
+
+        handler = FakePushoverHandler('key', 'token', batch_interval=0, rate_limit=1, rate_period=60)
+
+        try:
+            handler.emit(logging.makeLogRecord({'msg': 'first'}))
+            time.sleep(0.2)
+            handler.emit(logging.makeLogRecord({'msg': 'second'}))
+            time.sleep(0.2)
+
+            assert handler.client.messages == ['first']
+        finally:
+            handler.close()
+
+        assert handler.client.messages == ['first', 'second']
@@ -0,0 +1,182 @@
+import os
+import http.server
+import logging
+import threading
+
+import pytest
+
+from pyrestreamer.ingest import IngestConfig, StreamlinkIngest, count_retries, option_args, parse_ingest_config
+
+class FakeStream():
+
+    def __init__(self, chunks, worker_error=None):
+        self.chunks = list(chunks)
+        self.closed = False
+        self.session = None
+
+        self.worker_error = worker_error
+        self.worker = None
+
+    def read(self, size):
+        # Like streamlink's segment fetch pools, the worker is started after the stream was opened
+        if self.worker_error is not None and self.worker is None:
+            self.worker = threading.Thread(target=self.fetch)
+            self.worker.start()
+            self.worker.join()
+
+        if len(self.chunks) == 1:
+            logging.getLogger('streamlink.stream.dash').error("Failed to open segment 2")
+
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def fetch(self):
+        logging.getLogger('streamlink.stream.segmented').error(self.worker_error)
+
+    def close(self):
+        self.closed = True
+
+class FakeSession():
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def streams(self, url):
+        return {'best': self}
+
+    def open(self):
+        self.stream.session = self
+
+        return self.stream
+
+class FakeIngest(StreamlinkIngest):
+
+    def __init__(self, stream, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.stream = stream
+
+    def make_session(self):
+        return FakeSession(self.stream)
+
+def read_all(fd):
+    data = b''
+
+    while True:
+        chunk = os.read(fd, 65536)
+
+        if not chunk:
+            return data
+
+        data += chunk
+
+class TestStreamlinkIngest():
+    """Verify the in-process streamlink ingest."""
+
+    def run_ingest(self, stream, config=IngestConfig(mode='api')):
+        stream_r, stream_w = os.pipe()
+        log_r, log_w = os.pipe()
+
+        ingest = FakeIngest(stream, 'https://example.com/Manifest.mpd', config, stream_w, log_w)
+        ingest.start()
+
+        data = read_all(stream_r)
+        lines = read_all(log_r).decode().splitlines()
+        ingest.join(5)
+
+        os.close(stream_r)
+        os.close(log_r)
+
+        return ingest, data, lines
+
+    def test_copy(self):
+        """Verify stream bytes reach the descriptor and log records reach the log in CLI format."""
+
+        stream = FakeStream([b'a' * 1000, b'b' * 10])
+        ingest, data, lines = self.run_ingest(stream)
+
+        assert data == b'a' * 1000 + b'b' * 10
+        assert lines == ["[cli][info] Opened best stream in process", "[stream.dash][error] Failed to open segment 2"]
+        assert ingest.returncode == 0
+        assert ingest.log_records == {'info': 1, 'error': 1}
+        assert stream.closed
+
+    def test_worker_thread(self):
+        """Verify records from a worker thread started after opening are attributed to the ingest and counted as events."""
+
+        stream = FakeStream([b'a' * 10, b'b' * 10], worker_error="Failed to fetch segment 1: read timeout")
+        unattributed = FakeStream([], worker_error="Not ours")
+        ingest, data, lines = self.run_ingest(stream)
+
+        # A worker bound to no ingest's session is not attributed to this one
+        unattributed.read(1)
+
+        assert data == b'a' * 10 + b'b' * 10
+        assert lines == [
+            "[cli][info] Opened best stream in process",
+            "[stream.segmented][error] Failed to fetch segment 1: read timeout",
+            "[stream.dash][error] Failed to open segment 2",
+        ]
+        assert ingest.events == {'segment_error': 2, 'retry': 0}
+
+    def test_count_retries(self):
+        """Verify failed requests are retried through the mounted adapters and each retry is counted."""
+
+        urllib3 = pytest.importorskip('urllib3')
+        statuses = [503, 503, 200]
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self): #pylint: disable=invalid-name
+                self.send_response(statuses.pop(0))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args): #pylint: disable=arguments-differ
+                pass
+
+        class Adapter():
+            max_retries = None
+
+        class Http():
+            adapters = {'http://': Adapter(), 'https://': Adapter()}
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        retries = []
+        session = Http()
+
+        count_retries(session, lambda: retries.append(1), 2)
+
+        try:
+            response = urllib3.PoolManager().request('GET', f'http://127.0.0.1:{server.server_address[1]}/segment1', retries=session.adapters['http://'].max_retries)
+        finally:
+            server.shutdown()
+
+        assert response.status == 200
+        assert len(retries) == 2
+
+    def test_missing_quality(self):
+        """Verify a missing quality fails the ingest with an error line."""
+
+        ingest, data, lines = self.run_ingest(FakeStream([]), IngestConfig(mode='api', quality='720p'))
+
+        assert data == b''
+        assert lines == ["error: No 720p stream found (available: best)"]
+        assert ingest.returncode == 1
+
+class TestIngestConfig():
+    """Verify ingest configuration."""
+
+    def test_parse(self):
+        """Verify ingest config parsing and conversion to CLI flags."""
+
+        config = parse_ingest_config({'mode': 'API', 'options': {'stream-timeout': 30, 'hls-live-restart': True, 'http-no-ssl-verify': False}})
+
+        assert config.mode == 'api'
+        assert config.quality == 'best'
+        assert option_args(config.options) == ['--hls-live-restart', '--stream-timeout', '30']
+        assert parse_ingest_config(None) == IngestConfig()
+
+        with pytest.raises(ValueError):
+            parse_ingest_config({'mode': 'subprocess'})
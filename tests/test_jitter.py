@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+
+import pytest
+
+from pyrestreamer.jitter import JitterBuffer, JitterConfig, JitterCopier, RingBuffer, parse_jitter_config
+from pyrestreamer.pipeline import ThroughputMeter
+
+class TestJitterBuffer():
+    """Verify the jitter buffer."""
+
+    @pytest.mark.parametrize('file', [False, True])
+    def test_ring_buffer(self, file, tmp_path):
+        """Verify data wraps around the ring in order, in memory or in a file."""
+
+        ring = RingBuffer(10, str(tmp_path), file)
+
+        assert ring.write(b'abcdefgh') == 8
+        assert ring.read(6) == b'abcdef'
+        assert ring.write(b'ijklmnopq') == 8
+        assert ring.free == 0
+        assert ring.read(100) == b'ghijklmnop'
+        assert ring.used == 0
+
+        ring.close()
+
+    def test_prefill_and_refill(self):
+        """Verify data is held back for the configured time, and again after a drain."""
+
+        buffer = JitterBuffer(JitterConfig(seconds=5, max_mb=1))
+
+        assert buffer.take(100, 0) == b''
+        assert buffer.ready_at() is None
+
+        buffer.put(b'a' * 10, 1)
+
+        assert buffer.ready_at() == 6
+        assert buffer.take(100, 5.9) == b''
+        assert buffer.take(4, 6) == b'aaaa'
+        assert buffer.take(100, 7) == b'aaaaaa'
+
+        # Drained: hold the output until it has refilled
+        assert buffer.take(100, 8) == b''
+        assert buffer.drains == 1
+        assert buffer.state == JitterBuffer.PREFILL
+
+        buffer.put(b'b', 20)
+
+        assert buffer.take(100, 24) == b''
+        assert buffer.take(100, 25) == b'b'
+
+    def test_drain_policies(self):
+        """Verify pass-through and restart drain policies, and that the end of the stream is flushed."""
+
+        buffer = JitterBuffer(JitterConfig(seconds=1, on_drain='passthrough'))
+        buffer.put(b'a', 0)
+
+        assert buffer.take(100, 1) == b'a'
+        assert buffer.take(100, 2) == b''
+        assert buffer.take(100, 3) == b''
+        assert buffer.drains == 1
+
+        buffer.put(b'b', 4)
+
+        assert buffer.take(100, 4) == b'b'
+        assert not buffer.failed
+
+        buffer = JitterBuffer(JitterConfig(seconds=1, on_drain='restart'))
+        buffer.put(b'a', 0)
+        buffer.take(100, 1)
+        buffer.take(100, 2)
+
+        assert buffer.failed
+
+        buffer = JitterBuffer(JitterConfig(seconds=60))
+        buffer.put(b'a', 0)
+        buffer.finish()
+
+        assert buffer.take(100, 1) == b'a'
+
+    def test_copier(self):
+        """Verify a copier delays the stream by the buffer time and copies it intact."""
+
+        src_r, src_w = os.pipe()
+        dst_r, dst_w = os.pipe()
+        meter = ThroughputMeter()
+        received = []
+
+        def read_all():
+            for chunk in iter(lambda: os.read(dst_r, 2 ** 20), b''):
+                received.append((time.monotonic(), chunk))
+
+        reader = threading.Thread(target=read_all)
+        reader.start()
+
+        copier = JitterCopier(src_r, dst_w, JitterBuffer(JitterConfig(seconds=0.3, max_mb=1), meter), meter)
+        copier.start()
+
+        data = os.urandom(3 * 2 ** 20)
+        started = time.monotonic()
+        os.write(src_w, data[:100])
+
+        while not received and time.monotonic() - started < 5:
+            time.sleep(0.01)
+
+        assert received[0][0] - started >= 0.3
+
+        # More than the buffer holds, so the copier must wait for space
+        view = memoryview(data)[100:]
+
+        while view:
+            view = view[os.write(src_w, view):]
+
+        os.close(src_w)
+
+        reader.join(5)
+        copier.join(5)
+        os.close(dst_r)
+
+        assert b''.join(chunk for _, chunk in received) == data
+        assert meter.total_bytes == len(data)
+
+    def test_parse(self):
+        """Verify jitter buffer config parsing."""
+
+        assert not parse_jitter_config(None).enabled
+        assert parse_jitter_config({'seconds': '10', 'storage': 'FILE'}) == JitterConfig(10, 64, 'file', None, 'refill')
+
+        with pytest.raises(ValueError):
+            parse_jitter_config({'seconds': 10, 'on_drain': 'panic'})
@@ -0,0 +1,193 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.helpers import ReStreamer, StreamingState
+from pyrestreamer.lease import FileLease, PeerLease, LeaderElector, parse_lease_backend
+from pyrestreamer.metrics import Metrics
+from pyrestreamer.supervisor import AsyncReStreamer
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class TestLease():
+    """Verify the hot-standby lease backends and elector."""
+
+    def test_file_lease(self, tmp_path):
+        """Verify only one node holds a file lease, and that each new holder gets a higher token."""
+
+        lease = FileLease(str(tmp_path / 'lease'))
+
+        assert lease.acquire('a', 0.3) == 1
+        assert lease.acquire('b', 0.3) is None
+        assert lease.acquire('a', 0.3) == 1
+
+        lease.release('a')
+
+        assert lease.acquire('b', 0.3) == 2
+
+        # Once b stops renewing, its lease expires
+        time.sleep(0.35)
+
+        assert lease.acquire('a', 0.3) == 3
+        assert lease.peek().holder == 'a'
+
+    def test_peer_lease(self):
+        """Verify a majority of members agree on one leader, hand over on release, and fail over once the leader goes quiet."""
+
+        a_port, b_port, w_port = free_port(), free_port(), free_port()
+        a = PeerLease(f'127.0.0.1:{a_port}', [f'127.0.0.1:{b_port}', f'127.0.0.1:{w_port}'])
+        b = PeerLease(f'127.0.0.1:{b_port}', [f'127.0.0.1:{a_port}', f'127.0.0.1:{w_port}'])
+        witness = PeerLease(f'127.0.0.1:{w_port}', [])
+
+        for member in (a, b, witness):
+            member.serve()
+
+        try:
+            assert a.acquire('a', 0.5) == 1
+            assert b.acquire('b', 0.5) is None
+            assert a.acquire('a', 0.5) == 1
+
+            a.release('a')
+
+            assert b.acquire('b', 0.5) == 2
+            assert a.acquire('a', 0.5) is None
+
+            # b is cut off from both a and the witness: it loses its majority, and a can't take over until b's votes expire
+            b.peers = [f'127.0.0.1:{free_port()}', f'127.0.0.1:{free_port()}']
+
+            assert b.acquire('b', 0.5) is None
+            assert a.acquire('a', 0.5) is None
+
+            time.sleep(0.55)
+
+            # A failed attempt may use up a token; a new holder's is still always higher
+            assert a.acquire('a', 0.5) > 2
+            assert b.acquire('b', 0.5) is None
+        finally:
+            for member in (a, b, witness):
+                member.close()
+
+    def test_peer_vote(self):
+        """Verify a vote is promised to one node at a time and never to a stale token."""
+
+        voter = PeerLease('127.0.0.1:0', [])
+
+        assert voter.vote('a', 1, 0.3) == (True, 1)
+        assert voter.vote('b', 2, 0.3) == (False, 1)
+        assert voter.vote('a', 1, 0.3) == (True, 1)
+
+        time.sleep(0.35)
+
+        # a's promise has expired, but a token no higher than one already granted to a is refused to b
+        assert voter.vote('b', 1, 0.3) == (False, 1)
+        assert voter.vote('b', 2, 0.3) == (True, 2)
+
+        voter.vote('b', 0, 0, release=True)
+
+        assert voter.vote('a', 1, 0.3) == (False, 2)
+        assert voter.vote('a', 3, 0.3) == (True, 3)
+
+    def test_parse_peer_backend(self):
+        """Verify the peer backend needs a witness as well as the peer."""
+
+        assert parse_lease_backend('peer', listen=':9466', peer='b:9466, w:9466').peers == ['b:9466', 'w:9466']
+
+        with pytest.raises(ValueError):
+            parse_lease_backend('peer', listen=':9466', peer='b:9466')
+
+    def test_fencing(self, tmp_path):
+        """Verify a leader that can't renew stops counting as leader before anyone else can take the lease."""
+
+        lease = FileLease(str(tmp_path / 'lease'))
+        elector = LeaderElector(lease, 'a', ttl=0.6, fence_margin=0.3, registry=Metrics())
+        changes = []
+        elector.subscribe(lambda: changes.append(elector.is_leader))
+
+        assert elector.renew()
+        assert elector.seconds_left() <= 0.3
+        assert elector.registry.get('pyrestreamer_leader', node='a') == 1
+
+        time.sleep(0.35)
+        elector.check()
+
+        assert not elector.is_leader
+        assert changes == [True, False]
+
+        # The lease itself is still held, so nobody else streams yet
+        assert lease.acquire('b', 0.6) is None
+
+        with pytest.raises(ValueError):
+            LeaderElector(lease, 'a', ttl=6, fence_margin=5)
+
+    def test_standby(self, tmp_path):
+        """Verify a standby restreamer stays warmed up through a service, and streams once it holds the lease."""
+
+        lease = FileLease(str(tmp_path / 'lease'))
+        lease.acquire('a', 30)
+
+        elector = LeaderElector(lease, 'b', ttl=30, fence_margin=6, registry=Metrics())
+        rs = ReStreamer(PipelineConfig(None, "1|00:00|10080", 0, 15, 'US/Eastern', 'https://example.com', '-f null -'), elector=elector)
+        woken = []
+        rs.on_change = lambda: woken.append(True)
+
+        assert not elector.renew()
+        assert rs.expected_state() is StreamingState.WARMING
+
+        lease.release('a')
+
+        assert elector.renew()
+        assert rs.expected_state() is StreamingState.STREAMING
+        assert woken
+        assert rs.seconds_until_transition() <= 30 - 6
+
+    def test_failover(self, tmp_path):
+        """Verify the standby takes over once the leader stops renewing, and the two never stream at once."""
+
+        path = str(tmp_path / 'lease')
+        supervisors = []
+
+        for node in ('a', 'b'):
+            elector = LeaderElector(FileLease(path), node, ttl=1.5, fence_margin=0.6, registry=Metrics())
+            rs = ReStreamer(PipelineConfig(node, "1|00:00|10080", 0, 1, 'US/Eastern', 'https://example.com', '-f null -'), elector=elector)
+            rs.ingest_args = lambda: ['sh', '-c', 'while true; do echo data; sleep 0.05; done']
+            rs.output_args = lambda params: ['sh', '-c', 'exec cat > /dev/null']
+            rs.check_source = lambda logger=None: None
+
+            supervisors.append(AsyncReStreamer(rs, handle_signals=False))
+
+        leader, standby = supervisors
+        leader.restreamer.elector.renew()
+
+        async def scenario():
+            tasks = [asyncio.ensure_future(supervisor.run()) for supervisor in supervisors]
+            standby.restreamer.elector.start()
+            states = []
+
+            for tick in range(80):
+                if tick == 10:
+                    # The leader's host stops renewing the lease (e.g. it lost its network)
+                    leader.restreamer.elector.renew = lambda: leader.restreamer.elector.check() or False
+                    leader.restreamer.elector.start()
+
+                states.append((leader.state, standby.state))
+                await asyncio.sleep(0.05)
+
+            for supervisor in supervisors:
+                supervisor.request_stop()
+
+            await asyncio.wait_for(asyncio.gather(*tasks), 10)
+            standby.restreamer.elector.stop()
+
+            return states
+
+        states = asyncio.run(scenario())
+
+        assert states[9] == (StreamingState.STREAMING, StreamingState.WARMING)
+        assert states[-1] == (StreamingState.WARMING, StreamingState.STREAMING)
+        assert (StreamingState.STREAMING, StreamingState.STREAMING) not in states
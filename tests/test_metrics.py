@@ -0,0 +1,70 @@
+import os
+import tempfile
+
+from pyrestreamer.helpers import StreamingState
+from pyrestreamer.metrics import Metrics, PipelineMetrics
+from pyrestreamer.server import start_metrics_server, unix_get
+from pyrestreamer.progress import ProgressRecord
+
+class TestMetrics():
+    """Verify the metrics registry and endpoint."""
+
+    def test_render(self):
+        """Verify Prometheus text rendering of plain and computed values."""
+
+        metrics = Metrics()
+        metrics.set('pyrestreamer_state', 1, pipeline='a')
+        metrics.inc('pyrestreamer_segment_timeouts_total', pipeline='a')
+        metrics.inc('pyrestreamer_segment_timeouts_total', pipeline='a')
+        metrics.set('pyrestreamer_ingest_bytes_per_second', lambda: 1024, pipeline='a')
+
+        rendered = metrics.render()
+
+        assert '# TYPE pyrestreamer_state gauge' in rendered
+        assert 'pyrestreamer_state{pipeline="a"} 1.0' in rendered
+        assert 'pyrestreamer_segment_timeouts_total{pipeline="a"} 2.0' in rendered
+        assert 'pyrestreamer_ingest_bytes_per_second{pipeline="a"} 1024.0' in rendered
+
+    def test_render_escapes_labels(self):
+        """Verify backslashes, quotes and newlines in label values are escaped."""
+
+        metrics = Metrics()
+        metrics.set('pyrestreamer_state', 1, pipeline='say "hi"\\now\nplease')
+
+        assert 'pyrestreamer_state{pipeline="say \\"hi\\"\\\\now\\nplease"} 1.0' in metrics.render()
+
+    def test_pipeline_metrics(self):
+        """Verify pipeline events are recorded with the right labels."""
+
+        metrics = Metrics()
+        pipeline = PipelineMetrics('a', metrics)
+
+        pipeline.state(StreamingState.STREAMING)
+        pipeline.progress(ProgressRecord(512000, 45802, 715.7, 1.01, 29.97, 0, 0, False))
+        pipeline.restart('pipeline')
+
+        assert metrics.get('pyrestreamer_state', pipeline='a') == 1
+        assert metrics.get('pyrestreamer_encoder_speed', pipeline='a', output='0') == 1.01
+        assert metrics.get('pyrestreamer_output_bitrate_kbps', pipeline='a', output='0') == 715.7
+        assert metrics.get('pyrestreamer_seconds_since_progress', pipeline='a', output='0') < 5
+        assert metrics.get('pyrestreamer_pipeline_restarts_total', pipeline='a', component='pipeline') == 1
+
+        pipeline.stopped()
+
+        assert metrics.get('pyrestreamer_encoder_speed', pipeline='a', output='0') is None
+
+    def test_unix_socket_server(self):
+        """Verify metrics are served over a Unix socket."""
+
+        metrics = Metrics()
+        metrics.set('pyrestreamer_state', 0, pipeline='a')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.sock')
+            server = start_metrics_server(f'unix:{path}', metrics)
+
+            try:
+                assert 'pyrestreamer_state{pipeline="a"} 0.0' in unix_get(path)
+            finally:
+                server.shutdown()
+                server.server_close()
@@ -0,0 +1,128 @@
+import time
+
+import pytest
+
+from pyrestreamer.progress import ProgressRecord
+from pyrestreamer.watchdog import StallWatchdog
+from pyrestreamer.pipeline import \
+    ffmpeg_args, OutputHealth, StreamHeaderCache, StreamGate, ThroughputMeter, ManagedPipeline, PipelineFailure, MATROSKA_MAGIC, MATROSKA_CLUSTER
+
+class TestPipeline():
+    """Verify pipeline building blocks."""
+
+    def test_ffmpeg_args(self):
+        """Verify ffmpeg params are split like the shell would."""
+
+        assert ffmpeg_args("-vn -f flv 'rtmp://example.com/app/live'")[-3:] == ['-vn', '-f', 'flv', 'rtmp://example.com/app/live'][-3:]
+        assert ffmpeg_args("-f null -")[:8] == ['ffmpeg', '-progress', '-', '-nostats', '-hide_banner', '-re', '-i', '-']
+
+    def test_output_health(self):
+        """Verify an output is reported stuck once it stops progressing for the watchdog timeout."""
+
+        health = OutputHealth(StallWatchdog(progress_timeout=10), now=0)
+
+        assert health.handle_record(ProgressRecord(512000, 100, 715.7, 1.0, 30.0, 0, 0, False), now=1)
+        assert not health.handle_record(ProgressRecord(512000, 100, 715.7, 1.0, 30.0, 0, 0, False), now=5)
+
+        assert health.had_status_out
+        assert health.deadline() == 11
+        assert health.check(now=10.9) is None
+        assert health.check(now=11) is not None
+
+    def test_header_cache(self):
+        """Verify matroska headers are captured and MPEG-TS is passed through."""
+
+        mkv = StreamHeaderCache()
+        mkv.feed(MATROSKA_MAGIC + b'header')
+        mkv.feed(b'more' + MATROSKA_CLUSTER + b'frames')
+
+        assert mkv.complete
+        assert mkv.header == MATROSKA_MAGIC + b'headermore'
+
+        ts = StreamHeaderCache()
+        ts.feed(b'\x47' * 188)
+
+        assert ts.complete
+        assert ts.header == b''
+
+    def test_stream_gate(self):
+        """Verify a closed gate discards the stream, and the header is replayed once it opens."""
+
+        gate = StreamGate()
+
+        assert gate.filter(MATROSKA_MAGIC + b'header' + MATROSKA_CLUSTER + b'old') == b''
+        assert gate.filter(b'frames') == b''
+
+        gate.open()
+
+        assert gate.filter(b'new') == MATROSKA_MAGIC + b'header' + b'new'
+        assert gate.filter(b'newer') == b'newer'
+        assert gate.discarded == 4 + 6 + 4 + 3 + 6
+
+    def test_gated_pipeline(self):
+        """Verify a warmed-up pipeline feeds ffmpeg only once its gate opens."""
+
+        gate = StreamGate()
+        pipeline = ManagedPipeline(
+            ['sh', '-c', 'while true; do echo data; sleep 0.05; done'],
+            ['sh', '-c', 'exec wc -c'],
+            gate=gate
+        ).start()
+
+        while pipeline.meter.total_bytes < 20:
+            time.sleep(0.05)
+
+        gate.open()
+
+        while pipeline.meter.total_bytes - gate.discarded < 20:
+            time.sleep(0.05)
+
+        # End the ingest so ffmpeg sees EOF and reports what it received
+        pipeline.ingest.terminate()
+        output = int(pipeline.stdout.read().decode('utf-8').split()[-1])
+        pipeline.copier.join()
+        pipeline.output.wait()
+
+        assert gate.discarded >= 20
+        assert output == pipeline.meter.total_bytes - gate.discarded
+
+    def test_managed_pipeline(self):
+        """Verify the stream is copied between processes and metered, with logs merged."""
+
+        pipeline = ManagedPipeline(
+            ['sh', '-c', 'echo ingest log >&2; head -c 3000000 /dev/zero'],
+            ['sh', '-c', 'exec wc -c']
+        ).start()
+
+        output = pipeline.stdout.read().decode('utf-8').split()
+        pipeline.output.wait()
+        pipeline.ingest.wait()
+        pipeline.copier.join()
+
+        assert 'ingest' in output
+        assert '3000000' in output
+        assert pipeline.meter.total_bytes == 3000000
+        assert pipeline.poll() == 0
+
+    def test_failed_start(self):
+        """Verify ffmpeg is stopped when the ingest can't be started, and the failure is a PipelineFailure."""
+
+        pipeline = ManagedPipeline(['/nonexistent/streamlink'], ['sleep', '30'])
+
+        with pytest.raises(PipelineFailure):
+            pipeline.start()
+
+        assert pipeline.output.returncode is not None
+
+    def test_throughput_meter(self):
+        """Verify rate, idle time and stall counting."""
+
+        meter = ThroughputMeter()
+        meter.record(1000, now=meter.started + 1)
+        meter.record(1000, now=meter.started + 5)
+
+        assert meter.total_bytes == 2000
+        assert meter.stalls == 1
+        assert meter.max_gap == 4
+        assert meter.idle_for(now=meter.started + 6) == 1
+        assert meter.rate(now=meter.started + 6) == 2000 / ThroughputMeter.WINDOW
@@ -0,0 +1,64 @@
+from pyrestreamer.progress import ProgressParser, ProgressRecord
+
+PROGRESS_BLOCK = (
+    b"frame=120\n"
+    b"fps=29.97\n"
+    b"stream_0_0_q=-1.0\n"
+    b"bitrate= 715.7kbits/s\n"
+    b"total_size=45802\n"
+    b"out_time_us=512000\n"
+    b"out_time_ms=512000\n"
+    b"out_time=00:00:00.512000\n"
+    b"dup_frames=1\n"
+    b"drop_frames=0\n"
+    b"speed=1.01x\n"
+    b"progress=continue\n"
+)
+
+class TestProgressParser():
+    """Verify the incremental ffmpeg progress parser."""
+
+    def test_feed(self):
+        """Verify a progress block becomes one typed record alongside standard output."""
+
+        parser = ProgressParser()
+
+        standard_out, records = parser.feed(b"[cli][info] Opening stream: 1080p (dash)\nDuration: N/A, start: 264.256000, bitrate: N/A\n" + PROGRESS_BLOCK)
+
+        assert standard_out == [
+            "[cli][info] Opening stream: 1080p (dash)",
+            "Duration: N/A, start: 264.256000, bitrate: N/A",
+        ]
+        assert records == [ProgressRecord(512000, 45802, 715.7, 1.01, 29.97, 1, 0, False)]
+
+    def test_feed_split(self):
+        """Verify records are assembled from arbitrarily split chunks."""
+
+        parser = ProgressParser()
+        records = []
+
+        for idx in range(len(PROGRESS_BLOCK)):
+            records += parser.feed(PROGRESS_BLOCK[idx:idx + 1])[1]
+
+        assert records == [ProgressRecord(512000, 45802, 715.7, 1.01, 29.97, 1, 0, False)]
+
+    def test_unexpected(self):
+        """Verify malformed and unavailable values."""
+
+        parser = ProgressParser()
+
+        standard_out, records = parser.feed(b"unexpected=\n=unexpected\nunexpected=unexpected=unexpected\nspeed=N/A\nprogress=end\npartial")
+
+        assert standard_out == ["unexpected=", "=unexpected", "unexpected=unexpected=unexpected"]
+        assert records == [ProgressRecord(None, None, None, None, None, None, None, True)]
+        assert parser.flush() == ["partial"]
+
+    def test_bounded_line(self):
+        """Verify overlong lines are truncated rather than buffered."""
+
+        parser = ProgressParser()
+
+        standard_out, _ = parser.feed(b"x" * (ProgressParser.MAX_LINE * 2))
+
+        assert len(standard_out) == 1
+        assert parser.flush() == []
@@ -0,0 +1,73 @@
+import math
+
+import pytest
+
+from pyrestreamer.progress import ProgressRecord
+from pyrestreamer.recorder import ProgressRecorder, format_dump, read_dump
+
+def progress(seconds: float, speed: float = 1.0) -> ProgressRecord:
+    return ProgressRecord(int(seconds * 1000000), int(seconds * 16000), 128.0, speed, None, None, None, False)
+
+class TestProgressRecorder():
+    """Verify the progress history recorder."""
+
+    def test_ring(self):
+        """Verify the ring keeps the newest samples in order and drops those older than the history."""
+
+        recorder = ProgressRecorder(seconds=5, rate=1)
+
+        for second in range(8):
+            recorder.record(progress(second), second * 20000, now=1000 + second)
+
+        columns = recorder.snapshot(now=1007)
+
+        assert recorder.capacity == 5
+        assert list(columns['time']) == [1003, 1004, 1005, 1006, 1007]
+        assert list(columns['ingest_bytes']) == [60000, 80000, 100000, 120000, 140000]
+
+        # Samples older than the history are left out even if the ring still holds them
+        assert list(recorder.snapshot(now=1010)['time']) == [1005, 1006, 1007]
+
+    def test_missing_values(self):
+        """Verify fields ffmpeg didn't report are stored as NaN."""
+
+        recorder = ProgressRecorder(seconds=5, rate=1)
+        recorder.record(ProgressRecord(1000000, None, None, None, None, None, None, False), 0, output=1, now=1000)
+
+        columns = recorder.snapshot(now=1000)
+
+        assert columns['output'][0] == 1
+        assert math.isnan(columns['speed'][0])
+
+    def test_dump(self, tmp_path):
+        """Verify a dump round-trips through a file and renders rates and lag."""
+
+        recorder = ProgressRecorder(seconds=60, rate=1, directory=str(tmp_path))
+
+        # The output falls behind wall time from the third sample
+        for second, out_time in enumerate([0, 1, 1.5, 2]):
+            recorder.record(progress(out_time, 0.5), second * 20000, now=1000 + second)
+
+        path = recorder.dump("circuit breaker opened", 'north', now=1003)
+        dump = read_dump(path)
+
+        assert path.startswith(str(tmp_path))
+        assert 'pyrestreamer-north-' in path
+        assert dump.reason == "circuit breaker opened"
+        assert dump.samples == 4
+        assert list(dump.columns['out_time_us']) == [0, 1000000, 1500000, 2000000]
+
+        lines = format_dump(dump)
+
+        assert lines[0].endswith("circuit breaker opened")
+        assert len(lines) == 6
+        assert lines[-1].split()[-3:] == ['20000', '8000', '1.0']
+
+    def test_read_invalid(self, tmp_path):
+        """Verify other files are rejected."""
+
+        path = tmp_path / 'dump.progress'
+        path.write_bytes(b'x' * 64)
+
+        with pytest.raises(ValueError):
+            read_dump(str(path))
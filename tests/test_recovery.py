@@ -0,0 +1,38 @@
+from pyrestreamer.recovery import RestartPolicy
+
+class TestRestartPolicy():
+    """Verify restart backoff and the circuit breaker."""
+
+    def test_backoff(self):
+        """Verify delays grow exponentially up to the maximum and reset on recovery."""
+
+        policy = RestartPolicy(base_delay=1, max_delay=5, multiplier=2, jitter=0, max_failures=10)
+
+        assert [policy.record_failure(t) for t in range(5)] == [1, 2, 4, 5, 5]
+        assert policy.record_recovery(12) == 12
+        assert policy.record_recovery(13) is None
+        assert policy.record_failure(20) == 1
+
+    def test_jitter(self):
+        """Verify jitter stays within bounds."""
+
+        policy = RestartPolicy(base_delay=10, jitter=0.2, max_failures=100)
+
+        for t in range(20):
+            policy.consecutive = 0
+            assert 8 <= policy.record_failure(t) <= 12
+
+    def test_circuit_breaker(self):
+        """Verify the breaker opens on too many failures within the window only."""
+
+        policy = RestartPolicy(jitter=0, max_failures=2, window=60)
+
+        assert policy.record_failure(0) is not None
+        assert policy.record_failure(10) is not None
+        assert policy.record_failure(20) is None
+
+        policy.reset()
+
+        assert policy.record_failure(100) is not None
+        assert policy.record_failure(200) is not None
+        assert policy.record_failure(300) is not None
@@ -0,0 +1,75 @@
+import os
+import subprocess
+
+from pyrestreamer.resources import ComponentUsage, ResourceSampler, group_processes, read_process
+from pyrestreamer.rules import Action
+
+def fake_process(root, pid, pgid, comm, ticks, rss_kb, rchar=0, wchar=0):
+    base = root / str(pid)
+    base.mkdir()
+
+    # Fields after the command name: state, ppid, pgrp, ... utime (14th) and stime (15th)
+    fields = ['S', '1', str(pgid)] + ['0'] * 8 + [str(ticks), '0'] + ['0'] * 10
+    (base / 'stat').write_text(f"{pid} ({comm}) {' '.join(fields)}\n")
+    (base / 'status').write_text(f"Name:\t{comm}\nVmRSS:\t{rss_kb} kB\n")
+    (base / 'io').write_text(f"rchar: {rchar}\nwchar: {wchar}\nread_bytes: 0\n")
+
+class TestResourceSampler():
+    """Verify process group resource accounting."""
+
+    def test_sample(self, tmp_path):
+        """Verify processes are grouped into components and CPU% is measured between samples."""
+
+        fake_process(tmp_path, 10, 10, 'ffmpeg', 100, 2048, 10, 20)
+        fake_process(tmp_path, 11, 10, 'streamlink', 50, 1024, 30, 40)
+        fake_process(tmp_path, 20, 20, 'ffmpeg', 0, 4096)
+        fake_process(tmp_path, 30, 30, 'python', 0, 4096)
+
+        sampler = ResourceSampler(interval=5, proc_root=str(tmp_path))
+        usage = sampler.sample({10: '', 20: 'output-0'}, 100)
+
+        assert sorted(usage) == ['ffmpeg', 'output-0/ffmpeg', 'streamlink']
+        assert usage['ffmpeg'].rss_bytes == 2048 * 1024
+        assert usage['streamlink'].read_bytes == 30
+        assert usage['streamlink'].write_bytes == 40
+        assert usage['ffmpeg'].cpu_percent == 0
+        assert not sampler.due(104)
+        assert sampler.due(105)
+
+        fake_process(tmp_path, 12, 10, 'ffmpeg', 0, 1024)
+        (tmp_path / '10' / 'stat').write_text((tmp_path / '10' / 'stat').read_text().replace(' 100 0 ', f" {100 + 5 * os.sysconf('SC_CLK_TCK')} 0 "))
+
+        usage = sampler.sample({10: '', 20: 'output-0'}, 110)
+
+        assert usage['ffmpeg'].processes == 2
+        assert usage['ffmpeg'].cpu_percent == 50
+        assert usage['ffmpeg'].rss_bytes == 3072 * 1024
+
+    def test_check(self):
+        """Verify a limit must be exceeded for the sustain period, and is reported once per period."""
+
+        sampler = ResourceSampler(max_cpu_percent=100, max_rss_mb=100, sustain=30, action='restart')
+        usage = lambda cpu, rss_mb: {'ffmpeg': ComponentUsage('ffmpeg', 1, cpu, rss_mb * 2 ** 20, 0, 0)}
+
+        assert sampler.action is Action.RESTART
+        assert sampler.check(usage(150, 10), 0) is None
+        assert sampler.check(usage(150, 10), 29) is None
+        assert sampler.check(usage(150, 10), 30)[0] == 'ffmpeg'
+        assert sampler.check(usage(150, 10), 40) is None
+        assert sampler.check(usage(50, 10), 50) is None
+        assert sampler.check(usage(50, 200), 60) is None
+        assert "RSS 200 MiB" in sampler.check(usage(50, 200), 90)[1]
+
+    def test_real_process_group(self):
+        """Verify a real process group is found and read."""
+
+        proc = subprocess.Popen(['sleep', '5'], start_new_session=True)
+
+        try:
+            assert read_process(proc.pid).comm == 'sleep'
+            assert [sample.pid for sample in group_processes([proc.pid])] == [proc.pid]
+        finally:
+            proc.kill()
+            proc.wait()
+
+        assert read_process(proc.pid) is None
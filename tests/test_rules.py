@@ -0,0 +1,49 @@
+import pytest
+
+from pyrestreamer.rules import Action, Rule, OutputRules, DEFAULT_RULES, parse_rules
+
+class TestOutputRules():
+    """Verify output line classification."""
+
+    def test_classify(self):
+        """Verify prefix and regex rules match in priority order and count matches."""
+
+        rules = OutputRules([
+            Rule('noise', '[cli][debug]', Action.IGNORE),
+            Rule('forbidden', r'403 (Client|Server) Error', Action.FATAL, regex=True),
+            Rule('any_error', r'\[([\w.]+)\]\[error\]', Action.WARN, regex=True),
+        ] + list(DEFAULT_RULES))
+
+        assert rules.classify("[cli][debug] OS: Linux").name == 'noise'
+        assert rules.classify("[stream.dash][error] 403 Client Error: Forbidden").name == 'forbidden'
+        assert rules.classify("[stream.dash][error] Failed to open segment 1").name == 'any_error'
+        assert rules.classify("[stream.ffmpegmux][error] Pipe copy aborted: x").name == 'any_error'
+        assert rules.classify("[cli][info] Opening stream") is None
+
+        assert rules.counts() == {'noise': 1, 'forbidden': 1, 'any_error': 2, 'segment_timeout': 0, 'pipe_copy_aborted': 0}
+
+    def test_default_rules(self):
+        """Verify the built-in failure signatures."""
+
+        rules = OutputRules()
+
+        assert rules.classify("[stream.dash][error] Failed to open segment 1").action is Action.COUNT
+        assert rules.classify("[stream.ffmpegmux][error] Pipe copy aborted: broken pipe").action is Action.RESTART
+        assert rules.classify("x [stream.dash][error] Failed to open segment 1") is None
+        assert OutputRules([]).classify("anything") is None
+
+    def test_parse_rules(self):
+        """Verify rules are parsed from config and invalid rules rejected."""
+
+        assert parse_rules([
+            {'name': 'a', 'prefix': '[cli]', 'action': 'Ignore'},
+            {'name': 'b', 'regex': 'x+', 'action': 'restart', 'description': 'Bad'},
+        ]) == [Rule('a', '[cli]', Action.IGNORE), Rule('b', 'x+', Action.RESTART, True, 'Bad')]
+
+        assert parse_rules(None) == []
+
+        with pytest.raises(ValueError):
+            parse_rules([{'name': 'a', 'action': 'warn'}])
+
+        with pytest.raises(ValueError):
+            parse_rules([{'name': 'a', 'prefix': 'x', 'action': 'explode'}])
@@ -0,0 +1,97 @@
+import datetime
+
+import pytz
+
+from pyrestreamer.helpers import Service, load_services
+from pyrestreamer.schedule import ServiceSchedule, WEEK_SECONDS
+from pyrestreamer.clock import SimulatedClock
+
+TZ = pytz.timezone('US/Eastern')
+
+def local(*args):
+    return TZ.localize(datetime.datetime(*args))
+
+class TestServiceSchedule():
+    """Verify the compiled schedule index."""
+
+    def test_is_active(self):
+        """Verify the index agrees with the per-service checks."""
+
+        schedule = ServiceSchedule([Service(6, 18, 00, 2, 90, TZ)], TZ)
+
+        assert False == schedule.is_active(local(2020, 1, 4, 17, 57, 59))
+        assert True == schedule.is_active(local(2020, 1, 4, 17, 58, 0))
+        assert True == schedule.is_active(local(2020, 1, 4, 19, 31, 59))
+        assert False == schedule.is_active(local(2020, 1, 4, 19, 32, 0))
+        assert False == schedule.is_active(local(2020, 1, 5, 10, 45, 0))
+
+    def test_merge_overlapping(self):
+        """Verify overlapping services are merged into one window."""
+
+        services = load_services("7|09:00|88,7|10:30|60", 2, 'US/Eastern')
+        schedule = ServiceSchedule(services, TZ)
+
+        assert len(schedule.windows) == 1
+        assert schedule.next_transition(local(2020, 1, 5, 9, 0)) == local(2020, 1, 5, 11, 32)
+
+    def test_crosses_midnight_and_week(self):
+        """Verify services crossing midnight and the end of the week."""
+
+        schedule = ServiceSchedule([Service(7, 23, 30, 0, 60, TZ)], TZ)
+
+        assert len(schedule.windows) == 2
+        assert True == schedule.is_active(local(2020, 1, 5, 23, 45))
+        assert True == schedule.is_active(local(2020, 1, 6, 0, 15))
+        assert False == schedule.is_active(local(2020, 1, 6, 0, 30))
+        assert schedule.next_transition(local(2020, 1, 5, 23, 45)) == local(2020, 1, 6, 0, 30)
+        assert schedule.next_transition(local(2020, 1, 6, 1, 0)) == local(2020, 1, 12, 23, 30)
+
+    def test_next_transition(self):
+        """Verify next transition and seconds until it."""
+
+        services = load_services("6|18:00|88,7|09:00|88", 2, 'US/Eastern')
+        schedule = ServiceSchedule(services, TZ)
+
+        assert schedule.next_transition(local(2020, 1, 4, 12, 0)) == local(2020, 1, 4, 17, 58)
+        assert schedule.next_transition(local(2020, 1, 4, 18, 0)) == local(2020, 1, 4, 19, 30)
+        assert schedule.next_transition(local(2020, 1, 5, 12, 0)) == local(2020, 1, 11, 17, 58)
+        assert schedule.seconds_until_transition(local(2020, 1, 4, 17, 57, 59, 500000)) == 0.5
+
+    def test_always_and_never(self):
+        """Verify schedules without transitions."""
+
+        never = ServiceSchedule([], TZ)
+        always = ServiceSchedule([Service(1, 0, 0, 0, WEEK_SECONDS // 60, TZ)], TZ)
+
+        assert False == never.is_active(local(2020, 1, 4, 12, 0))
+        assert None == never.next_transition(local(2020, 1, 4, 12, 0))
+        assert True == always.is_active(local(2020, 1, 4, 12, 0))
+        assert None == always.seconds_until_transition(local(2020, 1, 4, 12, 0))
+
+    def test_dst_transitions(self):
+        """Verify transitions at wall-clock times skipped or repeated by a DST change."""
+
+        # 02:28 does not exist on 2020-03-08; the window starts when the clock jumps to 03:00
+        schedule = ServiceSchedule([Service(7, 2, 30, 2, 30, TZ)], TZ)
+        start = schedule.next_transition(local(2020, 3, 8, 1, 0))
+
+        assert abs((start - TZ.localize(datetime.datetime(2020, 3, 8, 3, 0), is_dst=True)).total_seconds()) < 0.01
+        assert schedule.is_active(start + datetime.timedelta(seconds=1))
+
+        # 01:28 happens twice on 2020-11-01; the window starts on the first pass
+        schedule = ServiceSchedule([Service(7, 1, 30, 2, 20, TZ)], TZ)
+
+        assert schedule.next_transition(local(2020, 11, 1, 0, 0)) == TZ.localize(datetime.datetime(2020, 11, 1, 1, 28), is_dst=True)
+
+    def test_clock(self):
+        """Verify the current time comes from the injected clock."""
+
+        clock = SimulatedClock(local(2020, 1, 4, 17, 57))
+        schedule = ServiceSchedule([Service(6, 18, 00, 2, 90, TZ)], TZ, clock)
+
+        assert not schedule.is_active()
+
+        clock.sleep(60)
+
+        assert schedule.is_active()
+        assert schedule.seconds_until_transition() == 94 * 60
@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+import subprocess
+import threading
+import time
+
+from pyrestreamer.clock import SimulatedClock
+from pyrestreamer.shutdown import StopPolicy, group_alive, stop_group, stop_group_async
+
+class TestShutdown():
+    """Verify process groups are stopped and escalated to SIGKILL."""
+
+    def test_stop_group(self):
+        """Verify a group that exits on SIGTERM is stopped without waiting out the grace period."""
+
+        proc = subprocess.Popen(['sh', '-c', 'sleep 30 & sleep 30'], start_new_session=True)
+
+        result = stop_group(proc.pid, [proc], StopPolicy(grace=5, kill_timeout=1))
+
+        assert result.exited
+        assert not result.killed
+        assert result.seconds < 2
+        assert not group_alive(proc.pid)
+
+    def test_escalate(self):
+        """Verify a group ignoring SIGTERM is killed once the grace period is up."""
+
+        proc = subprocess.Popen(['sh', '-c', 'trap "" TERM; sleep 30 & wait'], start_new_session=True)
+
+        # Let the shell set its trap
+        time.sleep(0.2)
+
+        result = stop_group(proc.pid, [proc], StopPolicy(grace=0.3, kill_timeout=2))
+
+        assert result.exited
+        assert result.killed
+        assert 0.3 <= result.seconds < 2
+        assert proc.returncode == -9
+
+    def test_escalate_async(self):
+        """Verify an asyncio process's group is killed once the grace period is up."""
+
+        async def stop():
+            proc = await asyncio.create_subprocess_exec('sh', '-c', 'trap "" TERM; sleep 30', start_new_session=True)
+            await asyncio.sleep(0.2)
+
+            return await stop_group_async(proc.pid, proc, StopPolicy(grace=0.3, kill_timeout=2))
+
+        result = asyncio.run(stop())
+
+        assert result.exited
+        assert result.killed
+
+    def test_clock_wait(self):
+        """Verify waits on the simulated clock end early once the event is set."""
+
+        clock = SimulatedClock(datetime.datetime(2020, 3, 1))
+        event = threading.Event()
+
+        assert not clock.wait(event, 60)
+        assert clock.elapsed == 60
+
+        event.set()
+
+        assert clock.wait(event, 60)
+        assert clock.elapsed == 60
@@ -0,0 +1,29 @@
+import os
+import signal
+import threading
+
+from pyrestreamer.signals import add_signal_handler
+
+class TestSignals():
+    """Verify signal handlers run on the dispatcher thread."""
+
+    def test_dispatch(self):
+        """Verify a handler runs with its arguments, outside the main thread, once the signal arrives."""
+
+        called = threading.Event()
+        calls = []
+
+        def handler(reason):
+            calls.append((reason, threading.current_thread() is threading.main_thread()))
+            called.set()
+
+        previous = signal.getsignal(signal.SIGUSR2)
+
+        try:
+            add_signal_handler(signal.SIGUSR2, handler, "requested")
+            os.kill(os.getpid(), signal.SIGUSR2)
+
+            assert called.wait(5)
+            assert calls == [("requested", False)]
+        finally:
+            signal.signal(signal.SIGUSR2, previous)
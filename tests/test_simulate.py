@@ -0,0 +1,62 @@
+import datetime
+
+import pytz
+
+from pyrestreamer.clock import SimulatedClock, OffsetClock
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.helpers import ReStreamer
+from pyrestreamer.simulate import simulate, format_transition
+
+TZ = pytz.timezone('US/Eastern')
+
+class TestSimulate():
+    """Verify the schedule simulator and clocks."""
+
+    def test_simulate_week(self):
+        """Verify a week with a DST change is replayed with every transition."""
+
+        start = TZ.localize(datetime.datetime(2020, 3, 2))
+        rs = ReStreamer(PipelineConfig(None, "7|09:00|88,6|23:30|60", 2, 15, 'US/Eastern', 'https://example.com', '-f null -'), SimulatedClock(start))
+
+        result = simulate(rs, start + datetime.timedelta(days=7))
+
+        assert [format_transition(transition) for transition in result.transitions] == [
+            "Sat 2020-03-07 23:28:00 EST  start",
+            "Sun 2020-03-08 00:32:00 EST  stop   streamed for 1:04:00",
+            "Sun 2020-03-08 03:00:00 EDT  dst    UTC-05:00 -> UTC-04:00 (EST -> EDT)",
+            "Sun 2020-03-08 08:58:00 EDT  start",
+            "Sun 2020-03-08 10:30:00 EDT  stop   streamed for 1:32:00",
+        ]
+        assert result.streaming_seconds == (64 + 92) * 60
+
+    def test_simulate_event_loop_decisions(self):
+        """Verify the simulation follows the event loop's decisions: pre-roll, one-off events and overrides."""
+
+        start = TZ.localize(datetime.datetime(2020, 1, 1))
+        rs = ReStreamer(PipelineConfig(None, "7|09:00|60", 0, 15, 'US/Eastern', 'https://example.com', '-f null -', preroll=600), SimulatedClock(start))
+        rs.add_event(datetime.datetime(2020, 1, 2, 12, 0), 30)
+
+        first = simulate(rs, start + datetime.timedelta(days=2))
+
+        # Hold off Sunday's service until 09:30
+        rs.set_override(False, minutes=(2 * 24 + 9.5) * 60)
+
+        second = simulate(rs, start + datetime.timedelta(days=7))
+
+        assert [format_transition(transition) for transition in first.transitions + second.transitions] == [
+            "Thu 2020-01-02 11:50:00 EST  warm",
+            "Thu 2020-01-02 12:00:00 EST  start",
+            "Thu 2020-01-02 12:30:00 EST  stop   streamed for 0:30:00",
+            "Sun 2020-01-05 09:30:00 EST  start",
+            "Sun 2020-01-05 10:00:00 EST  stop   streamed for 0:30:00",
+        ]
+        assert first.streaming_seconds + second.streaming_seconds == 60 * 60
+
+    def test_offset_clock(self):
+        """Verify an offset clock starts at the given time and runs in real time."""
+
+        clock = OffsetClock(datetime.datetime(2020, 1, 4, 23, 0))
+        now = clock.now(TZ)
+
+        assert now.tzinfo is not None
+        assert abs((now - TZ.localize(datetime.datetime(2020, 1, 4, 18, 0))).total_seconds()) < 5
@@ -0,0 +1,140 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from soak.harness import cpu_usage
+from soak.origin import Fault, FaultPlan, OriginServer, parse_faults, parse_seconds
+from soak.sink import ContinuityTracker, Gap, Packet, fault_recovery, parse_packet, parse_time_base
+
+class TestSoak():
+    """Verify the soak harness's fault plans, origin and continuity checks."""
+
+    def test_parse_faults(self):
+        """Verify fault specs are parsed with units and ordered by start."""
+
+        assert parse_seconds('90') == 90
+        assert parse_seconds('20m') == 1200
+        assert parse_seconds('1.5h') == 5400
+
+        assert parse_faults("outage@30m+1m, delay@10m+30s=4,404@20m+20=0.5") == [
+            Fault('delay', 600, 30, 4),
+            Fault('404', 1200, 20, 0.5),
+            Fault('outage', 1800, 60, 0),
+        ]
+        assert parse_faults('') == []
+
+        for spec in ("stall@10+5", "delay@10", "404@10+0"):
+            with pytest.raises(ValueError):
+                parse_faults(spec)
+
+    def test_fault_plan(self):
+        """Verify which faults are active when, and that repeating plans repeat."""
+
+        plan = FaultPlan([Fault('delay', 10, 5, 2), Fault('outage', 30, 10)], period=60)
+
+        assert plan.active(5) == []
+        assert plan.active(12) == [Fault('delay', 10, 5, 2)]
+        assert plan.active(15) == []
+        assert plan.active(75) == []
+        assert plan.active(95) == [Fault('outage', 30, 10)]
+        assert [fault.start for fault in plan.windows(100)] == [10, 30, 70, 90]
+
+        with pytest.raises(ValueError):
+            FaultPlan([Fault('outage', 30, 10)], period=35)
+
+    def test_origin(self, tmp_path):
+        """Verify the origin serves files and fails segments (but not manifests) during a 404 window."""
+
+        (tmp_path / 'stream.m3u8').write_text('#EXTM3U\n')
+        (tmp_path / 'segment000001.ts').write_bytes(b'\x47' * 188)
+
+        origin = OriginServer(str(tmp_path), FaultPlan([Fault('404', 0, 3600)]))
+        origin.start()
+
+        try:
+            with urllib.request.urlopen(origin.url('stream.m3u8')) as response:
+                assert response.read() == b'#EXTM3U\n'
+                assert response.headers['Cache-Control'] == 'no-cache'
+
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(origin.url('segment000001.ts'))
+
+            assert error.value.code == 404
+
+            origin.plan = FaultPlan([Fault('outage', 0, 3600)])
+
+            with pytest.raises((urllib.error.URLError, ConnectionError)):
+                urllib.request.urlopen(origin.url('stream.m3u8'))
+
+            origin.plan = FaultPlan([])
+
+            with urllib.request.urlopen(origin.url('segment000001.ts')) as response:
+                assert len(response.read()) == 188
+        finally:
+            origin.shutdown()
+            origin.server_close()
+
+        assert origin.counts == {'requests': 2, 'delay': 0, '404': 1, 'outage': 1}
+
+    def test_parse_framecrc(self):
+        """Verify framecrc time bases and packet lines are parsed."""
+
+        assert parse_time_base('#tb 1: 1/1000\n') == (1, 0.001)
+        assert parse_time_base('#media_type 0: video\n') is None
+
+        time_bases = {0: 1 / 90000}
+
+        assert parse_packet('0,       9000,      12000,     3000,    20411, 0x5a2c7f10, F=0x1\n', time_bases) == Packet(0, 0.1, 3000 / 90000)
+        assert parse_packet('#stream#, dts, pts, duration, size, hash\n', time_bases) is None
+
+    def test_continuity(self):
+        """Verify gaps, timestamp jumps and reconnects are counted apart."""
+
+        tracker = ContinuityTracker(gap_threshold=1.0, jump_threshold=0.5)
+        tracker.connect()
+
+        # 10 seconds of video at 10 packets a second, stalling for 3 seconds of wall time at 5s
+        for i in range(100):
+            tracker.feed(i / 10 + (3 if i >= 50 else 0), Packet(0, i / 10, 0.1))
+
+        # The timestamps jump ahead 5 seconds
+        tracker.feed(13.1, Packet(0, 15.0, 0.1))
+
+        # The publisher reconnects and timestamps start again
+        tracker.connect()
+        tracker.feed(13.2, Packet(0, 0.0, 0.1))
+        tracker.finish(20)
+
+        summary = tracker.summary()
+
+        assert tracker.gaps == [Gap(4.9, 8.0), Gap(13.2, 20)]
+        assert summary['reconnects'] == 1
+        assert summary['timestamp_jumps'] == 1
+        assert summary['media_seconds'] == pytest.approx(9.9)
+
+    def test_fault_recovery(self):
+        """Verify gaps are blamed on the faults they overlap and recovery is timed from the fault's end."""
+
+        windows = [Fault('outage', 100, 30), Fault('delay', 300, 30, 2), Fault('404', 500, 20)]
+        gaps = [Gap(1105, 1142), Gap(1510, 1515)]
+
+        impact = fault_recovery(windows, gaps, origin_started=1000, settle=60)
+
+        assert [fault['interrupted'] for fault in impact] == [True, False, True]
+        assert impact[0]['recovery_seconds'] == pytest.approx(12)
+        assert impact[1]['recovery_seconds'] == 0
+        assert impact[2]['recovery_seconds'] == 0
+        assert impact[2]['gap_seconds'] == pytest.approx(5)
+
+    def test_cpu_usage(self):
+        """Verify CPU and memory are summarized from process samples."""
+
+        mb = 1048576
+        samples = [(0, 0, 40 * mb), (1800, 18000, 42 * mb), (3600, 54000, 41 * mb)]
+        usage = cpu_usage(samples)
+
+        assert usage['cpu_percent'] == pytest.approx(54000 / 100 / 3600 * 100)
+        assert usage['cpu_max_percent'] == pytest.approx(36000 / 100 / 1800 * 100)
+        assert usage['rss_max_mb'] == 42
+        assert usage['rss_growth_mb_per_hour'] == pytest.approx(1)
@@ -0,0 +1,28 @@
+import time
+
+from pyrestreamer.startup import StartupProfile, format_profile
+
+class TestStartupProfile():
+    """Verify startup phases are timed back to back."""
+
+    def test_profile(self):
+        """Verify each phase runs from the previous mark and the table totals them."""
+
+        profile = StartupProfile()
+
+        time.sleep(0.02)
+        first = profile.mark('imports')
+
+        import pyrestreamer.simulate #pylint: disable=import-outside-toplevel,unused-import
+
+        second = profile.mark('pipelines')
+
+        assert first.seconds >= 0.02
+        assert first.rss_bytes > 0
+        assert profile.seconds == first.seconds + second.seconds
+
+        lines = format_profile(profile)
+
+        assert len(lines) == 4
+        assert lines[1].split()[0] == 'imports'
+        assert lines[-1].startswith(f"Started in {profile.seconds:.3f}s")
@@ -0,0 +1,241 @@
+import asyncio
+
+import pytest
+
+from pyrestreamer.config import PipelineConfig
+from pyrestreamer.helpers import ReStreamer, StreamingState
+from pyrestreamer.supervisor import AsyncOutput, AsyncReStreamer, MultiSupervisor, PipelineFailure
+from pyrestreamer.progress import ProgressRecord
+from pyrestreamer.recovery import RestartPolicy
+from pyrestreamer.rules import Action, Rule, OutputRules
+
+# An ffmpeg stand-in that reports progress while consuming its input
+FAKE_FFMPEG = ['sh', '-c', 'printf "total_size=1\\nprogress=continue\\n"; exec cat > /dev/null']
+
+def always_on_restreamer(ingest, name=None, outputs=None, max_failures=5):
+    """Build a restreamer that is always scheduled and runs ingest as its ingest process."""
+
+    policy = RestartPolicy(base_delay=0.05, jitter=0, max_failures=max_failures)
+    rs = ReStreamer(PipelineConfig(name, "1|00:00|10080", 0, 1, 'US/Eastern', 'https://example.com/Manifest.mpd', '-f null -', tuple(outputs or ()), policy))
+    rs.ingest_args = lambda: ['sh', '-c', ingest]
+    rs.output_args = lambda params: FAKE_FFMPEG
+
+    return rs
+
+class TestAsyncReStreamer():
+    """Verify the asyncio supervisor."""
+
+    def test_handle_line(self):
+        """Verify output lines update health state as they arrive."""
+
+        supervisor = AsyncReStreamer(always_on_restreamer('true'))
+        output = supervisor.outputs[0]
+
+        output.handle_line("[cli][info] Opening stream: 1080p (dash)")
+        output.handle_record(ProgressRecord(512000, 45802, 715.7, 1.0, 30.0, 0, 0, False))
+
+        assert output.health.had_status_out
+        assert output.health.total_size == 45802
+
+        supervisor.handle_ingest_line("[stream.ffmpegmux][error] Pipe copy aborted: broken pipe")
+
+        assert supervisor._failure == "Pipe died"
+
+    def test_output_rules(self):
+        """Verify output rules restart only the output that printed the line, or stop the pipeline."""
+
+        rs = always_on_restreamer('true', outputs=['a', 'b'])
+        rs.rules = OutputRules([Rule('bad', 'Conversion failed', Action.RESTART), Rule('fatal', 'Forbidden', Action.FATAL)])
+        supervisor = AsyncReStreamer(rs)
+        supervisor.outputs[0].proc = supervisor.outputs[1].proc = object()
+
+        supervisor.outputs[0].handle_line("Conversion failed!")
+
+        assert supervisor.outputs[0].failure == 'bad'
+        assert supervisor.outputs[1].failure is None
+        assert supervisor._failure is None
+
+        supervisor.handle_ingest_line("Forbidden")
+
+        assert supervisor._fatal == 'fatal'
+        assert rs.rules.counts() == {'bad': 1, 'fatal': 1}
+
+    def test_unexpected_exit(self):
+        """Verify an exiting ingest is restarted in-process until the circuit breaker opens."""
+
+        supervisor = AsyncReStreamer(always_on_restreamer("echo data; exit 1", name='exits', max_failures=2))
+
+        with pytest.raises(PipelineFailure):
+            asyncio.run(asyncio.wait_for(supervisor.run(), 5))
+
+        assert supervisor.state is StreamingState.IDLE
+        assert supervisor.metrics.registry.get('pyrestreamer_pipeline_restarts_total', pipeline='exits', component='pipeline') == 2
+
+    def test_request_stop(self):
+        """Verify a stop request ends a running pipeline gracefully."""
+
+        supervisor = AsyncReStreamer(always_on_restreamer("sleep 30"))
+
+        async def scenario():
+            task = asyncio.ensure_future(supervisor.run())
+            await asyncio.sleep(0.5)
+            assert supervisor.state is StreamingState.STREAMING
+            supervisor.request_stop()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(scenario())
+
+        assert supervisor.state is StreamingState.IDLE
+
+    def test_fan_out(self):
+        """Verify one failed output is restarted without disturbing the others."""
+
+        supervisor = AsyncReStreamer(always_on_restreamer("while true; do echo data; sleep 0.1; done", outputs=['a', 'b']))
+
+        async def scenario():
+            task = asyncio.ensure_future(supervisor.run())
+            await asyncio.sleep(0.5)
+
+            ingest = supervisor.ingest
+
+            assert ingest is not None
+            untouched = supervisor.outputs[1].proc
+            supervisor.outputs[0].proc.kill()
+            await asyncio.sleep(0.5)
+
+            assert supervisor.outputs[0].restarts == 1
+            assert supervisor.outputs[0].running
+            assert supervisor.outputs[1].proc is untouched
+            assert supervisor.ingest is ingest
+
+            supervisor.request_stop()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(scenario())
+
+    def test_stuck_output(self, monkeypatch):
+        """Verify an output that stops reading its input is restarted without holding back the ingest or the others."""
+
+        monkeypatch.setattr(AsyncOutput, 'QUEUE_LIMIT', 2 ** 20)
+
+        rs = always_on_restreamer("while true; do head -c 65536 /dev/zero; sleep 0.01; done", outputs=['stuck', 'ok'])
+        # The stuck output reports progress but never reads its input
+        rs.output_args = lambda params: ['sh', '-c', 'printf "total_size=1\\nprogress=continue\\n"; exec sleep 30'] if params == 'stuck' else FAKE_FFMPEG
+        supervisor = AsyncReStreamer(rs)
+
+        async def scenario():
+            task = asyncio.ensure_future(supervisor.run())
+            await asyncio.sleep(1)
+
+            assert supervisor.outputs[0].restarts >= 1
+            assert supervisor.outputs[1].failure is None
+            assert supervisor.outputs[1].restarts == 0
+
+            # Far more than the stuck output's queue and pipe could hold
+            assert supervisor.ingest_meter.total_bytes > 2 * AsyncOutput.QUEUE_LIMIT
+
+            supervisor.request_stop()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(scenario())
+
+    def test_warm_start(self):
+        """Verify a warmed-up pipeline holds the stream back from its outputs until the gate opens."""
+
+        rs = always_on_restreamer("while true; do echo data; sleep 0.05; done", name='warm')
+        # Reports progress only once it has been fed
+        rs.output_args = lambda params: ['sh', '-c', 'head -c 1 > /dev/null; printf "total_size=1\\nprogress=continue\\n"; exec cat > /dev/null']
+        supervisor = AsyncReStreamer(rs)
+
+        async def scenario():
+            supervisor._wake = asyncio.Event()
+
+            await supervisor._start(warm=True)
+            await asyncio.sleep(0.5)
+
+            assert supervisor.state is StreamingState.WARMING
+            assert supervisor.ingest_meter.total_bytes > 0
+            assert not supervisor.outputs[0].health.had_status_out
+
+            supervisor._open_gate()
+            await asyncio.sleep(0.5)
+
+            assert supervisor.state is StreamingState.STREAMING
+            assert supervisor.outputs[0].health.had_status_out
+            assert supervisor.metrics.registry.get('pyrestreamer_start_seconds', pipeline='warm', output='0') < 0.5
+
+            await supervisor._stop()
+
+        asyncio.run(scenario())
+
+    def test_reload(self):
+        """Verify a reload restarts a live pipeline only when its own params change."""
+
+        rs = always_on_restreamer("while true; do echo data; sleep 0.05; done", name='reload')
+        supervisor = AsyncReStreamer(rs, handle_signals=False)
+
+        async def scenario():
+            task = asyncio.ensure_future(supervisor.run())
+            await asyncio.sleep(0.5)
+
+            ingest = supervisor.ingest
+
+            assert ingest is not None
+
+            rs.reload(service_times="1|00:00|10080", service_buffer=0, sleep_time=2, pytz_timezone='US/Eastern', input_url=rs.settings.input_url, ffmpeg_params='-f null -')
+            await asyncio.sleep(0.5)
+
+            assert supervisor.ingest is ingest
+            assert rs.settings.sleep_time == 2
+
+            rs.reload(service_times="1|00:00|10080", service_buffer=0, sleep_time=2, pytz_timezone='US/Eastern', input_url=rs.settings.input_url, ffmpeg_params='-f null -', outputs=['-f null -', '-f null -'])
+            await asyncio.sleep(0.5)
+
+            assert supervisor.ingest is not ingest
+            assert len(supervisor.outputs) == 2
+            assert supervisor.state is StreamingState.STREAMING
+
+            supervisor.request_stop()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(scenario())
+
+    def test_failed_start(self):
+        """Verify a start that fails part way stops the outputs it started and releases its slot."""
+
+        rs = always_on_restreamer('true', outputs=['-f null -', '-f null -'])
+        rs.ingest_args = lambda: ['/nonexistent/streamlink']
+
+        async def scenario():
+            slots = asyncio.Semaphore(1)
+            supervisor = AsyncReStreamer(rs, slots, handle_signals=False)
+            supervisor._wake = asyncio.Event()
+
+            with pytest.raises(FileNotFoundError):
+                await supervisor._start()
+
+            assert not slots.locked()
+            assert supervisor.ingest is None
+            assert all(output.proc is None for output in supervisor.outputs)
+
+        asyncio.run(scenario())
+
+class TestMultiSupervisor():
+    """Verify supervising several pipelines from one process."""
+
+    def test_max_concurrent(self):
+        """Verify the concurrent pipeline cap is respected."""
+
+        multi = MultiSupervisor([always_on_restreamer("sleep 30", 'a'), always_on_restreamer("sleep 30", 'b')], 1)
+
+        async def scenario():
+            task = asyncio.ensure_future(multi.run())
+            await asyncio.sleep(0.5)
+            states = [supervisor.state for supervisor in multi.supervisors.values()]
+            assert states.count(StreamingState.STREAMING) == 1
+            multi.request_stop()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(scenario())
+
+        assert all(supervisor.state is StreamingState.IDLE for supervisor in multi.supervisors.values())
@@ -0,0 +1,49 @@
+import os
+
+from pyrestreamer.tune import TuneCandidate, TuneResult, build_candidates, recommend, run_candidate
+
+class TestTune():
+    """Verify the encoder tuning sweep."""
+
+    def test_build_candidates(self):
+        """Verify threads and presets are swept and the destination is replaced."""
+
+        candidates = build_candidates('-c:v libx264 -preset medium -b:v 3M -f flv rtmp://example.com/app/key', [1, 2], ['veryfast', 'fast'])
+
+        assert [candidate.label for candidate in candidates] == [
+            'threads=1 preset=veryfast', 'threads=1 preset=fast', 'threads=2 preset=veryfast', 'threads=2 preset=fast'
+        ]
+        assert candidates[0].params == ['-c:v', 'libx264', '-preset', 'veryfast', '-b:v', '3M', '-f', 'flv', '-threads', '1', os.devnull]
+
+        # Audio-only output: no presets to sweep
+        candidates = build_candidates('-vn -c:a pcm_s16le -ar 44100 -f flv rtmp://example.com/app/key', [1, 2], ['veryfast'])
+
+        assert [candidate.label for candidate in candidates] == ['threads=1', 'threads=2']
+
+    def test_recommend(self):
+        """Verify the cheapest candidate with enough margin is recommended."""
+
+        results = [
+            TuneResult('slow', '', 1.2, 100, 0.8, 3000, 0),
+            TuneResult('cheap', '', 1.6, 50, 0.5, 3000, 0),
+            TuneResult('fast', '', 4.0, 300, 0.7, 3000, 0),
+            TuneResult('broken', '', None, 0, None, None, 1),
+        ]
+
+        assert recommend(results, 0.5).label == 'cheap'
+        assert recommend(results, 1.0).label == 'fast'
+        assert recommend(results, 5.0) is None
+
+    def test_run_candidate(self, tmp_path):
+        """Verify speed and bitrate are measured from ffmpeg's progress output."""
+
+        fake = tmp_path / 'ffmpeg'
+        fake.write_text("#!/bin/sh\nprintf 'out_time_us=10000000\\ntotal_size=1250000\\nspeed=50x\\nprogress=end\\n'\n")
+        fake.chmod(0o755)
+
+        result = run_candidate(TuneCandidate('threads=1', ['-threads', '1', os.devnull]), [], 10, str(fake))
+
+        assert result.ok
+        assert result.bitrate_kbps == 1000
+        assert result.speed > 1
+        assert result.params == '-threads 1'
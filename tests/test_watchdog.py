@@ -0,0 +1,117 @@
+from pyrestreamer.jitter import JitterBuffer, JitterConfig
+from pyrestreamer.progress import ProgressRecord
+from pyrestreamer.watchdog import StallWatchdog
+
+def record(out_time_s, total_size, speed=1.0):
+    return ProgressRecord(int(out_time_s * 1000000), total_size, 715.7, speed, 30.0, 0, 0, False)
+
+class TestStallWatchdog():
+    """Verify wall-clock stall detection."""
+
+    def test_startup_timeout(self):
+        """Verify an output that never reports progress fails after the startup timeout."""
+
+        watchdog = StallWatchdog(startup_timeout=30)
+        watchdog.start(100)
+
+        assert watchdog.deadline() == 130
+        assert watchdog.check(129) is None
+        assert watchdog.check(130) is not None
+
+    def test_progress_timeout(self):
+        """Verify either total_size or out_time_us advancing counts as progress."""
+
+        watchdog = StallWatchdog(progress_timeout=10, max_drift=0)
+        watchdog.start(0)
+
+        assert watchdog.observe(record(1, 100), 1)
+        assert watchdog.observe(record(2, 100), 2)
+        assert watchdog.observe(record(2, 200), 3)
+        assert not watchdog.observe(record(2, 200), 8)
+
+        assert watchdog.check(12.9) is None
+        assert watchdog.check(13) is not None
+
+    def test_slow_encoder(self):
+        """Verify speed must stay below the minimum for the whole window."""
+
+        watchdog = StallWatchdog(progress_timeout=100, min_speed=0.9, slow_window=30, max_drift=0)
+        watchdog.start(0)
+
+        watchdog.observe(record(1, 100, speed=0.5), 1)
+        watchdog.observe(record(2, 200, speed=1.0), 20)
+        watchdog.observe(record(3, 300, speed=0.5), 21)
+
+        assert watchdog.deadline() == 51
+        assert watchdog.check(50) is None
+        assert watchdog.check(51) is not None
+
+    def test_drift(self):
+        """Verify output falling behind wall time is detected."""
+
+        watchdog = StallWatchdog(progress_timeout=100, min_speed=0, max_drift=15)
+        watchdog.start(0)
+
+        watchdog.observe(record(0, 100), 1)
+        watchdog.observe(record(10, 200), 11)
+
+        assert watchdog.drift == 0
+        assert watchdog.check(11) is None
+
+        watchdog.observe(record(15, 300), 32)
+
+        assert watchdog.drift == 16
+        assert watchdog.check(32) is not None
+
+    def test_clone(self):
+        """Verify clones keep thresholds but not state."""
+
+        watchdog = StallWatchdog(progress_timeout=5)
+        watchdog.start(0)
+        watchdog.observe(record(1, 100), 1)
+
+        clone = watchdog.clone()
+
+        assert clone.progress_timeout == 5
+        assert clone.last_progress is None
+
+    def test_jitter_refill(self):
+        """Verify a jitter buffer refilling after a drain holds the watchdog rather than tripping it."""
+
+        buffer = JitterBuffer(JitterConfig(seconds=15, max_mb=1))
+        watchdog = StallWatchdog(progress_timeout=10, min_speed=0.9, slow_window=30, max_drift=5)
+        watchdog.start(0)
+
+        buffer.put(b'a' * 10, 0)
+
+        assert buffer.take(100, 15) == b'a' * 10
+
+        watchdog.hold(buffer.refilling, buffer.held_seconds(15))
+        watchdog.observe(record(10, 100), 16)
+
+        # The source goes quiet and the buffer drains at 17; the output gets nothing until it has refilled 15 seconds after data returns at 20
+        assert buffer.take(100, 17) == b''
+        assert buffer.refilling
+
+        watchdog.hold(buffer.refilling, buffer.held_seconds(30))
+        watchdog.observe(record(10, 100, speed=0.5), 30)
+
+        assert watchdog.check(30) is None
+        assert watchdog.deadline() == float('inf')
+
+        buffer.put(b'b' * 10, 20)
+
+        assert buffer.take(100, 35) == b'b' * 10
+        assert buffer.held_seconds() == 18
+
+        watchdog.hold(buffer.refilling, buffer.held_seconds())
+
+        # Deadlines move out by the 18 seconds held, and the held time is not drift
+        assert watchdog.deadline() == 16 + 18 + 10
+        assert watchdog.check(43) is None
+
+        watchdog.observe(record(12, 200), 36)
+
+        assert watchdog.drift < 5
+        assert watchdog.check(36) is None
+        assert watchdog.check(46) is not None